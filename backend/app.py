@@ -1,13 +1,41 @@
-import os, io, time, json, tempfile, subprocess, numpy as np, csv, uuid
+import os, io, time, json, tempfile, subprocess, numpy as np, csv, uuid, hmac
 from typing import Dict, Any, List
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import requests
 from datetime import datetime
-from collections import defaultdict
-import math
+import functools
+import asyncio
+
+from session_store import (
+    create_session_backend, SESSION_NS, LOG_SWITCH_NS, PHOTO_COUNT_NS, RETRIEVER_NS, PROFILE_NS,
+)
+from scene_registry import SceneRegistry, SceneWatcher, RetrievalState, SCENE_WATCH_INTERVAL
+from embedding_store import META_SUFFIX, open_embedding_index, load_legacy_npz
+from enhanced_retriever import EnhancedDualChannelRetriever
+from pipeline_timing import (
+    run_in_pool, stage, timed, start_request_timer, STAGE_HISTOGRAMS, LOCATE_POOL_WORKERS,
+)
+from prometheus_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, GAUGES, render_metrics, torch_module_bytes
+from request_profiler import (
+    PROFILE_DIR, PROFILE_HEADER, PROFILE_BURST_REQUESTS, PROFILE_MODES, PROFILING_ENABLED, ADMIN_TOKEN_HEADER,
+    open_slot, close_slot, begin_request_profile, list_profiles, profile_file_path,
+)
+from structured_log import get_logger, start_trace, finish_trace, trace_event, trace_enabled
+from caption_cache import load_caption_cache
+from calibration_tables import CALIBRATION_TABLES
+from response_templates import RESPONSE_TEMPLATES
+from warmup_log import WARMUP_PLACEHOLDER, WarmupLog
+# 置信度标定在 calibration.py；apply_softmax_calibration 等仍从 app 导出（旧测试脚本按 app.xxx 引用）
+from calibration import (
+    LOWCONF_SCORE_TH, LOWCONF_MARGIN_TH, SOFTMAX_TEMPERATURE, ENABLE_SOFTMAX_CALIBRATION,
+    ENABLE_CONTINUITY_BOOST, apply_softmax_calibration, calibrate_confidence, are_neighbors,
+    calculate_calibrated_confidence_and_margin,
+)
+
+locate_log = get_logger("locate")
 
 # Local BLIP model imports
 from transformers import BlipProcessor, BlipForConditionalGeneration
@@ -81,91 +109,24 @@ ENABLE_DG_EVALUATION = os.getenv("ENABLE_DG_EVALUATION", "true").lower() == "tru
 ENABLE_ACCESSIBILITY_CHECKING = os.getenv("ENABLE_ACCESSIBILITY_CHECKING", "true").lower() == "true"
 ENABLE_INDOOR_GML = os.getenv("ENABLE_INDOOR_GML", "true").lower() == "true"
 
-# ✅ New: Preset output mapping based on provider + site_id
-PRESET_OUTPUTS = {
-    "ft_SCENE_A_MS": "Sense_A_Finetuned.fixed.jsonl",
-    "ft_SCENE_B_STUDIO": "Sense_B_Finetuned.fixed.jsonl", 
-    "base_SCENE_A_MS": "Sence_A_4o.fixed.jsonl",
-    "base_SCENE_B_STUDIO": "Sense_B_4o.fixed.jsonl"
-}
-
+# ✅ Preset outputs per provider + site_id are declared in the site manifest (data/sites.json)
+# 预设文件在启动时由 RESPONSE_TEMPLATES 解析一次并缓存（源文件变化后自动重建），请求中不再读文件
 def get_preset_output(provider: str, site_id: str) -> str:
     """Get preset output based on provider and site_id combination"""
-    key = f"{provider.lower()}_{site_id}"
-    filename = PRESET_OUTPUTS.get(key)
-    print(f"🔍 Looking for preset output: key={key}, filename={filename}")
-    
-    if not filename:
-        print(f"⚠️ No filename found for key: {key}")
-        return "Welcome! Please take a photo to start exploring."
-    
-    filepath = os.path.join(DATA_DIR, filename)
-    print(f"📁 Full filepath: {filepath}")
-    
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            # Read first line (JSONL format)
-            first_line = f.readline().strip()
-            print(f"📖 First line: {first_line[:100]}...")
-            
-            if first_line:
-                data = json.loads(first_line)
-                output = data.get("output", "Welcome! Please take a photo to start exploring.")
-                print(f"✅ Found output: {output[:100]}...")
-                return output
-            else:
-                print("⚠️ Empty first line")
-                return "Welcome! Please take a photo to start exploring."
-    except Exception as e:
-        print(f"⚠️ Failed to load preset output from {filename}: {e}")
-        return "Welcome! Please take a photo to start exploring."
+    return RESPONSE_TEMPLATES.preset_output(provider, site_id)
 
 def get_matching_data(provider: str, site_id: str) -> dict:
-    """Get matching data for BLIP text matching based on provider and site_id"""
-    key = f"{provider.lower()}_{site_id}"
-    filename = PRESET_OUTPUTS.get(key)
-    if not filename:
-        return {}
-    
-    filepath = os.path.join(DATA_DIR, filename)
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            # Read first line (JSONL format)
-            first_line = f.readline().strip()
-            if first_line:
-                data = json.loads(first_line)
-                return data
-            else:
-                return {}
-    except Exception as e:
-        print(f"⚠️ Failed to load matching data from {filename}: {e}")
-        return {}
+    """Get matching data for BLIP text matching based on provider and site_id (shared, read-only)"""
+    return RESPONSE_TEMPLATES.matching_data(provider, site_id)
 
 def get_detailed_matching_data(site_id: str) -> list:
     """Get detailed matching data from Detail files for layered fusion conversation enhancement"""
-    # Map site_id to corresponding Detail file
-    detail_file_mapping = {
-        "SCENE_A_MS": "Sense_A_MS.jsonl",
-        "SCENE_B_STUDIO": "Sense_B_Studio.jsonl"
-    }
-    
-    filename = detail_file_mapping.get(site_id)
-    if not filename:
+    # 细节文件由场景注册表按站点加载一次并缓存
+    scene = SCENE_REGISTRY.get(site_id)
+    if scene is None:
         print(f"⚠️ No Detail file mapping found for site_id: {site_id}")
         return []
-    
-    filepath = os.path.join(DATA_DIR, filename)
-    try:
-        data = []
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip():
-                    data.append(json.loads(line))
-        print(f"✅ Loaded {len(data)} detailed descriptions from {filepath} for {site_id}")
-        return data
-    except Exception as e:
-        print(f"⚠️ Failed to load detailed descriptions from {filename}: {e}")
-        return []
+    return list(scene.detail_records)
 
 def validate_location_continuity(session_id: str, new_location: str, previous_location: str = None) -> dict:
     """Validate if new location is continuous with previous location"""
@@ -211,7 +172,7 @@ def track_orientation(session_id: str, caption: str, predicted_location: str) ->
         orientation = "behind"
     
     # Get session state
-    session = SESSIONS.get(session_id, {})
+    session = _get_session(session_id) or {}
     orientation_history = session.get("orientation_history", [])
     
     # Check orientation consistency
@@ -230,41 +191,51 @@ def track_orientation(session_id: str, caption: str, predicted_location: str) ->
 
 def update_session_location(session_id: str, new_location: str, confidence: float, orientation_info: dict):
     """Update location information in session"""
-    if session_id not in SESSIONS:
+    if not SESSION_STORE.contains(SESSION_NS, session_id):
         return
     
-    session = SESSIONS[session_id]
-    previous_location = session.get("current_location")
-    
-    # Validate location continuity
-    continuity_check = validate_location_continuity(session_id, new_location, previous_location)
+    continuity = {}
     
-    # Update current location
-    session["current_location"] = new_location
-    session["last_update_time"] = datetime.utcnow().isoformat()
-    
-    # Add to history records
-    location_record = {
-        "location": new_location,
-        "confidence": confidence,
-        "timestamp": datetime.utcnow().isoformat(),
-        "continuity_valid": continuity_check["valid"],
-        "continuity_reason": continuity_check["reason"],
-        "confidence_boost": continuity_check["confidence_boost"]
-    }
-    
-    session["location_history"].append(location_record)
-    session["orientation_history"].append(orientation_info)
-    session["confidence_history"].append(confidence)
-    
-    # Keep history records within reasonable range
-    if len(session["location_history"]) > 10:
-        session["location_history"] = session["location_history"][-10:]
-        session["orientation_history"] = session["orientation_history"][-10:]
-        session["confidence_history"] = session["confidence_history"][-10:]
+    def _apply(session):
+        # 在后端的原子更新里完成读-改-写，避免多 worker 并发时互相覆盖历史
+        if session is None:
+            return None
+        previous_location = session.get("current_location")
+        
+        # Validate location continuity
+        continuity_check = validate_location_continuity(session_id, new_location, previous_location)
+        continuity.update(continuity_check)
+        
+        # Update current location
+        session["current_location"] = new_location
+        session["last_update_time"] = datetime.utcnow().isoformat()
+        
+        # Add to history records
+        location_record = {
+            "location": new_location,
+            "confidence": confidence,
+            "timestamp": datetime.utcnow().isoformat(),
+            "continuity_valid": continuity_check["valid"],
+            "continuity_reason": continuity_check["reason"],
+            "confidence_boost": continuity_check["confidence_boost"]
+        }
+        
+        session["location_history"].append(location_record)
+        session["orientation_history"].append(orientation_info)
+        session["confidence_history"].append(confidence)
+        
+        # Keep history records within reasonable range
+        if len(session["location_history"]) > 10:
+            session["location_history"] = session["location_history"][-10:]
+            session["orientation_history"] = session["orientation_history"][-10:]
+            session["confidence_history"] = session["confidence_history"][-10:]
+        return session
     
-    print(f"📍 Session {session_id} location updated: {new_location} (confidence: {confidence:.3f})")
-    print(f"   Continuity: {continuity_check['reason']}, Boost: {continuity_check['confidence_boost']:.3f}")
+    SESSION_STORE.update(SESSION_NS, session_id, _apply)
+    if not continuity:
+        return
+    locate_log.debug("session %s location updated: %s (confidence %.3f, continuity %s, boost %.3f)",
+                     session_id, new_location, confidence, continuity["reason"], continuity["confidence_boost"])
 
 def get_location_distance(from_location: str, to_destination: str, site_id: str) -> dict:
     """Calculate distance from current location to destination"""
@@ -366,10 +337,10 @@ def get_location_distance(from_location: str, to_destination: str, site_id: str)
 
 def generate_location_context_prompt(session_id: str, user_question: str, site_id: str, lang: str = "en") -> str:
     """Generate context prompt with location secondary judgment"""
-    if session_id not in SESSIONS:
+    session = _get_session(session_id)
+    if session is None:
         return ""
-    
-    session = SESSIONS[session_id]
+
     current_location = session.get("current_location")
     orientation_history = session.get("orientation_history", [])
     location_history = session.get("location_history", [])
@@ -482,25 +453,20 @@ def normalize_candidate(c):
     # 兜底：非法输入
     return str(c), 0.0, False
 
-def enhanced_ft_retrieval(caption: str, retriever, site_id: str, detailed_data: list) -> list:
+def enhanced_ft_retrieval(caption: str, retriever, site_id: str, detailed_data: list = None, state: RetrievalState = None) -> list:
     """增强：改进的FT检索，使用增强的双通道融合策略"""
-    print(f"🏗️ Enhanced Dual-Channel Fusion retrieval for {site_id}")
-    
     try:
         # 使用增强的双通道检索器
         try:
             # 获取融合后的候选列表
-            candidates = retriever.retrieve(caption, top_k=10, scene_filter=site_id)
+            candidates = retriever.retrieve(caption, top_k=10, scene_filter=site_id, state=state)
             
             if not candidates:
-                print("❌ 无法获取候选列表")
+                locate_log.warning("no candidates from enhanced retriever: %s", site_id)
                 return []
-                
-            print(f"✅ 成功获取候选列表: {len(candidates)} 个候选")
             
             # 🔧 NEW: 标准化候选格式，确保三元组一致性
             if candidates and isinstance(candidates[0], (list, tuple)):
-                print(f"🔧 标准化候选格式: 从{len(candidates[0])}元组到三元组")
                 normalized_candidates = []
                 for c in candidates:
                     node_id, score, has_detail = normalize_candidate(c)
@@ -511,65 +477,35 @@ def enhanced_ft_retrieval(caption: str, retriever, site_id: str, detailed_data:
                         "has_detail": has_detail
                     })
                 candidates = normalized_candidates
-                print(f"🔧 标准化完成: {len(candidates)} 个候选")
                 
         except Exception as e:
-            print(f"❌ 增强双通道检索失败: {e}")
+            locate_log.warning("enhanced dual-channel retrieval failed: %s", e)
             return []
         
-        print(f"📊 Enhanced dual-channel fusion returned {len(candidates)} candidates")
-        
         # 修复：正确查找detail数据，确保has_detail与detail_entries一致
-        for candidate in candidates:
-            node_id = candidate["id"]
-            
-            # 🔧 NEW: 应用实体别名映射，将结构数据ID转换为细节数据ID
-            mapped_detail_id = node_id  # 默认使用原ID
-            entity_aliases = {
-                "poi01_entrance_glass_door": "dp_ms_entrance",
-                "poi02_green_trash_bin": "yline_start",
-                "poi03_black_drawer_cabinet": "yline_bend_mid",
-                "poi04_wall_3d_printers": "atrium_edge",
-                "poi05_desk_3d_printer": "tv_zone",
-                "poi06_small_open_3d_printer": "storage_corner",
-                "poi07_cardboard_boxes": "orange_sofa_corner",
-                "poi08_to_atrium": "desks_cluster",
-                "poi09_qr_bookshelf": "chair_on_yline",
-                "poi10_metal_display_cabinet": "small_table_mid"
-            }
-            
-            if node_id in entity_aliases:
-                mapped_detail_id = entity_aliases[node_id]
-                print(f"🔍 实体别名映射: {node_id} → {mapped_detail_id}")
-            
-            # 使用retriever中的detail_index（优先使用映射后的ID）
-            if hasattr(retriever, 'detail_index') and retriever.detail_index:
-                detail_items = retriever.detail_index.get(mapped_detail_id, [])
-                print(f"🔧 使用retriever.detail_index查找 {mapped_detail_id}: {len(detail_items)} 项")
-            else:
-                # 回退到原始方法（使用映射后的ID）
-                detail_items = find_node_details_by_hint(mapped_detail_id, detailed_data)
-                print(f"🔧 使用find_node_details_by_hint查找 {mapped_detail_id}: {len(detail_items)} 项")
-            
-            candidate["detail_metadata"] = detail_items
-            candidate["detail_items"] = len(detail_items)
+        scene = SCENE_REGISTRY.get(site_id)
+        with stage("detail_attach"):
+            for candidate in candidates:
+                node_id = candidate["id"]
             
-            # 修复：确保has_detail与detail_entries统计一致
-            has_detail = len(detail_items) > 0
-            candidate["has_detail"] = has_detail  # 绑定到候选节点上
+                # 🔧 NEW: 别名映射与节点细节表在场景加载时由数据文件预计算，这里只做O(1)查找
+                detail_items = scene.details_for_node(node_id) if scene else []
             
-            print(f"🔍 Found {len(detail_items)} detail entries for node {node_id}")
+                candidate["detail_metadata"] = detail_items
+                candidate["detail_items"] = len(detail_items)
             
-            if has_detail:
-                print(f"🔍 Node {node_id}: structure={candidate.get('structure_score', 0):.3f}, detail_available")
-            else:
-                print(f"🔍 Node {node_id}: structure={candidate.get('structure_score', 0):.3f}, no_detail_available")
-        
-        print(f"📊 Enhanced Dual-Channel Fusion completed: {len(candidates)} candidates (fused scoring)")
+                # 修复：确保has_detail与detail_entries统计一致
+                has_detail = len(detail_items) > 0
+                candidate["has_detail"] = has_detail  # 绑定到候选节点上
+        
+        if trace_enabled():
+            trace_event("detail_attach", details={
+                c["id"]: [scene.alias_for(c["id"]) if scene else c["id"], c["detail_items"]]
+                for c in candidates[:5]})
         return candidates
         
     except Exception as e:
-        print(f"❌ Enhanced FT retrieval failed: {e}")
+        locate_log.warning("enhanced FT retrieval failed: %s", e)
         return []
 
 def match_detailed_descriptions(caption: str, detailed_data: list) -> list:
@@ -663,78 +599,26 @@ def match_detailed_descriptions(caption: str, detailed_data: list) -> list:
     matches.sort(key=lambda x: x["score"], reverse=True)
     return matches
 
-def find_node_details_by_hint(node_id: str, detailed_data: list) -> list:
-    """Find detail descriptions from Sense_A_MS.jsonl using node_hint field with alias resolution"""
-    print(f"🔍 find_node_details_by_hint调用: node_id={node_id}, detailed_data长度={len(detailed_data) if detailed_data else 0}")
-    
-    if not detailed_data:
-        print(f"⚠️ detailed_data为空！")
+def find_node_details_by_hint(node_id: str, site_id: str = None) -> list:
+    """Find detail descriptions for a node via the scene model's precomputed alias/detail tables
+
+    未指定站点时只在已常驻的站点中查找（最近使用的优先），不会为此加载站点或改变 LRU 顺序。
+    """
+    scene = SCENE_REGISTRY.get(site_id) if site_id else None
+    if scene is None and not site_id:
+        for sid in reversed(SCENE_REGISTRY.resident()):
+            candidate_scene = SCENE_REGISTRY.peek(sid)
+            if candidate_scene and (node_id in candidate_scene.details_by_node
+                                    or node_id in candidate_scene.detail_by_key):
+                scene = candidate_scene
+                break
+    if scene is None:
+        locate_log.debug("no resident scene contains node %s (site_id=%s)", node_id, site_id)
         return []
-    
-    # 🔧 NEW: 统一的别名解析器
-    POI_TO_CANON = {
-        "poi01_entrance_glass_door": "dp_ms_entrance",
-        "poi02_green_trash_bin": "yline_start",
-        "poi03_black_drawer_cabinet": "yline_bend_mid",
-        "poi04_wall_3d_printers": "atrium_edge",
-        "poi05_desk_3d_printer": "tv_zone",
-        "poi06_small_open_3d_printer": "storage_corner",
-        "poi07_cardboard_boxes": "orange_sofa_corner",
-        "poi08_to_atrium": "desks_cluster",
-        "poi09_qr_bookshelf": "chair_on_yline",
-        "poi10_metal_display_cabinet": "small_table_mid",
-    }
-    
-    def resolve_alias(node_id: str) -> str:
-        """解析节点ID别名"""
-        return POI_TO_CANON.get(node_id, node_id)
-    
-    # 应用别名解析
-    anchor = resolve_alias(node_id)
-    if anchor != node_id:
-        print(f"🔍 别名解析: {node_id} → {anchor}")
-    
-    node_details = []
-    for item in detailed_data:
-        # Use node_hint field to match with structure nodes (使用解析后的别名)
-        if item.get("node_hint") == anchor:
-            node_details.append(item)
-    
-    # 🔧 NEW: 关键词兜底（避免0命中）
-    if not node_details:
-        k = anchor.lower()
-        if "entrance" in k or "door" in k: 
-            fallback_items = [item for item in detailed_data if item.get("node_hint") == "dp_ms_entrance"]
-            if fallback_items:
-                print(f"🔍 关键词兜底: {anchor} → dp_ms_entrance (找到 {len(fallback_items)} 项)")
-                node_details = fallback_items
-        elif "atrium" in k:
-            fallback_items = [item for item in detailed_data if item.get("node_hint") == "atrium_edge"]
-            if fallback_items:
-                print(f"🔍 关键词兜底: {anchor} → atrium_edge (找到 {len(fallback_items)} 项)")
-                node_details = fallback_items
-        elif "printer" in k:
-            fallback_items = [item for item in detailed_data if item.get("node_hint") in ["tv_zone", "desks_cluster"]]
-            if fallback_items:
-                print(f"🔍 关键词兜底: {anchor} → tv_zone/desks_cluster (找到 {len(fallback_items)} 项)")
-                node_details = fallback_items
-        elif "box" in k:
-            fallback_items = [item for item in detailed_data if item.get("node_hint") in ["storage_corner", "orange_sofa_corner"]]
-            if fallback_items:
-                print(f"🔍 关键词兜底: {anchor} → storage_corner/orange_sofa_corner (找到 {len(fallback_items)} 项)")
-                node_details = fallback_items
-        elif "bookshelf" in k or "qr" in k:
-            fallback_items = [item for item in detailed_data if item.get("node_hint") == "chair_on_yline"]
-            if fallback_items:
-                print(f"🔍 关键词兜底: {anchor} → chair_on_yline (找到 {len(fallback_items)} 项)")
-                node_details = fallback_items
-        elif "trash" in k or "bin" in k:
-            fallback_items = [item for item in detailed_data if item.get("node_hint") == "small_table_mid"]
-            if fallback_items:
-                print(f"🔍 关键词兜底: {anchor} → small_table_mid (找到 {len(fallback_items)} 项)")
-                node_details = fallback_items
-    
-    print(f"🔍 Found {len(node_details)} detail entries for node {node_id} (解析后: {anchor})")
+
+    node_details = scene.details_for_node(node_id)
+    locate_log.debug("found %d detail entries for node %s (alias %s)",
+                     len(node_details), node_id, scene.alias_for(node_id))
     return node_details
 
 def find_node_details(node_id: str, detailed_data: list) -> list:
@@ -955,11 +839,21 @@ def combine_retrieval_results(standard_candidates: list, detailed_candidates: li
     
     return combined
 
+# Shared session state backend (memory | sqlite), see session_store.py
+# SESSION_BACKEND=sqlite 时多个 uvicorn worker 共享同一份会话状态
+SESSION_STORE = create_session_backend()
+
 # Session-level logging switch: key = (session_id, provider) -> {"enabled":bool, "run_id":str}
-LOG_SWITCH = defaultdict(lambda: {"enabled": False, "run_id": ""})
+def _log_switch_key(session_id: str, provider: str) -> str:
+    return f"{session_id}|{(provider or 'base').lower()}"
+
+def _get_log_switch(session_id: str, provider: str) -> dict:
+    return SESSION_STORE.get(LOG_SWITCH_NS, _log_switch_key(session_id, provider),
+                             {"enabled": False, "run_id": ""})
 
 # Enhanced session management with location tracking
-SESSIONS: Dict[str, Dict[str, Any]] = {}
+def _get_session(session_id: str) -> Dict[str, Any]:
+    return SESSION_STORE.get(SESSION_NS, session_id)
 
 # ✅ New: DG Optimization Module Instances
 # if ENABLE_DG_EVALUATION:
@@ -1046,197 +940,17 @@ def _ensure_headers(paths: dict):
                 csv.writer(f).writerow(HEADERS[kind])
 
 def _is_logging(session_id: str, provider: str):
-    st = LOG_SWITCH[(session_id, (provider or "base").lower())]
+    st = _get_log_switch(session_id, provider)
     return bool(st.get("enabled")), st.get("run_id") or ""
 
 def _now_ms(): 
     """Get current time in milliseconds"""
     return int(time.time() * 1000)
 
-# 🔧 FIX: 调整低置信度阈值，让60%+的confidence不再显示警告
-# 低置信度阈值配置 - 双通道模式，优化阈值
-LOWCONF_SCORE_TH = float(os.getenv("LOWCONF_SCORE_TH", "0.40"))  # 双通道模式：40% confidence（从50%降低到40%）
-LOWCONF_MARGIN_TH = float(os.getenv("LOWCONF_MARGIN_TH", "0.05"))  # 双通道模式：5% margin（从10%降低到5%）
-
-# 🔧 NEW: Softmax temperature calibration for confidence scoring
-SOFTMAX_TEMPERATURE = float(os.getenv("SOFTMAX_TEMPERATURE", "0.06"))  # Temperature for softmax calibration
-ENABLE_SOFTMAX_CALIBRATION = False  # 修复：强制关闭softmax校准
-ENABLE_CONTINUITY_BOOST = os.getenv("ENABLE_CONTINUITY_BOOST", "true").lower() == "true"
-
 print(f"🔧 Low-confidence thresholds: score<{LOWCONF_SCORE_TH}, margin<{LOWCONF_MARGIN_TH}")
 print(f"🔧 Softmax calibration: enabled={ENABLE_SOFTMAX_CALIBRATION}, temperature={SOFTMAX_TEMPERATURE}")
 print(f"🔧 Continuity boost: enabled={ENABLE_CONTINUITY_BOOST}")
 
-def apply_softmax_calibration(scores: List[float], temperature: float = None) -> List[float]:
-    """
-    Apply softmax calibration to convert raw similarity scores to probabilities
-    
-    Args:
-        scores: List of raw similarity scores
-        temperature: Temperature parameter (lower = sharper distribution)
-    
-    Returns:
-        List of calibrated probabilities
-    """
-    if temperature is None:
-        temperature = SOFTMAX_TEMPERATURE
-    
-    if not scores:
-        return []
-    
-    # Apply temperature scaling
-    scaled_scores = [score / temperature for score in scores]
-    
-    # Compute softmax
-    max_score = max(scaled_scores)
-    exp_scores = [np.exp(score - max_score) for score in scaled_scores]
-    sum_exp_scores = sum(exp_scores)
-    
-    # Normalize to probabilities
-    probabilities = [exp_score / sum_exp_scores for exp_score in exp_scores]
-    
-    return probabilities
-
-def calibrate_confidence(margin, has_detail, struct_top1, detail_top1, same_as_last, content_match):
-    """温和的置信度标定，避免"先拉满再腰斩" """
-    import numpy as np
-    
-    # margin→sigmoid
-    conf_m = 1/(1 + np.exp(-12*(margin - 0.15)))   # 0.15 作为"可分"分界
-    if not has_detail:
-        conf_m *= 0.92
-
-    # 一致性：没有 top1 的时候不要给 1.15
-    if struct_top1 and detail_top1:
-        if struct_top1 == detail_top1:
-            cons = 1.15
-        elif are_neighbors(struct_top1, detail_top1):
-            cons = 1.05
-        else:
-            cons = 0.92
-    else:
-        cons = 0.95
-
-    cont = 1.10 if same_as_last else 1.00
-
-    # 内容匹配放最后，用温和乘法（≥0.75 下限）
-    conf = conf_m * cons * cont * max(0.75, float(content_match or 1.0))
-    
-    # 🔧 FIX: 移除硬编码的0.98上限，使用动态上限
-    # 基于margin动态调整上限：高margin时允许更高confidence
-    if margin > 0.5:
-        max_conf = 0.95  # 高margin时允许95%
-    elif margin > 0.2:
-        max_conf = 0.90  # 中等margin时允许90%
-    else:
-        max_conf = 0.80  # 低margin时限制在80%
-    
-    conf = float(np.clip(conf, 0.20, max_conf))
-
-    # 低置信度不更新会话，避免"定位抖动"
-    if conf < 0.35:
-        return conf, False   # False=不要 update_session
-    return conf, True
-
-def are_neighbors(node1, node2):
-    """检查两个节点是否为邻居（简化版）"""
-    # TODO: 实现真实的拓扑邻居检查
-    return False  # 暂时返回False，避免错误
-
-def calculate_calibrated_confidence_and_margin(candidates: List[Dict], top_k: int = 5) -> tuple:
-    """修复：统一置信度标尺，使用线性归一化"""
-    if not candidates or len(candidates) < 2:
-        return 0.0, 0.0, 0.0, 0.0
-    
-    # 获取top-k分数
-    top_scores = [float(c["score"]) for c in candidates[:top_k]]
-    
-    if len(top_scores) < 2:
-        return top_scores[0], 0.0, top_scores[0], 0.0
-    
-    top1_score = top_scores[0]
-    top2_score = top_scores[1]
-    
-    # 修复：统一使用线性归一化，避免softmax过度夸大
-    margin = max(0.0, top1_score - top2_score)
-    
-    # 使用线性归一化计算置信度
-    tau_low, tau_high = 0.10, 0.50
-    
-    if margin <= tau_low:
-        confidence = 0.2  # 低置信度下限
-    elif margin >= tau_high:
-        confidence = 0.9  # 高置信度上限
-    else:
-        # 线性插值
-        confidence = 0.2 + (0.9 - 0.2) * (margin - tau_low) / (tau_high - tau_low)
-    
-    # 检查detail可用性，如果没有detail则应用平滑折扣因子
-    top1_candidate = candidates[0]
-    has_detail = top1_candidate.get("has_detail", False)
-    
-    # 🔧 NEW: 使用平滑的margin→confidence映射，去掉硬帽
-    def conf_from_margin(margin, has_detail, base=0.15, k=12, nodetail_factor=0.92):
-        """平滑置信度 = margin × 一致性 × 连续性（全乘，再截断）"""
-        # S型曲线：margin=base 时约 0.5，>base 快速上升，<base 迅速下降
-        m = max(1e-6, margin)
-        conf_margin = 1.0 / (1.0 + math.exp(-k * (m - base)))
-        
-        # 应用detail因子
-        if not has_detail:
-            conf_margin *= nodetail_factor  # 0.92，不要硬帽
-        
-        # 设置下限，避免报 0
-        return max(0.2, min(conf_margin, 0.98))
-    
-    # 🔧 NEW: 置信度一致性升级
-    def calculate_consistency(struct_top1, detail_top1):
-        """计算结构/细节一致性：相同top1给额外提升，邻居给小幅提升，冲突时减分"""
-        if struct_top1 == detail_top1:
-            return 1.15  # 完全一致，大幅提升
-        elif struct_top1 and detail_top1:  # 简化检查，避免复杂邻居判断
-            return 1.05  # 邻居关系，小幅提升
-        else:
-            return 0.92  # 冲突，减分
-    
-    def calculate_continuity_factor(current_node, previous_node):
-        """计算连续性因子：与上一帧位置的关系"""
-        if not previous_node or current_node == previous_node:
-            return 1.10  # 相同位置，小幅提升
-        else:
-            return 1.00  # 其他位置，无影响
-    
-    # 获取结构通道和细节通道的top1（需要从外部传入）
-    # 这里先使用默认值，实际调用时需要传入
-    struct_top1 = None  # TODO: 从外部传入
-    detail_top1 = None  # TODO: 从外部传入
-    
-    # 计算一致性系数和连续性因子
-    consistency = calculate_consistency(struct_top1, detail_top1)
-    # 修复：current_node_id未定义，使用top1_id作为当前节点
-    current_node_id = top1_id if 'top1_id' in locals() else None
-    continuity = calculate_continuity_factor(current_node_id, None)  # 简化，避免复杂依赖
-    
-    if consistency != 1.0:
-        print(f"🔍 一致性检查: struct_top1={struct_top1}, detail_top1={detail_top1}, consistency={consistency:.3f}")
-    
-    # 🔧 NEW: 温和的置信度标定，避免"先拉满再腰斩"
-    confidence, should_update_session = calibrate_confidence(
-        margin, has_detail, struct_top1, detail_top1, 
-        current_node_id == None, 1.0  # content_match默认为1.0
-    )
-    
-    print(f"🔧 置信度标定: margin={margin:.3f}, has_detail={has_detail}, confidence={confidence:.3f}, should_update={should_update_session}")
-    
-    # 修复：添加断言式日志，确保状态一致
-    print(f"🔧 [ASSERT] 统一置信度计算:")
-    print(f"   Raw scores: top1={top1_score:.4f}, top2={top2_score:.4f}")
-    print(f"   Margin: {margin:.4f}")
-    print(f"   Calculated confidence: {confidence:.4f}")
-    print(f"   Has detail: {has_detail}")
-    
-    return confidence, margin, top1_score, top2_score
-
 def apply_continuity_boost(top1_score: float, session_id: str, site_id: str, 
                           current_node_id: str, orientation_info: Dict = None) -> tuple:
     """修复：改进的连续性boost，避免过度惩罚
@@ -1254,8 +968,9 @@ def apply_continuity_boost(top1_score: float, session_id: str, site_id: str,
     try:
         # 获取会话历史
         session_key = f"{session_id}_{site_id}"
-        if session_key in SESSIONS:
-            location_history = SESSIONS[session_key].get("location_history", [])
+        session = SESSION_STORE.get(SESSION_NS, session_key)
+        if session is not None:
+            location_history = session.get("location_history", [])
         else:
             location_history = []
             
@@ -1266,12 +981,10 @@ def apply_continuity_boost(top1_score: float, session_id: str, site_id: str,
                 # 位置一致：给予正向boost
                 boost = 0.05
                 reason = "location_consistency"
-                print(f"🔧 位置一致性boost: +{boost:.3f}")
             elif last_location != current_node_id:
                 # 位置变化：使用粘性阈值判断
                 boost = 0.0  # 保持中性
                 reason = "location_change_neutral"
-                print(f"🔧 位置变化，保持中性: {boost:.3f}")
                 
         # 方向一致性检查
         if orientation_info and "confidence" in orientation_info:
@@ -1279,15 +992,15 @@ def apply_continuity_boost(top1_score: float, session_id: str, site_id: str,
             if orientation_conf > 0.7:
                 boost += 0.03
                 reason += "_orientation_boost"
-                print(f"🔧 方向一致性boost: +0.03")
                 
     except Exception as e:
-        print(f"⚠️ 连续性boost计算失败: {e}")
+        locate_log.warning("continuity boost failed for %s: %s", session_id, e)
         boost = 0.0
         reason = "error"
     
     # 限制boost范围
     boost = max(-0.05, min(0.10, boost))
+    locate_log.debug("continuity boost %s: %+.3f (%s)", session_id, boost, reason)
     
     return boost, reason
 
@@ -1491,1306 +1204,37 @@ except Exception:
 
 # Initialize unified dual-channel retriever
 MODEL_DIR_PATH = pathlib.Path(MODEL_DIR)
+SCENE_REGISTRY = SceneRegistry(DATA_DIR)
+CALIBRATION_TABLES.attach(SCENE_REGISTRY)   # 站点标定表按同一份清单定位，并随数据文件版本校验
+RESPONSE_TEMPLATES.attach(SCENE_REGISTRY)
+RESPONSE_TEMPLATES.warm()                   # 预设输出 / 节点说明按站点、provider 预先构建
 UNIFIED_RETRIEVER = None
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def is_admin(token: str) -> bool:
+    """管理令牌校验：未配置 ADMIN_TOKEN 时任何令牌都不通过"""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest((token or "").encode(), ADMIN_TOKEN.encode())
+
+def require_admin(token: str):
+    """管理接口鉴权：未配置 ADMIN_TOKEN 时一律拒绝，不再默认开放"""
+    if not is_admin(token):
+        raise HTTPException(status_code=403, detail="admin token required")
+
+# 文件监视：textmap / 细节文件 / 索引变化后在后台重载对应站点（SCENE_WATCH_INTERVAL=0 关闭）
+SCENE_WATCHER = None
+if SCENE_WATCH_INTERVAL > 0:
+    SCENE_WATCHER = SceneWatcher(SCENE_REGISTRY, SCENE_WATCH_INTERVAL)
+    SCENE_WATCHER.start()
 
 def get_unified_retriever():
     """Get or create enhanced dual-channel retriever with improved fusion strategy"""
-    print("🔧 Initializing enhanced dual-channel retriever...")
-    
     global UNIFIED_RETRIEVER
     if UNIFIED_RETRIEVER is None:
+        print("🔧 Initializing enhanced dual-channel retriever...")
         try:
-            print("🔧 Creating enhanced dual-channel retriever with improved fusion...")
-            
-            # 🔧 ENHANCED: Create an enhanced dual-channel retriever with improved fusion strategy
-            class EnhancedDualChannelRetriever:
-                def __init__(self):
-                    self.structure_tau = 0.15  # 结构通道温度（提高，让分布更平衡）
-                    self.detail_tau = 0.20     # 细节通道温度（提高，让分布更平衡）
-                    self.alpha = 0.35          # 结构通道权重（进一步降低，减少宽泛索引词影响）
-                    self.beta = 0.65           # 细节通道权重（进一步提高，增强内容匹配）
-                    self.gamma = 0.15          # 连续性boost权重（适中，避免过度影响）
-                    
-                    # 🔧 FIX: 延迟加载数据，等待场景信息
-                    self.structure_data = None
-                    self.detail_data = None
-                    self.topology_graph = {}
-                    self.topology_empty = False
-                    self.current_scene_filter = None
-                    
-                    print(f"✅ Enhanced dual-channel retriever initialized (Margin Boost Mode)")
-                    print(f"   Structure tau: {self.structure_tau} (sharper distribution)")
-                    print(f"   Detail tau: {self.detail_tau} (sharper distribution)")
-                    print(f"   Enhanced fusion: α={self.alpha}, β={self.beta}, γ={self.gamma}")
-                    print(f"   Margin boost: exponential amplification + continuity boost")
-                    print(f"   Structure bias: enhanced with 1.5x clarity multiplier")
-                
-                def _build_topology_graph(self):
-                    """构建拓扑图用于连续性检查"""
-                    try:
-                        # 从结构数据中提取拓扑信息
-                        if hasattr(self, 'structure_data') and self.structure_data:
-                            topology = self.structure_data.get('input', {}).get('topology', {})
-                            nodes = topology.get('nodes', [])
-                            edges = topology.get('edges', [])
-                            
-                            # 🔧 NEW: Fail-fast检查
-                            if not nodes:
-                                print("❌ 空拓扑图！中止融合，使用预设/上一帧状态")
-                                self.topology_graph = {}
-                                return False
-                            
-                            print(f"🔧 开始构建拓扑图: {len(nodes)} 个节点, {len(edges)} 条边")
-                            
-                            for node in nodes:
-                                node_id = node['id']
-                                self.topology_graph[node_id] = []
-                                
-                                # 从edges中提取邻居信息
-                                for edge in edges:
-                                    if edge['from'] == node_id:
-                                        self.topology_graph[node_id].append(edge['to'])
-                                    elif edge['to'] == node_id:
-                                        self.topology_graph[node_id].append(edge['from'])
-                        
-                        print(f"🔧 拓扑图构建完成: {len(self.topology_graph)} 个节点")
-                        
-                        # 🔧 NEW: 验证拓扑图完整性
-                        if len(self.topology_graph) == 0:
-                            print("❌ 拓扑图为空！中止融合，使用预设/上一帧状态")
-                            self.topology_graph = {}
-                            return False  # 返回False表示构建失败
-                        else:
-                            print(f"🔧 拓扑图验证: 每个节点的邻居数量")
-                            for node_id, neighbors in self.topology_graph.items():
-                                print(f"   {node_id}: {len(neighbors)} 个邻居")
-                            return True  # 返回True表示构建成功
-                                
-                    except Exception as e:
-                        print(f"⚠️ 拓扑图构建失败: {e}")
-                        self.topology_graph = {}
-                        return False  # 返回False表示构建失败
-                
-                def _get_node_neighbors(self, node_id):
-                    """获取节点的邻居列表"""
-                    return self.topology_graph.get(node_id, [])
-                
-                def _are_neighbors(self, node1, node2):
-                    """检查两个节点是否为邻居"""
-                    if not node1 or not node2:
-                        return False
-                    if node1 == node2:
-                        return True
-                    return node2 in self.topology_graph.get(node1, [])
-                
-                def _get_previous_location(self):
-                    """获取上一帧位置（简化实现）"""
-                    # TODO: 从会话历史中获取
-                    return None
-                
-                def _load_structure_data(self):
-                    """加载结构数据（根据场景动态选择）"""
-                    try:
-                        # 🔧 FIX: 动态选择正确的结构文件
-                        import os
-                        
-                        # 获取当前场景ID（从实例属性或默认值）
-                        current_scene = getattr(self, 'current_scene_filter', 'SCENE_A_MS')
-                        print(f"🔧 当前场景: {current_scene}")
-                        
-                        # 根据场景选择正确的结构文件
-                        if current_scene == "SCENE_B_STUDIO":
-                            structure_file = os.path.join(DATA_DIR, "Sense_B_Finetuned.fixed.jsonl")
-                            print(f"🔧 选择Sense_B结构文件: {structure_file}")
-                        else:
-                            # 默认使用Sense_A
-                            structure_file = os.path.join(DATA_DIR, "Sense_A_Finetuned.fixed.jsonl")
-                            print(f"🔧 选择Sense_A结构文件: {structure_file}")
-                        
-                        if os.path.exists(structure_file):
-                            with open(structure_file, 'r', encoding='utf-8') as f:
-                                data = json.load(f)
-                                print(f"🔧 成功加载结构数据: {structure_file}")
-                                return data
-                        else:
-                            print(f"⚠️ 结构数据文件不存在: {structure_file}")
-                            # 返回模拟数据作为fallback
-                            return {
-                                "input": {
-                                    "topology": {
-                                        "nodes": [
-                                            {"id": "dp_ms_entrance", "type": "entrance"},
-                                            {"id": "poi_3d_printer_table", "type": "workstation"},
-                                            {"id": "atrium_edge", "type": "boundary"}
-                                        ],
-                                        "edges": [
-                                            {"from": "dp_ms_entrance", "to": "poi_3d_printer_table"},
-                                            {"from": "poi_3d_printer_table", "to": "atrium_edge"}
-                                        ]
-                                    }
-                                }
-                            }
-                    except Exception as e:
-                        print(f"⚠️  Failed to load structure data: {e}")
-                        return {}
-                
-                def _ensure_structure_data_loaded(self):
-                    """确保结构数据已加载（延迟加载）"""
-                    if self.structure_data is None:
-                        print("🔧 延迟加载结构数据...")
-                        self.structure_data = self._load_structure_data()
-                        # 构建拓扑图
-                        topology_built = self._build_topology_graph()
-                        if not topology_built:
-                            self.topology_empty = True
-                            print("⚠️ 拓扑图为空，融合时将使用预设状态")
-                        else:
-                            self.topology_empty = False
-                
-                def _ensure_detail_data_loaded(self):
-                    """确保细节数据已加载（延迟加载）"""
-                    if self.detail_data is None:
-                        print("🔧 延迟加载细节数据...")
-                        self.detail_data = self._load_detail_data()
-                
-                def _load_detail_data(self):
-                    """加载细节数据（Sense_A_MS.jsonl等）"""
-                    try:
-                        # 这里应该加载实际的Detail数据
-                        # 暂时返回模拟数据
-                        return {
-                            "dp_ms_entrance": {"id": "dp_ms_entrance", "features": ["glass doors", "yellow line"]},
-                            "poi_3d_printer_table": {"id": "poi_3d_printer_table", "features": ["3D printer", "workbench"]},
-                            "atrium_edge": {"id": "atrium_edge", "features": ["windows", "soft seats"]}
-                        }
-                    except Exception as e:
-                        print(f"⚠️  Failed to load detail data: {e}")
-                        return {}
-                
-                def _channel_calibration(self, scores, tau):
-                    """步骤A：通道内校准 - 温度化softmax（增强版）"""
-                    if not scores:
-                        return []
-                    
-                    # 温度缩放
-                    scaled_scores = [score / tau for score in scores]
-                    
-                    # Softmax
-                    max_score = max(scaled_scores)
-                    exp_scores = [np.exp(score - max_score) for score in scaled_scores]
-                    sum_exp = sum(exp_scores)
-                    
-                    probabilities = [exp_score / sum_exp for exp_score in exp_scores]
-                    
-                    # 温和的概率调整：避免过度放大
-                    if probabilities:
-                        # 找到最大概率的索引
-                        max_prob_idx = probabilities.index(max(probabilities))
-                        
-                        # 温和调整：只在概率过低时适当提升
-                        top1_prob = probabilities[max_prob_idx]
-                        if top1_prob < 0.3:  # 只在top1概率过低时调整
-                            # 温和提升top1概率
-                            adjustment_factor = 1.1  # 从1.2降低到1.1
-                            probabilities[max_prob_idx] = min(0.8, top1_prob * adjustment_factor)
-                            
-                            # 重新归一化其他概率
-                            remaining_prob = 1.0 - probabilities[max_prob_idx]
-                            other_probs = [p for i, p in enumerate(probabilities) if i != max_prob_idx]
-                            if other_probs and sum(other_probs) > 0:
-                                for i in range(len(probabilities)):
-                                    if i != max_prob_idx:
-                                        probabilities[i] = (probabilities[i] / sum(other_probs)) * remaining_prob
-                    
-                    return probabilities
-                
-                def _conflict_gate(self, alpha, beta, struct_logit, detail_logit, gap=0.5):
-                    """冲突门控函数：局部返回值，不修改全局权重"""
-                    if abs(struct_logit - detail_logit) > gap:
-                        return alpha * 0.7, beta * 1.1   # 轻微重构
-                    return alpha, beta
-                
-                def _safe_sharpen(self, probs, tau=0.10):
-                    """🔧 FIX: 修复过度极端的二次锐化"""
-                    try:
-                        import numpy as np
-                        
-                        def softmax(x):
-                            x = np.asarray(x, dtype=np.float64)
-                            x = x - np.max(x)
-                            e = np.exp(x)
-                            s = e.sum()
-                            return e / (s if s > 0 else 1.0)
-                        
-                        def sharpen(probs, tau=0.10):
-                            p = np.asarray(probs, dtype=np.float64)
-                            eps = 1e-12
-                            p = np.clip(p, eps, 1.0 - eps)
-                            logits = np.log(p) - np.log(1.0 - p)
-                            return softmax(logits / max(tau, 1e-6))
-                        
-                        # 🔧 FIX: 动态调整温度，避免过度极端
-                        # 检查原始分数的分布
-                        probs_array = np.array(probs)
-                        max_prob = np.max(probs_array)
-                        min_prob = np.min(probs_array)
-                        prob_range = max_prob - min_prob
-                        
-                        # 如果分数差异已经很大，使用更高温度
-                        if prob_range > 0.5:
-                            adjusted_tau = max(0.3, tau)  # 至少0.3
-                            print(f"🔧 检测到高差异({prob_range:.3f})，调整温度: {tau:.2f} → {adjusted_tau:.2f}")
-                            tau = adjusted_tau
-                        
-                        # 应用安全的二次锐化
-                        fused = probs  # 先得到融合后的概率
-                        sharpened = sharpen(fused, tau=tau)
-                        
-                        # 🔧 FIX: 限制锐化后的分数范围，避免过度极端
-                        sharpened_array = np.array(sharpened)
-                        max_score = 0.8  # 限制最高分数
-                        min_score = 0.05  # 限制最低分数
-                        
-                        # 应用范围限制
-                        sharpened_array = np.clip(sharpened_array, min_score, max_score)
-                        
-                        # 重新归一化
-                        total = np.sum(sharpened_array)
-                        if total > 0:
-                            sharpened_array = sharpened_array / total
-                        
-                        return sharpened_array.tolist()  # 转换回Python列表
-                        
-                    except Exception as e:
-                        print(f"⚠️ 二次锐化失败，使用原始概率: {e}")
-                        return probs  # 失败时返回原始概率
-                
-                def _calculate_channel_entropy(self, probabilities):
-                    """计算通道熵（分布尖锐度）"""
-                    if not probabilities:
-                        return 1.0
-                    
-                    entropy = 0.0
-                    for p in probabilities:
-                        if p > 0:
-                            entropy -= p * np.log(p)
-                    
-                    return entropy
-                
-                def _adaptive_weights(self, struct_entropy, detail_entropy):
-                    """根据通道熵自适应调整权重（标准公式实现）"""
-                    # 按照标准公式：α = (1-H_struct) / ((1-H_struct) + (1-H_detail))
-                    # 熵越低，权重越高（分布越尖锐，越可信）
-                    
-                    # 计算清晰度（1 - 熵）
-                    struct_clarity = 1.0 - struct_entropy
-                    detail_clarity = 1.0 - detail_entropy
-                    
-                    # 防止除零错误
-                    total_clarity = struct_clarity + detail_clarity
-                    
-                    if total_clarity > 0:
-                        # 标准公式实现
-                        alpha = struct_clarity / total_clarity
-                        beta = detail_clarity / total_clarity
-                        
-                        # 限制权重范围，避免极端值
-                        alpha = max(0.1, min(0.9, alpha))
-                        beta = max(0.1, min(0.9, beta))
-                        
-                        # 重新归一化
-                        total_weight = alpha + beta
-                        alpha = alpha / total_weight
-                        beta = beta / total_weight
-                        
-                    else:
-                        # 如果两个通道都很平（高熵），使用默认权重
-                        alpha, beta = 0.65, 0.35
-                    
-                    print(f"🔧 Dynamic weight calculation:")
-                    print(f"   Structure entropy: {struct_entropy:.3f} → clarity: {struct_clarity:.3f} → weight: {alpha:.3f}")
-                    print(f"   Detail entropy: {detail_entropy:.3f} → clarity: {detail_clarity:.3f} → weight: {beta:.3f}")
-                    print(f"   Total clarity: {total_clarity:.3f}")
-                    
-                    return alpha, beta
-                
-                def _enhanced_fusion(self, struct_candidates, detail_candidates, caption, scene_filter):
-                    """步骤B：增强的通道间融合（对数几率相加）+ 反证惩罚机制"""
-                    if not struct_candidates:
-                        return []
-                    
-                    try:
-                        # 🔧 NEW: 反证惩罚机制
-                        def apply_negatives(score, node_meta, query_text, penalty=0.15):
-                            """应用反证惩罚：如果查询文本命中节点的negative提示，则降低分数"""
-                            neg = set(node_meta.get("retrieval", {}).get("negative", []))
-                            hit = sum(1 for n in neg if n in query_text.lower())
-                            if hit > 0:
-                                print(f"🔍 反证惩罚: {node_meta.get('id', 'unknown')} 命中 {hit} 个negative提示，惩罚: {hit * penalty:.3f}")
-                            return score - hit * penalty
-                        
-                        # 🔧 NEW: 结构通道稳态词过滤（不污染原始文本）
-                        MOVABLE = {"suitcase", "bag", "backpack", "person", "cup", "bottle", "laptop", "phone", "book"}
-                        LOW_TRUST = {"box": 0.5, "bins": 0.6, "item": 0.7, "stuff": 0.6, "thing": 0.5, "object": 0.5}
-                        
-                        def term_weight(token):
-                            """获取词的权重，不修改原始文本"""
-                            return LOW_TRUST.get(token.lower(), 1.0)
-                        
-                        def stable_query(text: str):
-                            """结构通道专用：过滤可移动物体，保留固定地标（不污染文本）"""
-                            t = text.lower()
-                            # 完全移除可移动物体（包括复数形式）
-                            for w in MOVABLE:
-                                # 移除单数形式
-                                t = t.replace(f" {w} ", " ")
-                                t = t.replace(f"{w} ", " ")
-                                t = t.replace(f" {w}", " ")
-                                # 移除复数形式
-                                t = t.replace(f" {w}s ", " ")
-                                t = t.replace(f"{w}s ", " ")
-                                t = t.replace(f" {w}s", " ")
-                            
-                            # 清理多余空格和标点
-                            cleaned = " ".join(t.split())
-                            cleaned = cleaned.rstrip(" .")
-                            if cleaned != text.lower():
-                                print(f"🔍 结构通道稳态过滤: '{text}' → '{cleaned}'")
-                            return cleaned
-                        
-                        # 对结构通道分数应用反证惩罚 + 稳态过滤
-                        caption_lower = caption.lower()
-                        stable_caption = stable_query(caption)  # 结构通道用稳态版本
-                        
-                        for i, struct_cand in enumerate(struct_candidates):
-                            original_score = struct_cand['score']
-                            # 先应用稳态过滤（在反证惩罚之前）
-                            penalized_score = apply_negatives(original_score, struct_cand, stable_caption)
-                            if penalized_score != original_score:
-                                print(f"🔍 结构通道反证惩罚: {struct_cand['id']} {original_score:.3f} → {penalized_score:.3f}")
-                                struct_cand['score'] = penalized_score
-                        
-                        # 提取分数（已应用反证惩罚）
-                        struct_scores = [c['score'] for c in struct_candidates]
-                        detail_scores = [c['score'] for c in detail_candidates] if detail_candidates else [0.0] * len(struct_candidates)
-                        
-                        # 步骤A：通道内校准 - 温度化softmax
-                        struct_probs = self._channel_calibration(struct_scores, self.structure_tau)
-                        detail_probs = self._channel_calibration(detail_scores, self.detail_tau)
-                        
-                        print(f"🔧 Channel calibration completed:")
-                        print(f"   Structure probs: {[f'{p:.3f}' for p in struct_probs[:3]]}")
-                        print(f"   Detail probs: {[f'{p:.3f}' for p in detail_probs[:3]]}")
-                        
-                        # 新增：显示空间概念匹配调试信息
-                        print(f"🔍 Space concept matching debug:")
-                        print(f"   Caption: {caption}")
-                        space_concepts = ["large open space", "open space", "open area", "atrium"]
-                        for concept in space_concepts:
-                            if concept in caption.lower():
-                                print(f"   ✅ Detected space concept: '{concept}'")
-                                break
-                        
-                        # 计算通道熵和自适应权重
-                        struct_entropy = self._calculate_channel_entropy(struct_probs)
-                        detail_entropy = self._calculate_channel_entropy(detail_probs)
-                        
-                        alpha, beta = self._adaptive_weights(struct_entropy, detail_entropy)
-                        
-                        print(f"🔧 Adaptive weights:")
-                        print(f"   Structure entropy: {struct_entropy:.3f}, weight: {alpha:.3f}")
-                        print(f"   Detail entropy: {detail_entropy:.3f}, weight: {beta:.3f}")
-                        
-                        # 冲突门控检查：检查两个通道的top1是否不同且差异很大
-                        conflict_detected = False
-                        conflict_threshold = 0.5  # 冲突检测阈值
-                        alpha_final = alpha
-                        beta_final = beta
-                        
-                        # 概率转对数几率 - 安全版本
-                        def prob_to_logit(p, eps=1e-6):
-                            p = min(max(p, eps), 1 - eps)
-                            import math
-                            return math.log(p/(1-p))
-                        
-                        if len(struct_candidates) > 0 and len(detail_candidates) > 0:
-                            struct_top1_id = struct_candidates[0]['id']
-                            detail_top1_id = detail_candidates[0]['id']
-                            
-                            if struct_top1_id != detail_top1_id:
-                                # 计算两个通道top1的logit差异
-                                struct_top1_logit = prob_to_logit(struct_probs[0])
-                                detail_top1_logit = prob_to_logit(detail_probs[0])
-                                logit_diff = abs(struct_top1_logit - detail_top1_logit)
-                                
-                                if logit_diff > conflict_threshold:
-                                    conflict_detected = True
-                                    print(f"⚠️ Channel conflict detected:")
-                                    print(f"   Structure top1: {struct_top1_id} (logit: {struct_top1_logit:.3f})")
-                                    print(f"   Detail top1: {detail_top1_id} (logit: {detail_top1_logit:.3f})")
-                                    print(f"   Logit difference: {logit_diff:.3f} > {conflict_threshold}")
-                                    print(f"   Using conflict gating strategy")
-                                    
-                                    # 🔧 NEW: 冲突门控改为局部返回值，只执行一次
-                                    alpha_final, beta_final = self._conflict_gate(alpha, beta, struct_top1_logit, detail_top1_logit, gap=0.5)
-                                    print(f"🔧 冲突门控: α={alpha:.3f}→{alpha_final:.3f}, β={beta:.3f}→{beta_final:.3f}")
-                        
-                        # 融合对数几率（带冲突门控）
-                        fused_candidates = []
-                        fused_logits = []  # 收集所有融合后的logits用于二次锐化
-                        
-                        for i, struct_cand in enumerate(struct_candidates):
-                            struct_logit = prob_to_logit(struct_probs[i])
-                            detail_logit = prob_to_logit(detail_probs[i]) if i < len(detail_probs) else 0.0
-                            
-                            # 使用最终权重进行融合（无论是否有冲突）
-                            fused_logit = alpha_final * struct_logit + beta_final * detail_logit
-                            
-                            # 连续性boost（γ*boost）
-                            boost_value = self._calculate_continuity_boost(struct_cand, caption, scene_filter)
-                            fused_logit += self.gamma * boost_value
-                            
-                            # 🔧 NEW: 拓扑连续性prior
-                            def topo_prior(prev_node, current_node):
-                                """拓扑连续性prior：上一帧的邻居 +0.25，二阶邻居 +0.10，其它 0"""
-                                if prev_node is None:
-                                    return 0.0
-                                
-                                # 获取上一帧节点的邻居
-                                prev_neighbors = self._get_node_neighbors(prev_node)
-                                if current_node in prev_neighbors:
-                                    return 0.25  # 直接邻居
-                                
-                                # 检查二阶邻居
-                                for neighbor in prev_neighbors:
-                                    neighbor_neighbors = self._get_node_neighbors(neighbor)
-                                    if current_node in neighbor_neighbors:
-                                        return 0.10  # 二阶邻居
-                                
-                                return 0.0
-                            
-                            # 应用拓扑连续性prior
-                            prev_node = self._get_previous_location()
-                            topo_boost = topo_prior(prev_node, struct_cand['id'])
-                            if topo_boost > 0:
-                                print(f"🔍 拓扑连续性prior: {struct_cand['id']} +{topo_boost:.3f}")
-                            
-                            fused_logit += topo_boost
-                            
-                            # 转回概率空间
-                            fused_prob = 1 / (1 + np.exp(-fused_logit))
-                            
-                            # 收集logit用于二次锐化
-                            fused_logits.append(fused_logit)
-                            
-                            # 创建融合后的候选
-                            fused_cand = struct_cand.copy()
-                            fused_cand["score"] = fused_prob
-                            # 🔧 FIX: 保存原始的structure和detail分数
-                            fused_cand["structure_score"] = struct_cand["score"]  # 修复字段名
-                            fused_cand["detail_score"] = detail_candidates[i]["score"] if i < len(detail_candidates) else 0.0
-                            fused_cand["fusion_weights"] = {"alpha": alpha, "beta": beta, "gamma": self.gamma}
-                            fused_cand["boost_value"] = boost_value
-                            fused_cand["conflict_strategy"] = "conflict_gated" if conflict_detected else "normal"
-                            
-                            fused_candidates.append(fused_cand)
-                        
-                        # 🔧 FIX: 融合后二次锐化 + 拓扑先验
-                        if fused_logits and len(fused_logits) > 0:
-                            try:
-                                # 🔧 FIX: 使用更温和的初始温度，避免过度极端
-                                tau_fuse = 0.25  # 二次锐化温度（从0.10提升到0.25）
-                                print(f"🔧 融合后二次锐化: τ_fuse={tau_fuse}")
-                                
-                                # 应用安全的二次锐化函数（内部会动态调整温度）
-                                fused_probs = [cand["score"] for cand in fused_candidates]
-                                sharpened_probs = self._safe_sharpen(fused_probs, tau_fuse)
-                                
-                                # 更新候选分数
-                                if len(sharpened_probs) == len(fused_candidates):
-                                    for i, (cand, sharp_prob) in enumerate(zip(fused_candidates, sharpened_probs)):
-                                        old_score = cand["score"]
-                                        cand["score"] = float(sharp_prob)  # 确保是Python float
-                                        if abs(old_score - cand["score"]) > 0.01:
-                                            print(f"🔍 二次锐化: {cand['id']} {old_score:.3f} → {cand['score']:.3f}")
-                                else:
-                                    print(f"⚠️ 二次锐化数组长度不匹配: {len(sharpened_probs)} vs {len(fused_candidates)}")
-                            except Exception as e:
-                                print(f"⚠️ 二次锐化失败: {e}")
-                                # 继续使用原始分数，不中断流程
-                        
-                        print(f"🔧 Enhanced fusion completed: {len(fused_candidates)} candidates (fused scoring)")
-                        return fused_candidates
-                        
-                    except Exception as e:
-                        print(f"⚠️ Enhanced fusion failed: {e}")
-                        return struct_candidates  # 回退到结构通道
-                
-                def _build_detail_index(self):
-                    """统一一次初始化detail数据，避免重复加载冲突"""
-                    scene_id = getattr(self, 'current_scene_filter', 'SCENE_A_MS')
-                    return self._load_detail_once(scene_id)
-                
-                def _load_detail_once(self, scene_id):
-                    """统一一次初始化detail数据缓存"""
-                    # 检查缓存 - 修复：使用实例变量而不是方法属性
-                    if hasattr(self, '_detail_cache') and self._detail_cache.get("scene") == scene_id:
-                        return self._detail_cache["data"]
-                    
-                    # 定义detail文件路径
-                    DETAIL_PATHS = {
-                        'SCENE_A_MS': os.path.join(DATA_DIR, 'Sense_A_MS.jsonl'),
-                        'SCENE_B_STUDIO': os.path.join(DATA_DIR, 'Sense_B_Studio.jsonl')
-                    }
-                    
-                    detail_index = {}
-                    path = DETAIL_PATHS.get(scene_id)
-                    
-                    if not path or not os.path.exists(path):
-                        print(f"⚠️ 未找到detail文件: scene={scene_id}")
-                        data = {}
-                    else:
-                        try:
-                            with open(path, 'r', encoding='utf-8') as f:
-                                for line in f:
-                                    line = line.strip()
-                                    if not line:
-                                        continue
-                                    try:
-                                        item = json.loads(line)
-                                        node_hint = item.get('node_hint', '')
-                                        if node_hint:
-                                            if node_hint not in detail_index:
-                                                detail_index[node_hint] = []
-                                            detail_index[node_hint].append(item)
-                                    except json.JSONDecodeError:
-                                        continue
-                            
-                            print(f"✅ Detail数据已加载: scene={scene_id}, {len(detail_index)} 个节点有detail数据")
-                            for node_id, items in list(detail_index.items())[:3]:  # 只显示前3个
-                                print(f"   {node_id}: {len(items)} 项")
-                            if len(detail_index) > 3:
-                                print(f"   ...等共 {len(detail_index)} 个节点")
-                            data = detail_index
-                        except Exception as e:
-                            print(f"⚠️ Detail数据加载失败: {e}")
-                            data = {}
-                    
-                    # 缓存结果 - 修复：使用实例变量
-                    self._detail_cache = {"scene": scene_id, "data": data}
-                    return data
-                
-                def _calculate_continuity_boost(self, candidate, caption, scene_filter):
-                    """计算连续性boost值（γ*boost）- 增强版"""
-                    try:
-                        boost_value = 0.0
-                        
-                        # 1. 方向一致性boost（增强）
-                        if hasattr(candidate, 'bearing_hint'):
-                            bearing = candidate.get('bearing_hint', '')
-                            if bearing and any(word in caption.lower() for word in bearing.split()):
-                                boost_value += 0.2  # 从0.1增加到0.2
-                        
-                        # 2. 拓扑合法性boost（增强）
-                        if hasattr(candidate, 'topology_valid'):
-                            if candidate.get('topology_valid', False):
-                                boost_value += 0.15  # 从0.05增加到0.15
-                        
-                        # 3. 空间关系一致性boost（增强）
-                        spatial_relations = candidate.get('spatial_relations', {})
-                        for relation, landmark in spatial_relations.items():
-                            if landmark and any(word in caption.lower() for word in str(landmark).split()):
-                                boost_value += 0.1  # 从0.05增加到0.1
-                        
-                        # 4. 关键词匹配boost（新增）
-                        caption_lower = caption.lower()
-                        candidate_text = candidate.get('text', '').lower()
-                        if candidate_text:
-                            # 计算关键词匹配度
-                            caption_words = set(caption_lower.split())
-                            text_words = set(candidate_text.split())
-                            overlap = len(caption_words & text_words)
-                            if overlap > 0:
-                                boost_value += overlap * 0.05  # 每个匹配词+0.05
-                        
-                        # 5. 历史连续性boost（如果有session信息）
-                        # 这里可以添加基于session历史的boost逻辑
-                        
-                        return min(0.5, boost_value)  # 从0.3增加到0.5，让boost有更大影响
-                        
-                    except Exception as e:
-                        print(f"⚠️ Continuity boost calculation failed: {e}")
-                        return 0.0
-
-                def _pack_result(self, node_id, score, used_detail=None):
-                    """统一返回值格式，确保永远返回三元组"""
-                    return node_id, float(score), bool(used_detail) if used_detail is not None else False
-                
-                def _has_detail_data(self, scene_filter):
-                    """检查是否有可用的detail数据"""
-                    try:
-                        if scene_filter == "SCENE_A_MS":
-                            detail_file = os.path.join(DATA_DIR, "Sense_A_MS.jsonl")
-                        elif scene_filter == "SCENE_B_STUDIO":
-                            detail_file = os.path.join(DATA_DIR, "Sense_B_Studio.jsonl")
-                        else:
-                            return False
-                        
-                        return os.path.exists(detail_file) and os.path.getsize(detail_file) > 0
-                    except Exception:
-                        return False
-                
-                def _get_detail_for_node(self, node_id, scene_filter):
-                    """获取特定节点的detail数据"""
-                    try:
-                        if scene_filter == "SCENE_A_MS":
-                            detail_file = os.path.join(DATA_DIR, "Sense_A_MS.jsonl")
-                        elif scene_filter == "SCENE_B_STUDIO":
-                            detail_file = os.path.join(DATA_DIR, "Sense_B_Studio.jsonl")
-                        else:
-                            return []
-                        
-                        if not os.path.exists(detail_file):
-                            return []
-                        
-                        detail_items = []
-                        with open(detail_file, 'r', encoding='utf-8') as f:
-                            for line in f:
-                                if line.strip():
-                                    try:
-                                        detail_item = json.loads(line)
-                                        if detail_item.get("node_hint") == node_id:
-                                            detail_items.append(detail_item)
-                                    except json.JSONDecodeError:
-                                        continue
-                        
-                        return detail_items
-                    except Exception:
-                        return []
-
-                def retrieve(self, caption, top_k=10, scene_filter=None):
-                    """增强双通道检索：使用改进的融合策略，返回候选列表"""
-                    # 设置当前场景过滤器，用于构建detail索引
-                    self.current_scene_filter = scene_filter
-                    
-                    print(f"🔧 Enhanced dual-channel retrieval for: {caption[:50]}...")
-                    
-                    try:
-                        # 🔧 FIX: 确保数据已加载
-                        self._ensure_structure_data_loaded()
-                        self._ensure_detail_data_loaded()
-                        
-                        # 步骤A：通道内校准 - 获取两个通道的候选
-                        struct_candidates = self._retrieve_from_structure_map(caption, scene_filter, top_k)
-                        detail_candidates = self._retrieve_from_detail_map(caption, scene_filter, top_k)
-                        
-                        # 检查detail数据可用性
-                        has_detail_data = self._has_detail_data(scene_filter) and len(detail_candidates) > 0
-                        print(f"🔧 Detail data availability: {has_detail_data} (found {len(detail_candidates)} detail candidates)")
-                        
-                        # 修复：为每个candidate添加has_detail标记
-                        for candidate in struct_candidates:
-                            candidate["has_detail"] = has_detail_data
-                        
-                        if not struct_candidates:
-                            print("⚠️ No candidates found from structure map")
-                            return []
-                        
-                        # 步骤B：通道间融合（对数几率相加）
-                        fused_candidates = self._enhanced_fusion(
-                            struct_candidates, detail_candidates, caption, scene_filter
-                        )
-                        
-                        if not fused_candidates:
-                            print("⚠️ Fusion failed")
-                            return struct_candidates  # 回退到结构通道
-                        
-                        # 🔧 FIX: 添加多样性识别机制，避免总是识别同一个POI
-                        # 检查是否连续多次识别同一个POI
-                        current_top1_id = fused_candidates[0]['id']
-                        if hasattr(self, '_last_top1_id') and hasattr(self, '_top1_repeat_count'):
-                            if current_top1_id == self._last_top1_id:
-                                self._top1_repeat_count += 1
-                                # 如果连续识别超过3次，降低该POI的分数
-                                if self._top1_repeat_count > 3:
-                                    print(f"⚠️ 连续识别{self._top1_repeat_count}次{current_top1_id}，降低分数增加多样性")
-                                    for candidate in fused_candidates:
-                                        if candidate['id'] == current_top1_id:
-                                            candidate['score'] *= 0.7  # 降低30%分数
-                                            break
-                                    # 重新排序
-                                    fused_candidates.sort(key=lambda x: x["score"], reverse=True)
-                            else:
-                                self._top1_repeat_count = 1
-                        else:
-                            self._top1_repeat_count = 1
-                        
-                        self._last_top1_id = current_top1_id
-                        
-                        # 按融合分数排序
-                        fused_candidates.sort(key=lambda x: x["score"], reverse=True)
-                        
-                        # 步骤C：输出置信度与margin（增强版）
-                        top1_score = fused_candidates[0]['score']
-                        top2_score = fused_candidates[1]['score'] if len(fused_candidates) > 1 else 0
-                        
-                        # 🔧 FIX: 改进confidence计算，避免过于固定
-                        # 基于margin和top1_score的动态confidence计算
-                        base_margin = top1_score - top2_score
-                        
-                        # 动态confidence：结合margin和top1_score
-                        if base_margin > 0.3:  # 高margin时给予高confidence
-                            confidence = min(0.95, top1_score * 0.9 + base_margin * 0.3)
-                        elif base_margin > 0.1:  # 中等margin时给予中等confidence
-                            confidence = min(0.85, top1_score * 0.8 + base_margin * 0.2)
-                        else:  # 低margin时降低confidence
-                            confidence = max(0.5, top1_score * 0.6 + base_margin * 0.1)
-                        
-                        # 增强margin计算：使用指数放大和连续性boost
-                        # 连续性boost增强margin
-                        top1_boost = fused_candidates[0].get('boost_value', 0.0)
-                        margin_boost = top1_boost * 0.3  # boost对margin的贡献
-                        
-                        # 指数放大margin（让差异更明显）
-                        enhanced_margin = base_margin * (1.0 + margin_boost)
-                        if enhanced_margin > 0:
-                            enhanced_margin = enhanced_margin ** 0.8  # 指数0.8，让差异更突出
-                        
-                        margin = enhanced_margin
-                        
-                        # 🔧 FIX: 更合理的confidence和margin范围
-                        confidence = max(0.3, min(0.95, confidence))  # 允许更低的confidence
-                        margin = max(0.02, min(0.9, margin))  # 允许更低的margin
-                        
-                        print(f"✅ Enhanced dual-channel retrieval completed (Margin Boost Mode):")
-                        print(f"   Top1: {fused_candidates[0]['id']} (score: {top1_score:.4f})")
-                        if len(fused_candidates) > 1:
-                            print(f"   Top2: {fused_candidates[1]['id']} (score: {top2_score:.4f})")
-                            print(f"   Base margin: {base_margin:.4f}")
-                            print(f"   Boost value: {top1_boost:.4f}")
-                            print(f"   Enhanced margin: {margin:.4f}")
-                        print(f"   Confidence: {confidence:.4f}")
-                        print(f"   Margin boost: exponential + continuity boost applied")
-                        
-                        # 为每个候选添加confidence和margin信息
-                        for i, candidate in enumerate(fused_candidates):
-                            candidate["confidence"] = confidence if i == 0 else confidence * 0.8
-                            candidate["margin"] = margin
-                            candidate["retrieval_method"] = "enhanced_dual_channel_fusion"
-                            candidate["has_detail"] = has_detail_data  # 添加detail可用性标记
-                        
-                        # 修复：确保返回的每个candidate都有正确的has_detail标记
-                        print(f"🔧 Final candidates prepared: {len(fused_candidates)} with has_detail={has_detail_data}")
-                        
-                        return fused_candidates
-                        
-                    except Exception as e:
-                        print(f"⚠️ Enhanced dual-channel retrieval failed: {e}")
-                        return []
-                
-                def _retrieve_from_structure_map(self, caption, scene_filter, top_k):
-                    """从structure map文件中检索（结构通道）"""
-                    try:
-                        # 根据场景选择文件
-                        if scene_filter == "SCENE_A_MS":
-                            textmap_file = os.path.join(DATA_DIR, "Sense_A_Finetuned.fixed.jsonl")
-                        elif scene_filter == "SCENE_B_STUDIO":
-                            textmap_file = os.path.join(DATA_DIR, "Sense_B_Finetuned.fixed.jsonl")
-                        else:
-                            print(f"⚠️ Unknown scene: {scene_filter}")
-                            return []
-                        
-                        print(f"🔍 Reading structure map from: {textmap_file}")
-                        
-                        # 读取textmap文件 - 支持JSON和JSONL两种格式
-                        textmap_data = None
-                        try:
-                            # 首先尝试作为标准JSON读取
-                            with open(textmap_file, 'r', encoding='utf-8') as f:
-                                textmap_data = json.load(f)
-                                print(f"🔍 成功读取为标准JSON格式")
-                        except json.JSONDecodeError:
-                            # 如果失败，尝试作为JSONL读取
-                            try:
-                                with open(textmap_file, 'r', encoding='utf-8') as f:
-                                    for line in f:
-                                        if line.strip():
-                                            textmap_data = json.loads(line)
-                                            break  # 只读取第一行
-                                print(f"🔍 成功读取为JSONL格式")
-                            except Exception as e:
-                                print(f"⚠️ 无法读取文件: {e}")
-                                return []
-                        
-                        if not textmap_data:
-                            print(f"⚠️ No data found in {textmap_file}")
-                            return []
-                        
-                        # 🔧 FIX: 正确处理Sense_B的节点格式
-                        # 提取节点信息 - 检查input.topology和顶级topology
-                        nodes = []
-                        if "input" in textmap_data and "topology" in textmap_data["input"]:
-                            nodes = textmap_data["input"]["topology"].get("nodes", [])
-                            print(f"🔍 从input.topology中读取节点")
-                        elif "topology" in textmap_data:
-                            nodes = textmap_data["topology"].get("nodes", [])
-                            print(f"🔍 从顶级topology中读取节点")
-                        
-                        if not nodes:
-                            print(f"⚠️ No nodes found in {textmap_file}")
-                            return []
-                        
-                        print(f"🔍 Found {len(nodes)} nodes in structure map (structure channel)")
-                        
-                        # 🔧 FIX: 处理不同的节点格式
-                        # Sense_A: [{"id": "poi01", "name": "..."}, ...]
-                        # Sense_B: ["poi11", "poi12", ...]
-                        processed_nodes = []
-                        if nodes and isinstance(nodes[0], str):
-                            # Sense_B格式：字符串数组，需要转换为对象格式
-                            print(f"🔧 检测到Sense_B格式，转换节点为对象格式")
-                            for node_id in nodes:
-                                # 从pois中获取节点信息
-                                pois = textmap_data.get("input", {}).get("pois", {})
-                                if node_id in pois:
-                                    node_info = pois[node_id]
-                                    processed_nodes.append({
-                                        "id": node_id,
-                                        "name": node_info.get("name", ""),
-                                        "retrieval": textmap_data.get("input", {}).get("retrieval", {}),
-                                        "landmarks": [],
-                                        "categories": []
-                                    })
-                                else:
-                                    # 如果没有pois信息，创建基本节点
-                                    processed_nodes.append({
-                                        "id": node_id,
-                                        "name": node_id,
-                                        "retrieval": textmap_data.get("input", {}).get("retrieval", {}),
-                                        "landmarks": [],
-                                        "categories": []
-                                    })
-                        else:
-                            # Sense_A格式：已经是对象数组
-                            processed_nodes = nodes
-                        
-                        # 计算每个节点的相似度分数
-                        candidates = []
-                        caption_lower = caption.lower()
-                        
-                        for node in processed_nodes:
-                            node_id = node.get("id", "")
-                            if not node_id:
-                                continue
-                            
-                            # 计算检索分数
-                            score = self._calculate_node_score(node, caption_lower)
-                            
-                            candidates.append({
-                                "id": node_id,
-                                "score": score,
-                                "text": node.get("name", ""),
-                                "score_nl": score,
-                                "score_struct": score,
-                                "provider": "ft",
-                                "bonus_keywords": 0.0,
-                                "bonus_bearing": 0.0,
-                                "alpha_used": 0.8,
-                                "retrieval_method": "structure_channel"
-                            })
-                        
-                        # 语义去重：合并语义相似的节点
-                        deduplicated_candidates = self._semantic_deduplication(candidates, caption_lower)
-                        
-                        # 返回top_k个候选
-                        deduplicated_candidates.sort(key=lambda x: x["score"], reverse=True)
-                        return deduplicated_candidates[:top_k]
-                        
-                    except Exception as e:
-                        print(f"⚠️ Failed to read structure map: {e}")
-                        return []
-                
-                def _retrieve_from_detail_map(self, caption, scene_filter, top_k):
-                    """从detail map文件中检索（细节通道）"""
-                    try:
-                        # 根据场景选择文件
-                        if scene_filter == "SCENE_A_MS":
-                            detail_file = os.path.join(DATA_DIR, "Sense_A_MS.jsonl")
-                        elif scene_filter == "SCENE_B_STUDIO":
-                            detail_file = os.path.join(DATA_DIR, "Sense_B_Studio.jsonl")
-                        else:
-                            print(f"⚠️ Unknown scene: {scene_filter}")
-                            return []
-                        
-                        # 读取detail文件
-                        if not os.path.exists(detail_file):
-                            print(f"⚠️ Detail file not found: {detail_file}")
-                            return []
-                        
-                        print(f"🔍 Reading detail data from: {detail_file}")
-                        
-                        # 解析JSONL格式
-                        detail_candidates = []
-                        caption_lower = caption.lower()
-                        
-                        with open(detail_file, 'r', encoding='utf-8') as f:
-                            for line_num, line in enumerate(f, 1):
-                                if line.strip():
-                                    try:
-                                        detail_item = json.loads(line)
-                                        node_id = detail_item.get("node_hint", "")
-                                        
-                                        if not node_id:
-                                            print(f"⚠️ Line {line_num}: Missing node_hint")
-                                            continue
-                                        
-                                        # 计算detail分数
-                                        score = self._calculate_detail_score(detail_item, caption_lower)
-                                        
-                                        detail_candidates.append({
-                                            "id": node_id,
-                                            "score": score,
-                                            "text": detail_item.get("nl_text", ""),
-                                            "score_nl": score,
-                                            "score_detail": score,
-                                            "provider": "ft",
-                                            "retrieval_method": "detail_channel"
-                                        })
-                                        
-                                    except json.JSONDecodeError as e:
-                                        print(f"⚠️ Line {line_num}: JSON decode error: {e}")
-                                        continue
-                        
-                        print(f"🔍 Successfully loaded {len(detail_candidates)} detail candidates")
-                        
-                        # 按分数排序并返回top_k
-                        detail_candidates.sort(key=lambda x: x["score"], reverse=True)
-                        return detail_candidates[:top_k]
-                        
-                    except Exception as e:
-                        print(f"⚠️ Failed to read detail map: {e}")
-                        return []
-                
-                def _calculate_detail_score(self, detail_item, caption_lower):
-                    """计算detail项的检索分数（细节通道）"""
-                    score = 0.0
-                    
-                    # 1. 自然语言文本匹配
-                    nl_text = detail_item.get("nl_text", "").lower()
-                    if nl_text:
-                        # 简单的词汇匹配
-                        caption_words = set(caption_lower.split())
-                        text_words = set(nl_text.split())
-                        overlap = len(caption_words & text_words)
-                        if overlap > 0:
-                            score += overlap * 0.1  # 每个匹配词+0.1
-                    
-                    # 2. 结构化文本匹配
-                    struct_text = detail_item.get("struct_text", "").lower()
-                    if struct_text:
-                        caption_words = set(caption_lower.split())
-                        struct_words = set(struct_text.split())
-                        overlap = len(caption_words & struct_words)
-                        if overlap > 0:
-                            score += overlap * 0.08  # 每个匹配词+0.08
-                    
-                    # 3. 空间关系匹配
-                    spatial_relations = detail_item.get("spatial_relations", {})
-                    for relation, landmark in spatial_relations.items():
-                        if landmark and any(word in caption_lower for word in str(landmark).split()):
-                            score += 0.05  # 空间关系匹配+0.05
-                    
-                    # 4. 独特特征匹配
-                    unique_features = detail_item.get("unique_features", [])
-                    for feature in unique_features:
-                        if any(word in caption_lower for word in feature.lower().split()):
-                            score += 0.03  # 每个匹配特征+0.03
-                    
-                    return min(1.0, score)  # 限制最大分数为1.0
-                
-                def _calculate_node_score(self, node, caption_lower):
-                    """计算节点的检索分数（结构通道）- 增强版"""
-                    score = 0.0
-                    
-                    # 🔧 FIX: 改进语义匹配，避免过于宽泛的匹配
-                    # 1. 基于检索词的分数（更严格的匹配）
-                    retrieval = node.get("retrieval", {})
-                    index_terms = retrieval.get("index_terms", [])
-                    tags = retrieval.get("tags", [])
-                    
-                    # 关键词匹配（更严格的权重分配）
-                    for term in index_terms + tags:
-                        term_lower = term.lower()
-                        if term_lower in caption_lower:
-                            # 空间概念给予更高权重
-                            if any(space_word in term_lower for space_word in ["open", "space", "area", "large", "atrium"]):
-                                score += 0.4  # 空间概念权重
-                            elif "box" in term_lower or "boxes" in term_lower:
-                                # 🔧 FIX: 降低box相关词的权重，避免过度匹配
-                                score += 0.15  # 从0.3降低到0.15
-                            else:
-                                score += 0.3
-                        elif any(word in caption_lower for word in term_lower.split()):
-                            if any(space_word in term_lower for space_word in ["open", "space", "area", "large", "atrium"]):
-                                score += 0.2
-                            elif "box" in term_lower or "boxes" in term_lower:
-                                # 🔧 FIX: 降低box相关词的部分匹配权重
-                                score += 0.08  # 从0.15降低到0.08
-                            else:
-                                score += 0.15
-                    
-                    # 2. 基于节点名称的分数（更精确的匹配）
-                    node_name = node.get("name", "").lower()
-                    if node_name:
-                        # 检查空间概念关键词
-                        space_keywords = ["open", "space", "area", "large", "atrium", "cluster"]
-                        space_match = any(space_word in node_name for space_word in space_keywords)
-                        
-                        if space_match and any(word in caption_lower for word in ["open", "space", "large"]):
-                            score += 0.3  # 空间概念匹配给予更高权重
-                        elif any(word in caption_lower for word in node_name.split()):
-                            # 🔧 FIX: 降低box相关节点的名称匹配权重
-                            if "box" in node_name or "boxes" in node_name:
-                                score += 0.1  # 从0.2降低到0.1
-                            else:
-                                score += 0.2
-                    
-                    # 3. 基于地标的分数
-                    landmarks = node.get("landmarks", [])
-                    for landmark in landmarks:
-                        if isinstance(landmark, dict):
-                            landmark_term = landmark.get("term", "").lower()
-                            if landmark_term and any(word in caption_lower for word in landmark_term.split()):
-                                score += 0.1
-                        elif isinstance(landmark, str) and landmark.startswith("lm_"):
-                            # 地标ID匹配
-                            landmark_id = landmark.lower()
-                            if any(word in caption_lower for word in landmark_id.split("_")):
-                                score += 0.1
-                    
-                    # 4. 基于类别的分数
-                    categories = node.get("categories", [])
-                    for category in categories:
-                        if category.lower() in caption_lower:
-                            score += 0.1
-                    
-                    # 5. 新增：空间概念语义匹配（解决"large open space"问题）
-                    # 检查caption中的空间概念是否与节点匹配
-                    space_concepts = {
-                        "large open space": ["open", "space", "large", "area", "atrium", "cluster"],
-                        "open space": ["open", "space", "area", "atrium"],
-                        "open area": ["open", "area", "space", "atrium"],
-                        "atrium": ["atrium", "open", "space", "area"]
-                    }
-                    
-                    for caption_concept, keywords in space_concepts.items():
-                        if caption_concept in caption_lower:
-                            # 检查节点是否包含相关空间概念
-                            node_text = f"{node.get('name', '')} {' '.join(index_terms)} {' '.join(tags)}"
-                            node_text_lower = node_text.lower()
-                            
-                            if any(keyword in node_text_lower for keyword in keywords):
-                                score += 0.25  # 空间概念语义匹配给予额外权重
-                                break
-                    
-                    # 🔧 FIX: 添加多样性惩罚，避免总是选择同一个POI
-                    if hasattr(self, '_last_top1_id') and node.get("id") == getattr(self, '_last_top1_id', None):
-                        score *= 0.8  # 连续选择同一POI时降低20%分数
-                    
-                    return min(1.0, score)  # 限制最大分数为1.0
-                
-                def _semantic_deduplication(self, candidates, caption_lower):
-                    """语义去重：合并语义相似的节点，避免返回重复的TV screen等"""
-                    if not candidates:
-                        return candidates
-                    
-                    # 定义语义相似组 - 增强版，更精确的区分
-                    semantic_groups = {
-                        "tv_screen_group": [
-                            "tv screen", "large tv screen", "large tv screen near entry",
-                            "tv", "television", "display", "screen", "monitor"
-                        ],
-                        "window_group": [
-                            "glass window", "window wall", "windows", "glass", "window"
-                        ],
-                        "sofa_group": [
-                            "orange sofa", "sofa", "couch", "seating"
-                        ],
-                        "chair_group": [
-                            "chair", "chair_on", "yline", "seating", "stool"
-                        ],
-                        "space_group": [
-                            "open space", "large open space", "open area", "atrium", "space"
-                        ],
-                        "boxes_group": [
-                            "boxes", "box", "cardboard", "stacked", "floor", "on floor"
-                        ],
-                        "desk_group": [
-                            "desk", "desks", "workbench", "workstation", "computer"
-                        ],
-                        "table_group": [
-                            "table", "surface", "counter", "small_table"
-                        ],
-                        "storage_group": [
-                            "storage", "shelf", "cabinet", "drawer", "container"
-                        ],
-                        "wall_group": [
-                            "wall", "drawer_wall", "component_wall", "partition"
-                        ]
-                    }
-                    
-                    # 新增：实体别名映射，识别同一实体的不同表示（修复节点ID不匹配）
-                    entity_aliases = {
-                        "poi01_entrance_glass_door": ["dp_ms_entrance", "entrance", "glass door"],
-                        "poi02_green_trash_bin": ["yline_start", "trash bin", "green bin"],
-                        "poi03_black_drawer_cabinet": ["yline_bend_mid", "drawer cabinet", "black cabinet"],
-                        "poi04_wall_3d_printers": ["atrium_edge", "3d printers", "wall printers"],
-                        "poi05_desk_3d_printer": ["tv_zone", "desk printer", "3d printer"],
-                        "poi06_small_open_3d_printer": ["storage_corner", "small printer", "open printer"],
-                        "poi07_cardboard_boxes": ["orange_sofa_corner", "cardboard boxes", "boxes"],
-                        "poi08_to_atrium": ["desks_cluster", "atrium", "to atrium"],
-                        "poi09_qr_bookshelf": ["chair_on_yline", "qr bookshelf", "bookshelf"],
-                        "poi10_metal_display_cabinet": ["small_table_mid", "metal cabinet", "display cabinet"]
-                    }
-                    
-                    # 按语义组分组候选
-                    grouped_candidates = {}
-                    for candidate in candidates:
-                        candidate_id = candidate["id"].lower()
-                        candidate_text = candidate.get("text", "").lower()
-                        candidate_name = candidate.get("name", "").lower()
-                        
-                        # 新增：检查实体别名，识别同一实体（修复映射逻辑）
-                        entity_group = None
-                        for canonical_name, aliases in entity_aliases.items():
-                            # 检查候选ID是否匹配规范名称
-                            if candidate_id.lower() == canonical_name.lower():
-                                # 找到匹配，返回对应的细节数据ID
-                                entity_group = aliases[0]  # 使用第一个别名作为细节数据ID
-                                print(f"🔍 Entity alias detected: {candidate_id} → {entity_group}")
-                                break
-                        
-                        # 检查属于哪个语义组
-                        assigned_group = None
-                        best_match_score = 0
-                        
-                        for group_name, keywords in semantic_groups.items():
-                            match_score = 0
-                            for keyword in keywords:
-                                # 检查候选的各个字段
-                                if keyword in candidate_id:
-                                    match_score += 2  # ID匹配给予最高权重
-                                if keyword in candidate_text:
-                                    match_score += 1.5  # 文本匹配给予高权重
-                                if keyword in candidate_name:
-                                    match_score += 1.0  # 名称匹配给予中等权重
-                            
-                            # 选择匹配度最高的组
-                            if match_score > best_match_score:
-                                best_match_score = match_score
-                                assigned_group = group_name
-                        
-                        # 如果匹配度太低，则不分组
-                        if best_match_score < 1.0:
-                            assigned_group = None
-                        
-                        # 优先使用实体别名分组，如果没有则使用语义分组
-                        final_group = entity_group if entity_group else assigned_group
-                        
-                        if final_group:
-                            if final_group not in grouped_candidates:
-                                grouped_candidates[final_group] = []
-                            grouped_candidates[final_group].append(candidate)
-                        else:
-                            # 不属于任何组的候选，单独处理
-                            if "other" not in grouped_candidates:
-                                grouped_candidates["other"] = []
-                            grouped_candidates["other"].append(candidate)
-                    
-                    # 对每个语义组，选择最高分的候选
-                    deduplicated = []
-                    for group_name, group_candidates in grouped_candidates.items():
-                        if group_name == "other":
-                            # 其他候选直接添加
-                            deduplicated.extend(group_candidates)
-                        else:
-                            # 语义组选择最高分的
-                            if len(group_candidates) > 1:
-                                print(f"🔍 Semantic deduplication: {group_name} has {len(group_candidates)} candidates")
-                                for i, cand in enumerate(group_candidates):
-                                    print(f"   {i+1}. {cand['id']} (score: {cand['score']:.3f})")
-                            
-                            # 选择最高分的候选
-                            best_candidate = max(group_candidates, key=lambda x: x["score"])
-                            best_candidate["semantic_group"] = group_name
-                            best_candidate["merged_candidates"] = len(group_candidates)
-                            deduplicated.append(best_candidate)
-                    
-                    print(f"🔍 Semantic deduplication: {len(candidates)} → {len(deduplicated)} candidates")
-                    return deduplicated
-                
-                def _calculate_detail_score(self, detail_item, caption_lower):
-                    """计算detail分数（细节通道）- 增强版"""
-                    score = 0.0
-                    
-                    # 1. 基于自然语言描述的分数（增强空间概念权重）
-                    nl_text = detail_item.get("nl_text", "").lower()
-                    if nl_text:
-                        # 关键词匹配
-                        keywords = nl_text.split()
-                        for keyword in keywords:
-                            if keyword in caption_lower:
-                                # 空间概念给予更高权重
-                                if any(space_word in keyword for space_word in ["open", "space", "area", "large", "atrium", "cluster"]):
-                                    score += 0.3  # 空间概念权重从0.2提升到0.3
-                                else:
-                                    score += 0.2
-                            elif len(keyword) > 3 and any(word in caption_lower for word in keyword.split()):
-                                if any(space_word in keyword for space_word in ["open", "space", "area", "large", "atrium", "cluster"]):
-                                    score += 0.15  # 空间概念权重从0.1提升到0.15
-                                else:
-                                    score += 0.1
-                    
-                    # 2. 基于结构化文本的分数
-                    struct_text = detail_item.get("struct_text", "").lower()
-                    if struct_text:
-                        # 解析结构化特征
-                        struct_features = struct_text.split(";")
-                        for feature in struct_features:
-                            if feature.strip() and any(word in caption_lower for word in feature.split()):
-                                score += 0.15
-                    
-                    # 3. 基于空间关系的分数
-                    spatial_info = detail_item.get("spatial_info", {})
-                    for relation, landmark in spatial_info.items():
-                        if landmark and any(word in caption_lower for word in str(landmark).split()):
-                            score += 0.1
-                    
-                    # 4. 新增：空间概念语义匹配（与结构通道保持一致）
-                    space_concepts = {
-                        "large open space": ["open", "space", "large", "area", "atrium", "cluster"],
-                        "open space": ["open", "space", "area", "atrium"],
-                        "open area": ["open", "area", "space", "atrium"],
-                        "atrium": ["atrium", "open", "space", "area"]
-                    }
-                    
-                    for caption_concept, keywords in space_concepts.items():
-                        if caption_concept in caption_lower:
-                            # 检查detail文本是否包含相关空间概念
-                            detail_text = f"{nl_text} {struct_text}"
-                            if any(keyword in detail_text for keyword in keywords):
-                                score += 0.2  # 空间概念语义匹配给予额外权重
-                                break
-                    
-                    return min(1.0, score)  # 限制最大分数为1.0
-            
-            UNIFIED_RETRIEVER = EnhancedDualChannelRetriever()
-            
-            # 修复：确保detail_index已构建
-            if not hasattr(UNIFIED_RETRIEVER, 'detail_index'):
-                print("🔧 构建detail_index...")
-                UNIFIED_RETRIEVER.detail_index = UNIFIED_RETRIEVER._build_detail_index()
-            
+            # 检索器无请求级状态：场景数据在 SCENE_REGISTRY 中按站点只读缓存，
+            # 会话级状态（RetrievalState）通过 retrieve(..., state=) 显式传入
+            UNIFIED_RETRIEVER = EnhancedDualChannelRetriever(SCENE_REGISTRY)
             print("✅ Calibrated dual-channel retriever initialized successfully")
             return UNIFIED_RETRIEVER
             
@@ -2800,25 +1244,56 @@ def get_unified_retriever():
             return None
     return UNIFIED_RETRIEVER
 
+def load_retrieval_state(session_key: str) -> RetrievalState:
+    """从会话后端读取该会话的检索状态"""
+    return RetrievalState.from_dict(SESSION_STORE.get(RETRIEVER_NS, session_key))
+
+def save_retrieval_state(session_key: str, base: RetrievalState, state: RetrievalState):
+    """把检索对状态的推进原子地应用到会话后端的当前值（而不是用检索前读到的快照覆盖）"""
+    if state == base:
+        return
+    SESSION_STORE.update(RETRIEVER_NS, session_key, lambda cur: state.rebase(base, cur), None)
+
 # Legacy scene loading (fallback)
 def load_scene_index(scene_id: str):
-    """Legacy function - kept for backward compatibility"""
-    npz = np.load(os.path.join(MODEL_DIR, f"{scene_id}.npz"), allow_pickle=True)
-    X = npz["X"].astype(np.float32)
-    texts = npz["texts"].tolist()
-    ids = json.loads(open(os.path.join(MODEL_DIR, f"{scene_id}.ids.json"), "r", encoding="utf-8").read())
+    """Legacy function - kept for backward compatibility
+
+    向量以只读内存映射打开（.npy + .meta.json），多个 worker 共享页缓存；
+    尚未转换的站点回退到旧的 .npz + .ids.json。
+    """
+    def artifact(name: str, default: str) -> str:
+        return SCENE_REGISTRY.index_file(scene_id, name) or os.path.join(MODEL_DIR, default)
+    meta_path = artifact("embeddings", f"{scene_id}{META_SUFFIX}")
+    if os.path.exists(meta_path):
+        emb = open_embedding_index(meta_path)
+    else:
+        emb = load_legacy_npz(os.path.join(MODEL_DIR, f"{scene_id}.npz"),
+                              os.path.join(MODEL_DIR, f"{scene_id}.ids.json"))
+    X, texts, ids = emb["X"], emb.texts, emb.items
     if USE_FAISS:
-        index = faiss.read_index(os.path.join(MODEL_DIR, f"{scene_id}.faiss"))
+        index = faiss.read_index(artifact("faiss", f"{scene_id}.faiss"))
         return {"index": index, "X": X, "texts": texts, "ids": ids}
     else:
         nn = NearestNeighbors(n_neighbors=5, metric="cosine").fit(X)
         return {"index": nn, "X": X, "texts": texts, "ids": ids}
 
-# Legacy scene loading (fallback)
-SCENE = {
-    "SCENE_A_MS": load_scene_index("SCENE_A_MS"),
-    "SCENE_B_STUDIO": load_scene_index("SCENE_B_STUDIO"),
-}
+# Legacy scene loading (fallback): 按需加载，常驻数量与场景注册表使用同一上限；
+# 以 (站点, 数据版本) 为键，热更新后自动换用新索引，旧版本由 LRU 淘汰
+@functools.lru_cache(maxsize=SCENE_REGISTRY.max_resident)
+def _legacy_scene_index(scene_id: str, data_version: int):
+    return load_scene_index(scene_id)
+
+def get_legacy_scene_index(scene_id: str):
+    return _legacy_scene_index(scene_id, SCENE_REGISTRY.version(scene_id) or 0)
+
+def _warm_legacy_index(site_id: str, model):
+    """重载回调：在后台线程预先打开新版本的向量索引，请求路径不必等待
+
+    只重新打开服务实际读取的索引文件；离线构建的 index_dual（build_index.py）不在这里重建。
+    """
+    _legacy_scene_index(site_id, model.version)
+
+SCENE_REGISTRY.add_reload_listener(_warm_legacy_index)
 
 # ---------- BLIP caption (Local Model) ----------
 # Initialize local BLIP model
@@ -2833,21 +1308,40 @@ except Exception as e:
     processor = None
     model = None
 
+# 离线 caption 缓存（CAPTION_CACHE=bench/caption_corpus.py 生成的语料）：同一张照片直接返回录制的 caption
+try:
+    CAPTION_CACHE_STORE = load_caption_cache()
+    if CAPTION_CACHE_STORE is not None:
+        print(f"✓ Caption cache loaded: {len(CAPTION_CACHE_STORE)} images")
+except (OSError, ValueError) as e:
+    print(f"⚠ Failed to load caption cache: {e}")
+    CAPTION_CACHE_STORE = None
+
 def hf_caption(image_bytes: bytes) -> str:
+    if CAPTION_CACHE_STORE is not None:
+        cached = CAPTION_CACHE_STORE.get(image_bytes)
+        if cached:
+            return cached
     if processor is None or model is None:
         return "an indoor workspace with desks and shelves"
     
     try:
         # Convert bytes to PIL Image
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        inputs = processor(image, return_tensors="pt")
-        out = model.generate(**inputs)
-        caption = processor.decode(out[0], skip_special_tokens=True)
+        with stage("decode"):
+            image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+            inputs = processor(image, return_tensors="pt")
+        with stage("caption"):
+            out = model.generate(**inputs)
+            caption = processor.decode(out[0], skip_special_tokens=True)
         return caption
     except Exception as e:
         print(f"⚠ Error in local BLIP captioning: {e}")
         return "an indoor workspace with desks and shelves"
 
+# 首张照片的 caption：sync 请求内生成（默认）；async 响应后后台生成并补写 warmup 行；off 不生成
+WARMUP_LOG = WarmupLog(hf_caption)
+print(f"✓ Warm-up caption mode: {WARMUP_LOG.mode}")
+
 def guess_bearing_from_caption(caption: str) -> str:
     t = caption.lower()
     if "left" in t: return "left"
@@ -2952,7 +1446,8 @@ def asr_bytes_to_text(data: bytes) -> str:
     if not (len(buf) > 12 and buf[:4] == b"RIFF" and b"WAVE" in buf[:12]):
         print("Converting WebM to WAV...")
         try:
-            buf = webm_to_wav_16k_mono(data)
+            with timed("asr_decode"):
+                buf = webm_to_wav_16k_mono(data)
             print(f"Conversion successful: {len(buf)} bytes WAV")
         except Exception as e:
             print(f"WebM to WAV conversion failed: {e}")
@@ -2965,8 +1460,10 @@ def asr_bytes_to_text(data: bytes) -> str:
             f.flush()
             
             print(f"Transcribing audio file: {f.name}")
-            segments, info = ASR.transcribe(f.name, beam_size=1, vad_filter=True)
-            text = "".join([s.text for s in segments]).strip()
+            # segments 是惰性生成器：转写实际发生在 join 中
+            with timed("asr_transcribe"):
+                segments, info = ASR.transcribe(f.name, beam_size=1, vad_filter=True)
+                text = "".join([s.text for s in segments]).strip()
             
             # Clean up temp file
             os.unlink(f.name)
@@ -2994,11 +1491,12 @@ SYS_PROMPT = (
 )
 def llm_intent(text: str) -> str:
     if not text.strip(): return "unknown"
-    resp = OAI.chat.completions.create(
-        model=LLM_MODEL, temperature=LLM_TEMP,
-        response_format={"type":"json_object"},
-        messages=[{"role":"system","content":SYS_PROMPT},{"role":"user","content":text}],
-    )
+    with timed("llm_call"):
+        resp = OAI.chat.completions.create(
+            model=LLM_MODEL, temperature=LLM_TEMP,
+            response_format={"type":"json_object"},
+            messages=[{"role":"system","content":SYS_PROMPT},{"role":"user","content":text}],
+        )
     try:
         j = json.loads(resp.choices[0].message.content)
         return j.get("intent","unknown")
@@ -3017,6 +1515,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ✅ 按请求开启的性能剖析（X-Profile 请求头或 /api/profiling/set 会话开关），默认不剖析；
+# 请求头只在 PROFILING_ENABLED=true 或带管理令牌（X-Admin-Token）时生效，会话开关的设置接口同样受限
+PROFILED_PATHS = ("/api/locate", "/api/qa")
+
+@app.middleware("http")
+async def request_profiling(request, call_next):
+    if request.url.path not in PROFILED_PATHS:
+        return await call_next(request)
+    admin = is_admin(request.headers.get(ADMIN_TOKEN_HEADER, ""))
+    header = request.headers.get(PROFILE_HEADER) if PROFILING_ENABLED or admin else None
+    token = open_slot(header, allow_cprofile=admin)
+    try:
+        response = await call_next(request)
+    finally:
+        profile = close_slot(token)
+        if profile is not None:
+            profile.stop()
+    if profile is not None:
+        try:
+            meta = await run_in_pool(profile.write, PROFILE_DIR)
+            response.headers["X-Profile-Path"] = meta["path"]
+        except OSError as e:
+            print(f"⚠️ Failed to write profile {profile.session_id}/{profile.req_id}: {e}")
+    return response
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint for monitoring"""
@@ -3028,7 +1551,8 @@ async def health_check():
             "asr_model": "loaded" if ASR else "not_loaded",
             "blip_model": "loaded" if processor else "not_loaded",
             "enhanced_dual_channel_retriever": "available" if get_unified_retriever() else "not_available"
-        }
+        },
+        "calibration_tables": CALIBRATION_TABLES.status(),
     }
 
 # TTS start endpoint for end-to-end latency tracking
@@ -3062,6 +1586,40 @@ def api_tts_start(mark: TTSMark):
     print(f"📊 TTS start recorded: req_id={mark.req_id}, e2e={e2e}ms, logging={enabled}")
     return {"ok": True, "e2e_latency_ms": e2e}
 
+@app.get("/api/metrics/stages")
+def api_metrics_stages(reset: bool = False):
+    """Per-stage latency histograms of /api/locate (ms) for this worker"""
+    snap = STAGE_HISTOGRAMS.snapshot()
+    if reset:
+        STAGE_HISTOGRAMS.reset()
+    return {"ok": True, "pool_workers": LOCATE_POOL_WORKERS, "stages": snap}
+
+# 模型参数内存在加载后不变，只算一次
+_MODEL_BYTES = {"blip": torch_module_bytes(model), "sentence_embedder": torch_module_bytes(EMB)}
+GAUGES.register("textnavi_model_memory_bytes", "Memory held by loaded models and resident scene data in bytes",
+                lambda: dict(_MODEL_BYTES, scene_data=SCENE_REGISTRY.resident_bytes()), label="model")
+GAUGES.register("textnavi_scene_resident_sites", "Scene models currently resident in the registry",
+                lambda: len(SCENE_REGISTRY.resident()))
+GAUGES.register("textnavi_scene_reload_queue_depth", "Scene reloads waiting in the background reloader",
+                SCENE_REGISTRY.reload_queue_depth)
+GAUGES.register("textnavi_scene_loads_total", "Scene model loads", lambda: SCENE_REGISTRY.loads, kind="counter")
+GAUGES.register("textnavi_scene_evictions_total", "Scene model LRU evictions",
+                lambda: SCENE_REGISTRY.evictions, kind="counter")
+GAUGES.register("textnavi_scene_reloads_total", "Scene model hot reloads", lambda: SCENE_REGISTRY.reloads,
+                kind="counter")
+GAUGES.register("textnavi_caption_cache_lookups_total", "Offline caption cache lookups by result",
+                lambda: ({"hit": CAPTION_CACHE_STORE.hits, "miss": CAPTION_CACHE_STORE.misses}
+                         if CAPTION_CACHE_STORE is not None else None), label="result", kind="counter")
+GAUGES.register("textnavi_warmup_captions_pending", "First-photo log captions still being generated in the background",
+                WARMUP_LOG.pending)
+GAUGES.register("textnavi_warmup_captions_total", "Background first-photo log captions by result",
+                lambda: {"ok": WARMUP_LOG.completed, "failed": WARMUP_LOG.failed}, label="result", kind="counter")
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition: stage/component latency histograms and queue/memory gauges"""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 # ✅ New: Logging control API endpoints
 class LogSwitchIn(BaseModel):
     session_id: str
@@ -3072,11 +1630,14 @@ class LogSwitchIn(BaseModel):
 @app.post("/api/logging/set")
 def api_logging_set(body: LogSwitchIn):
     """Set logging record switch"""
-    key = (body.session_id, body.provider.lower())
-    cur = LOG_SWITCH[key]
-    cur["enabled"] = bool(body.enabled)
-    if body.run_id:
-        cur["run_id"] = body.run_id
+    def _apply(cur):
+        cur["enabled"] = bool(body.enabled)
+        if body.run_id:
+            cur["run_id"] = body.run_id
+        return cur
+    
+    cur = SESSION_STORE.update(LOG_SWITCH_NS, _log_switch_key(body.session_id, body.provider),
+                               _apply, {"enabled": False, "run_id": ""})
     
     status = "ON" if cur["enabled"] else "OFF"
     run_id_info = f" (run_id: {cur['run_id']})" if cur["run_id"] else ""
@@ -3087,9 +1648,88 @@ def api_logging_set(body: LogSwitchIn):
 @app.get("/api/logging/status")
 def api_logging_status(session_id: str, provider: str = "ft"):
     """Query logging record status"""
-    st = LOG_SWITCH[(session_id, provider.lower())]
+    st = _get_log_switch(session_id, provider)
     return {"ok": True, "state": st}
 
+class ProfileSwitchIn(BaseModel):
+    session_id: str
+    enabled: bool
+    mode: str = "sample"                         # sample | cprofile
+    max_requests: int = PROFILE_BURST_REQUESTS   # 剖析该会话接下来的 N 个请求，用完自动关闭
+    token: str = ""                              # 管理令牌：PROFILING_ENABLED 关闭时或 cprofile 模式必需
+
+@app.post("/api/profiling/set")
+def api_profiling_set(body: ProfileSwitchIn):
+    """Profile the next N locate / QA requests of a session"""
+    if body.mode not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {PROFILE_MODES}")
+    if body.enabled and (not PROFILING_ENABLED or body.mode == "cprofile"):
+        require_admin(body.token)
+    state = {"enabled": bool(body.enabled) and body.max_requests > 0, "mode": body.mode,
+             "remaining": max(0, body.max_requests) if body.enabled else 0}
+    SESSION_STORE.set(PROFILE_NS, body.session_id, state)
+    print(f"🔧 Profiling {'ON' if state['enabled'] else 'OFF'} for session={body.session_id} "
+          f"(mode={body.mode}, remaining={state['remaining']})")
+    return {"ok": True, "state": state}
+
+@app.get("/api/profiling/status")
+def api_profiling_status(session_id: str):
+    """Query profiling switch status"""
+    st = SESSION_STORE.get(PROFILE_NS, session_id, {"enabled": False, "mode": "sample", "remaining": 0})
+    return {"ok": True, "state": st}
+
+# ✅ Admin: hot-reload textmaps / detail files / indexes without restarting (BLIP & Whisper stay loaded)
+@app.post("/api/admin/reload")
+async def api_admin_reload(site_id: str = Form(""), wait: bool = Form(False), token: str = Form("")):
+    """Rebuild a site's scene model (or all resident sites) in the background and swap it in atomically
+
+    site_id 为空时重新读取站点清单并重载全部常驻站点。wait=1 时等待重载完成并返回新版本号。
+    """
+    require_admin(token)
+    if site_id:
+        if site_id not in SCENE_REGISTRY.sites():
+            raise HTTPException(status_code=404, detail=f"unknown site: {site_id}")
+        targets = [site_id]
+    else:
+        changed = SCENE_REGISTRY.reload_manifest()
+        targets = list(dict.fromkeys(SCENE_REGISTRY.resident() + changed))
+    
+    futures = {sid: SCENE_REGISTRY.reload_async(sid) for sid in targets}
+    if not wait:
+        return {"ok": True, "scheduled": targets,
+                "versions": {sid: SCENE_REGISTRY.version(sid) for sid in targets}}
+    
+    results = {}
+    for sid, fut in futures.items():
+        model = await asyncio.wrap_future(fut)
+        results[sid] = {"reloaded": model is not None, "version": SCENE_REGISTRY.version(sid)}
+    return {"ok": all(r["reloaded"] for r in results.values()), "sites": results}
+
+@app.get("/api/admin/data_version")
+def api_admin_data_version(token: str = ""):
+    """Current data version of every site (None = not loaded yet)"""
+    require_admin(token)
+    return {"ok": True, "versions": {sid: SCENE_REGISTRY.version(sid) for sid in SCENE_REGISTRY.sites()},
+            "resident": SCENE_REGISTRY.resident(), "watcher": SCENE_WATCHER is not None}
+
+@app.get("/api/admin/profiles")
+def api_admin_profiles(token: str = "", session_id: str = "", limit: int = 100):
+    """List recorded request profiles (newest first)"""
+    require_admin(token)
+    return {"ok": True, "root": PROFILE_DIR, "profiles": list_profiles(PROFILE_DIR, session_id or None, limit)}
+
+@app.get("/api/admin/profiles/{session_id}/{req_id}/{name}")
+def api_admin_profile_file(session_id: str, req_id: str, name: str, token: str = ""):
+    """Download one profile file (profile.folded / profile.speedscope.json / profile.pstats / profile.txt)"""
+    require_admin(token)
+    path = profile_file_path(PROFILE_DIR, session_id, req_id, name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="profile file not found")
+    media_type = "application/json" if name.endswith(".json") else (
+        "application/octet-stream" if name.endswith(".pstats") else "text/plain; charset=utf-8")
+    with open(path, "rb") as f:
+        return Response(content=f.read(), media_type=media_type)
+
 # ✅ 新增：RQ3 澄清对话管理端点
 class ClarificationRound(BaseModel):
     clarification_id: str
@@ -3188,7 +1828,7 @@ class StartIn(BaseModel):
 @app.post("/api/start")
 def api_start(body: StartIn):
     # ✅ New: Enhanced session initialization with location tracking
-    SESSIONS[body.session_id] = {
+    SESSION_STORE.set(SESSION_NS, body.session_id, {
         "site_id": body.site_id, 
         "opening_provider": body.opening_provider, 
         "lang": body.lang,
@@ -3198,18 +1838,47 @@ def api_start(body: StartIn):
         "confidence_history": [],           # 置信度历史记录
         "last_update_time": datetime.utcnow().isoformat(),  # 最后更新时间
         "photo_count": 0                   # 拍照计数
-    }
+    })
     
     # Initialize photo count tracking
     session_key = f"{body.session_id}_{body.opening_provider}_{body.site_id}"
-    if "_photo_count" not in SESSIONS:
-        SESSIONS["_photo_count"] = {}
-    SESSIONS["_photo_count"][session_key] = 0
+    SESSION_STORE.set(PHOTO_COUNT_NS, session_key, 0)
     
     table = HARD_OUTPUTS_EN if body.lang=="en" else HARD_OUTPUTS_ZH
     say = table[body.site_id][body.opening_provider]
     return {"mode":"orient","say":[say],"site_id":body.site_id,"opening_provider":body.opening_provider,"lang":body.lang}
 
+async def _first_photo_warmup(image: UploadFile, site_id: str, provider: str, req_id: str, session_id: str,
+                             client_start_ms: int, server_recv_ms: int) -> tuple:
+    """首张照片：返回 (预设输出, caption) 并写 warmup 行（无论日志开关是否打开）
+
+    caption 写入 warmup 行：WARMUP_CAPTION=sync 时在请求内生成并随响应返回；async 时交给 WARMUP_LOG
+    在响应后生成并写行（此时返回的 caption 为 None）；off 时不生成。
+    """
+    cap = img = None
+    try:
+        if WARMUP_LOG.needs_image:
+            img = await image.read()
+        if WARMUP_LOG.mode == "sync":
+            cap = await run_in_pool(hf_caption, img)
+        
+        # 🔧 FIXED: Use traditional preset output for first photo, not AI reasoning
+        # 预设输出在启动时已构建，这里只是查表
+        preset_output = get_preset_output(provider, site_id)
+        locate_log.debug("first photo %s_%s: caption=%r preset=%r", provider, site_id, cap, preset_output[:100])
+    except Exception as e:
+        print(f"⚠️ Failed to get preset output, using fallback: {e}")
+        # Fall back to simple welcome message
+        preset_output = f"Welcome to {site_id}! Please take a photo to start exploring."
+    
+    # 🔧 Record warmup phase (first photo) for tracking
+    paths = _log_paths(provider)
+    _ensure_headers(paths)
+    WARMUP_LOG.record(paths["locate"], site_id, req_id, session_id, provider,
+                      client_start_ms, server_recv_ms, _now_ms(),
+                      image=img if cap is None else None, caption=cap)
+    return preset_output, cap
+
 @app.post("/api/locate")
 async def api_locate(
     site_id: str = Form(...),
@@ -3219,51 +1888,33 @@ async def api_locate(
     gt_node_id: str = Form(None),      # ✅ New: ground truth label (optional)
     client_start_ms: int = Form(None), # ✅ New: client start timestamp
     req_id: str = Form(None),          # ✅ New: request ID for tracking
-    first_photo: bool = Form(False)    # ✅ New: whether this is the first photo
+    first_photo: bool = Form(False),   # ✅ New: whether this is the first photo
+    debug: int = Form(0)               # 1 = return the per-request debug trace in the response
 ):
     # Generate request ID if not provided
     req_id = req_id or str(uuid.uuid4())
     server_recv_ms = _now_ms()
-    
-    print(f"🔍 API locate called: site_id={site_id}, provider={provider}, first_photo={first_photo}, session_id={session_id}")
+    timer = start_request_timer()
+    begin_request_profile(session_id, req_id, "locate", SESSION_STORE, PROFILE_NS)
+    # 调试轨迹只在 debug=1 或该会话的 LOG_SWITCH 开启时创建，结束时输出为一条 JSON 记录
+    start_trace(bool(debug) or _is_logging(session_id, provider)[0],
+                req_id=req_id, site_id=site_id, session_id=session_id, provider=provider)
+    # 固定本请求使用的场景模型：热更新在请求中途替换时，本请求仍使用同一版本的数据
+    await run_in_pool(SCENE_REGISTRY.get, site_id)   # 首次加载在线程池中进行，不阻塞事件循环
+    scene = SCENE_REGISTRY.pin(site_id)
+    data_version = scene.version if scene is not None else None
+    
+    locate_log.debug("locate called: site_id=%s provider=%s first_photo=%s session_id=%s",
+                     site_id, provider, first_photo, session_id)
     
     # ✅ Check if this is the first photo
     if first_photo:
-        print(f"📸 First photo detected for {provider}_{site_id}")
-        
-        # First photo: return traditional preset output from JSONL files
-        try:
-            # Get image and generate BLIP caption for logging purposes only
-            img = await image.read()
-            cap = hf_caption(img)
-            print(f"📸 BLIP caption for first photo (logging only): {cap[:100]}...")
-            
-            # 🔧 FIXED: Use traditional preset output for first photo, not AI reasoning
-            preset_output = get_preset_output(provider, site_id)
-            print(f"📚 First photo preset output for {provider}_{site_id}: {preset_output[:100]}...")
-        except Exception as e:
-            print(f"⚠️ Failed to get preset output, using fallback: {e}")
-            # Fall back to simple welcome message
-            preset_output = f"Welcome to {site_id}! Please take a photo to start exploring."
-            print(f"📚 Fallback preset output: {preset_output}")
+        locate_log.debug("first photo detected for %s_%s", provider, site_id)
         
-        # 🔧 Record warmup phase (first photo) for tracking
-        paths = _log_paths(provider)
-        _ensure_headers(paths)
-        
-        # Always log warmup phase, regardless of logging switch
-        with open(paths["locate"], "a", newline="", encoding="utf-8") as f:
-            csv.writer(f).writerow([
-                site_id, "WARMUP", datetime.utcnow().isoformat(), req_id, session_id, provider,
-                "warmup",  # phase
-                "First photo - preset output",  # caption
-                "", "", "", "", "",  # top1, top2, margin
-                "", "", "", "",  # gt_node_id, hit_top1, hit_top2, hit_hop1
-                "", "",  # low_conf, low_conf_rule
-                client_start_ms or "", server_recv_ms, _now_ms()  # timing
-            ])
-        
-        print(f"📝 Warmup phase logged for {provider}_{site_id}")
+        # First photo: return traditional preset output; the BLIP caption is for logging only
+        preset_output, cap = await _first_photo_warmup(
+            image, site_id, provider, req_id, session_id, client_start_ms, server_recv_ms
+        )
         
         # ✅ New: Collect DG metrics for first photo
         try:
@@ -3290,83 +1941,54 @@ async def api_locate(
                     success=True
                 )
         except Exception as e:
-            print(f"⚠️ Failed to collect DG metrics for first photo: {e}")
+            locate_log.warning("failed to collect DG metrics for first photo: %s", e)
         
         return {
             "req_id": req_id,
-            "caption": cap if 'cap' in locals() else "First photo - preset output",
+            "caption": cap or WARMUP_PLACEHOLDER,
             "node_id": None,
             "confidence": 1.0,
             "low_conf": False,
             "preset_output": preset_output,
             "is_first_photo": True,
-            "retrieval_method": "preset_output"
+            "retrieval_method": "preset_output",
+            "data_version": data_version,
+            "debug": _finish_locate_debug(timer, debug)
         }
     
     # 🔧 FORCE FIRST PHOTO DETECTION: If this is a new session, treat as first photo
     session_key = f"{session_id}_{provider}_{site_id}"
-    if session_key not in SESSIONS.get("_photo_count", {}):
-        if "_photo_count" not in SESSIONS:
-            SESSIONS["_photo_count"] = {}
-        SESSIONS["_photo_count"][session_key] = 0
-    
-    photo_count = SESSIONS["_photo_count"][session_key]
-    if photo_count == 0:
-        print(f"🔧 FORCE DETECTION: First photo for session {session_key}")
-        SESSIONS["_photo_count"][session_key] = 1
-        
-        # First photo: return traditional preset output from JSONL files
-        try:
-            # Get image and generate BLIP caption for logging purposes only
-            img = await image.read()
-            cap = hf_caption(img)
-            print(f"📸 BLIP caption for first photo (logging only): {cap[:100]}...")
-            
-            # 🔧 FIXED: Use traditional preset output for first photo, not AI reasoning
-            preset_output = get_preset_output(provider, site_id)
-            print(f"📚 First photo preset output for {provider}_{site_id}: {preset_output[:100]}...")
-        except Exception as e:
-            print(f"⚠️ Failed to get preset output, using fallback: {e}")
-            # Fall back to simple welcome message
-            preset_output = f"Welcome to {site_id}! Please take a photo to start exploring."
-            print(f"📚 Fallback preset output: {preset_output}")
-        
-        # 🔧 Record warmup phase (first photo) for tracking
-        paths = _log_paths(provider)
-        _ensure_headers(paths)
-        
-        # Always log warmup phase, regardless of logging switch
-        with open(paths["locate"], "a", newline="", encoding="utf-8") as f:
-            csv.writer(f).writerow([
-                site_id, "WARMUP", datetime.utcnow().isoformat(), req_id, session_id, provider,
-                "warmup",  # phase
-                "First photo - preset output",  # caption
-                "", "", "", "", "",  # top1, top2, margin
-                "", "", "", "",  # gt_node_id, hit_top1, hit_top2, hit_hop1
-                "", "", "", "",  # low_conf, low_conf_rule
-                client_start_ms or "", server_recv_ms, _now_ms()  # timing
-            ])
-        
-        print(f"📝 Warmup phase logged for {provider}_{site_id}")
+    # 原子地把 0 → 1：多 worker 下同一会话的并发请求只有一个会被当作首张照片
+    is_first = SESSION_STORE.compare_and_set(PHOTO_COUNT_NS, session_key, 0, 1, default=0)
+    if is_first:
+        locate_log.debug("first photo for new session %s", session_key)
+        
+        # First photo: return traditional preset output; the BLIP caption is for logging only
+        preset_output, cap = await _first_photo_warmup(
+            image, site_id, provider, req_id, session_id, client_start_ms, server_recv_ms
+        )
         
         return {
             "req_id": req_id,
-            "caption": cap if 'cap' in locals() else "First photo - preset output",
+            "caption": cap or WARMUP_PLACEHOLDER,
             "node_id": None,
             "confidence": 1.0,
             "low_conf": False,
             "preset_output": preset_output,
             "is_first_photo": True,
-            "retrieval_method": "preset_output"
+            "retrieval_method": "preset_output",
+            "data_version": data_version,
+            "debug": _finish_locate_debug(timer, debug)
         }
     
     # 1) Get image → BLIP generate caption (for subsequent photos)
     try:
         img = await image.read()
-        cap = hf_caption(img)
+        cap = await run_in_pool(hf_caption, img)
     except Exception as e:
         # Log failure
-        # paths is already initialized above
+        paths = _log_paths(provider)
+        _ensure_headers(paths)
         
         # ✅ Only write when logging is enabled
         enabled, run_id = _is_logging(session_id, provider)
@@ -3380,9 +2002,39 @@ async def api_locate(
         raise HTTPException(status_code=400, detail=f"BLIP failed: {e}")
     
     # 🔧 Increment photo count for this session
-    SESSIONS["_photo_count"][session_key] += 1
-    print(f"📸 Photo #{SESSIONS['_photo_count'][session_key]} for session {session_key}")
-    
+    new_count = SESSION_STORE.update(PHOTO_COUNT_NS, session_key, lambda c: (c or 0) + 1, 0)
+    photo_count = new_count - 1  # 与之前一致：photo_count 为本次请求开始时的计数
+    trace_event("photo", count=new_count, session_key=session_key)
+    
+    # 2) Retrieval → fusion → calibration → logging run in the locate worker pool,
+    #    keeping the event loop free for I/O
+    response = await run_in_pool(
+        _locate_pipeline, site_id, session_id, provider, gt_node_id,
+        client_start_ms, req_id, server_recv_ms, cap, session_key, photo_count
+    )
+    response["data_version"] = data_version
+    response.setdefault("debug", {}).update(_finish_locate_debug(timer, debug, response.get("node_id")))
+    return response
+
+def _finish_locate_timings(timer) -> dict:
+    """结束本次请求计时，汇总到阶段直方图并返回各阶段耗时（ms）"""
+    timings = timer.finish()
+    STAGE_HISTOGRAMS.observe_all(timings)
+    return timings
+
+def _finish_locate_debug(timer, debug: int = 0, node_id: str = None) -> dict:
+    """结束计时与调试轨迹：轨迹作为一条 JSON 记录输出，debug=1 时同时随响应返回"""
+    timings = _finish_locate_timings(timer)
+    trace = finish_trace(timings_ms=timings, node_id=node_id)
+    out = {"timings_ms": timings}
+    if debug and trace is not None:
+        out["trace"] = trace
+    return out
+
+def _locate_pipeline(site_id: str, session_id: str, provider: str, gt_node_id: str,
+                     client_start_ms: int, req_id: str, server_recv_ms: int,
+                     cap: str, session_key: str, photo_count: int) -> dict:
+    """/api/locate 的同步部分（caption 之后）：检索、融合、校准、写日志。在线程池中执行。"""
     # 2) Try unified dual-channel retrieval first
     # Initialize paths early to avoid UnboundLocalError
     paths = _log_paths(provider)
@@ -3390,65 +2042,45 @@ async def api_locate(
     
     retriever = get_unified_retriever()
     if retriever:
+        # 会话级检索状态（连续识别计数）：按会话读取，检索后把推进原子地写回
+        retrieval_state = load_retrieval_state(session_key)
+        retrieval_base = RetrievalState.from_dict(retrieval_state.to_dict())
         try:
             # ✅ Layered Fusion: Structure for localization + Detail for conversation enhancement
             if provider.lower() == "ft":
-                print(f"🏗️ FT mode detected for {site_id} - using Enhanced Dual-Channel Fusion mode")
-                
                 # Phase 1: Structure-only localization (Sense_A_Finetuned.fixed.jsonl or Sense_B_Finetuned.fixed.jsonl)
                 matching_data = get_matching_data(provider, site_id)
-                print(f"🔍 Using Structure data from {PRESET_OUTPUTS.get(f'{provider.lower()}_{site_id}')}")
-                
-                # Phase 2: Load Detail data for post-localization conversation enhancement
-                # Detail files (Sense_A_MS.jsonl, Sense_B_Studio.jsonl) are NOT used for scoring
-                detailed_data = get_detailed_matching_data(site_id)
-                print(f"🔍 Detail数据加载结果: {len(detailed_data) if detailed_data else 0} 条记录")
-                if detailed_data:
-                    print(f"🔍 Loaded Detail data from Detail file for conversation enhancement")
-                    # 验证前几个节点的detail数据
-                    if site_id == "SCENE_A_MS":
-                        test_nodes = ["chair_on_yline", "desks_cluster", "dp_ms_entrance"]
-                    elif site_id == "SCENE_B_STUDIO":
-                        test_nodes = ["dp_studio_entrance", "workstation_zone", "glass_cage_room"]
-                    else:
-                        test_nodes = []
-                    
-                    for node_id in test_nodes:
-                        node_details = [item for item in detailed_data if item.get("node_hint") == node_id]
-                        print(f"   {node_id}: {len(node_details)} 项detail数据")
-                else:
-                    print(f"⚠️ Detail数据加载失败！")
                 
+                # Phase 2: Detail data (Sense_A_MS.jsonl, Sense_B_Studio.jsonl) is attached from the scene
+                # registry after localization for conversation enhancement; it is NOT used for scoring
                 # Use layered fusion retrieval: Structure-only scoring + Detail metadata attachment
-                candidates = enhanced_ft_retrieval(cap, retriever, site_id, detailed_data)
+                candidates = enhanced_ft_retrieval(cap, retriever, site_id, state=retrieval_state)
             else:
                 # Standard retrieval for other modes (base/4o)
                 matching_data = get_matching_data(provider, site_id)
-                if matching_data:
-                    print(f"🔍 Using matching data from {PRESET_OUTPUTS.get(f'{provider.lower()}_{site_id}')}")
                 
                 # Use enhanced dual-channel retrieval with scene filtering
                 try:
                     # 获取融合后的候选列表
-                    candidates = retriever.retrieve(cap, top_k=10, scene_filter=site_id)
+                    candidates = retriever.retrieve(cap, top_k=10, scene_filter=site_id, state=retrieval_state)
                     
                     if not candidates:
-                        print("❌ 无法获取候选列表")
+                        locate_log.warning("no candidates from enhanced retriever: %s", site_id)
                         candidates = None
-                    else:
-                        print(f"✅ 成功获取候选列表: {len(candidates)} 个候选")
                         
                 except Exception as e:
-                    print(f"⚠️ Enhanced dual-channel retrieval failed: {e}")
+                    locate_log.warning("enhanced dual-channel retrieval failed: %s", e)
                     # 不回退，不改位置；只沿用上一帧（或置为低置信待澄清）
                     candidates = None
             
+            save_retrieval_state(session_key, retrieval_base, retrieval_state)
+            
             if candidates:
                 # 🔧 NEW: Apply softmax calibration and continuity boost for enhanced dual-channel confidence scoring
-                print(f"🔧 Applying enhanced confidence calculation for {len(candidates)} candidates")
                 
                 # Phase 1: Softmax calibration
-                calibrated_confidence, calibrated_margin, raw_top1_score, raw_top2_score = calculate_calibrated_confidence_and_margin(candidates, top_k=5)
+                with stage("calibration"):
+                    calibrated_confidence, calibrated_margin, raw_top1_score, raw_top2_score = calculate_calibrated_confidence_and_margin(candidates, top_k=5, site_id=site_id)
                 
                 # Phase 2: Extract basic candidate info
                 top1 = candidates[0]
@@ -3457,7 +2089,6 @@ async def api_locate(
                 
                 # 修复：添加断言式日志，确保状态一致
                 has_detail = top1.get("has_detail", False)
-                print(f"🔧 [ASSERT] top1={top1_id}, s1={top1_score:.4f}, has_detail={has_detail}")
                 
                 # 验证状态一致性
                 assert isinstance(top1_id, str) and isinstance(top1_score, float) and isinstance(has_detail, bool), \
@@ -3469,24 +2100,25 @@ async def api_locate(
                 top2_score = float(top2["score"]) if top2 else 0.0
                 
                 # 🔧 NEW: Apply continuity boost to calibrated confidence
-                boost_amount, boost_reason = apply_continuity_boost(
-                    calibrated_confidence, session_id, site_id, top1_id
-                )
+                with stage("calibration"):
+                    boost_amount, boost_reason = apply_continuity_boost(
+                        calibrated_confidence, session_id, site_id, top1_id
+                    )
                 
-                # Use boosted calibrated confidence for final decision
-                final_confidence = calibrated_confidence + boost_amount
-                final_margin = calibrated_margin
+                    # Use boosted calibrated confidence for final decision
+                    final_confidence = calibrated_confidence + boost_amount
+                    final_margin = calibrated_margin
                 
-                print(f"🔧 Final confidence calculation:")
-                print(f"   Raw scores: top1={raw_top1_score:.4f}, top2={raw_top2_score:.4f}")
-                print(f"   Calibrated: confidence={calibrated_confidence:.4f}, margin={calibrated_margin:.4f}")
-                print(f"   Continuity boost: {boost_amount:.4f} ({boost_reason})")
-                print(f"   Final: confidence={final_confidence:.4f}, margin={final_margin:.4f}")
+                    if trace_enabled():
+                        trace_event("calibration", raw_top1=raw_top1_score, raw_top2=raw_top2_score,
+                                    calibrated_confidence=calibrated_confidence, calibrated_margin=calibrated_margin,
+                                    boost=boost_amount, boost_reason=boost_reason,
+                                    final_confidence=final_confidence, final_margin=final_margin)
                 
-                # Determine confidence level using configurable thresholds
-                # 🔧 FIX: 使用新的阈值：confidence > 40% 且 margin > 5% 就不触发low_conf
-                low_conf = final_confidence < LOWCONF_SCORE_TH or final_margin < LOWCONF_MARGIN_TH
-                low_conf_rule = f"score<{LOWCONF_SCORE_TH*100:.0f}% OR margin<{LOWCONF_MARGIN_TH*100:.0f}%" if low_conf else f"confidence>{LOWCONF_SCORE_TH*100:.0f}% AND margin>{LOWCONF_MARGIN_TH*100:.0f}%"
+                    # Determine confidence level using configurable thresholds
+                    # 🔧 FIX: 使用新的阈值：confidence > 40% 且 margin > 5% 就不触发low_conf
+                    low_conf = final_confidence < LOWCONF_SCORE_TH or final_margin < LOWCONF_MARGIN_TH
+                    low_conf_rule = f"score<{LOWCONF_SCORE_TH*100:.0f}% OR margin<{LOWCONF_MARGIN_TH*100:.0f}%" if low_conf else f"confidence>{LOWCONF_SCORE_TH*100:.0f}% AND margin>{LOWCONF_MARGIN_TH*100:.0f}%"
                 
                 # Calculate hit metrics
                 hit_top1 = (gt_node_id == top1_id) if gt_node_id else ""
@@ -3506,7 +2138,6 @@ async def api_locate(
                     # Check for structure-detail inconsistency
                     if detail_score < structure_score * 0.3:  # Detail score < 30% of structure score
                         structure_detail_conflict = True
-                        print(f"⚠️ Structure-detail conflict detected: structure={structure_score:.3f}, detail={detail_score:.3f}")
                 
                 if gt_node_id and top1_id != gt_node_id:
                     # If prediction is wrong, check if clarification dialogue is triggered
@@ -3522,8 +2153,8 @@ async def api_locate(
                     
                     # Add structure-detail conflict context to clarification
                     if structure_detail_conflict:
-                        print(f"🔍 Triggering clarification due to structure-detail conflict")
                         # You can add specific clarification logic here
+                        trace_event("clarification", reason="structure_detail_conflict", clarification_id=clarification_id)
                 
                 # Extract bearing from caption
                 bearing = "ahead"
@@ -3536,7 +2167,6 @@ async def api_locate(
                 # 🔧 NEW: 只有在统一检索成功后才更新会话位置，保持连续性
                 orientation_info = track_orientation(session_id, cap, top1_id)
                 update_session_location(session_id, top1_id, final_confidence, orientation_info)
-                print(f"🔧 会话位置已更新: {top1_id} (confidence: {final_confidence:.3f})")
                 
                 # ✅ New: Collect DG metrics for successful localization
                 try:
@@ -3592,7 +2222,7 @@ async def api_locate(
                     )
                     
                 except Exception as e:
-                    print(f"⚠️ Failed to collect DG metrics for localization: {e}")
+                    locate_log.warning("failed to collect DG metrics for localization: %s", e)
                 
                 # ✅ Detect language from caption and provider
                 detected_lang = detect_language_from_caption(cap, provider)
@@ -3644,73 +2274,65 @@ async def api_locate(
                 server_resp_ms = _now_ms()
                 
                 # ✅ Only write when logging is enabled
-                enabled, run_id = _is_logging(session_id, provider)
-                if enabled:
-                    # 🔧 NEW: Enhanced logging with similarity distribution analysis
-                    top3_score = float(candidates[2]["score"]) if len(candidates) > 2 else 0.0
-                    top4_score = float(candidates[3]["score"]) if len(candidates) > 3 else 0.0
-                    top5_score = float(candidates[4]["score"]) if len(candidates) > 4 else 0.0
-                    
-                    # Calculate similarity distribution metrics
-                    score_range = raw_top1_score - top5_score if len(candidates) > 4 else raw_top1_score - top2_score
-                    score_variance = np.var([raw_top1_score, raw_top2_score, top3_score, top4_score, top5_score]) if len(candidates) > 4 else np.var([raw_top1_score, raw_top2_score])
-                    
-                    with open(paths["locate"], "a", newline="", encoding="utf-8") as f:
-                        csv.writer(f).writerow([
-                            site_id, run_id, datetime.utcnow().isoformat(), req_id, session_id, provider,
-                            "trial",  # phase: trial phase for subsequent photos
-                            cap,
-                            top1_id, f"{final_confidence:.6f}",  # 🔧 Use final calibrated confidence
-                            top2_id, f"{raw_top2_score:.6f}",
-                            f"{final_margin:.6f}",  # 🔧 Use final calibrated margin
-                            gt_node_id or "",
-                            str(hit_top1).lower(), str(hit_top2).lower(), str(hit_hop1).lower(),
-                            str(low_conf).lower(), low_conf_rule if low_conf else "",
-                            client_start_ms or "", server_recv_ms, server_resp_ms
-                        ])
-                    
-                    # 🔧 NEW: Log detailed similarity distribution for analysis
-                    similarity_log_path = os.path.join(os.path.dirname(paths["locate"]), "similarity_distribution.csv")
-                    similarity_headers = [
-                        "site_id", "run_id", "ts_iso", "req_id", "session_id", "provider",
-                        "raw_top1", "raw_top2", "raw_top3", "raw_top4", "raw_top5",
-                        "calibrated_conf", "calibrated_margin", "boost_amount", "boost_reason",
-                        "final_conf", "final_margin", "score_range", "score_variance",
-                        "low_conf", "low_conf_rule", "gt_node_id", "hit_top1"
-                    ]
-                    
-                    # Ensure similarity distribution log headers
-                    if not os.path.exists(similarity_log_path):
-                        with open(similarity_log_path, "w", newline="", encoding="utf-8") as f:
-                            csv.writer(f).writerow(similarity_headers)
-                    
-                    # Log similarity distribution data
-                    with open(similarity_log_path, "a", newline="", encoding="utf-8") as f:
-                        csv.writer(f).writerow([
-                            site_id, run_id, datetime.utcnow().isoformat(), req_id, session_id, provider,
-                            f"{raw_top1_score:.6f}", f"{raw_top2_score:.6f}", f"{top3_score:.6f}", f"{top4_score:.6f}", f"{top5_score:.6f}",
-                            f"{calibrated_confidence:.6f}", f"{calibrated_margin:.6f}", f"{boost_amount:.6f}", boost_reason,
-                            f"{final_confidence:.6f}", f"{final_margin:.6f}", f"{score_range:.6f}", f"{score_variance:.6f}",
-                            str(low_conf).lower(), low_conf_rule if low_conf else "", gt_node_id or "", str(hit_top1).lower()
-                        ])
+                with stage("logging"):
+                    enabled, run_id = _is_logging(session_id, provider)
+                    if enabled:
+                        # 🔧 NEW: Enhanced logging with similarity distribution analysis
+                        top3_score = float(candidates[2]["score"]) if len(candidates) > 2 else 0.0
+                        top4_score = float(candidates[3]["score"]) if len(candidates) > 3 else 0.0
+                        top5_score = float(candidates[4]["score"]) if len(candidates) > 4 else 0.0
+                    
+                        # Calculate similarity distribution metrics
+                        score_range = raw_top1_score - top5_score if len(candidates) > 4 else raw_top1_score - top2_score
+                        score_variance = np.var([raw_top1_score, raw_top2_score, top3_score, top4_score, top5_score]) if len(candidates) > 4 else np.var([raw_top1_score, raw_top2_score])
+                    
+                        with open(paths["locate"], "a", newline="", encoding="utf-8") as f:
+                            csv.writer(f).writerow([
+                                site_id, run_id, datetime.utcnow().isoformat(), req_id, session_id, provider,
+                                "trial",  # phase: trial phase for subsequent photos
+                                cap,
+                                top1_id, f"{final_confidence:.6f}",  # 🔧 Use final calibrated confidence
+                                top2_id, f"{raw_top2_score:.6f}",
+                                f"{final_margin:.6f}",  # 🔧 Use final calibrated margin
+                                gt_node_id or "",
+                                str(hit_top1).lower(), str(hit_top2).lower(), str(hit_hop1).lower(),
+                                str(low_conf).lower(), low_conf_rule if low_conf else "",
+                                client_start_ms or "", server_recv_ms, server_resp_ms
+                            ])
+                    
+                        # 🔧 NEW: Log detailed similarity distribution for analysis
+                        similarity_log_path = os.path.join(os.path.dirname(paths["locate"]), "similarity_distribution.csv")
+                        similarity_headers = [
+                            "site_id", "run_id", "ts_iso", "req_id", "session_id", "provider",
+                            "raw_top1", "raw_top2", "raw_top3", "raw_top4", "raw_top5",
+                            "calibrated_conf", "calibrated_margin", "boost_amount", "boost_reason",
+                            "final_conf", "final_margin", "score_range", "score_variance",
+                            "low_conf", "low_conf_rule", "gt_node_id", "hit_top1"
+                        ]
                     
-                    print(f"📝 Trial phase logged to {paths['locate']} (run_id: {run_id})")
-                    print(f"📊 Similarity distribution logged to {similarity_log_path}")
-                    print(f"   Raw scores: [{raw_top1_score:.4f}, {raw_top2_score:.4f}, {top3_score:.4f}, {top4_score:.4f}, {top5_score:.4f}]")
-                    print(f"   Score range: {score_range:.4f}, Variance: {score_variance:.4f}")
-                else:
-                    print(f"📝 Logging disabled for session={session_id}, provider={provider}")
-                
-                print(f"✓ Unified dual-channel retrieval successful for {site_id}")
-                print(f"  Top candidate: {top1['text'][:50]}... (score: {final_confidence:.3f})")
-                print(f"  Provider: {top1['provider']}, Alpha: {top1['alpha_used']:.2f}")
-                print(f"  Margin: {final_margin:.3f}, Low conf: {low_conf}")
-                if gt_node_id:
-                    print(f"  Ground truth: {gt_node_id}")
-                    print(f"  Hit Top1: {hit_top1}, Hit Top2: {hit_top2}, Hit ±1-Hop: {hit_hop1}")
-                    print(f"  Misbelief: {misbelief}, Clarification: {clarification_triggered}")
-                    if clarification_id:
-                        print(f"  Clarification session: {clarification_id}")
+                        # Ensure similarity distribution log headers
+                        if not os.path.exists(similarity_log_path):
+                            with open(similarity_log_path, "w", newline="", encoding="utf-8") as f:
+                                csv.writer(f).writerow(similarity_headers)
+                    
+                        # Log similarity distribution data
+                        with open(similarity_log_path, "a", newline="", encoding="utf-8") as f:
+                            csv.writer(f).writerow([
+                                site_id, run_id, datetime.utcnow().isoformat(), req_id, session_id, provider,
+                                f"{raw_top1_score:.6f}", f"{raw_top2_score:.6f}", f"{top3_score:.6f}", f"{top4_score:.6f}", f"{top5_score:.6f}",
+                                f"{calibrated_confidence:.6f}", f"{calibrated_margin:.6f}", f"{boost_amount:.6f}", boost_reason,
+                                f"{final_confidence:.6f}", f"{final_margin:.6f}", f"{score_range:.6f}", f"{score_variance:.6f}",
+                                str(low_conf).lower(), low_conf_rule if low_conf else "", gt_node_id or "", str(hit_top1).lower()
+                            ])
+                    
+                        trace_event("logged", run_id=run_id, locate_log=paths["locate"],
+                                    raw_scores=[raw_top1_score, raw_top2_score, top3_score, top4_score, top5_score],
+                                    score_range=score_range, score_variance=score_variance)
+                
+                if trace_enabled():
+                    trace_event("result", top1=top1_id, confidence=final_confidence, margin=final_margin,
+                                low_conf=low_conf, gt_node_id=gt_node_id, hit_top1=hit_top1, hit_top2=hit_top2,
+                                hit_hop1=hit_hop1, misbelief=misbelief, clarification_id=clarification_id)
                 
                 return response
             else:
@@ -3718,20 +2340,21 @@ async def api_locate(
                 server_resp_ms = _now_ms()
                 
                 # ✅ Only write when logging is enabled
-                enabled, run_id = _is_logging(session_id, provider)
-                if enabled:
-                    with open(paths["locate"], "a", newline="", encoding="utf-8") as f:
-                        csv.writer(f).writerow([
-                            site_id, run_id, datetime.utcnow().isoformat(), req_id, session_id, provider,
-                            cap,
-                            "", "0.0",
-                            "", "0.0",
-                            "0.0",
-                            gt_node_id or "",
-                            "", "", "",
-                            "true", "no_candidates",
-                            client_start_ms or "", server_recv_ms, server_resp_ms
-                        ])
+                with stage("logging"):
+                    enabled, run_id = _is_logging(session_id, provider)
+                    if enabled:
+                        with open(paths["locate"], "a", newline="", encoding="utf-8") as f:
+                            csv.writer(f).writerow([
+                                site_id, run_id, datetime.utcnow().isoformat(), req_id, session_id, provider,
+                                cap,
+                                "", "0.0",
+                                "", "0.0",
+                                "0.0",
+                                gt_node_id or "",
+                                "", "", "",
+                                "true", "no_candidates",
+                                client_start_ms or "", server_recv_ms, server_resp_ms
+                            ])
                 
                 return {
                     "req_id": req_id,
@@ -3744,15 +2367,13 @@ async def api_locate(
                 }
                 
         except Exception as e:
-            print(f"⚠ Unified dual-channel retrieval failed: {e}")
-            print("⚠ 异常→沿用已算出的fused top-1，不回退到legacy")
-            print("⚠ 保持上一个稳定位置状态，不更新会话位置")
+            # 异常→沿用已算出的fused top-1，不回退到legacy；保持上一个稳定位置状态，不更新会话位置
+            locate_log.warning("unified dual-channel retrieval failed, keeping fused top-1: %s", e)
             # 不回退到legacy，避免位置标签漂移打断continuity
             use_legacy = False
     
     # 检查是否需要回退到legacy
     if 'use_legacy' in locals() and not use_legacy:
-        print("🔧 跳过legacy回退，保持fused top-1结果")
         # 🔧 NEW: 如果有成功的检索结果，返回实际结果而不是默认值
         if 'candidates' in locals() and candidates and len(candidates) > 0:
             top1 = candidates[0]
@@ -3789,7 +2410,8 @@ async def api_locate(
                             # 如果内容匹配度低，降低置信度
             if content_match_score < 0.15:  # 进一步降低阈值到0.15
                 adjusted_confidence = top1_score * 0.6  # 降低40%（更严格）
-                print(f"⚠️ 内容匹配度低({content_match_score:.2f})，调整置信度: {top1_score:.3f} → {adjusted_confidence:.3f}")
+                locate_log.debug("low content match %.2f, confidence %.3f -> %.3f",
+                                 content_match_score, top1_score, adjusted_confidence)
                 top1_score = adjusted_confidence
             
             # 🔧 NEW: 额外的语义检查 - 如果caption包含"desk"但top1不是desk相关，大幅降低置信度
@@ -3797,10 +2419,12 @@ async def api_locate(
             if "desk" in caption_lower and "desk" not in top1_node.get('text', '').lower():
                 # 如果图片描述包含"desk"但识别结果不是desk相关，大幅降低置信度
                 adjusted_confidence = top1_score * 0.5  # 降低50%
-                print(f"⚠️ 语义不匹配：图片包含'desk'但识别为'{top1_id}'，大幅降低置信度: {top1_score:.3f} → {adjusted_confidence:.3f}")
+                locate_log.debug("caption mentions desk but top-1 is %s, confidence %.3f -> %.3f",
+                                 top1_id, top1_score, adjusted_confidence)
                 top1_score = adjusted_confidence
             
-            print(f"🔧 返回成功的fused top-1结果: {top1_id} (confidence: {top1_score:.3f}, margin: {margin:.3f})")
+            locate_log.debug("returning fused top-1 after failure: %s (confidence %.3f, margin %.3f)",
+                             top1_id, top1_score, margin)
             return {
                 "req_id": req_id,
                 "caption": cap,
@@ -3813,7 +2437,7 @@ async def api_locate(
             }
         else:
             # 如果没有候选结果，才返回默认值
-            print("🔧 没有候选结果，返回默认响应")
+            locate_log.debug("no fused candidates after failure, returning default response")
             return {
                 "req_id": req_id,
                 "caption": cap,
@@ -3825,11 +2449,11 @@ async def api_locate(
             }
     
     # Fallback to legacy retrieval
-    print("Using legacy retrieval system")
+    locate_log.debug("using legacy retrieval: %s", site_id)
     from sentence_transformers import SentenceTransformer
     def embed_text(t: str):
         return EMB.encode([t], normalize_embeddings=True, convert_to_numpy=True)[0].astype(np.float32).reshape(1,-1)
-    item = SCENE[site_id]
+    item = get_legacy_scene_index(site_id)
     v = embed_text(cap)
     if "faiss" in str(type(item["index"])).lower():
         D, I = item["index"].search(v, 4)
@@ -3871,20 +2495,21 @@ async def api_locate(
     server_resp_ms = _now_ms()
     
     # ✅ Only write when logging is enabled
-    enabled, run_id = _is_logging(session_id, provider)
-    if enabled:
-        with open(paths["locate"], "a", newline="", encoding="utf-8") as f:
-            csv.writer(f).writerow([
-                site_id, run_id, datetime.utcnow().isoformat(), req_id, session_id, provider,
-                cap,
-                top1_id, f"{top1_score:.6f}",
-                top2_id, f"{top2_score:.6f}",
-                f"{margin:.6f}",
-                gt_node_id or "",
-                str(hit_top1).lower(), str(hit_top2).lower(), str(hit_hop1).lower(),
-                str(low_conf).lower(), low_conf_rule if low_conf else "",
-                client_start_ms or "", server_recv_ms, server_resp_ms
-            ])
+    with stage("logging"):
+        enabled, run_id = _is_logging(session_id, provider)
+        if enabled:
+            with open(paths["locate"], "a", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerow([
+                    site_id, run_id, datetime.utcnow().isoformat(), req_id, session_id, provider,
+                    cap,
+                    top1_id, f"{top1_score:.6f}",
+                    top2_id, f"{top2_score:.6f}",
+                    f"{margin:.6f}",
+                    gt_node_id or "",
+                    str(hit_top1).lower(), str(hit_top2).lower(), str(hit_hop1).lower(),
+                    str(low_conf).lower(), low_conf_rule if low_conf else "",
+                    client_start_ms or "", server_recv_ms, server_resp_ms
+                ])
     
     return {
         "req_id": req_id,
@@ -3993,8 +2618,16 @@ Users can take photos to update their current location information."""
 @app.post("/api/qa")
 async def api_qa(body: QAIn):
     """Dynamic QA using GPT with enhanced location context"""
+    profile = begin_request_profile(body.session_id, uuid.uuid4().hex, "qa", SESSION_STORE, PROFILE_NS)
+    if profile is None:
+        return _answer_qa(body)
+    # 处理逻辑同步运行在事件循环线程上：只在这段同步调用期间剖析该线程，不跨 await
+    with profile.thread():
+        return _answer_qa(body)
+
+def _answer_qa(body: QAIn):
     try:
-        sess = SESSIONS.get(body.session_id, {})
+        sess = _get_session(body.session_id) or {}
         site_id = sess.get("site_id", "SCENE_A_MS")
         lang = "zh" if body.lang.lower().startswith("zh") else "en"
         
@@ -4035,22 +2668,23 @@ Keep your answer concise and suitable for voice output, using abstract direction
         print(f"GPT enhanced prompt: {prompt[:300]}...")
         
         # Call GPT for dynamic response with location context
-        response = OAI.chat.completions.create(
-            model=LLM_MODEL,
-            temperature=LLM_TEMP,
-            messages=[
-                {"role": "system", "content": "You are a helpful indoor navigation assistant with precise location awareness."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=200  # Increased for more detailed navigation guidance
-        )
+        with timed("llm_call"):
+            response = OAI.chat.completions.create(
+                model=LLM_MODEL,
+                temperature=LLM_TEMP,
+                messages=[
+                    {"role": "system", "content": "You are a helpful indoor navigation assistant with precise location awareness."},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=200  # Increased for more detailed navigation guidance
+            )
         
         answer = response.choices[0].message.content.strip()
         print(f"GPT response with location context: {answer}")
         
         # ✅ New: Log the location-aware QA interaction
         try:
-            session = SESSIONS.get(body.session_id, {})
+            session = _get_session(body.session_id) or {}
             current_location = session.get("current_location", "unknown")
             
             # Log to clarification log if available
@@ -4142,10 +2776,10 @@ Keep your answer concise and suitable for voice output, using abstract direction
 @app.get("/api/session/location/{session_id}")
 async def get_session_location(session_id: str):
     """Get current location and history for a session"""
-    if session_id not in SESSIONS:
+    session = _get_session(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    session = SESSIONS[session_id]
+
     
     return {
         "session_id": session_id,
@@ -4162,12 +2796,12 @@ async def get_session_location(session_id: str):
 @app.get("/api/session/status/{session_id}")
 async def get_session_status(session_id: str):
     """Get comprehensive session status including location tracking"""
-    if session_id not in SESSIONS:
+    session = _get_session(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    session = SESSIONS[session_id]
+
     session_key = f"{session_id}_{session.get('opening_provider', 'ft')}_{session.get('site_id', 'SCENE_A_MS')}"
-    photo_count = SESSIONS.get("_photo_count", {}).get(session_key, 0)
+    photo_count = SESSION_STORE.get(PHOTO_COUNT_NS, session_key, 0)
     
     # Calculate location confidence trend
     confidence_history = session.get("confidence_history", [])
@@ -4197,10 +2831,10 @@ async def get_session_status(session_id: str):
 @app.get("/api/location/verify/{session_id}")
 async def verify_location_and_distance(session_id: str, destination: str = None):
     """Verify user location and calculate distance to destination"""
-    if session_id not in SESSIONS:
+    session = _get_session(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    session = SESSIONS[session_id]
+
     current_location = session.get("current_location")
     site_id = session.get("site_id")
     
@@ -4250,10 +2884,10 @@ async def verify_location_and_distance(session_id: str, destination: str = None)
 @app.get("/api/location/navigate/{session_id}")
 async def get_navigation_instructions(session_id: str, destination: str):
     """Get detailed navigation instructions from current location to destination"""
-    if session_id not in SESSIONS:
+    session = _get_session(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    session = SESSIONS[session_id]
+
     current_location = session.get("current_location")
     site_id = session.get("site_id")
     
@@ -4343,52 +2977,22 @@ def detect_language_from_caption(caption: str, provider: str) -> str:
         return "en"  # Default to English for base mode
 
 def generate_dynamic_navigation_response(site_id: str, node_id: str, confidence: float, low_conf: bool, matching_data: dict, lang: str = "en", candidate_info: dict = None) -> str:
-    """修复：改进的动态导航响应生成"""
-    print(f"🏗️ Layered Fusion navigation for {site_id} - {node_id} (conf: {confidence:.3f}, low_conf: {low_conf})")
-    
+    """节点位置说明取自预计算模板，有细节元数据时追加对话增强"""
     try:
-        # 获取结构信息
         structure_info = get_structure_based_location_info(site_id, node_id, lang)
-        
-        # 获取detail增强信息
-        detail_info = "None"
-        if candidate_info and candidate_info.get("detail_metadata"):
-            detail_info = get_detail_based_conversation_enhancement(node_id, candidate_info["detail_metadata"], lang)
-        
-        print(f"🔍 Layered fusion info: structure={confidence:.3f}, detail_items={len(candidate_info.get('detail_metadata', []) if candidate_info else [])}, method={candidate_info.get('retrieval_method', 'unknown') if candidate_info else 'unknown'}")
-        print(f"🧭 Layered fusion response: structure='{structure_info[:50]}...', detail='{detail_info[:50] if detail_info else 'None'}...'")
-        
-        # 组合响应
-        if detail_info and detail_info != "None":
-            response = f"{structure_info} {detail_info}"
-        else:
-            response = structure_info
-            
-        return response
-        
+        detail_metadata = candidate_info.get("detail_metadata") if candidate_info else None
+        detail_info = get_detail_based_conversation_enhancement(node_id, detail_metadata, lang) if detail_metadata else ""
+        locate_log.debug("navigation response: site=%s node=%s conf=%.3f low_conf=%s detail_items=%d",
+                         site_id, node_id, confidence, low_conf, len(detail_metadata or []))
+        return f"{structure_info} {detail_info}" if detail_info else structure_info
     except Exception as e:
-        print(f"⚠️ Layered fusion response generation failed: {e}")
+        locate_log.warning("layered fusion response generation failed: %s", e)
         # 回退到简单响应
         return f"You are at {node_id}. Please describe what you see around you."
 
 def get_structure_based_location_info(site_id: str, node_id: str, lang: str = "en") -> str:
-    """获取位置信息，避免NameError"""
-    try:
-        if site_id == "SCENE_A_MS":
-            return generate_scene_a_structure_info(node_id, lang)
-        elif site_id == "SCENE_B_STUDIO":
-            return generate_scene_b_structure_info(node_id, lang)
-        else:
-            if lang == "zh":
-                return f"当前位置：{node_id}。请告诉我您要去哪里。"
-            else:
-                return f"Current location: {node_id}. Please tell me where you want to go."
-    except NameError:
-        # 如果函数不存在，返回简单描述
-        if lang == "zh":
-            return f"当前位置：{node_id}。请告诉我您要去哪里。"
-        else:
-            return f"Current location: {node_id}. Please tell me where you want to go."
+    """站点 / 语言的预计算节点说明；未知节点只插入 node_id"""
+    return RESPONSE_TEMPLATES.location_info(site_id, node_id, lang)
 
 def get_detail_based_conversation_enhancement(node_id: str, detail_metadata: list, lang: str = "en") -> str:
     """获取对话增强信息，避免NameError"""
@@ -4430,7 +3034,7 @@ def get_detail_based_conversation_enhancement(node_id: str, detail_metadata: lis
         
         return ""
     except Exception as e:
-        print(f"⚠️ Detail enhancement failed: {e}")
+        locate_log.warning("detail enhancement failed: %s", e)
         return ""
 
 def generate_ai_spatial_reasoning(caption: str, provider: str, site_id: str, matching_data: dict, detailed_data: list = None) -> str:
@@ -5012,104 +3616,10 @@ async def enhanced_health_check():
 
 def generate_scene_a_structure_info(node_id: str, lang: str = "en") -> str:
     """Generate structure-based location information for SCENE_A_MS from Sense_A_Finetuned.fixed.jsonl"""
-    if lang == "zh":
-        # 中文导航指令 - 基于Structure文件的拓扑信息
-        if node_id == "dp_ms_entrance":
-            return "您在Maker Space入口。直行约6步到达3D打印机桌，然后左转继续前进进入中庭。"
-        
-        elif node_id == "yline_start":
-            return "您在黄色引导线起点。直行约3步到达椅子位置，然后继续沿引导线前进。"
-        
-        elif node_id == "chair_on_yline":
-            return "您在黄色引导线上的椅子旁。继续直行约2步，引导线将向左弯曲。"
-        
-        elif node_id == "yline_bend_mid":
-            return "您在黄色引导线弯曲处。直行约7步到达窗户和软座区域，然后进入中庭。"
-        
-        elif node_id == "atrium_edge":
-            return "您在中庭边缘，靠近窗户和软座。右转约5步到达电视区域。"
-        
-        elif node_id == "tv_zone":
-            return "您在电视区域。前方约4步到达小会议桌，然后继续前进到橙色沙发。"
-        
-        elif node_id == "small_table_mid":
-            return "您在低矮会议桌旁。直行约3步到达橙色沙发角落。"
-        
-        elif node_id == "orange_sofa_corner":
-            return "您已到达橙色沙发角落，靠墙放置。导航任务完成！"
-        
-        else:
-            return f"当前位置：{node_id}。请告诉我您要去哪里。"
-    
-    else:
-        # English navigation instructions - based on Structure file topology
-        if node_id == "dp_ms_entrance":
-            return "You are at the Maker Space entrance. Walk straight about 6 steps to reach the 3D printer table, then turn left to continue into the atrium."
-        
-        elif node_id == "yline_start":
-            return "You are at the yellow line start. Walk straight about 3 steps to reach the chair position, then continue along the guide line."
-        
-        elif node_id == "chair_on_yline":
-            return "You are at the chair on the yellow line. Continue straight about 2 steps, the line will bend left."
-        
-        elif node_id == "yline_bend_mid":
-            return "You are at the yellow line bend. Walk straight about 7 steps to reach the windows and soft seats, then enter the atrium."
-        
-        elif node_id == "atrium_edge":
-            return "You are at the atrium edge, near windows and soft seats. Turn right about 5 steps to reach the TV zone."
-        
-        elif node_id == "tv_zone":
-            return "You are in the TV zone. Walk forward about 4 steps to reach the small meeting table, then continue to the orange sofa."
-        
-        elif node_id == "small_table_mid":
-            return "You are at the low meeting table. Walk straight about 3 steps to reach the orange sofa corner."
-        
-        elif node_id == "orange_sofa_corner":
-            return "You have reached the orange sofa corner, against the wall. Navigation task completed!"
-        
-        else:
-            return f"Current location: {node_id}. Please tell me where you want to go."
+    return RESPONSE_TEMPLATES.location_info("SCENE_A_MS", node_id, lang)
 
 def generate_scene_b_structure_info(node_id: str, lang: str = "en") -> str:
     """Generate structure-based location information for SCENE_B_STUDIO from Sense_B_Finetuned.fixed.jsonl"""
-    if lang == "zh":
-        # 中文导航指令 - 基于Structure文件的拓扑信息
-        if node_id == "atrium_desks_hub":
-            return "您在中央工作台区域，面向大电视屏幕。左侧是窗户墙，右侧是橙色沙发区域。"
-        
-        elif node_id == "node_left_to_windows":
-            return "您正在向左转向窗户方向。直行约2步到达窗户边缘的软座区域。"
-        
-        elif node_id == "atrium_windows_edge":
-            return "您在窗户边缘的软座区域。向后转约3步到达小白色会议桌，然后继续前进到橙色沙发。"
-        
-        elif node_id == "poi_small_table":
-            return "您在白色会议桌旁，桌上有紫色椅子。直行约2步到达橙色沙发区域。"
-        
-        elif node_id == "poi_orange_green_sofa":
-            return "您已到达橙色沙发区域，沙发靠墙放置。附近有绿色高背扶手椅和两个黑色边桌。"
-        
-        else:
-            return f"当前位置：{node_id}。请告诉我您要去哪里。"
-    
-    else:
-        # English navigation instructions - based on Structure file topology
-        if node_id == "atrium_desks_hub":
-            return "You are at the central desks hub, facing the large TV screen. To your left is the windows wall, to your right is the orange sofa area."
-        
-        elif node_id == "node_left_to_windows":
-            return "You are turning left toward the windows. Walk straight about 2 steps to reach the soft seats area at the window edge."
-        
-        elif node_id == "atrium_windows_edge":
-            return "You are at the soft seats area by the windows. Turn around and walk about 3 steps to reach the small white meeting table, then continue to the orange sofa."
-        
-        elif node_id == "poi_small_table":
-            return "You are at the white meeting table with purple chairs. Walk straight about 2 steps to reach the orange sofa area."
-        
-        elif node_id == "poi_orange_green_sofa":
-            return "You have reached the orange sofa area, with the sofa against the wall. Nearby are a green high-back armchair and two black side tables."
-        
-        else:
-            return f"Current location: {node_id}. Please tell me where you want to go."
+    return RESPONSE_TEMPLATES.location_info("SCENE_B_STUDIO", node_id, lang)
 
 # ✅ New: AI Spatial Reasoning System to Replace Preset Outputs
\ No newline at end of file
@@ -0,0 +1,18 @@
+"""
+Performance benchmarks and load tests
+性能基准：
+- replay：在进程内回放录制的 caption 语料，测量 /api/locate 流水线各阶段的延迟、吞吐与内存分配
+- loadgen：按参与者会话流程对运行中的服务器施压，得到各端点延迟、错误率与饱和曲线
+- llm_stub：本地 OpenAI 兼容的 LLM 替身，压测时不访问外部服务
+- caption_corpus：从试验日志抽取去重、带版本号的 caption 语料（可带图片哈希，供 CAPTION_CACHE 跳过 BLIP）
+- sweep：在采集一次的通道分数上并行重放融合与校准，网格 / 随机搜索超参数并按命中率排名
+- fit_calibration：从试验日志 / 带标注语料离线拟合按站点的 margin → 命中率标定表
+
+    cd backend
+    python -m bench.caption_corpus logs --labeled-only --out bench/data/trial_captions.jsonl
+    python -m bench.replay --corpus bench/data/smoke_captions.jsonl --out bench_report.json
+    python -m bench.replay --baseline bench_report.json      # 与基线对比，回退时退出码为 1
+    python -m bench.sweep --grid structure_tau=0.1,0.15,0.2 --random 500 --out sweep.json
+    python -m bench.fit_calibration --logs logs --method isotonic
+    python -m bench.loadgen --url http://127.0.0.1:8000 --users 1,4,8,16 --duration 60
+"""
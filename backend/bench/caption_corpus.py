@@ -0,0 +1,172 @@
+"""
+Build a replay / caption-cache corpus from trial logs
+从试验日志 locate_log.csv 抽取去重的 (site_id, caption, gt_node_id) 语料
+
+- 输入：一个或多个 locate_log.csv，或包含它们的目录（递归查找，如 logs/ 下的 ft/、base/）
+- 跳过 warmup 行、预设输出与 BLIP 失败（与 bench.corpus 读取日志时的规则相同）
+- 按 (site_id, 规整空白后的 caption, gt_node_id) 去重，记录出现次数与首次出现的会话 / provider / req_id；
+  --per-session 时按会话分别去重，保留会话内的顺序（回放会话连续性时使用）
+- --images DIR：按 req_id 匹配照片（文件名去掉扩展名等于 req_id），记录图片 sha256 与相对语料文件的路径；
+  这些哈希即 caption_cache.CaptionCache 的键
+- 输出 jsonl：首行为元数据（format、corpus_version = 记录内容 sha256 的前 16 位、来源日志指纹、条数），
+  其后每行一条记录，可直接作为 bench.replay / bench.sweep 的 --corpus
+
+    cd backend
+    python -m bench.caption_corpus logs --labeled-only --out bench/data/trial_captions.jsonl
+    python -m bench.caption_corpus logs/ft/locate_log.csv --images ~/trial_photos --out trial_captions.jsonl
+    CAPTION_CACHE=trial_captions.jsonl uvicorn app:app      # hf_caption 命中缓存时跳过 BLIP
+"""
+
+import os
+import sys
+import csv
+import json
+import hashlib
+import argparse
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from caption_cache import file_digest
+from bench.corpus import usable_log_caption
+
+CORPUS_FORMAT = "textnavi.caption_corpus"
+CORPUS_VERSION = 1
+LOG_NAME = "locate_log.csv"
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".heic", ".bmp")
+
+
+def find_logs(paths: Sequence[str]) -> List[str]:
+    """展开输入：文件原样保留，目录下递归查找 locate_log.csv（按路径排序）"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                found.extend(os.path.join(root, name) for name in files if name == LOG_NAME)
+        elif os.path.isfile(path):
+            found.append(path)
+    return sorted(dict.fromkeys(os.path.abspath(p) for p in found))
+
+
+def normalize_caption(text: str) -> str:
+    return " ".join(text.split())
+
+
+def index_images(images_dir: str) -> Dict[str, str]:
+    """照片目录：文件名（去扩展名）→ 路径"""
+    index = {}
+    for root, _, files in os.walk(images_dir):
+        for name in sorted(files):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() in IMAGE_EXTS:
+                index.setdefault(stem, os.path.join(root, name))
+    return index
+
+
+def extract(log_paths: Sequence[str], images_dir: Optional[str] = None, labeled_only: bool = False,
+            per_session: bool = False) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """读取日志并去重，返回 (记录列表, 来源列表)；记录按首次出现的顺序"""
+    images = index_images(images_dir) if images_dir else {}
+    entries: Dict[tuple, Dict[str, Any]] = {}
+    sources = []
+    for path in log_paths:
+        used = 0
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                caption = usable_log_caption(row)
+                if caption is None:
+                    continue
+                gt = (row.get("gt_node_id") or "").strip()
+                if labeled_only and not gt:
+                    continue
+                used += 1
+                caption = normalize_caption(caption)
+                session = row.get("session_id") or ""
+                key = (row["site_id"], caption, gt) + ((session, row.get("provider") or "") if per_session else ())
+                entry = entries.get(key)
+                if entry is None:
+                    entry = entries[key] = {"site_id": row["site_id"], "caption": caption}
+                    if gt:
+                        entry["gt_node_id"] = gt
+                    entry.update(count=0, session_id=session, provider=row.get("provider") or "",
+                                 req_id=row.get("req_id") or "")
+                entry["count"] += 1
+                image = images.get(row.get("req_id") or "")
+                if image:
+                    digest = file_digest(image)
+                    hashes = entry.setdefault("image_sha256", [])
+                    if digest not in hashes:
+                        hashes.append(digest)
+                    entry.setdefault("image", image)
+        sources.append({"path": path, "sha256": file_digest(path), "rows_used": used})
+    return list(entries.values()), sources
+
+
+def corpus_version(entries: Sequence[Dict[str, Any]]) -> str:
+    """记录内容的指纹（不含生成时间与来源路径）：日志和照片没有变化时版本号不变"""
+    h = hashlib.sha256()
+    for entry in entries:
+        h.update(json.dumps(entry, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()[:16]
+
+
+def write_corpus(entries: Sequence[Dict[str, Any]], out_path: str,
+                 sources: Sequence[Dict[str, Any]] = ()) -> Dict[str, Any]:
+    """写出 jsonl 语料（图片路径改为相对语料文件），返回元数据"""
+    base = os.path.dirname(os.path.abspath(out_path))
+    rows = []
+    for entry in entries:
+        row = dict(entry)
+        if row.get("image"):
+            row["image"] = os.path.relpath(row["image"], base)
+        rows.append(row)
+    meta = {
+        "format": CORPUS_FORMAT,
+        "version": CORPUS_VERSION,
+        "corpus_version": corpus_version([{k: v for k, v in r.items() if k != "image"} for r in rows]),
+        "created": datetime.utcnow().isoformat() + "Z",
+        "entries": len(rows),
+        "labeled": sum(1 for r in rows if r.get("gt_node_id")),
+        "requests": sum(r["count"] for r in rows),
+        "images": sum(len(r.get("image_sha256") or []) for r in rows),
+        "sources": list(sources),
+    }
+    os.makedirs(base, exist_ok=True)
+    tmp = out_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    os.replace(tmp, out_path)
+    return meta
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Extract a deduplicated caption corpus from locate logs")
+    parser.add_argument("logs", nargs="+", help="locate_log.csv 文件或包含它们的目录")
+    parser.add_argument("--out", required=True, help="输出 jsonl 语料")
+    parser.add_argument("--images", help="照片目录（文件名为 req_id），记录图片哈希供 CAPTION_CACHE 使用")
+    parser.add_argument("--labeled-only", action="store_true", help="只保留有 gt_node_id 的记录")
+    parser.add_argument("--per-session", action="store_true", help="按会话分别去重，保留会话内顺序")
+    args = parser.parse_args(argv)
+
+    log_paths = find_logs(args.logs)
+    if not log_paths:
+        parser.error(f"no {LOG_NAME} found in {', '.join(args.logs)}")
+    entries, sources = extract(log_paths, args.images, args.labeled_only, args.per_session)
+    if not entries:
+        print(f"❌ no usable captions in {len(log_paths)} log file(s)")
+        return 1
+    meta = write_corpus(entries, args.out, sources)
+    print(f"📦 {meta['entries']} captions ({meta['labeled']} labeled, {meta['requests']} requests, "
+          f"{meta['images']} images) from {len(log_paths)} log(s)")
+    print(f"💾 corpus {meta['corpus_version']} written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Replay corpus loading
+回放语料：每条记录是一次定位请求的输入（站点、BLIP caption、可选的真值节点与图片）。
+
+支持两种文件：
+- .jsonl：每行 {"site_id", "caption", "gt_node_id"?, "image"?, "session_id"?, "provider"?}；
+  image 为相对语料文件的路径。bench/caption_corpus.py 生成的语料首行为元数据（format / corpus_version 等，
+  没有 site_id），读取记录时跳过，可用 corpus_meta 取出
+- .csv：试验日志 locate_log.csv（跳过 warmup 行和没有 caption 的行）
+"""
+
+import os
+import csv
+import json
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "smoke_captions.jsonl")
+
+
+@dataclass(frozen=True)
+class CorpusEntry:
+    site_id: str
+    caption: str
+    gt_node_id: Optional[str] = None
+    image: Optional[str] = None          # 图片绝对路径（可选，用于测量解码阶段）
+    session_id: str = "bench"
+    provider: str = "ft"
+
+
+def _from_jsonl(path: str) -> List[CorpusEntry]:
+    base = os.path.dirname(os.path.abspath(path))
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            if not row.get("site_id") or not row.get("caption"):
+                continue
+            image = row.get("image")
+            entries.append(CorpusEntry(
+                site_id=row["site_id"],
+                caption=row["caption"],
+                gt_node_id=row.get("gt_node_id") or None,
+                image=os.path.join(base, image) if image else None,
+                session_id=row.get("session_id") or "bench",
+                provider=row.get("provider") or "ft",
+            ))
+    return entries
+
+
+def usable_log_caption(row: Dict[str, str]) -> Optional[str]:
+    """locate_log.csv 中一行可回放的 caption；warmup 行、预设输出和 BLIP 失败返回 None"""
+    caption = (row.get("caption") or "").strip()
+    if not row.get("site_id") or not caption or row.get("phase") == "warmup":
+        return None
+    if caption.startswith("BLIP_FAILED") or caption.startswith("First photo"):
+        return None
+    return caption
+
+
+def _from_locate_log(path: str) -> List[CorpusEntry]:
+    entries = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            caption = usable_log_caption(row)
+            if caption is None:
+                continue
+            entries.append(CorpusEntry(
+                site_id=row["site_id"],
+                caption=caption,
+                gt_node_id=row.get("gt_node_id") or None,
+                session_id=row.get("session_id") or "bench",
+                provider=row.get("provider") or "ft",
+            ))
+    return entries
+
+
+def load_corpus(path: str = DEFAULT_CORPUS) -> List[CorpusEntry]:
+    """读取回放语料；空语料视为错误"""
+    entries = _from_locate_log(path) if path.lower().endswith(".csv") else _from_jsonl(path)
+    if not entries:
+        raise ValueError(f"empty replay corpus: {path}")
+    return entries
+
+
+def corpus_meta(path: str) -> Optional[Dict[str, Any]]:
+    """jsonl 语料首行的元数据（没有时返回 None）"""
+    if path.lower().endswith(".csv"):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                row = json.loads(line)
+                return row if "format" in row and "caption" not in row else None
+    return None
+
+
+def corpus_digest(path: str) -> str:
+    """语料文件的 sha256（写入报告，对比基线时确认回放的是同一份语料）"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,119 @@
+"""
+Fit per-site calibration tables
+离线拟合按站点的单调标定表（calibration_tables.py）
+
+样本来源（可同时给出）：
+- --logs：试验日志 locate_log.csv（文件或目录），取非 warmup 且 hit_top1 有值的行的 margin / hit_top1
+- --corpus：带标注的回放语料（bench.corpus 格式），经 bench.replay 的 pipeline 目标跑一遍得到 margin 与是否命中
+
+日志里记录的 margin 就是运行时查表用的 margin（融合分数 top1 - top2）。
+每个站点写出一个表文件（默认按 CALIBRATION_TABLES.path_for 定位，即清单声明的文件或 data/calibration/<site_id>.json），
+记录拟合方法、样本数、Brier 分数与站点数据版本；样本少于 --min-samples 的站点跳过，继续使用默认的 sigmoid 映射。
+
+    cd backend
+    python -m bench.fit_calibration --logs logs --method isotonic
+    python -m bench.fit_calibration --corpus bench/data/trial_captions.jsonl --method platt --out-dir /tmp/calibration
+"""
+
+import os
+import sys
+import csv
+import argparse
+import contextlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from calibration_tables import (
+    CALIBRATION_TABLES, METHODS, CalibrationTable, fit_samples_by_site, fit_table, save_table, scene_data_version,
+)
+from bench.caption_corpus import find_logs
+from bench.corpus import load_corpus
+
+DEFAULT_MIN_SAMPLES = 30
+TRUE_VALUES = {"true", "1", "yes"}
+FALSE_VALUES = {"false", "0", "no"}
+
+Sample = Tuple[str, float, bool]
+
+
+def samples_from_logs(log_paths: Sequence[str]) -> List[Sample]:
+    """locate_log.csv → [(site_id, margin, hit_top1)]"""
+    samples = []
+    for path in log_paths:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                if row.get("phase") == "warmup" or not row.get("site_id"):
+                    continue
+                hit = (row.get("hit_top1") or "").strip().lower()
+                if hit not in TRUE_VALUES and hit not in FALSE_VALUES:
+                    continue
+                try:
+                    margin = float(row.get("margin") or "")
+                except ValueError:
+                    continue
+                samples.append((row["site_id"], margin, hit in TRUE_VALUES))
+    return samples
+
+
+def samples_from_corpus(corpus_path: str, lexical_scorer: Optional[str] = None) -> List[Sample]:
+    """带标注语料经 pipeline 目标回放 → [(site_id, margin, 是否命中)]"""
+    from bench.replay import PipelineTarget
+
+    corpus = [e for e in load_corpus(corpus_path) if e.gt_node_id]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        target = PipelineTarget(lexical_scorer=lexical_scorer)
+        target.prepare(corpus)
+        results = [target.locate(e) for e in corpus]
+    return [(e.site_id, r["margin"], r["node_id"] == e.gt_node_id) for e, r in zip(corpus, results)]
+
+
+def fit_sites(samples: Sequence[Sample], method: str = "isotonic",
+              min_samples: int = DEFAULT_MIN_SAMPLES) -> Tuple[Dict[str, CalibrationTable], Dict[str, int]]:
+    """按站点拟合；返回 (站点 → 表, 样本不足而跳过的站点 → 样本数)"""
+    tables, skipped = {}, {}
+    registry = CALIBRATION_TABLES.site_registry()
+    for site_id, (margins, hits) in sorted(fit_samples_by_site(samples).items()):
+        if margins.size < min_samples:
+            skipped[site_id] = int(margins.size)
+            continue
+        spec = registry.spec(site_id)
+        tables[site_id] = fit_table(site_id, margins, hits, method,
+                                    data_version=scene_data_version(spec) if spec else "")
+    return tables, skipped
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Fit per-site margin → accuracy calibration tables")
+    parser.add_argument("--logs", nargs="*", default=[], help="locate_log.csv 文件或包含它们的目录")
+    parser.add_argument("--corpus", help="带标注的回放语料")
+    parser.add_argument("--method", choices=METHODS, default="isotonic")
+    parser.add_argument("--min-samples", type=int, default=DEFAULT_MIN_SAMPLES)
+    parser.add_argument("--lexical-scorer", choices=("heuristic", "bm25"), default=None)
+    parser.add_argument("--out-dir", help="输出目录（默认按站点清单 / CALIBRATION_DIR）")
+    args = parser.parse_args(argv)
+    if not args.logs and not args.corpus:
+        parser.error("give --logs and/or --corpus")
+
+    samples = samples_from_logs(find_logs(args.logs)) if args.logs else []
+    if args.corpus:
+        samples += samples_from_corpus(args.corpus, args.lexical_scorer)
+    tables, skipped = fit_sites(samples, args.method, args.min_samples)
+    for site_id, n in skipped.items():
+        print(f"⚠️  {site_id}: {n} labeled samples < {args.min_samples}, skipped")
+    if not tables:
+        print("❌ no site had enough labeled samples")
+        return 1
+    for site_id, table in tables.items():
+        path = (os.path.join(args.out_dir, f"{site_id}.json") if args.out_dir
+                else CALIBRATION_TABLES.path_for(site_id))
+        save_table(table, path)
+        print(f"📈 {site_id}: {table.method} on {table.samples} samples (top1 {table.hits / table.samples:.1%}), "
+              f"{table.margins.size} knots, brier={table.meta['brier']}, data {table.data_version} → {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Local OpenAI-compatible LLM stub
+本地 OpenAI 兼容的 LLM 替身服务：压测时让后端的 /api/qa 与意图识别不访问外部服务。
+
+    python -m bench.llm_stub --port 8011 --delay-ms 300
+    OPENAI_BASE_URL=http://127.0.0.1:8011/v1 OPENAI_API_KEY=stub uvicorn app:app ...
+
+实现 POST /v1/chat/completions（非流式）与 GET /v1/models。
+response_format 为 json_object 时返回 {"intent": "unknown"}，否则返回固定的导航回答。
+--delay-ms / --jitter-ms 模拟上游 LLM 的响应时间。
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+DEFAULT_ANSWER = ("You are near the main work table. Walk straight ahead along the yellow floor line; "
+                  "the windows will be on your left.")
+DEFAULT_INTENT = json.dumps({"intent": "unknown"})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "TextNaviLLMStub/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):  # 压测时不逐请求打印
+        pass
+
+    def _send(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send(200, {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "textnavi"}]})
+        else:
+            self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send(400, {"error": {"message": "invalid JSON body", "type": "invalid_request_error"}})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+
+        stub = self.server
+        delay = stub.delay_ms + (random.uniform(-stub.jitter_ms, stub.jitter_ms) if stub.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        wants_json = (request.get("response_format") or {}).get("type") == "json_object"
+        content = DEFAULT_INTENT if wants_json else stub.answer
+        with stub.lock:
+            stub.calls += 1
+            call_id = stub.calls
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request.get("messages", []))
+        completion_tokens = len(content.split())
+        self._send(200, {
+            "id": f"chatcmpl-stub-{call_id}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+class LLMStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay_ms: float = 0.0, jitter_ms: float = 0.0,
+                 answer: str = DEFAULT_ANSWER):
+        super().__init__((host, port), _Handler)
+        self.delay_ms = delay_ms
+        self.jitter_ms = jitter_ms
+        self.answer = answer
+        self.calls = 0
+        self.lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "LLMStubServer":
+        """后台线程运行（测试 / 压测脚本内嵌使用）"""
+        self._thread = threading.Thread(target=self.serve_forever, name="llm-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="OpenAI-compatible LLM stub for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("LLM_STUB_PORT", "8011")))
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="模拟的 LLM 响应时间")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    args = parser.parse_args(argv)
+    server = LLMStubServer(args.host, args.port, args.delay_ms, args.jitter_ms)
+    print(f"🤖 LLM stub listening on {server.base_url} (delay {args.delay_ms}±{args.jitter_ms} ms)")
+    print(f"   export OPENAI_BASE_URL={server.base_url} OPENAI_API_KEY=stub")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,470 @@
+"""
+HTTP load generator with participant-style session flows
+按真实参与者流程对运行中的后端施压：每个虚拟用户循环执行 App.jsx 的会话流程
+
+    /api/start → /api/locate(first_photo) → N × (/api/locate + /api/metrics/tts_start) → /api/asr → /api/qa
+
+在多个并发用户数下各运行一段时间，输出每个端点的延迟直方图与分位数、错误率、吞吐，
+以及每一档的服务端阶段耗时（/api/metrics/stages），得到饱和曲线和满足 SLO 的最大并发用户数。
+
+    python -m bench.llm_stub --port 8011 &
+    OPENAI_BASE_URL=http://127.0.0.1:8011/v1 OPENAI_API_KEY=stub uvicorn app:app --port 8000 &
+    python -m bench.loadgen --url http://127.0.0.1:8000 --users 1,4,8,16 --duration 60 --out load.json
+
+图片与音频默认在本地生成（640×480 PNG、2 秒 16kHz WAV），可用 --images / --audio 换成真实素材。
+只用标准库的 http.client，每个虚拟用户一条 keep-alive 连接。
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import wave
+import zlib
+import random
+import struct
+import argparse
+import platform
+import threading
+import http.client
+from datetime import datetime
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from pipeline_timing import StageHistograms
+from bench.stats import percentiles
+
+REPORT_FORMAT = "textnavi.loadtest"
+REPORT_VERSION = 1
+# 流程中的步骤（报告按步骤而不是 URL 分组：首张照片和后续照片走的是同一个 URL）
+ENDPOINTS = ("start", "locate_first", "locate", "tts_start", "asr", "qa")
+DEFAULT_USERS = (1, 2, 4, 8)
+DEFAULT_DURATION_S = 30.0
+DEFAULT_SLO_MS = 3000.0         # locate p95 的目标
+MAX_ERROR_RATE = 0.01
+# 客户端直方图桶（毫秒）：比服务端阶段直方图多覆盖到 30s，排队严重时仍可区分
+LOAD_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+SITES = ("SCENE_A_MS", "SCENE_B_STUDIO")
+QUESTIONS = ("where am i", "how do i get to the window", "what is in front of me",
+             "is there anything on the floor", "repeat that please")
+
+
+# ---------- 素材 ----------
+
+def canned_image(width: int = 640, height: int = 480, seed: int = 0) -> bytes:
+    """生成一张带噪声渐变的 RGB PNG（numpy + zlib 编码，不依赖 Pillow）"""
+    rng = np.random.default_rng(seed)
+    xs = np.arange(width) * 255 // width
+    ys = np.arange(height) * 255 // height
+    pixels = np.empty((height, width, 3), dtype=np.int64)
+    pixels[..., 0] = xs[None, :]
+    pixels[..., 1] = ys[:, None]
+    pixels[..., 2] = 96
+    pixels = ((pixels + rng.integers(0, 32, size=(height, width, 1))) & 0xFF).astype(np.uint8)
+    # 每行前加 filter type 0（None）
+    rows = np.concatenate([np.zeros((height, 1), dtype=np.uint8), pixels.reshape(height, -1)], axis=1).tobytes()
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows, 6))
+            + chunk(b"IEND", b""))
+
+
+def canned_audio(seconds: float = 2.0, rate: int = 16000) -> bytes:
+    """生成 16kHz 单声道 WAV（后端识别为 WAV，跳过 ffmpeg 转码，直接进入转写）"""
+    t = np.arange(int(seconds * rate)) / rate
+    frames = (6000 * np.sin(2 * np.pi * 220 * t)).astype("<i2").tobytes()
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(frames)
+    return buf.getvalue()
+
+
+@dataclass
+class Assets:
+    images: List[Tuple[str, bytes, str]]          # (文件名, 字节, MIME)
+    audio: Tuple[str, bytes, str]
+
+    @classmethod
+    def load(cls, images_dir: Optional[str] = None, audio_path: Optional[str] = None) -> "Assets":
+        images = []
+        if images_dir:
+            for name in sorted(os.listdir(images_dir)):
+                ext = name.lower().rsplit(".", 1)[-1]
+                if ext in ("jpg", "jpeg", "png"):
+                    with open(os.path.join(images_dir, name), "rb") as f:
+                        images.append((name, f.read(), "image/png" if ext == "png" else "image/jpeg"))
+            if not images:
+                raise ValueError(f"no .jpg/.png images in {images_dir}")
+        else:
+            images = [(f"canned_{i}.png", canned_image(seed=i), "image/png") for i in range(3)]
+        if audio_path:
+            with open(audio_path, "rb") as f:
+                data = f.read()
+            ext = audio_path.lower().rsplit(".", 1)[-1]
+            audio = (os.path.basename(audio_path), data, "audio/wav" if ext == "wav" else f"audio/{ext}")
+        else:
+            audio = ("rec.wav", canned_audio(), "audio/wav")
+        return cls(images=images, audio=audio)
+
+
+def encode_multipart(fields: Dict[str, str], files: Dict[str, Tuple[str, bytes, str]]) -> Tuple[bytes, str]:
+    """multipart/form-data 编码（与浏览器 FormData 相同的结构）"""
+    boundary = "----textnavi" + uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data, mime) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: {mime}\r\n\r\n'.encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+# ---------- HTTP ----------
+
+class HttpClient:
+    """单个虚拟用户的 keep-alive 连接（断开时重连一次）"""
+
+    def __init__(self, base_url: str, timeout: float = 60.0):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.conn: Optional[http.client.HTTPConnection] = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.conn = cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+        for attempt in (0, 1):
+            if self.conn is None:
+                self._connect()
+            try:
+                self.conn.request(method, self.prefix + path, body=body, headers=headers or {})
+                resp = self.conn.getresponse()
+                return resp.status, resp.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt:
+                    raise
+            except Exception:
+                self.close()
+                raise
+        raise RuntimeError("unreachable")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class LoadRecorder:
+    """线程安全的请求记录：(步骤, 开始时间, 延迟 ms, 成功, 状态/错误)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: List[Tuple[str, float, float, bool, str]] = []
+        self.sessions_completed = 0
+
+    def record(self, endpoint: str, started: float, latency_ms: float, ok: bool, status: str):
+        with self._lock:
+            self.samples.append((endpoint, started, latency_ms, ok, status))
+
+    def session_done(self):
+        with self._lock:
+            self.sessions_completed += 1
+
+
+@dataclass
+class FlowProfile:
+    """一个参与者会话的形态"""
+    sites: Tuple[str, ...] = SITES
+    providers: Tuple[str, ...] = ("ft",)
+    lang: str = "en"
+    locates_per_session: int = 3
+    think_ms: float = 500.0                 # 步骤之间的思考时间（指数分布均值，0 表示不停顿）
+    questions: Tuple[str, ...] = field(default=QUESTIONS)
+
+
+class VirtualUser(threading.Thread):
+    """循环执行会话流程直到截止时间"""
+
+    def __init__(self, name: str, base_url: str, profile: FlowProfile, assets: Assets, recorder: LoadRecorder,
+                 deadline: float, start_delay: float = 0.0, timeout: float = 60.0, seed: int = 0):
+        super().__init__(name=name, daemon=True)
+        self.client = HttpClient(base_url, timeout)
+        self.profile = profile
+        self.assets = assets
+        self.recorder = recorder
+        self.deadline = deadline
+        self.start_delay = start_delay
+        self.rng = random.Random(seed)
+
+    def _expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def _think(self):
+        if self.profile.think_ms > 0:
+            pause = self.rng.expovariate(1.0 / self.profile.think_ms) / 1000.0
+            time.sleep(max(0.0, min(pause, self.deadline - time.monotonic())))
+
+    def _call(self, endpoint: str, method: str, path: str, body: Optional[bytes] = None,
+              headers: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
+        started = time.time()
+        t0 = time.perf_counter()
+        try:
+            status, payload = self.client.request(method, path, body, headers)
+        except Exception as e:
+            self.recorder.record(endpoint, started, (time.perf_counter() - t0) * 1000.0, False, type(e).__name__)
+            return None
+        latency = (time.perf_counter() - t0) * 1000.0
+        ok = 200 <= status < 300
+        data = None
+        if ok:
+            try:
+                data = json.loads(payload or b"null")
+            except ValueError:
+                ok = False
+        self.recorder.record(endpoint, started, latency, ok, str(status) if ok or status != 200 else "bad_json")
+        return data if ok else None
+
+    def _json(self, endpoint: str, path: str, body: Dict[str, Any]):
+        return self._call(endpoint, "POST", path, json.dumps(body).encode("utf-8"),
+                          {"Content-Type": "application/json"})
+
+    def _locate(self, endpoint: str, session_id: str, site_id: str, provider: str, first_photo: bool):
+        req_id = str(uuid.uuid4())
+        client_start_ms = int(time.time() * 1000)
+        image = self.rng.choice(self.assets.images)
+        body, content_type = encode_multipart({
+            "site_id": site_id, "session_id": session_id, "provider": provider,
+            "client_start_ms": str(client_start_ms), "req_id": req_id,
+            "first_photo": "true" if first_photo else "false",
+        }, {"image": image})
+        resp = self._call(endpoint, "POST", "/api/locate", body, {"Content-Type": content_type})
+        if resp is not None and not first_photo:
+            # 与前端一致：开始播报前上报 tts_start
+            self._json("tts_start", "/api/metrics/tts_start", {
+                "req_id": resp.get("req_id") or req_id, "session_id": session_id, "site_id": site_id,
+                "provider": provider, "client_start_ms": client_start_ms,
+                "client_tts_start_ms": int(time.time() * 1000)})
+
+    def run_session(self, session_id: str):
+        p = self.profile
+        site_id, provider = self.rng.choice(p.sites), self.rng.choice(p.providers)
+        if self._json("start", "/api/start", {"session_id": session_id, "site_id": site_id,
+                                              "opening_provider": provider, "lang": p.lang}) is None:
+            return
+        steps = [("locate_first", True)] + [("locate", False)] * p.locates_per_session
+        for endpoint, first in steps:
+            if self._expired():
+                return
+            self._think()
+            self._locate(endpoint, session_id, site_id, provider, first)
+        if self._expired():
+            return
+        self._think()
+        body, content_type = encode_multipart({}, {"audio": self.assets.audio})
+        self._call("asr", "POST", "/api/asr", body, {"Content-Type": content_type})
+        if self._expired():
+            return
+        self._json("qa", "/api/qa", {"session_id": session_id, "text": self.rng.choice(p.questions),
+                                     "lang": p.lang})
+        self.recorder.session_done()
+
+    def run(self):
+        time.sleep(self.start_delay)
+        n = 0
+        try:
+            while not self._expired():
+                self.run_session(f"LT-{self.name}-{n}")
+                n += 1
+        finally:
+            self.client.close()
+
+
+def server_stages(base_url: str, reset: bool = False, timeout: float = 10.0) -> Optional[Dict[str, Any]]:
+    """读取服务端阶段直方图（/api/metrics/stages）；不可用时返回 None"""
+    client = HttpClient(base_url, timeout)
+    try:
+        status, payload = client.request("GET", "/api/metrics/stages" + ("?reset=true" if reset else ""))
+        return json.loads(payload) if status == 200 else None
+    except Exception:
+        return None
+    finally:
+        client.close()
+
+
+def run_level(base_url: str, users: int, duration_s: float, profile: FlowProfile, assets: Assets,
+              ramp_s: float = 0.0, timeout: float = 60.0, seed: int = 0) -> Dict[str, Any]:
+    """以 users 个并发虚拟用户运行 duration_s 秒"""
+    server_stages(base_url, reset=True)
+    recorder = LoadRecorder()
+    t0 = time.monotonic()
+    deadline = t0 + ramp_s + duration_s
+    threads = [VirtualUser(f"u{users}-{i}", base_url, profile, assets, recorder, deadline,
+                           start_delay=ramp_s * i / users, timeout=timeout, seed=seed * 1000 + i)
+               for i in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.monotonic() - t0
+    server = server_stages(base_url)
+
+    histograms = StageHistograms(LOAD_BUCKETS_MS)
+    endpoints = {}
+    for name in ENDPOINTS:
+        rows = [s for s in recorder.samples if s[0] == name]
+        if not rows:
+            continue
+        errors = [s for s in rows if not s[3]]
+        for s in rows:
+            histograms.observe(name, s[2])
+        by_status: Dict[str, int] = {}
+        for s in errors:
+            by_status[s[4]] = by_status.get(s[4], 0) + 1
+        endpoints[name] = {
+            "requests": len(rows),
+            "errors": len(errors),
+            "error_rate": round(len(errors) / len(rows), 4),
+            "errors_by_status": by_status,
+            "latency_ms": percentiles([s[2] for s in rows if s[3]]),
+        }
+    for name, snap in histograms.snapshot().items():
+        endpoints[name]["histogram_ms"] = snap["buckets_ms"]
+
+    total = len(recorder.samples)
+    failed = sum(1 for s in recorder.samples if not s[3])
+    return {
+        "users": users,
+        "duration_s": round(wall, 3),
+        "requests": total,
+        "throughput_rps": round(total / wall, 3) if wall > 0 else 0.0,
+        "error_rate": round(failed / total, 4) if total else 0.0,
+        "sessions_completed": recorder.sessions_completed,
+        "endpoints": endpoints,
+        "server": {
+            "pool_workers": server.get("pool_workers"),
+            "stages_mean_ms": {k: v["mean_ms"] for k, v in server.get("stages", {}).items()},
+            "stages_count": {k: v["count"] for k, v in server.get("stages", {}).items()},
+        } if server else None,
+    }
+
+
+def saturation(levels: Sequence[Dict[str, Any]], slo_ms: float = DEFAULT_SLO_MS,
+               max_error_rate: float = MAX_ERROR_RATE) -> Dict[str, Any]:
+    """饱和曲线：每档用户数的吞吐、locate p95、错误率与服务端 total 均值；以及满足 SLO 的最大用户数"""
+    curve, supported = [], 0
+    for level in levels:
+        locate = level["endpoints"].get("locate") or level["endpoints"].get("locate_first") or {}
+        p95 = locate.get("latency_ms", {}).get("p95")
+        server_total = ((level.get("server") or {}).get("stages_mean_ms") or {}).get("total")
+        within = p95 is not None and p95 <= slo_ms and level["error_rate"] <= max_error_rate
+        curve.append({"users": level["users"], "throughput_rps": level["throughput_rps"],
+                      "locate_p95_ms": p95, "error_rate": level["error_rate"],
+                      "server_locate_total_mean_ms": server_total, "within_slo": within})
+        if within:
+            supported = max(supported, level["users"])
+    return {"slo_ms": slo_ms, "max_error_rate": max_error_rate, "curve": curve,
+            "max_users_within_slo": supported}
+
+
+def run_load_test(base_url: str, users: Sequence[int] = DEFAULT_USERS, duration_s: float = DEFAULT_DURATION_S,
+                  profile: Optional[FlowProfile] = None, assets: Optional[Assets] = None, ramp_s: float = 0.0,
+                  slo_ms: float = DEFAULT_SLO_MS, timeout: float = 60.0, seed: int = 0) -> Dict[str, Any]:
+    profile = profile or FlowProfile()
+    assets = assets or Assets.load()
+    levels = [run_level(base_url, n, duration_s, profile, assets, ramp_s, timeout, seed) for n in users]
+    return {
+        "format": REPORT_FORMAT,
+        "version": REPORT_VERSION,
+        "created": datetime.utcnow().isoformat() + "Z",
+        "target": base_url,
+        "profile": {k: list(v) if isinstance(v, tuple) else v for k, v in asdict(profile).items()},
+        "env": {"python": platform.python_version(), "platform": platform.platform(),
+                "client_cpu_count": os.cpu_count()},
+        "levels": levels,
+        "saturation": saturation(levels, slo_ms),
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"📈 load test against {report['target']}")
+    for level in report["levels"]:
+        print(f"users={level['users']:<4} {level['throughput_rps']:>8.2f} req/s  "
+              f"errors={level['error_rate']:.2%}  sessions={level['sessions_completed']}")
+        for name, ep in level["endpoints"].items():
+            lat = ep["latency_ms"]
+            print(f"    {name:<13} n={ep['requests']:<6} p50={lat['p50']:>9.1f} p95={lat['p95']:>9.1f} "
+                  f"p99={lat['p99']:>9.1f} ms  err={ep['error_rate']:.2%}")
+    sat = report["saturation"]
+    print(f"🎯 max users with locate p95 ≤ {sat['slo_ms']:.0f} ms and errors ≤ {sat['max_error_rate']:.0%}: "
+          f"{sat['max_users_within_slo']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Multi-session HTTP load generator for the TextNavi backend")
+    parser.add_argument("--url", default=os.getenv("TEXTNAVI_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--users", default=",".join(map(str, DEFAULT_USERS)), help="逗号分隔的并发用户数")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION_S, help="每一档的持续时间（秒）")
+    parser.add_argument("--ramp", type=float, default=0.0, help="每一档内用户逐个启动的总时长（秒）")
+    parser.add_argument("--locates", type=int, default=3, help="每个会话首张照片之后的拍照次数")
+    parser.add_argument("--think-ms", type=float, default=500.0)
+    parser.add_argument("--sites", default=",".join(SITES))
+    parser.add_argument("--providers", default="ft")
+    parser.add_argument("--lang", default="en")
+    parser.add_argument("--images", help="真实照片目录（.jpg/.png）")
+    parser.add_argument("--audio", help="真实录音文件（.wav/.webm）")
+    parser.add_argument("--slo-ms", type=float, default=DEFAULT_SLO_MS)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-stub-port", type=int, default=None,
+                        help="同时在该端口启动本地 LLM 替身（后端需设置 OPENAI_BASE_URL 指向它）")
+    parser.add_argument("--out", help="写出 JSON 报告")
+    args = parser.parse_args(argv)
+
+    stub = None
+    if args.llm_stub_port is not None:
+        from bench.llm_stub import LLMStubServer
+        stub = LLMStubServer(port=args.llm_stub_port).start()
+        print(f"🤖 LLM stub at {stub.base_url}")
+    try:
+        profile = FlowProfile(sites=tuple(s for s in args.sites.split(",") if s),
+                              providers=tuple(p for p in args.providers.split(",") if p), lang=args.lang,
+                              locates_per_session=args.locates, think_ms=args.think_ms)
+        report = run_load_test(args.url, [int(u) for u in args.users.split(",") if u.strip()], args.duration,
+                               profile, Assets.load(args.images, args.audio), args.ramp, args.slo_ms,
+                               args.timeout, args.seed)
+    finally:
+        if stub is not None:
+            stub.stop()
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+"""
+Offline replay benchmark for the /api/locate pipeline
+/api/locate 流水线的离线回放基准
+
+把录制的 caption 语料（可带图片）在进程内回放：BLIP 与 LLM 用替身（bench/stubs.py），
+检索 → 融合 → 校准走真实代码。输出：
+
+- 各阶段（pipeline_timing.LOCATE_STAGES）延迟的 p50 / p95 / p99
+- 多个并发度下的吞吐（req/s）与端到端延迟分位数
+- 每个请求的内存分配（tracemalloc 峰值增量、净增内存块数）
+- 带标注语料上的 Top-1 命中率与低置信度比例（确认性能改动没有改变结果）
+
+报告为 JSON，可用 --baseline 与之前的报告对比，超出容差的回退会列出并以退出码 1 结束。
+
+回放目标：
+- pipeline（默认）：SceneRegistry + EnhancedDualChannelRetriever + calibration，只依赖本仓库模块
+- app：完整的 app._locate_pipeline（含连续性 boost、会话更新）；需要完整的后端依赖
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import argparse
+import platform
+import threading
+import contextlib
+import tracemalloc
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from pipeline_timing import LOCATE_STAGES, start_request_timer, stage
+from calibration import LOWCONF_MARGIN_TH, LOWCONF_SCORE_TH, calculate_calibrated_confidence_and_margin
+from scene_registry import RetrievalState, SceneRegistry
+from enhanced_retriever import EnhancedDualChannelRetriever
+from bench.corpus import DEFAULT_CORPUS, CorpusEntry, corpus_digest, load_corpus
+from bench.stats import percentiles
+from bench.stubs import StubCaptioner, StubLLMClient
+
+REPORT_FORMAT = "textnavi.bench"
+REPORT_VERSION = 1
+DEFAULT_CONCURRENCY = (1, 2, 4, 8)
+DEFAULT_REQUESTS = 200
+DEFAULT_ALLOC_SAMPLES = 50
+DEFAULT_TOLERANCE = 0.15        # 相对回退容差（15%）
+MIN_DELTA_MS = 0.05             # 绝对差低于此值的阶段耗时变化不算回退（计时噪声）
+
+
+def _decode_image(data: bytes):
+    """与 hf_caption 相同的解码；没有 Pillow 时只计读取的字节"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+    return Image.open(io.BytesIO(data)).convert("RGB")
+
+
+class PipelineTarget:
+    """进程内的检索 → 融合 → 校准（不含会话连续性 boost 与写日志）"""
+
+    name = "pipeline"
+
+    def __init__(self, data_dir: Optional[str] = None, lexical_scorer: Optional[str] = None):
+        self.registry = SceneRegistry(data_dir) if data_dir else SceneRegistry()
+        self.retriever = EnhancedDualChannelRetriever(self.registry, lexical_scorer=lexical_scorer)
+        self.captioner = StubCaptioner()
+        self._images: Dict[str, bytes] = {}
+        self._local = threading.local()
+
+    def prepare(self, corpus: Sequence[CorpusEntry]):
+        """预加载场景模型和图片字节（不计入测量）"""
+        for site_id in sorted({e.site_id for e in corpus}):
+            self.registry.get(site_id)
+        for e in corpus:
+            if e.image and e.image not in self._images:
+                with open(e.image, "rb") as f:
+                    self._images[e.image] = f.read()
+
+    def _state(self, entry: CorpusEntry) -> RetrievalState:
+        """每个工作线程一个会话：同一会话的请求串行，检索状态跨请求保留"""
+        states = getattr(self._local, "states", None)
+        if states is None:
+            states = self._local.states = {}
+        return states.setdefault((entry.session_id, entry.provider, entry.site_id), RetrievalState())
+
+    def locate(self, entry: CorpusEntry) -> Dict[str, Any]:
+        if entry.image:
+            with stage("decode"):
+                _decode_image(self._images[entry.image])
+        with stage("caption"):
+            caption = self.captioner(entry.caption)
+        candidates = self.retriever.retrieve(caption, top_k=10, scene_filter=entry.site_id,
+                                             state=self._state(entry))
+        with stage("calibration"):
+            confidence, margin, _, _ = calculate_calibrated_confidence_and_margin(candidates, top_k=5,
+                                                                                 site_id=entry.site_id)
+            low_conf = confidence < LOWCONF_SCORE_TH or margin < LOWCONF_MARGIN_TH
+        return {"node_id": candidates[0]["id"] if candidates else None,
+                "confidence": confidence, "margin": margin, "low_conf": low_conf}
+
+
+class AppTarget(PipelineTarget):
+    """完整的 app._locate_pipeline（BLIP 不加载，LLM 客户端替换为替身）"""
+
+    name = "app"
+
+    def __init__(self, data_dir: Optional[str] = None, lexical_scorer: Optional[str] = None):
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("BLIP_MODEL_PATH", os.path.join(BACKEND_DIR, "bench", "no-blip"))
+        if lexical_scorer:
+            os.environ["LEXICAL_SCORER"] = lexical_scorer
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app as backend_app
+        backend_app.OAI = StubLLMClient()
+        self.app = backend_app
+        self.registry = backend_app.SCENE_REGISTRY
+        self.captioner = StubCaptioner()
+        self._images = {}
+        self._local = threading.local()
+
+    def locate(self, entry: CorpusEntry) -> Dict[str, Any]:
+        if entry.image:
+            with stage("decode"):
+                _decode_image(self._images[entry.image])
+        with stage("caption"):
+            caption = self.captioner(entry.caption)
+        app = self.app
+        session_id = f"{entry.session_id}-{threading.get_ident()}"
+        session_key = f"{session_id}_{entry.provider}_{entry.site_id}"
+        photo_count = app.SESSION_STORE.update(app.PHOTO_COUNT_NS, session_key, lambda c: (c or 0) + 1, 0) - 1
+        response = app._locate_pipeline(entry.site_id, session_id, entry.provider, entry.gt_node_id, None,
+                                        str(uuid.uuid4()), app._now_ms(), caption, session_key, photo_count)
+        return {"node_id": response.get("node_id"), "confidence": response.get("confidence"),
+                "margin": response.get("margin"), "low_conf": response.get("low_conf")}
+
+
+TARGETS = {"pipeline": PipelineTarget, "app": AppTarget}
+
+
+def _run_one(target, entry: CorpusEntry):
+    timer = start_request_timer()
+    try:
+        result, error = target.locate(entry), None
+    except Exception as e:
+        result, error = None, repr(e)
+    return timer.finish(), result, error
+
+
+def _schedule(corpus: Sequence[CorpusEntry], n: int) -> List[CorpusEntry]:
+    return [corpus[i % len(corpus)] for i in range(n)]
+
+
+def stage_summary(timings: Sequence[Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """按阶段汇总分位数（标准阶段在前，其余按名称）"""
+    names = [s for s in LOCATE_STAGES if any(s in t for t in timings)]
+    names += sorted({k for t in timings for k in t} - set(names))
+    return {name: percentiles([t[name] for t in timings if name in t]) for name in names}
+
+
+def run_level(target, corpus: Sequence[CorpusEntry], workers: int, requests: int) -> Dict[str, Any]:
+    """在给定并发度下回放 requests 个请求"""
+    jobs = _schedule(corpus, requests)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bench") as pool:
+        outcomes = list(pool.map(lambda e: _run_one(target, e), jobs))
+    wall = time.perf_counter() - t0
+    timings = [t for t, _, _ in outcomes]
+    errors = [err for _, _, err in outcomes if err]
+    return {
+        "workers": workers,
+        "requests": requests,
+        "wall_s": round(wall, 4),
+        "throughput_rps": round(requests / wall, 2) if wall > 0 else 0.0,
+        "latency_ms": percentiles([t["total"] for t in timings]),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "_timings": timings,
+        "_outcomes": [(e, r) for e, (_, r, _) in zip(jobs, outcomes)],
+    }
+
+
+def quality(outcomes) -> Dict[str, Any]:
+    """带标注请求的 Top-1 命中率与低置信度比例"""
+    labeled = [(e, r) for e, r in outcomes if e.gt_node_id and r is not None]
+    answered = [r for _, r in outcomes if r is not None]
+    hits = sum(1 for e, r in labeled if r["node_id"] == e.gt_node_id)
+    return {
+        "labeled": len(labeled),
+        "top1_accuracy": round(hits / len(labeled), 4) if labeled else None,
+        "low_conf_rate": round(sum(1 for r in answered if r["low_conf"]) / len(answered), 4) if answered else None,
+    }
+
+
+def measure_allocations(target, corpus: Sequence[CorpusEntry], samples: int) -> Dict[str, Any]:
+    """串行回放 samples 个请求，记录每个请求的 tracemalloc 峰值增量与净增内存块数"""
+    peaks, retained, blocks = [], [], []
+    tracemalloc.start()
+    try:
+        for entry in _schedule(corpus, samples):
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            blocks_before = sys.getallocatedblocks()
+            _run_one(target, entry)
+            current, peak = tracemalloc.get_traced_memory()
+            blocks.append(sys.getallocatedblocks() - blocks_before)
+            peaks.append((peak - base) / 1024.0)
+            retained.append((current - base) / 1024.0)
+    finally:
+        tracemalloc.stop()
+    return {"requests": samples, "peak_kib": percentiles(peaks), "retained_kib": percentiles(retained),
+            "net_blocks": percentiles(blocks)}
+
+
+def run_benchmark(corpus_path: str = DEFAULT_CORPUS, target: str = "pipeline",
+                  concurrency: Sequence[int] = DEFAULT_CONCURRENCY, requests: int = DEFAULT_REQUESTS,
+                  warmup: Optional[int] = None, alloc_samples: int = DEFAULT_ALLOC_SAMPLES,
+                  lexical_scorer: Optional[str] = None, data_dir: Optional[str] = None) -> Dict[str, Any]:
+    """回放语料并返回报告字典
+
+    各阶段分位数取自第一个并发度（通常为 1，即无排队的单请求延迟）。
+    """
+    corpus = load_corpus(corpus_path)
+    # 流水线各处的诊断 print 写到 /dev/null：仍计入耗时，但不刷屏
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        bench_target = TARGETS[target](data_dir=data_dir, lexical_scorer=lexical_scorer)
+        bench_target.prepare(corpus)
+        for entry in _schedule(corpus, len(corpus) if warmup is None else warmup):
+            _run_one(bench_target, entry)
+
+        levels = [run_level(bench_target, corpus, workers, requests) for workers in concurrency]
+        allocations = measure_allocations(bench_target, corpus, alloc_samples) if alloc_samples > 0 else None
+
+    first = levels[0]
+    report = {
+        "format": REPORT_FORMAT,
+        "version": REPORT_VERSION,
+        "created": datetime.utcnow().isoformat() + "Z",
+        "target": target,
+        "corpus": {"path": os.path.abspath(corpus_path), "entries": len(corpus),
+                   "sha256": corpus_digest(corpus_path)},
+        "env": {"python": platform.python_version(), "platform": platform.platform(),
+                "cpu_count": os.cpu_count(), "lexical_scorer": bench_target.retriever.lexical_scorer
+                if hasattr(bench_target, "retriever") else os.getenv("LEXICAL_SCORER", "heuristic")},
+        "stages_ms": stage_summary(first["_timings"]),
+        "concurrency": [{k: v for k, v in level.items() if not k.startswith("_")} for level in levels],
+        "allocations": allocations,
+        "quality": quality(first["_outcomes"]),
+    }
+    return report
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float = DEFAULT_TOLERANCE,
+                    min_delta_ms: float = MIN_DELTA_MS) -> List[Dict[str, Any]]:
+    """对比两份报告，返回超出容差的回退项（空列表表示没有回退）"""
+    regressions = []
+
+    def check(metric, old, new, higher_is_worse=True, min_delta=0.0):
+        if old is None or new is None or old <= 0:
+            return
+        ratio = new / old
+        if higher_is_worse:
+            worse = ratio > 1.0 + tolerance and new - old > min_delta
+        else:
+            worse = ratio < 1.0 / (1.0 + tolerance)
+        if worse:
+            regressions.append({"metric": metric, "baseline": old, "current": new, "ratio": round(ratio, 3)})
+
+    for name, old in baseline.get("stages_ms", {}).items():
+        new = current.get("stages_ms", {}).get(name)
+        if new:
+            for p in ("p50", "p95"):
+                check(f"stages_ms.{name}.{p}", old[p], new[p], min_delta=min_delta_ms)
+
+    levels = {level["workers"]: level for level in current.get("concurrency", [])}
+    for old in baseline.get("concurrency", []):
+        new = levels.get(old["workers"])
+        if new:
+            check(f"concurrency.{old['workers']}.throughput_rps", old["throughput_rps"], new["throughput_rps"],
+                  higher_is_worse=False)
+            check(f"concurrency.{old['workers']}.latency_ms.p95", old["latency_ms"]["p95"],
+                  new["latency_ms"]["p95"], min_delta=min_delta_ms)
+            if new["errors"] > old["errors"]:
+                regressions.append({"metric": f"concurrency.{old['workers']}.errors",
+                                    "baseline": old["errors"], "current": new["errors"], "ratio": None})
+
+    old_alloc, new_alloc = baseline.get("allocations"), current.get("allocations")
+    if old_alloc and new_alloc:
+        check("allocations.peak_kib.p50", old_alloc["peak_kib"]["p50"], new_alloc["peak_kib"]["p50"])
+
+    # 结果变化（同一语料）也列出：性能改动不应改变定位结果
+    old_q, new_q = baseline.get("quality", {}), current.get("quality", {})
+    if baseline.get("corpus", {}).get("sha256") == current.get("corpus", {}).get("sha256"):
+        for key in ("top1_accuracy", "low_conf_rate"):
+            if old_q.get(key) != new_q.get(key):
+                regressions.append({"metric": f"quality.{key}", "baseline": old_q.get(key),
+                                    "current": new_q.get(key), "ratio": None})
+    return regressions
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"📊 target={report['target']} corpus={report['corpus']['entries']} entries "
+          f"lexical_scorer={report['env']['lexical_scorer']}")
+    print(f"{'stage':<14}{'p50':>10}{'p95':>10}{'p99':>10}   (ms)")
+    for name, s in report["stages_ms"].items():
+        print(f"{name:<14}{s['p50']:>10.3f}{s['p95']:>10.3f}{s['p99']:>10.3f}")
+    for level in report["concurrency"]:
+        lat = level["latency_ms"]
+        print(f"workers={level['workers']:<3} {level['throughput_rps']:>9.1f} req/s   "
+              f"p50={lat['p50']:.3f} p95={lat['p95']:.3f} p99={lat['p99']:.3f} ms   errors={level['errors']}")
+    if report["allocations"]:
+        a = report["allocations"]
+        print(f"allocations: peak p50={a['peak_kib']['p50']:.1f} KiB, net blocks p50={a['net_blocks']['p50']:.0f}")
+    q = report["quality"]
+    print(f"quality: top1={q['top1_accuracy']} on {q['labeled']} labeled, low_conf_rate={q['low_conf_rate']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Replay recorded captions through the locate pipeline")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="回放语料（.jsonl 或 locate_log.csv）")
+    parser.add_argument("--target", choices=sorted(TARGETS), default="pipeline")
+    parser.add_argument("--concurrency", default=",".join(map(str, DEFAULT_CONCURRENCY)),
+                        help="逗号分隔的并发度列表")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="每个并发度回放的请求数")
+    parser.add_argument("--warmup", type=int, default=None, help="预热请求数（默认语料条数）")
+    parser.add_argument("--alloc-samples", type=int, default=DEFAULT_ALLOC_SAMPLES, help="0 关闭内存分配测量")
+    parser.add_argument("--lexical-scorer", choices=("heuristic", "bm25"), default=None)
+    parser.add_argument("--out", help="写出 JSON 报告")
+    parser.add_argument("--baseline", help="与之前的 JSON 报告对比")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.corpus, args.target, [int(c) for c in args.concurrency.split(",") if c.strip()],
+                           args.requests, args.warmup, args.alloc_samples, args.lexical_scorer)
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 report written to {args.out}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) vs {args.baseline}:")
+            for r in regressions:
+                print(f"   {r['metric']}: {r['baseline']} → {r['current']} (x{r['ratio']})")
+            return 1
+        print(f"✅ no regressions vs {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+"""
+Shared latency statistics for the benchmarks
+基准工具共用的分位数统计
+"""
+
+from typing import Dict, Sequence
+
+import numpy as np
+
+
+def percentiles(values: Sequence[float]) -> Dict[str, float]:
+    """p50 / p95 / p99 / 均值 / 最大值 / 样本数（空序列全部为 0）"""
+    if not len(values):
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0, "max": 0.0, "count": 0}
+    arr = np.asarray(values, dtype=np.float64)
+    p50, p95, p99 = np.percentile(arr, (50, 95, 99))
+    return {"p50": round(float(p50), 4), "p95": round(float(p95), 4), "p99": round(float(p99), 4),
+            "mean": round(float(arr.mean()), 4), "max": round(float(arr.max()), 4), "count": int(arr.size)}
@@ -0,0 +1,33 @@
+"""
+Model stubs for offline benchmarks
+离线基准用的模型替身：BLIP 直接返回录制的 caption，LLM 返回固定的 JSON，不访问网络也不加载模型。
+"""
+
+import json
+from types import SimpleNamespace
+
+
+class StubCaptioner:
+    """BLIP 替身：按请求返回语料中录制的 caption"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, caption: str) -> str:
+        self.calls += 1
+        return caption
+
+
+class StubLLMClient:
+    """OpenAI 客户端替身：client.chat.completions.create(...) 返回固定内容"""
+
+    def __init__(self, content: str = json.dumps({"intent": "unknown"})):
+        self.content = content
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(role="assistant", content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+                               model=kwargs.get("model", "stub"))
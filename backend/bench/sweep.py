@@ -0,0 +1,440 @@
+"""
+Fusion hyperparameter sweep over captured channel scores
+融合超参数扫描
+
+对带标注的 caption 语料只跑一次两个检索通道（结构 / 细节），把每条请求的通道分数、连续性 boost、拓扑先验、
+细节可用性与会话重复计数采集下来（可缓存到文件）；之后每组参数只重放
+融合（fusion_kernel.fuse_batch）→ 多样性惩罚 → 排序 → 置信度标定，
+按 Top-1 命中率、±1 跳命中率（越高越好）和低置信度比例（越低越好）排名。
+每组参数在整批请求上一次向量化算完，多组参数分给进程池并行。
+
+可扫描的参数（默认值取自 EnhancedDualChannelRetriever 与 calibration）：
+- structure_tau / detail_tau：通道内校准温度
+- alpha / beta：固定的通道权重；默认 None 为按通道熵自适应（只给 alpha 时 beta = 1 - alpha）
+- gamma：连续性 boost 权重；sharpen_tau：融合后二次锐化温度
+- lowconf_score_th / lowconf_margin_th：低置信度阈值
+- conf_k / conf_base：margin→sigmoid 置信度曲线的斜率与分界（只作用于没有标定表的站点；
+  有 calibration_tables 标定表的站点与线上一样按表查 confidence）
+
+会话状态（上一条 top1 与重复计数）只取决于结构通道的候选顺序，与上述参数无关，所以采集一次即可精确重放；
+默认参数下的结果与 bench.replay 的 pipeline 目标逐条一致（同样不含 app 中依赖会话历史的连续性 boost）。
+
+    cd backend
+    python -m bench.sweep --grid structure_tau=0.1,0.15,0.2 --grid sharpen_tau=0.2,0.25,0.3 --out sweep.json
+    python -m bench.sweep --corpus logs/locate_log.csv --random 2000 --seed 7 --workers 8 --cache sweep_capture.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import itertools
+import contextlib
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from fusion_kernel import fuse_batch, pad_rows
+from calibration import (
+    CONF_SIGMOID_BASE, CONF_SIGMOID_K, LOWCONF_MARGIN_TH, LOWCONF_SCORE_TH, confidence_from_margin,
+)
+from calibration_tables import CALIBRATION_TABLES
+from scene_registry import RetrievalState, SceneRegistry
+from enhanced_retriever import EnhancedDualChannelRetriever
+from bench.corpus import DEFAULT_CORPUS, CorpusEntry, corpus_digest, load_corpus
+
+CAPTURE_FORMAT = "textnavi.sweep_capture"
+CAPTURE_VERSION = 1
+REPORT_FORMAT = "textnavi.sweep"
+REPORT_VERSION = 1
+TOPOLOGY_FILE = os.path.join(BACKEND_DIR, "topology.json")
+
+# 与 EnhancedDualChannelRetriever.retrieve 相同：同一 top1 连续出现超过 3 次时该候选分数 ×0.7
+REPEAT_PENALTY_AFTER = 3
+REPEAT_PENALTY = 0.7
+# calculate_calibrated_confidence_and_margin 调用 calibrate_confidence 时的一致性 / 连续性 / 内容匹配系数
+PIPELINE_CONF_FACTORS = (0.95, 1.10, 1.0)
+
+PARAMS = ("structure_tau", "detail_tau", "alpha", "beta", "gamma", "sharpen_tau",
+          "lowconf_score_th", "lowconf_margin_th", "conf_k", "conf_base")
+# 随机搜索的均匀采样区间（alpha / beta 只在网格中显式给出时固定）
+RANDOM_SPACE = {
+    "structure_tau": (0.05, 0.50),
+    "detail_tau": (0.05, 0.50),
+    "gamma": (0.0, 0.50),
+    "sharpen_tau": (0.10, 0.60),
+    "lowconf_score_th": (0.30, 0.60),
+    "lowconf_margin_th": (0.01, 0.15),
+    "conf_k": (4.0, 20.0),
+    "conf_base": (0.05, 0.30),
+}
+
+
+def default_params(retriever: Optional[EnhancedDualChannelRetriever] = None) -> Dict[str, Any]:
+    """当前线上使用的参数"""
+    r = retriever or EnhancedDualChannelRetriever(SceneRegistry())
+    return {"structure_tau": r.structure_tau, "detail_tau": r.detail_tau, "alpha": None, "beta": None,
+            "gamma": r.gamma, "sharpen_tau": r.sharpen_tau,
+            "lowconf_score_th": LOWCONF_SCORE_TH, "lowconf_margin_th": LOWCONF_MARGIN_TH,
+            "conf_k": CONF_SIGMOID_K, "conf_base": CONF_SIGMOID_BASE}
+
+
+def load_topology(path: str = TOPOLOGY_FILE) -> Dict[str, Dict[str, List[str]]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def is_hop1(topology: Dict[str, Dict[str, List[str]]], site_id: str, a: Optional[str], b: Optional[str]) -> bool:
+    """与 app.is_hop1 相同：a、b 相同或 b 是 a 的直接邻居"""
+    if not a or not b:
+        return False
+    if a == b:
+        return True
+    return b in (topology.get(site_id, {}).get(a) or [])
+
+
+# ---------- 采集 ----------
+
+def capture_rows(corpus: Sequence[CorpusEntry], retriever: EnhancedDualChannelRetriever,
+                 topology: Dict[str, Dict[str, List[str]]]) -> List[Dict[str, Any]]:
+    """按语料顺序跑两个检索通道，每个 (会话, provider, 站点) 一个 RetrievalState，与 bench.replay 相同"""
+    states: Dict[Tuple[str, str, str], RetrievalState] = {}
+    rows = []
+    for e in corpus:
+        state = states.setdefault((e.session_id, e.provider, e.site_id), RetrievalState())
+        out = retriever.fusion_inputs(e.caption, top_k=10, scene_filter=e.site_id, state=state)
+        row = {"site_id": e.site_id, "gt": e.gt_node_id, "ids": [], "struct": [], "detail": [], "boosts": [],
+               "topo": [], "differ": False, "has_detail": False, "repeat": 0, "hop": []}
+        if out is not None:
+            inputs, has_detail = out
+            row.update(ids=inputs.candidate_ids, struct=[float(s) for s in inputs.struct_scores],
+                       detail=[float(s) for s in inputs.detail_scores],
+                       boosts=[float(b) for b in inputs.boosts],
+                       topo=[float(t) for t in np.asarray(inputs.topo_prior).reshape(-1)],
+                       differ=inputs.top1_ids_differ, has_detail=bool(has_detail),
+                       repeat=state.advance(inputs.candidate_ids[0]),
+                       hop=[is_hop1(topology, e.site_id, cid, e.gt_node_id) for cid in inputs.candidate_ids])
+        rows.append(row)
+    return rows
+
+
+def capture_key(corpus_path: str, retriever: EnhancedDualChannelRetriever, sites: Sequence[str],
+                topology_path: str = TOPOLOGY_FILE) -> str:
+    """采集缓存的版本键：语料内容、检索器配置、各站点数据文件指纹与拓扑文件"""
+    stamps = {}
+    for site_id in sorted(sites):
+        scene = retriever.registry.get(site_id)
+        stamps[site_id] = [list(s) for s in scene.source_stamp] if scene is not None else None
+    try:
+        topo_stat = os.stat(topology_path)
+        topo_stamp = [topo_stat.st_mtime_ns, topo_stat.st_size]
+    except OSError:
+        topo_stamp = None
+    doc = {"version": CAPTURE_VERSION, "corpus": corpus_digest(corpus_path),
+           "alignment": retriever.alignment, "detail_aggregation": retriever.detail_aggregation,
+           "lexical_scorer": retriever.lexical_scorer, "sites": stamps, "topology": topo_stamp}
+    return hashlib.sha256(json.dumps(doc, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_capture(corpus_path: str = DEFAULT_CORPUS, cache_path: Optional[str] = None,
+                 lexical_scorer: Optional[str] = None, data_dir: Optional[str] = None) -> Dict[str, Any]:
+    """读取或生成采集结果；cache_path 中版本键一致的缓存直接复用，否则重新采集并写回"""
+    corpus = load_corpus(corpus_path)
+    # 检索器各处的诊断 print 写到 /dev/null
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        registry = SceneRegistry(data_dir) if data_dir else SceneRegistry()
+        retriever = EnhancedDualChannelRetriever(registry, lexical_scorer=lexical_scorer)
+        key = capture_key(corpus_path, retriever, {e.site_id for e in corpus})
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    cached = json.load(f)
+                if cached.get("format") == CAPTURE_FORMAT and cached.get("key") == key:
+                    return cached
+            except (OSError, ValueError):
+                pass
+        rows = capture_rows(corpus, retriever, load_topology())
+    capture = {"format": CAPTURE_FORMAT, "version": CAPTURE_VERSION, "key": key,
+               "created": datetime.utcnow().isoformat() + "Z",
+               "corpus": {"path": os.path.abspath(corpus_path), "entries": len(corpus)},
+               "lexical_scorer": retriever.lexical_scorer, "alignment": retriever.alignment,
+               "defaults": default_params(retriever), "rows": rows}
+    if cache_path:
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(capture, f, ensure_ascii=False)
+    return capture
+
+
+# ---------- 重放 ----------
+
+class CapturedBatch:
+    """采集结果按行补齐后的矩阵（每个工作进程构建一次，之后每组参数只做向量运算）"""
+
+    def __init__(self, rows: Sequence[Dict[str, Any]]):
+        self.struct, self.struct_mask = pad_rows([r["struct"] for r in rows])
+        self.detail, self.detail_mask = pad_rows([r["detail"] for r in rows])
+        self.boosts = np.zeros_like(self.struct)
+        self.topo = np.zeros_like(self.struct)
+        self.hop = np.zeros(self.struct.shape, dtype=bool)
+        for i, r in enumerate(rows):
+            n = len(r["struct"])
+            self.boosts[i, :n] = r["boosts"]
+            self.topo[i, :n] = r["topo"]
+            self.hop[i, :len(r["hop"])] = r["hop"]
+        self.differ = np.array([bool(r["differ"]) for r in rows], dtype=bool)
+        self.has_detail = np.array([bool(r["has_detail"]) for r in rows], dtype=bool)
+        self.penalize = np.array([r["repeat"] > REPEAT_PENALTY_AFTER for r in rows], dtype=bool)
+        self.labeled = np.array([bool(r["gt"]) for r in rows], dtype=bool)
+        self.gt_index = np.array([r["ids"].index(r["gt"]) if r["gt"] in r["ids"] else -1 for r in rows])
+        self.count = self.struct_mask.sum(axis=1)
+        self.site_rows: Dict[str, np.ndarray] = {}
+        for i, r in enumerate(rows):
+            self.site_rows.setdefault(r["site_id"], []).append(i)
+        self.site_rows = {s: np.asarray(idx) for s, idx in self.site_rows.items()}
+
+    def __len__(self):
+        return self.struct.shape[0]
+
+
+def resolve_weights(params: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    """固定通道权重；alpha、beta 都为 None 时返回 None（自适应）"""
+    alpha, beta = params.get("alpha"), params.get("beta")
+    if alpha is None and beta is None:
+        return None
+    if beta is None:
+        beta = 1.0 - alpha
+    elif alpha is None:
+        alpha = 1.0 - beta
+    return float(alpha), float(beta)
+
+
+def replay(batch: CapturedBatch, params: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """一组参数下每条请求的 top1 位置、置信度、margin 与低置信度标记"""
+    scores = fuse_batch(batch.struct, batch.struct_mask, batch.detail, batch.detail_mask,
+                        batch.boosts, batch.topo, batch.differ,
+                        structure_tau=params["structure_tau"], detail_tau=params["detail_tau"],
+                        gamma=params["gamma"], sharpen_tau=params["sharpen_tau"],
+                        weights=resolve_weights(params))
+    scores = np.where(batch.struct_mask, scores, -np.inf)
+    scores[batch.penalize, 0] *= REPEAT_PENALTY
+    order = np.argsort(-scores, axis=1, kind="stable")   # 与 list.sort(reverse=True) 一样保持并列项原顺序
+    rows = np.arange(len(batch))
+    top1 = order[:, 0]
+
+    ranked = batch.count >= 2
+    margin = np.zeros(len(batch))
+    confidence = np.zeros(len(batch))
+    if ranked.any() and scores.shape[1] > 1:
+        s1 = scores[rows, top1][ranked]
+        s2 = scores[rows, order[:, 1]][ranked]
+        margin[ranked] = np.maximum(0.0, s1 - s2)
+        confidence[ranked] = confidence_from_margin(margin[ranked], batch.has_detail[ranked], PIPELINE_CONF_FACTORS,
+                                                    k=params["conf_k"], base=params["conf_base"])
+        for site_id, idx in batch.site_rows.items():
+            table = CALIBRATION_TABLES.get(site_id)
+            if table is not None:
+                idx = idx[ranked[idx]]
+                confidence[idx] = table(margin[idx])
+    low_conf = (confidence < params["lowconf_score_th"]) | (margin < params["lowconf_margin_th"])
+    return {"top1": np.where(batch.count > 0, top1, -1), "confidence": confidence, "margin": margin,
+            "low_conf": low_conf}
+
+
+def evaluate(batch: CapturedBatch, params: Dict[str, Any]) -> Dict[str, Any]:
+    """一组参数的 Top-1 / ±1 跳命中率、低置信度比例与平均置信度"""
+    out = replay(batch, params)
+    rows = np.arange(len(batch))
+    top1 = out["top1"]
+    answered = top1 >= 0
+    hit = batch.labeled & answered & (top1 == batch.gt_index)
+    hop = batch.labeled & answered & batch.hop[rows, np.maximum(top1, 0)]
+    labeled = int(batch.labeled.sum())
+    return {
+        "params": dict(params),
+        "labeled": labeled,
+        "top1_accuracy": round(float(hit.sum()) / labeled, 4) if labeled else None,
+        "hop1_accuracy": round(float(hop.sum()) / labeled, 4) if labeled else None,
+        "low_conf_rate": round(float(out["low_conf"].mean()), 4) if len(batch) else None,
+        "mean_confidence": round(float(out["confidence"].mean()), 4) if len(batch) else None,
+    }
+
+
+def rank_key(result: Dict[str, Any]):
+    """Top-1 高者优先，其次 ±1 跳，再次低置信度比例低者"""
+    return (-(result["top1_accuracy"] or 0.0), -(result["hop1_accuracy"] or 0.0),
+            result["low_conf_rate"] if result["low_conf_rate"] is not None else 1.0)
+
+
+# ---------- 参数空间 ----------
+
+def _parse_value(name: str, text: str):
+    text = text.strip()
+    if name in ("alpha", "beta") and text.lower() in ("none", "auto", ""):
+        return None
+    return float(text)
+
+
+def parse_grid(specs: Sequence[str]) -> Dict[str, List[Any]]:
+    """["structure_tau=0.1,0.15", "gamma=0.1"] → {"structure_tau": [0.1, 0.15], "gamma": [0.1]}"""
+    grid: Dict[str, List[Any]] = {}
+    for spec in specs:
+        name, sep, values = spec.partition("=")
+        name = name.strip()
+        if not sep or name not in PARAMS:
+            raise ValueError(f"bad grid spec {spec!r} (expected name=v1,v2 with name in {', '.join(PARAMS)})")
+        grid[name] = [_parse_value(name, v) for v in values.split(",")]
+    return grid
+
+
+def grid_configs(grid: Dict[str, Sequence[Any]], base: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """网格中所有组合（未列出的参数取 base）"""
+    names = list(grid)
+    return [{**base, **dict(zip(names, combo))} for combo in itertools.product(*(grid[n] for n in names))]
+
+
+def random_configs(n: int, base: Dict[str, Any], seed: Optional[int] = None,
+                   space: Dict[str, Tuple[float, float]] = RANDOM_SPACE,
+                   fixed: Optional[Dict[str, Sequence[Any]]] = None) -> List[Dict[str, Any]]:
+    """在 space 内均匀采样 n 组参数；fixed 中的参数从给定取值里随机选"""
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(n):
+        params = dict(base)
+        for name, (lo, hi) in space.items():
+            params[name] = round(rng.uniform(lo, hi), 4)
+        for name, values in (fixed or {}).items():
+            params[name] = rng.choice(list(values))
+        configs.append(params)
+    return configs
+
+
+# ---------- 并行执行 ----------
+
+_WORKER_BATCH: Optional[CapturedBatch] = None
+
+
+def _init_worker(rows):
+    global _WORKER_BATCH
+    _WORKER_BATCH = CapturedBatch(rows)
+
+
+def _evaluate_chunk(configs: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [evaluate(_WORKER_BATCH, params) for params in configs]
+
+
+def run_sweep(capture: Dict[str, Any], configs: Sequence[Dict[str, Any]], workers: Optional[int] = None,
+              chunk_size: int = 50) -> List[Dict[str, Any]]:
+    """在采集结果上评估全部参数组合，按 rank_key 排序返回（workers=1 时在当前进程内执行）"""
+    rows = capture["rows"]
+    workers = workers or os.cpu_count() or 1
+    chunks = [list(configs[i:i + chunk_size]) for i in range(0, len(configs), chunk_size)]
+    if workers <= 1 or len(chunks) <= 1:
+        batch = CapturedBatch(rows)
+        results = [evaluate(batch, params) for params in configs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=_init_worker,
+                                 initargs=(rows,)) as pool:
+            results = [r for chunk in pool.map(_evaluate_chunk, chunks) for r in chunk]
+    return sorted(results, key=rank_key)
+
+
+def sweep(corpus_path: str = DEFAULT_CORPUS, grid: Optional[Dict[str, Sequence[Any]]] = None,
+          n_random: int = 0, seed: Optional[int] = None, workers: Optional[int] = None,
+          cache_path: Optional[str] = None, lexical_scorer: Optional[str] = None,
+          data_dir: Optional[str] = None) -> Dict[str, Any]:
+    """采集（或读缓存）→ 生成参数组合 → 并行评估，返回报告字典
+
+    给出 n_random 时做随机搜索，grid 中的参数作为随机选取的离散取值；否则做网格搜索。
+    默认参数总是作为基线一并评估。
+    """
+    t0 = time.perf_counter()
+    capture = load_capture(corpus_path, cache_path, lexical_scorer, data_dir)
+    capture_s = time.perf_counter() - t0
+    base = capture["defaults"]
+    if n_random > 0:
+        mode, configs = "random", random_configs(n_random, base, seed, fixed=grid)
+    else:
+        mode, configs = "grid", grid_configs(grid or {}, base)
+    configs = [base] + [c for c in configs if c != base]
+
+    t1 = time.perf_counter()
+    results = run_sweep(capture, configs, workers)
+    sweep_s = time.perf_counter() - t1
+    baseline = next(r for r in results if r["params"] == base)
+    return {
+        "format": REPORT_FORMAT,
+        "version": REPORT_VERSION,
+        "created": datetime.utcnow().isoformat() + "Z",
+        "mode": mode,
+        "seed": seed,
+        "corpus": capture["corpus"],
+        "capture_key": capture["key"],
+        "lexical_scorer": capture["lexical_scorer"],
+        "alignment": capture["alignment"],
+        "configs": len(configs),
+        "capture_s": round(capture_s, 3),
+        "sweep_s": round(sweep_s, 3),
+        "baseline": baseline,
+        "results": results,
+    }
+
+
+def _fmt_params(params: Dict[str, Any], base: Dict[str, Any]) -> str:
+    changed = [f"{k}={v}" for k, v in params.items() if base.get(k) != v]
+    return " ".join(changed) or "(defaults)"
+
+
+def print_report(report: Dict[str, Any], top: int = 10):
+    base = report["baseline"]
+    print(f"🔎 {report['mode']} sweep: {report['configs']} configs over {report['corpus']['entries']} captions "
+          f"({base['labeled']} labeled), capture {report['capture_s']}s, sweep {report['sweep_s']}s")
+    print(f"{'rank':<6}{'top1':>8}{'hop1':>8}{'lowconf':>9}{'conf':>8}   params")
+    for i, r in enumerate(report["results"][:top], 1):
+        print(f"{i:<6}{r['top1_accuracy']!s:>8}{r['hop1_accuracy']!s:>8}{r['low_conf_rate']!s:>9}"
+              f"{r['mean_confidence']!s:>8}   {_fmt_params(r['params'], base['params'])}")
+    rank = report["results"].index(base) + 1
+    print(f"baseline (rank {rank}): top1={base['top1_accuracy']} hop1={base['hop1_accuracy']} "
+          f"low_conf_rate={base['low_conf_rate']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Sweep fusion / calibration hyperparameters over captured scores")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="带标注的语料（.jsonl 或 locate_log.csv）")
+    parser.add_argument("--grid", action="append", default=[], metavar="NAME=V1,V2",
+                        help=f"网格取值，可重复；参数：{', '.join(PARAMS)}")
+    parser.add_argument("--random", type=int, default=0, metavar="N", help="随机搜索 N 组参数")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数）")
+    parser.add_argument("--cache", help="采集结果缓存文件（语料或场景数据变化时自动重新采集）")
+    parser.add_argument("--lexical-scorer", choices=("heuristic", "bm25"), default=None)
+    parser.add_argument("--top", type=int, default=10, help="打印前 N 名")
+    parser.add_argument("--out", help="写出 JSON 报告")
+    args = parser.parse_args(argv)
+
+    try:
+        grid = parse_grid(args.grid)
+    except ValueError as e:
+        parser.error(str(e))
+    report = sweep(args.corpus, grid, args.random, args.seed, args.workers, args.cache, args.lexical_scorer)
+    print_report(report, args.top)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+BM25F lexical channel
+BM25F 词法通道：在场景加载时把结构节点与细节记录分别建成带字段权重的 BM25F 索引，
+预先算好每个 (词, 文档) 的饱和后得分并存成稀疏数组（CSR：词 → 文档下标 / 得分切片），
+查询时只需按 caption 中出现的词把对应切片累加到分数数组上。
+
+与原关键词计数相比，IDF 让 "desk"、"room" 这类在多数节点都出现的常见词几乎不加分，
+只出现在个别节点上的区分性词（"oscilloscope"、"turnstile"）主导排序。
+
+BM25F（Robertson 等）：
+    tf~(t, d) = Σ_f w_f · tf_f(t, d) / (1 − b + b · len_f(d) / avglen_f)
+    score(q, d) = Σ_{t∈q} idf(t) · tf~·(k1+1) / (tf~ + k1)
+    idf(t) = ln(1 + (N − df + 0.5) / (df + 0.5))
+分数再除以查询词的理论上限 Σ idf(t)·(k1+1)，落在 [0, 1)，与启发式打分同一量级，
+融合时的温度参数无需调整。
+"""
+
+import os
+import re
+from typing import AbstractSet, Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 字段权重：名称与索引词最具区分性，标签为场景级常见词，权重最低
+FIELD_WEIGHTS = {
+    "name": float(os.getenv("BM25_W_NAME", "3.0")),
+    "index_terms": float(os.getenv("BM25_W_INDEX_TERMS", "2.0")),
+    "tags": float(os.getenv("BM25_W_TAGS", "0.5")),
+    "nl_text": float(os.getenv("BM25_W_NL_TEXT", "1.0")),
+    "unique_features": float(os.getenv("BM25_W_UNIQUE_FEATURES", "1.5")),
+}
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+STOP_WORDS = frozenset({
+    "the", "a", "an", "and", "or", "but", "in", "on", "at", "to", "for", "of", "with", "by",
+    "is", "are", "was", "were", "be", "it", "its", "this", "that", "there", "some", "near",
+    "view", "image", "photo", "picture",
+})
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_POI_PREFIX_RE = re.compile(r"^poi\d+$")
+
+
+def tokenize(text: str) -> List[str]:
+    """小写、按非字母数字切分、去停用词与单字符"""
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if len(t) > 1 and t not in STOP_WORDS]
+
+
+def _join(values) -> str:
+    if not values:
+        return ""
+    if isinstance(values, str):
+        return values
+    return " ".join(str(v) for v in values if v)
+
+
+def node_document(node: Dict[str, Any], details: Sequence[Dict[str, Any]] = (),
+                  scene_tags: Sequence[str] = ()) -> Dict[str, str]:
+    """结构节点 → BM25F 字段文本；细节字段取经别名表关联到该节点的细节记录
+
+    index_terms 取节点ID拆词（去掉 poiNN 前缀）与地标：retrieval.index_terms 是场景级的全部节点ID列表，
+    对单个节点没有区分度，不计入。
+    """
+    retrieval = node.get("retrieval") or {}
+    id_words = [w for w in str(node.get("id", "")).split("_") if not _POI_PREFIX_RE.match(w)]
+    landmarks = [lm.get("term", "") if isinstance(lm, dict) else str(lm) for lm in node.get("landmarks", [])]
+    tags = dict.fromkeys(list(retrieval.get("tags", [])) + list(scene_tags)
+                         + list(node.get("categories", [])) + [node.get("type", "")])
+    return {
+        "name": node.get("name", ""),
+        "index_terms": _join(id_words + landmarks),
+        "tags": _join(list(tags)),
+        "nl_text": _join([d.get("nl_text", "") for d in details]),
+        "unique_features": _join([_join(d.get("unique_features")) for d in details]),
+    }
+
+
+def detail_document(item: Dict[str, Any]) -> Dict[str, str]:
+    """细节记录 → BM25F 字段文本（struct_text 作为该记录的索引词）"""
+    return {
+        "nl_text": item.get("nl_text", ""),
+        "unique_features": _join(item.get("unique_features")),
+        "index_terms": (item.get("struct_text") or "").replace(";", " ").replace("=", " "),
+    }
+
+
+class BM25FIndex:
+    """预计算的 BM25F 稀疏索引（只读，可在线程间共享）
+
+    postings 以 CSR 形式存储：词 t 的命中文档为 doc_ids[indptr[t]:indptr[t+1]]，
+    对应的饱和得分 idf·tf~·(k1+1)/(tf~+k1) 为 weights[同一切片]。
+    """
+
+    def __init__(self, documents: Sequence[Mapping[str, str]],
+                 field_weights: Mapping[str, float] = None,
+                 k1: float = BM25_K1, b: float = BM25_B):
+        self.field_weights = dict(field_weights or FIELD_WEIGHTS)
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(documents)
+
+        fields = [f for f, w in self.field_weights.items() if w > 0]
+        tokens = [{f: tokenize(doc.get(f, "")) for f in fields} for doc in documents]
+        avglen = {f: (sum(len(t[f]) for t in tokens) / self.n_docs if self.n_docs else 0.0) for f in fields}
+
+        # 逐文档的字段归一化加权词频 tf~
+        weighted_tf: Dict[str, Dict[int, float]] = {}
+        for d, doc_tokens in enumerate(tokens):
+            for f in fields:
+                words = doc_tokens[f]
+                if not words:
+                    continue
+                norm = 1.0 - b + b * (len(words) / avglen[f] if avglen[f] else 0.0)
+                w = self.field_weights[f] / norm
+                for t in words:
+                    per_doc = weighted_tf.setdefault(t, {})
+                    per_doc[d] = per_doc.get(d, 0.0) + w
+
+        self.vocab: Dict[str, int] = {}
+        idf, indptr, doc_ids, weights = [], [0], [], []
+        for t, per_doc in weighted_tf.items():
+            self.vocab[t] = len(idf)
+            df = len(per_doc)
+            term_idf = float(np.log1p((self.n_docs - df + 0.5) / (df + 0.5)))
+            idf.append(term_idf)
+            for d, tf in per_doc.items():
+                doc_ids.append(d)
+                weights.append(term_idf * tf * (k1 + 1.0) / (tf + k1))
+            indptr.append(len(doc_ids))
+
+        self.idf = _readonly(np.asarray(idf, dtype=np.float64))
+        self.indptr = _readonly(np.asarray(indptr, dtype=np.intp))
+        self.doc_ids = _readonly(np.asarray(doc_ids, dtype=np.intp))
+        self.weights = _readonly(np.asarray(weights, dtype=np.float64))
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def _query_terms(self, text: str) -> List[int]:
+        seen = []
+        for t in tokenize(text):
+            i = self.vocab.get(t)
+            if i is not None and i not in seen:
+                seen.append(i)
+        return seen
+
+    def scores(self, text: str) -> np.ndarray:
+        """全部文档的归一化 BM25F 分数（[0, 1)，未命中为 0）"""
+        out = np.zeros(self.n_docs, dtype=np.float64)
+        terms = self._query_terms(text)
+        if not terms:
+            return out
+        for i in terms:
+            lo, hi = self.indptr[i], self.indptr[i + 1]
+            out[self.doc_ids[lo:hi]] += self.weights[lo:hi]   # 同一词的文档下标互不重复
+        upper = float(self.idf[terms].sum()) * (self.k1 + 1.0)
+        if upper > 0:
+            out /= upper
+        return out
+
+    def score_matches(self, text: str) -> Dict[int, float]:
+        """只返回命中文档：文档下标 → 分数（均 > 0），接口与 DetailIndex.score_matches 相同"""
+        scores = self.scores(text)
+        hit = np.flatnonzero(scores > 0)
+        return {int(i): float(scores[i]) for i in hit}
+
+    def top_k(self, text: str, k: int, eligible: Optional[AbstractSet[int]] = None) -> List[Tuple[int, float]]:
+        """按分数降序返回前 k 条 (文档下标, 分数)；同分按文档顺序，不足 k 条时补 0 分文档"""
+        scores = self.scores(text)
+        order = np.argsort(-scores, kind="stable")
+        hits = []
+        for i in order:
+            if eligible is not None and int(i) not in eligible:
+                continue
+            hits.append((int(i), float(scores[i])))
+            if len(hits) >= k:
+                break
+        return hits
+
+
+def _readonly(arr: np.ndarray) -> np.ndarray:
+    arr.setflags(write=False)
+    return arr
+
+
+def build_node_index(nodes: Sequence[Dict[str, Any]], details_by_node: Mapping[str, Sequence[Dict[str, Any]]],
+                     scene_tags: Sequence[str] = ()) -> BM25FIndex:
+    """结构通道索引：每个节点一篇文档（与 nodes 顺序一致）"""
+    return BM25FIndex([node_document(n, details_by_node.get(n.get("id", ""), ()), scene_tags) for n in nodes])
+
+
+def build_detail_index(records: Sequence[Dict[str, Any]]) -> BM25FIndex:
+    """细节通道索引：每条细节记录一篇文档（与文件顺序一致）"""
+    return BM25FIndex([detail_document(item) for item in records])
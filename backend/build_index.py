@@ -1,5 +1,6 @@
-import json, os, pathlib, numpy as np
-from sentence_transformers import SentenceTransformer
+import json, os, sys, time, hashlib, argparse, pathlib, tempfile, numpy as np
+
+from embedding_store import open_embedding_index, save_embedding_index
 
 try:
     import faiss  # type: ignore
@@ -12,6 +13,17 @@ MODEL_DIR  = pathlib.Path(__file__).resolve().parent / "models"
 MODEL_DIR.mkdir(parents=True, exist_ok=True)
 
 ST_MODEL = None
+ST_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+ENCODE_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "64"))
+INDEX_PREFIX = "index_dual"
+
+# Source files: (provider tag, filename)
+DATA_FILES = [
+    ("Sense_A_4o", "Sence_A_4o.fixed.jsonl"),
+    ("Sense_A_FT", "Sense_A_Finetuned.fixed.jsonl"),
+    ("Sense_B_4o", "Sense_B_4o.fixed.jsonl"),
+    ("Sense_B_FT", "Sense_B_Finetuned.fixed.jsonl")
+]
 
 def load_jsonl_records(file_path: pathlib.Path) -> list:
     """Load all records from a JSONL file"""
@@ -85,28 +97,18 @@ def extract_structured_text_from_finetuned(record: dict) -> str:
     
     return "; ".join(parts) if parts else "no_structured_info"
 
-def build_dual_channel_index():
-    """Build dual-channel index from all 4 jsonl files"""
-    print("🔍 Building dual-channel index from all data files...")
-    
-    # Define all data files
-    data_files = [
-        ("Sense_A_4o", "Sence_A_4o.fixed.jsonl"),
-        ("Sense_A_FT", "Sense_A_Finetuned.fixed.jsonl"), 
-        ("Sense_B_4o", "Sense_B_4o.fixed.jsonl"),
-        ("Sense_B_FT", "Sense_B_Finetuned.fixed.jsonl")
-    ]
-    
-    # Load and assemble all records
-    records = []  # Each record: {id, scene_id, provider, nl_text, struct_text}
+def collect_records(data_dir: pathlib.Path = DATA_DIR, verbose: bool = True) -> list:
+    """Load and assemble all records from the source JSONL files"""
+    records = []  # Each record: {id, scene_id, provider, nl_text, struct_text, nl_hash, struct_hash}
     
-    for provider, filename in data_files:
-        file_path = DATA_DIR / filename
+    for provider, filename in DATA_FILES:
+        file_path = pathlib.Path(data_dir) / filename
         if not file_path.exists():
             print(f"⚠ Warning: {filename} not found, skipping...")
             continue
             
-        print(f"📖 Loading {filename}...")
+        if verbose:
+            print(f"📖 Loading {filename}...")
         file_records = load_jsonl_records(file_path)
         
         for i, record in enumerate(file_records):
@@ -135,11 +137,107 @@ def build_dual_channel_index():
                 "provider": "ft" if "FT" in provider else "base",
                 "nl_text": nl_text,
                 "struct_text": struct_text,
-                "source_file": filename
+                "source_file": filename,
+                "nl_hash": text_hash(nl_text),
+                "struct_hash": text_hash(struct_text),
             }
             
             records.append(record_entry)
-            print(f"  ✓ {record_id}: {scene_id} ({len(nl_text)} chars, struct: {len(struct_text)} chars)")
+            if verbose:
+                print(f"  ✓ {record_id}: {scene_id} ({len(nl_text)} chars, struct: {len(struct_text)} chars)")
+    
+    return records
+
+def text_hash(text: str, model_name: str = ST_MODEL_NAME) -> str:
+    """Content hash of an embedding input (the model name is part of the key)"""
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+def load_embedding_cache(model_dir: pathlib.Path = MODEL_DIR, model_name: str = ST_MODEL_NAME) -> dict:
+    """text hash -> vector, taken from the existing index (empty when missing or built by another model)"""
+    try:
+        index = open_embedding_index(str(pathlib.Path(model_dir) / INDEX_PREFIX))
+    except (OSError, ValueError):
+        return {}
+    if index.meta.get("model", model_name) != model_name:
+        return {}
+    cache = {}
+    for row, item in enumerate(index.items):
+        for channel, field in (("nl_vecs", "nl_text"), ("struct_vecs", "struct_text")):
+            if channel in index.arrays and row < index[channel].shape[0]:
+                cache[text_hash(item.get(field, ""), model_name)] = index[channel][row]
+    return cache
+
+def index_status(records: list, cache: dict, model_dir: pathlib.Path = MODEL_DIR) -> dict:
+    """Compare the source records with the existing index"""
+    wanted = {r["nl_hash"] for r in records} | {r["struct_hash"] for r in records}
+    missing = wanted - cache.keys()
+    try:
+        existing = open_embedding_index(str(pathlib.Path(model_dir) / INDEX_PREFIX)).items
+    except (OSError, ValueError):
+        existing = []
+    old = {item.get("id"): (text_hash(item.get("nl_text", "")), text_hash(item.get("struct_text", "")))
+           for item in existing}
+    new = {r["id"]: (r["nl_hash"], r["struct_hash"]) for r in records}
+    return {
+        "records": len(records),
+        "added": sorted(new.keys() - old.keys()),
+        "removed": sorted(old.keys() - new.keys()),
+        "changed": sorted(k for k in new.keys() & old.keys() if new[k] != old[k]),
+        "texts_to_encode": len(missing),
+        "stale": bool(missing) or new != old,
+    }
+
+def get_encoder(model_name: str = ST_MODEL_NAME):
+    """Load the SentenceTransformer lazily (not needed for --check or a fully cached build)"""
+    global ST_MODEL
+    if ST_MODEL is None:
+        from sentence_transformers import SentenceTransformer
+        print("\n🤖 Loading SentenceTransformer model...")
+        ST_MODEL = SentenceTransformer(model_name)
+        print("✓ Model loaded successfully")
+    return lambda texts: ST_MODEL.encode(texts, normalize_embeddings=True, convert_to_numpy=True,
+                                         batch_size=ENCODE_BATCH_SIZE)
+
+def encode_missing(texts_by_hash: dict, cache: dict, encoder=None, batch_size: int = ENCODE_BATCH_SIZE) -> int:
+    """Encode only texts whose hash is not cached, in batches; returns the number encoded"""
+    todo = [(h, t) for h, t in texts_by_hash.items() if h not in cache]
+    if not todo:
+        return 0
+    encoder = encoder or get_encoder()
+    for start in range(0, len(todo), batch_size):
+        batch = todo[start:start + batch_size]
+        vecs = np.asarray(encoder([t for _, t in batch]), dtype=np.float32)
+        for (h, _), v in zip(batch, vecs):
+            cache[h] = v
+    return len(todo)
+
+def _write_faiss(path: pathlib.Path, vecs: np.ndarray):
+    """Write a FAISS index through a temp file + rename"""
+    fd, tmp = tempfile.mkstemp(prefix=".tmp_", dir=str(path.parent))
+    os.close(fd)
+    try:
+        index = faiss.IndexFlatIP(vecs.shape[1])
+        index.add(vecs)
+        faiss.write_index(index, tmp)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def build_dual_channel_index(data_dir: pathlib.Path = DATA_DIR, model_dir: pathlib.Path = MODEL_DIR,
+                             encoder=None, force: bool = False, batch_size: int = ENCODE_BATCH_SIZE):
+    """Build the dual-channel index from all 4 jsonl files, re-encoding only new or changed texts
+
+    Embeddings are cached by a content hash of (model, text): unchanged records reuse the vectors
+    of the existing index, and every output file is written atomically (temp file + rename).
+    Returns (records, number of texts encoded).
+    """
+    print("🔍 Building dual-channel index from all data files...")
+    t0 = time.perf_counter()
+    model_dir = pathlib.Path(model_dir)
+    records = collect_records(data_dir)
     
     print(f"\n📊 Total records loaded: {len(records)}")
     
@@ -156,85 +254,83 @@ def build_dual_channel_index():
     for scene, count in scene_counts.items():
         print(f"  {scene}: {count} records")
     
-    # Initialize sentence transformer model
-    global ST_MODEL
-    if ST_MODEL is None:
-        print("\n🤖 Loading SentenceTransformer model...")
-        ST_MODEL = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-        print("✓ Model loaded successfully")
-    
-    # Compute dual-channel vectors
-    print("\n🧮 Computing dual-channel embeddings...")
+    # Compute dual-channel vectors (cached vectors are reused by content hash)
+    cache = {} if force else load_embedding_cache(model_dir)
+    texts_by_hash = {}
+    for r in records:
+        texts_by_hash.setdefault(r["nl_hash"], r["nl_text"])
+        texts_by_hash.setdefault(r["struct_hash"], r["struct_text"])
+    print(f"\n🧮 Computing dual-channel embeddings ({len(texts_by_hash)} unique texts, {len(cache)} cached)...")
+    encoded = encode_missing(texts_by_hash, cache, encoder, batch_size)
+    print(f"✓ Encoded {encoded} new/changed texts, reused {len(texts_by_hash) - encoded}")
     
-    # Natural language vectors
-    nl_texts = [r["nl_text"] for r in records]
-    nl_vecs = ST_MODEL.encode(nl_texts, normalize_embeddings=True, convert_to_numpy=True)
+    nl_vecs = np.stack([cache[r["nl_hash"]] for r in records]).astype(np.float32) if records else np.zeros((0, 0), np.float32)
+    struct_vecs = np.stack([cache[r["struct_hash"]] for r in records]).astype(np.float32) if records else np.zeros((0, 0), np.float32)
     print(f"✓ NL vectors: {nl_vecs.shape}")
-    
-    # Structured vectors (for records without struct_text, use empty string)
-    struct_inputs = [r["struct_text"] if r["struct_text"] else "" for r in records]
-    struct_vecs = ST_MODEL.encode(struct_inputs, normalize_embeddings=True, convert_to_numpy=True)
     print(f"✓ Struct vectors: {struct_vecs.shape}")
     
-    # Save dual-channel index
-    output_npz = MODEL_DIR / "index_dual.npz"
-    output_meta = MODEL_DIR / "index_meta.json"
+    # Save dual-channel index: uncompressed float32 .npy per matrix + JSON sidecar (mmap-able, no pickle)
+    output_prefix = str(model_dir / INDEX_PREFIX)
     
-    print(f"\n💾 Saving dual-channel index...")
-    np.savez_compressed(
-        output_npz,
-        nl_vecs=nl_vecs.astype(np.float32),
-        struct_vecs=struct_vecs.astype(np.float32)
+    print("\n💾 Saving dual-channel index...")
+    output_meta = save_embedding_index(
+        output_prefix,
+        {"nl_vecs": nl_vecs, "struct_vecs": struct_vecs},
+        items=records,
+        model=ST_MODEL_NAME,
     )
-    print(f"✓ Vectors saved: {output_npz}")
-    
-    # Save metadata
-    with open(output_meta, "w", encoding="utf-8") as f:
-        json.dump(records, f, ensure_ascii=False, indent=2)
+    print(f"✓ Vectors saved: {output_prefix}.nl_vecs.npy, {output_prefix}.struct_vecs.npy")
     print(f"✓ Metadata saved: {output_meta}")
     
     # Create FAISS indices if available
-    if USE_FAISS:
+    if USE_FAISS and records:
         print("\n🔍 Creating FAISS indices...")
-        
-        # NL index
-        nl_index_path = MODEL_DIR / "index_dual.nl.faiss"
-        dim = nl_vecs.shape[1]
-        nl_index = faiss.IndexFlatIP(dim)
-        nl_index.add(nl_vecs.astype(np.float32))
-        faiss.write_index(nl_index, str(nl_index_path))
-        print(f"✓ NL FAISS index: {nl_index_path}")
-        
-        # Struct index
-        struct_index_path = MODEL_DIR / "index_dual.struct.faiss"
-        struct_index = faiss.IndexFlatIP(dim)
-        struct_index.add(struct_vecs.astype(np.float32))
-        faiss.write_index(struct_index, str(struct_index_path))
-        print(f"✓ Struct FAISS index: {struct_index_path}")
-    else:
+        _write_faiss(model_dir / "index_dual.nl.faiss", nl_vecs)
+        print(f"✓ NL FAISS index: {model_dir / 'index_dual.nl.faiss'}")
+        _write_faiss(model_dir / "index_dual.struct.faiss", struct_vecs)
+        print(f"✓ Struct FAISS index: {model_dir / 'index_dual.struct.faiss'}")
+    elif not USE_FAISS:
         print("\n⚠ FAISS not available, will use sklearn at runtime")
     
-    print(f"\n🎉 Dual-channel index complete!")
-    print(f"📁 Output files:")
-    print(f"  - {output_npz}")
+    print(f"\n🎉 Dual-channel index complete in {time.perf_counter() - t0:.1f}s!")
+    print("📁 Output files:")
+    print(f"  - {output_prefix}.nl_vecs.npy")
+    print(f"  - {output_prefix}.struct_vecs.npy")
     print(f"  - {output_meta}")
     if USE_FAISS:
-        print(f"  - {MODEL_DIR}/index_dual.nl.faiss")
-        print(f"  - {MODEL_DIR}/index_dual.struct.faiss")
+        print(f"  - {model_dir}/index_dual.nl.faiss")
+        print(f"  - {model_dir}/index_dual.struct.faiss")
     
-    return records
+    return records, encoded
+
+def check_index(data_dir: pathlib.Path = DATA_DIR, model_dir: pathlib.Path = MODEL_DIR) -> dict:
+    """Report whether the index is stale with respect to the source files (no model is loaded)"""
+    records = collect_records(data_dir, verbose=False)
+    return index_status(records, load_embedding_cache(model_dir), model_dir)
 
-def main():
+def main(argv=None):
     """Main function to build dual-channel index"""
+    parser = argparse.ArgumentParser(description="Dual-Channel Index Builder (incremental)")
+    parser.add_argument("--check", action="store_true", help="only report staleness; exit 1 if the index is stale")
+    parser.add_argument("--force", action="store_true", help="ignore cached embeddings and re-encode everything")
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE)
+    args = parser.parse_args(argv)
+    
+    if args.check:
+        status = check_index()
+        print(json.dumps(status, ensure_ascii=False, indent=2))
+        print("❌ Index is stale" if status["stale"] else "✅ Index is up to date")
+        return 1 if status["stale"] else 0
+    
     print("🚀 Dual-Channel Index Builder")
     print("=" * 50)
     
     try:
-        records = build_dual_channel_index()
+        records, _ = build_dual_channel_index(force=args.force, batch_size=args.batch_size)
         print(f"\n✅ Successfully built index with {len(records)} records")
         
         # Print sample records for verification
-        print(f"\n📋 Sample records:")
+        print("\n📋 Sample records:")
         for i, record in enumerate(records[:3]):
             print(f"  {i+1}. {record['id']}: {record['scene_id']} ({record['provider']})")
             print(f"     NL: {record['nl_text'][:80]}...")
@@ -251,4 +347,4 @@ def main():
     return 0
 
 if __name__ == "__main__":
-    exit(main())
\ No newline at end of file
+    sys.exit(main())
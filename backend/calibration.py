@@ -0,0 +1,135 @@
+"""
+Confidence calibration for the locate pipeline
+定位流水线的置信度标定：低置信度阈值、margin → confidence 映射。
+站点有离线拟合的单调标定表（calibration_tables.py）时按表插值，否则使用 sigmoid 映射。
+
+从 app.py 中拆出的纯函数（不依赖 FastAPI / 会话存储），供 /api/locate、离线基准（bench/）和评估工具共用。
+连续性 boost 依赖会话历史，仍在 app.py 中。
+"""
+
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from calibration_tables import CALIBRATION_TABLES
+from structured_log import get_logger
+
+log = get_logger("calibration")
+
+# 🔧 FIX: 调整低置信度阈值，让60%+的confidence不再显示警告
+# 低置信度阈值配置 - 双通道模式，优化阈值
+LOWCONF_SCORE_TH = float(os.getenv("LOWCONF_SCORE_TH", "0.40"))  # 双通道模式：40% confidence（从50%降低到40%）
+LOWCONF_MARGIN_TH = float(os.getenv("LOWCONF_MARGIN_TH", "0.05"))  # 双通道模式：5% margin（从10%降低到5%）
+
+# 🔧 NEW: Softmax temperature calibration for confidence scoring
+SOFTMAX_TEMPERATURE = float(os.getenv("SOFTMAX_TEMPERATURE", "0.06"))  # Temperature for softmax calibration
+ENABLE_SOFTMAX_CALIBRATION = False  # 修复：强制关闭softmax校准
+ENABLE_CONTINUITY_BOOST = os.getenv("ENABLE_CONTINUITY_BOOST", "true").lower() == "true"
+
+# margin→sigmoid 曲线：k 为斜率，base 为"可分"分界；无细节数据时乘以 NODETAIL_FACTOR
+CONF_SIGMOID_K = 12.0
+CONF_SIGMOID_BASE = 0.15
+NODETAIL_FACTOR = 0.92
+
+def apply_softmax_calibration(scores: List[float], temperature: float = None) -> List[float]:
+    """
+    Apply softmax calibration to convert raw similarity scores to probabilities
+    
+    Args:
+        scores: List of raw similarity scores
+        temperature: Temperature parameter (lower = sharper distribution)
+    
+    Returns:
+        List of calibrated probabilities
+    """
+    if temperature is None:
+        temperature = SOFTMAX_TEMPERATURE
+    
+    if not scores:
+        return []
+    
+    # Apply temperature scaling
+    scaled_scores = [score / temperature for score in scores]
+    
+    # Compute softmax
+    max_score = max(scaled_scores)
+    exp_scores = [np.exp(score - max_score) for score in scaled_scores]
+    sum_exp_scores = sum(exp_scores)
+    
+    # Normalize to probabilities
+    probabilities = [exp_score / sum_exp_scores for exp_score in exp_scores]
+    
+    return probabilities
+
+def confidence_from_margin(margin, has_detail, factors: Sequence[float] = (),
+                           k: float = CONF_SIGMOID_K, base: float = CONF_SIGMOID_BASE):
+    """margin→sigmoid 置信度，依次乘以 factors（一致性 / 连续性 / 内容匹配），再按 margin 动态上限截断
+
+    margin / has_detail 可以是标量或等长数组（离线参数扫描按批计算）。
+    """
+    margin = np.asarray(margin, dtype=np.float64)
+    conf = 1/(1 + np.exp(-k*(margin - base)))
+    conf = np.where(has_detail, conf, conf * NODETAIL_FACTOR)
+    for f in factors:
+        conf = conf * f
+    # 🔧 FIX: 移除硬编码的0.98上限，使用动态上限
+    # 基于margin动态调整上限：高margin时允许95%，中等margin 90%，低margin限制在80%
+    max_conf = np.where(margin > 0.5, 0.95, np.where(margin > 0.2, 0.90, 0.80))
+    return np.clip(conf, 0.20, max_conf)
+
+def calibrate_confidence(margin, has_detail, struct_top1, detail_top1, same_as_last, content_match,
+                         k: float = CONF_SIGMOID_K, base: float = CONF_SIGMOID_BASE):
+    """温和的置信度标定，避免"先拉满再腰斩" """
+    # 一致性：没有 top1 的时候不要给 1.15
+    if struct_top1 and detail_top1:
+        if struct_top1 == detail_top1:
+            cons = 1.15
+        elif are_neighbors(struct_top1, detail_top1):
+            cons = 1.05
+        else:
+            cons = 0.92
+    else:
+        cons = 0.95
+
+    cont = 1.10 if same_as_last else 1.00
+
+    # 内容匹配放最后，用温和乘法（≥0.75 下限）
+    conf = float(confidence_from_margin(margin, has_detail, (cons, cont, max(0.75, float(content_match or 1.0))),
+                                        k=k, base=base))
+
+    # 低置信度不更新会话，避免"定位抖动"
+    if conf < 0.35:
+        return conf, False   # False=不要 update_session
+    return conf, True
+
+def are_neighbors(node1, node2):
+    """检查两个节点是否为邻居（简化版）"""
+    # TODO: 实现真实的拓扑邻居检查
+    return False  # 暂时返回False，避免错误
+
+def calculate_calibrated_confidence_and_margin(candidates: List[Dict], top_k: int = 5,
+                                               site_id: Optional[str] = None) -> tuple:
+    """融合分数 top1 / top2 → (confidence, margin, top1_score, top2_score)
+
+    margin = max(0, top1 - top2)。站点有离线拟合的标定表（calibration_tables）时，
+    confidence 为该站点在此 margin 下实测的 Top-1 命中率（np.interp 查表）；
+    否则用 calibrate_confidence 的 sigmoid 映射（无 top1 一致性信息，连续性由 apply_continuity_boost 处理）。
+    """
+    if not candidates or len(candidates) < 2:
+        return 0.0, 0.0, 0.0, 0.0
+    
+    top1_score = float(candidates[0]["score"])
+    top2_score = float(candidates[1]["score"])
+    margin = max(0.0, top1_score - top2_score)
+    
+    table = CALIBRATION_TABLES.get(site_id) if site_id else None
+    if table is not None:
+        confidence = table(margin)
+    else:
+        has_detail = candidates[0].get("has_detail", False)
+        confidence, _ = calibrate_confidence(margin, has_detail, None, None, True, 1.0)
+    
+    log.debug("calibration: top1=%.4f top2=%.4f margin=%.4f confidence=%.4f table=%s",
+              top1_score, top2_score, margin, confidence, table.method if table is not None else "-")
+    return confidence, margin, top1_score, top2_score
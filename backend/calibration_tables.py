@@ -0,0 +1,288 @@
+"""
+Per-site monotone calibration tables (margin → measured Top-1 accuracy)
+按站点的单调标定表：把融合后的 top1-top2 margin 映射为该站点在此 margin 下实测的 Top-1 命中率。
+
+- 离线拟合（bench/fit_calibration.py）：从试验日志的 margin / hit_top1，或带标注语料的回放结果，
+  用保序回归（isotonic，PAV）或 Platt（一维逻辑回归）拟合，得到若干 (margin, confidence) 节点
+- 运行时：np.interp 在节点间线性插值（超出范围取端点值），标量或数组均可
+- 版本：表中记录拟合时站点结构 / 细节数据文件的内容指纹（data_version）；
+  数据文件变化后旧表不再使用，回退到 calibration.calibrate_confidence 的 sigmoid 映射，直到重新拟合
+
+表文件默认放在 data/calibration/<site_id>.json，也可以在站点清单的 index 中声明 "calibration": <文件>。
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from scene_registry import DATA_DIR, SceneRegistry, SiteSpec, source_stamp
+from structured_log import get_logger
+
+log = get_logger("calibration")
+
+TABLE_FORMAT = "textnavi.calibration"
+TABLE_VERSION = 1
+CALIBRATION_DIR = os.getenv("CALIBRATION_DIR", os.path.join(DATA_DIR, "calibration"))
+ENABLE_CALIBRATION_TABLES = os.getenv("CALIBRATION_TABLES", "true").lower() == "true"
+CHECK_INTERVAL_S = 2.0          # 两次检查表文件 / 数据文件是否变化的最小间隔
+METHODS = ("isotonic", "platt")
+PLATT_KNOTS = 41                # Platt 曲线在 [0, max margin] 上的采样节点数
+
+
+@dataclass(frozen=True, eq=False)
+class CalibrationTable:
+    site_id: str
+    margins: np.ndarray             # 严格递增
+    confidence: np.ndarray          # 非递减，位于 [0, 1]
+    method: str = "isotonic"
+    data_version: str = ""
+    samples: int = 0
+    hits: int = 0
+    meta: Dict[str, Any] = field(default_factory=dict)
+
+    def __post_init__(self):
+        xs = np.asarray(self.margins, dtype=np.float64)
+        ys = np.asarray(self.confidence, dtype=np.float64)
+        if xs.ndim != 1 or xs.shape != ys.shape or xs.size == 0:
+            raise ValueError("calibration table needs matching, non-empty margin / confidence knots")
+        if np.any(np.diff(xs) <= 0) or np.any(np.diff(ys) < 0) or ys.min() < 0 or ys.max() > 1:
+            raise ValueError(f"calibration table for {self.site_id} is not monotone")
+        xs.setflags(write=False)
+        ys.setflags(write=False)
+        object.__setattr__(self, "margins", xs)
+        object.__setattr__(self, "confidence", ys)
+
+    def __call__(self, margin):
+        """margin（标量或数组）→ confidence"""
+        out = np.interp(margin, self.margins, self.confidence)
+        return float(out) if np.ndim(out) == 0 else out
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"format": TABLE_FORMAT, "version": TABLE_VERSION, "site_id": self.site_id, "method": self.method,
+                "data_version": self.data_version, "samples": self.samples, "hits": self.hits,
+                "margins": [float(x) for x in self.margins],
+                "confidence": [float(y) for y in self.confidence], **self.meta}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "CalibrationTable":
+        if d.get("format") != TABLE_FORMAT:
+            raise ValueError(f"not a calibration table: format={d.get('format')!r}")
+        known = {"format", "version", "site_id", "method", "data_version", "samples", "hits", "margins", "confidence"}
+        return cls(site_id=d["site_id"], margins=d["margins"], confidence=d["confidence"],
+                   method=d.get("method", "isotonic"), data_version=d.get("data_version", ""),
+                   samples=int(d.get("samples", 0)), hits=int(d.get("hits", 0)),
+                   meta={k: v for k, v in d.items() if k not in known})
+
+
+# ---------- 拟合 ----------
+
+def _samples(margins, hits) -> Tuple[np.ndarray, np.ndarray]:
+    x = np.asarray(margins, dtype=np.float64)
+    y = np.asarray(hits, dtype=np.float64)
+    keep = np.isfinite(x)
+    x, y = np.maximum(x[keep], 0.0), y[keep]
+    if x.size == 0:
+        raise ValueError("no calibration samples")
+    return x, y
+
+
+def fit_isotonic(margins, hits, prior: float = 1.0) -> Tuple[np.ndarray, np.ndarray]:
+    """保序回归（pool adjacent violators）：返回 (节点 margin, 节点 confidence)
+
+    相同 margin 先合并，均值不升的相邻块也合并；每个单调块取其样本的平均 margin 作为节点，命中率向整体命中率做 prior 个样本的收缩，
+    避免样本很少的块给出 0 或 1。
+    """
+    x, y = _samples(margins, hits)
+    ux, inv = np.unique(x, return_inverse=True)
+    weight = np.bincount(inv).astype(np.float64)
+    total = np.bincount(inv, weights=y)
+    blocks = []   # [命中数, 样本数, margin 之和]
+    for s, w, m in zip(total, weight, ux * weight):
+        blocks.append([s, w, m])
+        while len(blocks) > 1 and blocks[-2][0] / blocks[-2][1] >= blocks[-1][0] / blocks[-1][1]:
+            s2, w2, m2 = blocks.pop()
+            blocks[-1][0] += s2
+            blocks[-1][1] += w2
+            blocks[-1][2] += m2
+    base_rate = float(y.mean())
+    b = np.asarray(blocks)
+    xs = b[:, 2] / b[:, 1]
+    ys = np.maximum.accumulate((b[:, 0] + prior * base_rate) / (b[:, 1] + prior))
+    return xs, np.clip(ys, 0.0, 1.0)
+
+
+def fit_platt(margins, hits, knots: int = PLATT_KNOTS, iterations: int = 100) -> Tuple[np.ndarray, np.ndarray, Tuple[float, float]]:
+    """Platt 标定：confidence = sigmoid(a·margin + b)，牛顿法拟合（使用 Platt 的平滑目标值）
+
+    a 被限制为非负以保证单调。返回 (节点 margin, 节点 confidence, (a, b))。
+    """
+    x, y = _samples(margins, hits)
+    n_pos = float(y.sum())
+    n_neg = float(y.size - n_pos)
+    t = np.where(y > 0.5, (n_pos + 1) / (n_pos + 2), 1 / (n_neg + 2))
+    a, b = 0.0, float(np.log((n_pos + 1) / (n_neg + 1)))
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(-(a * x + b)))
+        w = p * (1 - p) + 1e-12
+        g = np.array([np.sum((p - t) * x), np.sum(p - t)])
+        h = np.array([[np.sum(w * x * x) + 1e-9, np.sum(w * x)], [np.sum(w * x), np.sum(w) + 1e-9]])
+        step = np.linalg.solve(h, g)
+        a, b = a - step[0], b - step[1]
+        if np.max(np.abs(step)) < 1e-10:
+            break
+    if a < 0:
+        a, b = 0.0, float(np.log((n_pos + 1) / (n_neg + 1)))
+    xs = np.linspace(0.0, max(float(x.max()), 1e-3), knots)
+    return xs, 1 / (1 + np.exp(-(a * xs + b))), (float(a), float(b))
+
+
+def fit_table(site_id: str, margins, hits, method: str = "isotonic", data_version: str = "",
+              **meta) -> CalibrationTable:
+    """拟合一个站点的标定表"""
+    x, y = _samples(margins, hits)
+    if method == "isotonic":
+        xs, ys = fit_isotonic(x, y)
+    elif method == "platt":
+        xs, ys, (a, b) = fit_platt(x, y)
+        meta = dict(meta, platt={"a": round(a, 6), "b": round(b, 6)})
+    else:
+        raise ValueError(f"unknown calibration method: {method} (expected one of {', '.join(METHODS)})")
+    brier = float(np.mean((np.interp(x, xs, ys) - y) ** 2))
+    return CalibrationTable(site_id, xs, ys, method, data_version, int(y.size), int(y.sum()),
+                            meta=dict(meta, brier=round(brier, 6), fitted=datetime.utcnow().isoformat() + "Z"))
+
+
+def save_table(table: CalibrationTable, path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(table.to_dict(), f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def load_table(path: str) -> CalibrationTable:
+    with open(path, "r", encoding="utf-8") as f:
+        return CalibrationTable.from_dict(json.load(f))
+
+
+# ---------- 数据版本与运行时加载 ----------
+
+_VERSION_CACHE: Dict[Tuple, str] = {}
+_VERSION_LOCK = threading.Lock()
+
+
+def scene_data_version(spec: SiteSpec) -> str:
+    """站点结构 / 细节数据文件内容的指纹（按文件 mtime / 大小缓存，不重复读文件）"""
+    files = tuple(f for f in (spec.structure_file, spec.detail_file) if f)
+    stamp = source_stamp(files)
+    with _VERSION_LOCK:
+        cached = _VERSION_CACHE.get(stamp)
+    if cached is not None:
+        return cached
+    h = hashlib.sha256()
+    for path in files:
+        h.update(os.path.basename(path).encode("utf-8") + b"\0")
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 16), b""):
+                    h.update(chunk)
+        except OSError:
+            h.update(b"<missing>")
+    version = h.hexdigest()[:16]
+    with _VERSION_LOCK:
+        _VERSION_CACHE[stamp] = version
+    return version
+
+
+class CalibrationTables:
+    """按站点懒加载标定表；表文件或站点数据文件变化后自动重新加载 / 作废"""
+
+    def __init__(self, registry: Optional[SceneRegistry] = None, table_dir: str = CALIBRATION_DIR,
+                 enabled: bool = ENABLE_CALIBRATION_TABLES, check_interval_s: float = CHECK_INTERVAL_S):
+        self.registry = registry
+        self.table_dir = table_dir
+        self.enabled = enabled
+        self.check_interval_s = check_interval_s
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, Tuple, Optional[CalibrationTable]]] = {}
+
+    def attach(self, registry: SceneRegistry):
+        """使用服务的 SceneRegistry（站点清单与数据目录）"""
+        with self._lock:
+            self.registry = registry
+            self._entries.clear()
+
+    def site_registry(self) -> SceneRegistry:
+        if self.registry is None:
+            self.registry = SceneRegistry()
+        return self.registry
+
+    def path_for(self, site_id: str) -> str:
+        declared = self.site_registry().index_file(site_id, "calibration")
+        return declared or os.path.join(self.table_dir, f"{site_id}.json")
+
+    def get(self, site_id: Optional[str]) -> Optional[CalibrationTable]:
+        """站点当前可用的标定表；没有表、表无效或数据已变化时返回 None"""
+        if not self.enabled or not site_id:
+            return None
+        now = time.monotonic()
+        entry = self._entries.get(site_id)
+        if entry is not None and now - entry[0] < self.check_interval_s:
+            return entry[2]
+        with self._lock:
+            path = self.path_for(site_id)
+            spec = self.site_registry().spec(site_id)
+            data_files = (spec.structure_file, spec.detail_file) if spec else ()
+            stamp = source_stamp((path,) + data_files)
+            if entry is not None and entry[1] == stamp:
+                self._entries[site_id] = (now, stamp, entry[2])
+                return entry[2]
+            table = self._load(site_id, path, spec)
+            self._entries[site_id] = (now, stamp, table)
+            return table
+
+    def _load(self, site_id: str, path: str, spec: Optional[SiteSpec]) -> Optional[CalibrationTable]:
+        if not os.path.exists(path):
+            return None
+        try:
+            table = load_table(path)
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("invalid calibration table %s: %s", path, e)
+            return None
+        if table.site_id != site_id:
+            log.warning("calibration table %s is for site %s, not %s", path, table.site_id, site_id)
+            return None
+        if spec is not None and table.data_version and table.data_version != scene_data_version(spec):
+            log.warning("calibration table for %s was fit on data %s; scene data changed, using default mapping",
+                        site_id, table.data_version)
+            return None
+        log.info("calibration table loaded", extra={"fields": {
+            "site_id": site_id, "method": table.method, "knots": int(table.margins.size),
+            "samples": table.samples, "data_version": table.data_version}})
+        return table
+
+    def status(self) -> Dict[str, Optional[Dict[str, Any]]]:
+        """已检查过的站点及其表的概要（/api/health 等使用）"""
+        return {site_id: ({"method": t.method, "samples": t.samples, "data_version": t.data_version}
+                          if t is not None else None)
+                for site_id, (_, _, t) in sorted(self._entries.items())}
+
+
+CALIBRATION_TABLES = CalibrationTables()
+
+
+def fit_samples_by_site(samples: Sequence[Tuple[str, float, bool]]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """[(site_id, margin, hit)] → {site_id: (margins, hits)}"""
+    by_site: Dict[str, Tuple[list, list]] = {}
+    for site_id, margin, hit in samples:
+        xs, ys = by_site.setdefault(site_id, ([], []))
+        xs.append(float(margin))
+        ys.append(1.0 if hit else 0.0)
+    return {s: (np.asarray(xs), np.asarray(ys)) for s, (xs, ys) in by_site.items()}
@@ -0,0 +1,90 @@
+"""
+Offline caption cache keyed by image content
+按图片内容（sha256）查找录制过的 BLIP caption。
+
+缓存来自 bench/caption_corpus.py 从试验日志抽取的语料（每条记录可带 image_sha256 列表）。
+设置 CAPTION_CACHE=<语料文件>[,<语料文件>...] 后，hf_caption 命中缓存时直接返回录制的 caption，
+离线实验和基准回放同一批照片时不必再在 CPU 上跑 BLIP。
+"""
+
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, Iterable, Optional
+
+CAPTION_CACHE = os.getenv("CAPTION_CACHE", "")
+
+
+def image_digest(data: bytes) -> str:
+    """图片字节的 sha256（十六进制）"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class CaptionCache:
+    """sha256 → caption 的只读映射；同一张图片在多个文件中出现时以先加载的为准"""
+
+    def __init__(self, captions: Optional[Dict[str, str]] = None):
+        self._captions = dict(captions or {})
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_files(cls, paths: Iterable[str]) -> "CaptionCache":
+        cache = cls()
+        for path in paths:
+            cache.load(path)
+        return cache
+
+    def load(self, path: str) -> int:
+        """读取语料 jsonl 中带 image_sha256 的记录，返回新增的图片数"""
+        added = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                row = json.loads(line)
+                caption = row.get("caption")
+                if not caption:
+                    continue
+                for digest in row.get("image_sha256") or []:
+                    if digest not in self._captions:
+                        self._captions[digest] = caption
+                        added += 1
+        return added
+
+    def lookup(self, digest: str) -> Optional[str]:
+        caption = self._captions.get(digest)
+        with self._lock:
+            if caption is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return caption
+
+    def get(self, image_bytes: bytes) -> Optional[str]:
+        """按图片字节查 caption；未命中返回 None"""
+        return self.lookup(image_digest(image_bytes))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"images": len(self._captions), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        return len(self._captions)
+
+
+def load_caption_cache(spec: str = CAPTION_CACHE) -> Optional[CaptionCache]:
+    """按 CAPTION_CACHE（逗号分隔的文件列表）加载；未配置时返回 None"""
+    paths = [p.strip() for p in (spec or "").split(",") if p.strip()]
+    return CaptionCache.from_files(paths) if paths else None
@@ -0,0 +1,146 @@
+"""
+Inverted index over detail records (detail channel)
+细节通道倒排索引：把细节记录的打分规则在加载时预处理成 词 → 记录 的倒排表与逐记录的带权词序列，
+检索时只对与 caption 有共同词的记录打分，代价随命中数增长而不是随语料规模增长。
+
+打分规则与 EnhancedDualChannelRetriever._calculate_detail_score 完全一致（逐项相加顺序相同，结果逐位相等）：
+1. nl_text 中每个词（按出现次数）若是 caption 的子串：空间概念词 +0.3，其它 +0.2
+2. struct_text 按 ";" 切分的每个特征，只要其中任一词是 caption 的子串：+0.15
+3. spatial_info 中每个地标，只要其中任一词是 caption 的子串：+0.1
+4. caption 含空间概念短语且记录文本含相关词：+0.2（只加一次）
+最终分数上限 1.0。
+
+词不含空白，所以"词是 caption 的子串"等价于"词是 caption 某个非空白片段的子串"；
+检索时枚举 caption 各片段的全部子串与词表求交，即可得到全部命中词。
+"""
+
+import heapq
+from typing import AbstractSet, Any, Dict, List, Optional, Sequence, Set, Tuple
+
+NL_SPACE_WORDS = ("open", "space", "area", "large", "atrium", "cluster")
+NL_SPACE_WEIGHT = 0.3
+NL_WEIGHT = 0.2
+STRUCT_FEATURE_WEIGHT = 0.15
+SPATIAL_WEIGHT = 0.1
+SPACE_CONCEPT_WEIGHT = 0.2
+
+# caption 中的空间概念短语 → 记录文本中的相关词（按顺序检查）
+SPACE_CONCEPTS = (
+    ("large open space", ("open", "space", "large", "area", "atrium", "cluster")),
+    ("open space", ("open", "space", "area", "atrium")),
+    ("open area", ("open", "area", "space", "atrium")),
+    ("atrium", ("atrium", "open", "space", "area")),
+)
+
+
+class _RecordTerms:
+    """单条细节记录预处理后的带权词序列"""
+    __slots__ = ("nl_terms", "struct_features", "spatial_landmarks", "concepts")
+
+    def __init__(self, item: Dict[str, Any]):
+        nl_text = (item.get("nl_text") or "").lower()
+        struct_text = (item.get("struct_text") or "").lower()
+
+        # 保留出现顺序和重复次数，保证与逐词累加的结果逐位相等
+        self.nl_terms: Tuple[Tuple[str, float], ...] = tuple(
+            (w, NL_SPACE_WEIGHT if any(s in w for s in NL_SPACE_WORDS) else NL_WEIGHT)
+            for w in nl_text.split()
+        )
+        self.struct_features: Tuple[Tuple[str, ...], ...] = tuple(
+            tuple(feature.split()) for feature in struct_text.split(";") if feature.strip()
+        )
+        spatial_info = item.get("spatial_info") or {}
+        self.spatial_landmarks: Tuple[Tuple[str, ...], ...] = tuple(
+            tuple(str(landmark).split()) for landmark in spatial_info.values() if landmark
+        )
+        detail_text = f"{nl_text} {struct_text}"
+        self.concepts: frozenset = frozenset(
+            concept for concept, keywords in SPACE_CONCEPTS if any(k in detail_text for k in keywords)
+        )
+
+    def tokens(self) -> Set[str]:
+        out = {w for w, _ in self.nl_terms}
+        for words in self.struct_features + self.spatial_landmarks:
+            out.update(words)
+        return out
+
+    def score(self, matched: Set[str], caption_concepts: Sequence[str]) -> float:
+        score = 0.0
+        for w, weight in self.nl_terms:
+            if w in matched:
+                score += weight
+        for words in self.struct_features:
+            if any(w in matched for w in words):
+                score += STRUCT_FEATURE_WEIGHT
+        for words in self.spatial_landmarks:
+            if any(w in matched for w in words):
+                score += SPATIAL_WEIGHT
+        for concept in caption_concepts:
+            if concept in self.concepts:
+                score += SPACE_CONCEPT_WEIGHT
+                break
+        return min(1.0, score)
+
+
+class DetailIndex:
+    """细节记录倒排索引（只读，可在线程间共享）"""
+
+    def __init__(self, records: Sequence[Dict[str, Any]]):
+        self.records = tuple(records)
+        self._terms = [_RecordTerms(item) for item in self.records]
+        postings: Dict[str, List[int]] = {}
+        for i, terms in enumerate(self._terms):
+            for token in terms.tokens():
+                postings.setdefault(token, []).append(i)
+        self.postings: Dict[str, Tuple[int, ...]] = {k: tuple(v) for k, v in postings.items()}
+        self.concept_postings: Dict[str, Tuple[int, ...]] = {
+            concept: tuple(i for i, t in enumerate(self._terms) if concept in t.concepts)
+            for concept, _ in SPACE_CONCEPTS
+        }
+        self.max_token_len = max((len(t) for t in self.postings), default=0)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def matched_tokens(self, caption_lower: str) -> Set[str]:
+        """caption 中出现（作为子串）的全部索引词"""
+        matched = set()
+        postings = self.postings
+        max_len = self.max_token_len
+        for piece in caption_lower.split():
+            n = len(piece)
+            for i in range(n):
+                for j in range(i + 1, min(n, i + max_len) + 1):
+                    sub = piece[i:j]
+                    if sub in postings:
+                        matched.add(sub)
+        return matched
+
+    def score_matches(self, caption_lower: str) -> Dict[int, float]:
+        """只对与 caption 有共同词（或空间概念）的记录打分：记录下标 → 分数（均 > 0）"""
+        matched = self.matched_tokens(caption_lower)
+        caption_concepts = [c for c, _ in SPACE_CONCEPTS if c in caption_lower]
+        candidates: Set[int] = set()
+        for token in matched:
+            candidates.update(self.postings[token])
+        for concept in caption_concepts:
+            candidates.update(self.concept_postings[concept])
+        return {i: self._terms[i].score(matched, caption_concepts) for i in candidates}
+
+    def top_k(self, caption_lower: str, k: int, eligible: Optional[AbstractSet[int]] = None) -> List[Tuple[int, float]]:
+        """按分数降序返回前 k 条 (记录下标, 分数)；同分按文件顺序
+
+        eligible: 允许返回的记录下标集合。命中不足 k 条时按文件顺序补 0 分记录，
+        与"全部打分后稳定排序再截断"的结果一致。
+        """
+        scores = self.score_matches(caption_lower)
+        if eligible is not None:
+            scores = {i: s for i, s in scores.items() if i in eligible}
+        # 键 (分数, -下标)：同分时下标小（文件靠前）的优先，无需先对全部命中排序
+        hits = heapq.nlargest(k, scores.items(), key=lambda x: (x[1], -x[0]))
+        i = 0
+        while len(hits) < k and i < len(self.records):
+            if i not in scores and (eligible is None or i in eligible):
+                hits.append((i, 0.0))
+            i += 1
+        return hits
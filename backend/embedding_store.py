@@ -0,0 +1,152 @@
+"""
+Memory-mapped embedding index format
+向量索引的存储格式：每个矩阵一个未压缩的 float32 .npy 文件，外加一个 JSON 侧车文件（.meta.json）
+记录格式版本、矩阵文件/形状/类型以及 ids、texts 等元数据。
+
+加载时用 np.load(mmap_mode="r") 直接映射文件：不解压、不反序列化 pickle，
+多个 uvicorn worker 打开同一索引时共享页缓存，启动耗时与每个进程的常驻内存都不随站点数线性增长。
+
+侧车格式（version 1）：
+    {
+      "format": "textnavi.embeddings",
+      "version": 1,
+      "arrays": {"X": {"file": "SCENE_A_MS.X.npy", "shape": [16, 384], "dtype": "float32"}},
+      "items": [...],          # 每行对应的 id 记录
+      "texts": [...]           # 每行对应的文本（可选）
+    }
+
+旧的 .npz（savez_compressed + allow_pickle）格式仍可通过 load_legacy_npz 读取，
+python embedding_store.py <scene.npz> [<scene.ids.json>] 可把旧格式转换为新格式。
+"""
+
+import os
+import sys
+import json
+import tempfile
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+FORMAT_NAME = "textnavi.embeddings"
+FORMAT_VERSION = 1
+META_SUFFIX = ".meta.json"
+
+
+@dataclass
+class EmbeddingIndex:
+    """打开后的向量索引：arrays 中的矩阵为只读内存映射（旧格式为普通数组）"""
+    arrays: Dict[str, np.ndarray]
+    items: List[Any] = field(default_factory=list)
+    texts: List[str] = field(default_factory=list)
+    meta: Dict[str, Any] = field(default_factory=dict)
+    path: str = ""
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+
+def meta_path_for(prefix: str) -> str:
+    """索引前缀（如 models/SCENE_A_MS）→ 侧车文件路径"""
+    return prefix if prefix.endswith(META_SUFFIX) else prefix + META_SUFFIX
+
+
+def _atomic_write(path: str, write):
+    """先写同目录临时文件再 os.replace，读者不会看到写了一半的文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".tmp_", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.chmod(tmp, 0o644)    # mkstemp 默认 0600，其他用户运行的 worker 也需要能读
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def save_embedding_index(prefix: str, arrays: Dict[str, np.ndarray], items: Optional[List[Any]] = None,
+                         texts: Optional[List[str]] = None, **extra) -> str:
+    """写出新格式索引，返回侧车文件路径
+
+    矩阵先写、侧车最后写：侧车一旦替换成功，它引用的 .npy 均已就位。
+    """
+    meta_path = meta_path_for(prefix)
+    base = meta_path[:-len(META_SUFFIX)]
+    directory = os.path.dirname(os.path.abspath(meta_path))
+    entries = {}
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr, dtype=np.float32)
+        filename = f"{os.path.basename(base)}.{name}.npy"
+        _atomic_write(os.path.join(directory, filename), lambda f, a=arr: np.save(f, a, allow_pickle=False))
+        entries[name] = {"file": filename, "shape": list(arr.shape), "dtype": str(arr.dtype)}
+
+    meta = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "arrays": entries,
+            "items": list(items or []), "texts": list(texts or [])}
+    meta.update(extra)
+    payload = json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8")
+    _atomic_write(meta_path, lambda f: f.write(payload))
+    return meta_path
+
+
+def open_embedding_index(path: str, mmap: bool = True) -> EmbeddingIndex:
+    """打开新格式索引（path 为侧车文件或索引前缀）；格式/版本/形状不符时抛出 ValueError"""
+    meta_path = meta_path_for(path)
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("format") != FORMAT_NAME:
+        raise ValueError(f"not an embedding index: {meta_path}")
+    if meta.get("version") != FORMAT_VERSION:
+        raise ValueError(f"unsupported embedding index version {meta.get('version')} in {meta_path}")
+
+    directory = os.path.dirname(os.path.abspath(meta_path))
+    arrays = {}
+    for name, entry in meta.get("arrays", {}).items():
+        arr = np.load(os.path.join(directory, entry["file"]), mmap_mode="r" if mmap else None, allow_pickle=False)
+        if list(arr.shape) != list(entry["shape"]) or str(arr.dtype) != entry["dtype"]:
+            raise ValueError(f"{entry['file']}: expected {entry['shape']} {entry['dtype']}, "
+                             f"found {list(arr.shape)} {arr.dtype}")
+        arrays[name] = arr
+    return EmbeddingIndex(arrays=arrays, items=meta.get("items", []), texts=meta.get("texts", []),
+                          meta=meta, path=meta_path)
+
+
+def load_legacy_npz(npz_path: str, ids_path: Optional[str] = None) -> EmbeddingIndex:
+    """读取旧的 .npz 索引（解压到进程私有内存，需要 allow_pickle 读取 texts）"""
+    npz = np.load(npz_path, allow_pickle=True)
+    arrays, texts = {}, []
+    for name in npz.files:
+        if npz[name].dtype == object:
+            texts = [str(t) for t in npz[name].tolist()]
+        else:
+            arrays[name] = npz[name].astype(np.float32)
+    items = []
+    if ids_path and os.path.exists(ids_path):
+        with open(ids_path, "r", encoding="utf-8") as f:
+            items = json.load(f)
+    return EmbeddingIndex(arrays=arrays, items=items, texts=texts, path=npz_path)
+
+
+def convert_legacy_npz(npz_path: str, ids_path: Optional[str] = None, prefix: Optional[str] = None) -> str:
+    """旧 .npz（+ .ids.json）→ 新格式，返回侧车文件路径"""
+    legacy = load_legacy_npz(npz_path, ids_path)
+    prefix = prefix or os.path.splitext(npz_path)[0]
+    return save_embedding_index(prefix, legacy.arrays, legacy.items, legacy.texts)
+
+
+def main(argv: List[str]) -> int:
+    if not argv:
+        print("usage: python embedding_store.py <index.npz> [<index.ids.json>]")
+        return 2
+    npz_path = argv[0]
+    ids_path = argv[1] if len(argv) > 1 else os.path.splitext(npz_path)[0] + ".ids.json"
+    meta_path = convert_legacy_npz(npz_path, ids_path)
+    index = open_embedding_index(meta_path)
+    shapes = {k: tuple(v.shape) for k, v in index.arrays.items()}
+    print(f"✅ {npz_path} → {meta_path} {shapes}, {len(index.items)} items")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,694 @@
+"""
+Enhanced dual-channel retriever (structure channel + detail channel + logit fusion)
+从 app.py 中拆出的增强双通道检索器。检索器本身不再保存任何按请求变化的状态：
+- 场景数据来自 SceneRegistry（按站点只读缓存）
+- 会话级的连续识别状态（RetrievalState）由调用方显式传入
+因此同一个实例可以在线程池中并发处理不同站点、不同会话的请求。
+"""
+
+import os
+
+import numpy as np
+
+import fusion_kernel
+from scene_registry import SceneRegistry, RetrievalState
+from pipeline_timing import stage
+from query_filters import NEGATIVE_PENALTY, negative_hits, stable_query
+from semantic_groups import group_key, semantic_group
+from structured_log import get_logger, trace_event, trace_enabled
+
+log = get_logger("retriever")
+
+# 通道对齐方式：node = 细节分数按节点聚合后经别名表与结构节点对齐；index = 旧的按列表位置配对
+FUSION_ALIGNMENT = os.getenv("FUSION_ALIGNMENT", "node").lower()
+# 同一节点多条细节记录的聚合方式：max | lse (log-sum-exp)
+DETAIL_AGGREGATION = os.getenv("DETAIL_AGGREGATION", "max").lower()
+# 词法打分器：heuristic = 原关键词计数规则；bm25 = 加载时预计算的 BM25F 索引（结构/细节两个通道）
+LEXICAL_SCORER = os.getenv("LEXICAL_SCORER", "heuristic").lower()
+
+
+# 🔧 ENHANCED: Create an enhanced dual-channel retriever with improved fusion strategy
+class EnhancedDualChannelRetriever:
+    def __init__(self, registry: SceneRegistry = None, alignment: str = None, detail_aggregation: str = None,
+                 lexical_scorer: str = None):
+        self.structure_tau = 0.15  # 结构通道温度（提高，让分布更平衡）
+        self.detail_tau = 0.20     # 细节通道温度（提高，让分布更平衡）
+        self.alpha = 0.35          # 结构通道权重（进一步降低，减少宽泛索引词影响）
+        self.beta = 0.65           # 细节通道权重（进一步提高，增强内容匹配）
+        self.gamma = 0.15          # 连续性boost权重（适中，避免过度影响）
+        self.sharpen_tau = 0.25    # 融合后二次锐化温度（从0.10提升到0.25）
+        self.alignment = (alignment or FUSION_ALIGNMENT).lower()
+        self.detail_aggregation = (detail_aggregation or DETAIL_AGGREGATION).lower()
+        self.lexical_scorer = (lexical_scorer or LEXICAL_SCORER).lower()
+        
+        # 场景数据由注册表按站点懒加载，检索器只读
+        self.registry = registry or SceneRegistry()
+        
+        log.info("enhanced dual-channel retriever initialized", extra={"fields": {
+            "structure_tau": self.structure_tau, "detail_tau": self.detail_tau,
+            "alpha": self.alpha, "beta": self.beta, "gamma": self.gamma, "sharpen_tau": self.sharpen_tau,
+            "alignment": self.alignment, "detail_aggregation": self.detail_aggregation,
+            "lexical_scorer": self.lexical_scorer}})
+    
+    def _get_node_neighbors(self, scene, node_id):
+        """获取节点的邻居列表"""
+        return scene.neighbors(node_id) if scene is not None else ()
+    
+    def _are_neighbors(self, scene, node1, node2):
+        """检查两个节点是否为邻居"""
+        if not node1 or not node2:
+            return False
+        if node1 == node2:
+            return True
+        return node2 in self._get_node_neighbors(scene, node1)
+    
+    def _get_previous_location(self, state=None):
+        """获取上一帧位置（简化实现）"""
+        # TODO: 从会话历史中获取
+        return None
+    
+    def _channel_calibration(self, scores, tau):
+        """步骤A：通道内校准 - 温度化softmax（增强版）"""
+        return fusion_kernel.calibrate(scores, tau).tolist()
+    
+    def _conflict_gate(self, alpha, beta, struct_logit, detail_logit, gap=0.5):
+        """冲突门控函数：局部返回值，不修改全局权重"""
+        return fusion_kernel.conflict_gate(alpha, beta, struct_logit, detail_logit, gap)
+    
+    def _safe_sharpen(self, probs, tau=0.10):
+        """🔧 FIX: 修复过度极端的二次锐化"""
+        try:
+            return fusion_kernel.safe_sharpen(probs, tau).tolist()
+        except Exception as e:
+            log.warning("safe sharpen failed, using raw probs: %s", e)
+            return probs  # 失败时返回原始概率
+    
+    def _calculate_channel_entropy(self, probabilities):
+        """计算通道熵（分布尖锐度）"""
+        return fusion_kernel.channel_entropy(probabilities)
+    
+    def _adaptive_weights(self, struct_entropy, detail_entropy):
+        """根据通道熵自适应调整权重（标准公式实现）"""
+        return fusion_kernel.adaptive_weights(struct_entropy, detail_entropy)
+    
+    def _fusion_inputs(self, struct_candidates, detail_candidates, caption, scene, state=None):
+        """融合内核的输入：反证惩罚（原地修改结构候选分数）、细节对齐、连续性boost 与拓扑先验"""
+        # 🔧 反证惩罚 + 结构通道稳态词过滤（不污染原始文本）：
+        # 可移动物体正则在模块加载时编译好，这里只扫描一次 caption
+        stable_caption = stable_query(caption)  # 结构通道用稳态版本
+        
+        for struct_cand in struct_candidates:
+            hit = negative_hits(struct_cand, stable_caption)
+            if hit > 0:
+                log.debug("negative penalty: %s hits=%d", struct_cand['id'], hit)
+                struct_cand['score'] = struct_cand['score'] - hit * NEGATIVE_PENALTY
+        
+        # 提取分数（已应用反证惩罚）
+        struct_scores = [c['score'] for c in struct_candidates]
+        if self.alignment == "node":
+            # 细节分数按节点ID（经别名表）与结构候选对齐
+            detail_scores, top1_ids_differ = self._align_detail_to_nodes(struct_candidates, detail_candidates, scene)
+            aligned_detail = detail_scores
+        else:
+            detail_scores = [c['score'] for c in detail_candidates] if detail_candidates else [0.0] * len(struct_candidates)
+            top1_ids_differ = bool(detail_candidates) and struct_candidates[0]['id'] != detail_candidates[0]['id']
+            aligned_detail = [detail_candidates[i]["score"] if i < len(detail_candidates) else 0.0
+                              for i in range(len(struct_candidates))]
+        
+        # 连续性boost（γ*boost）与拓扑连续性prior按候选计算，其余运算交给向量化内核
+        boosts = [self._calculate_continuity_boost(c, caption, scene) for c in struct_candidates]
+        candidate_ids = [c['id'] for c in struct_candidates]
+        topo = fusion_kernel.topology_prior(
+            candidate_ids, self._get_previous_location(state),
+            lambda node_id: self._get_node_neighbors(scene, node_id))
+        return fusion_kernel.FusionInputs(candidate_ids, struct_scores, detail_scores, aligned_detail,
+                                          boosts, topo, bool(top1_ids_differ))
+    
+    def _enhanced_fusion(self, struct_candidates, detail_candidates, caption, scene, state=None):
+        """步骤B：增强的通道间融合（对数几率相加）+ 反证惩罚机制"""
+        if not struct_candidates:
+            return []
+        
+        try:
+            inputs = self._fusion_inputs(struct_candidates, detail_candidates, caption, scene, state)
+            boosts, aligned_detail = inputs.boosts, inputs.aligned_detail
+            
+            # 步骤A/B：通道内校准 → 自适应权重 → 冲突门控 → 对数几率融合 → 二次锐化
+            result = fusion_kernel.fuse(
+                inputs.struct_scores, inputs.detail_scores, boosts, inputs.topo_prior,
+                structure_tau=self.structure_tau, detail_tau=self.detail_tau, gamma=self.gamma,
+                top1_ids_differ=inputs.top1_ids_differ,
+                sharpen_tau=self.sharpen_tau,
+            )
+            if result.conflict:
+                log.debug("channel conflict: struct=%s detail=%s alpha %.3f->%.3f",
+                          struct_candidates[0]['id'], detail_candidates[0]['id'], result.alpha, result.alpha_final)
+            if result.sharpened is None:
+                log.warning("post-fusion sharpen failed, keeping fused probs")
+            final_scores = result.sharpened if result.sharpened is not None else result.fused_probs
+            
+            fusion_weights = {"alpha": result.alpha, "beta": result.beta, "gamma": self.gamma}
+            conflict_strategy = "conflict_gated" if result.conflict else "normal"
+            fused_candidates = []
+            for i, struct_cand in enumerate(struct_candidates):
+                # 创建融合后的候选
+                fused_cand = struct_cand.copy()
+                fused_cand["score"] = float(final_scores[i])
+                # 🔧 FIX: 保存原始的structure和detail分数
+                fused_cand["structure_score"] = struct_cand["score"]  # 修复字段名
+                fused_cand["detail_score"] = aligned_detail[i]
+                fused_cand["fusion_weights"] = dict(fusion_weights)
+                fused_cand["boost_value"] = boosts[i]
+                fused_cand["conflict_strategy"] = conflict_strategy
+                fused_candidates.append(fused_cand)
+            
+            if trace_enabled():
+                trace_event("fusion", alpha=round(result.alpha_final, 4), beta=round(result.beta_final, 4),
+                            conflict=result.conflict,
+                            struct_probs=[round(float(p), 4) for p in result.struct_probs[:3]],
+                            detail_probs=[round(float(p), 4) for p in result.detail_probs[:3]])
+            return fused_candidates
+            
+        except Exception as e:
+            log.warning("enhanced fusion failed: %s", e)
+            return struct_candidates  # 回退到结构通道
+    
+    def _calculate_continuity_boost(self, candidate, caption, scene):
+        """计算连续性boost值（γ*boost）- 增强版"""
+        try:
+            boost_value = 0.0
+            
+            # 1. 方向一致性boost（增强）
+            if hasattr(candidate, 'bearing_hint'):
+                bearing = candidate.get('bearing_hint', '')
+                if bearing and any(word in caption.lower() for word in bearing.split()):
+                    boost_value += 0.2  # 从0.1增加到0.2
+            
+            # 2. 拓扑合法性boost（增强）
+            if hasattr(candidate, 'topology_valid'):
+                if candidate.get('topology_valid', False):
+                    boost_value += 0.15  # 从0.05增加到0.15
+            
+            # 3. 空间关系一致性boost（增强）
+            spatial_relations = candidate.get('spatial_relations', {})
+            for relation, landmark in spatial_relations.items():
+                if landmark and any(word in caption.lower() for word in str(landmark).split()):
+                    boost_value += 0.1  # 从0.05增加到0.1
+            
+            # 4. 关键词匹配boost（新增）
+            caption_lower = caption.lower()
+            candidate_text = candidate.get('text', '').lower()
+            if candidate_text:
+                # 计算关键词匹配度
+                caption_words = set(caption_lower.split())
+                text_words = set(candidate_text.split())
+                overlap = len(caption_words & text_words)
+                if overlap > 0:
+                    boost_value += overlap * 0.05  # 每个匹配词+0.05
+            
+            # 5. 历史连续性boost（如果有session信息）
+            # 这里可以添加基于session历史的boost逻辑
+            
+            return min(0.5, boost_value)  # 从0.3增加到0.5，让boost有更大影响
+            
+        except Exception as e:
+            log.warning("continuity boost failed: %s", e)
+            return 0.0
+
+    def _pack_result(self, node_id, score, used_detail=None):
+        """统一返回值格式，确保永远返回三元组"""
+        return node_id, float(score), bool(used_detail) if used_detail is not None else False
+    
+    def _has_detail_data(self, scene):
+        """检查是否有可用的detail数据"""
+        return bool(scene is not None and scene.has_detail)
+    
+    def _get_detail_for_node(self, node_id, scene):
+        """获取特定节点的detail数据"""
+        if scene is None:
+            return []
+        return scene.details_for_hint(node_id)
+
+    def _channel_candidates(self, caption, scene, top_k, last_top1_id=None):
+        """两个通道各自的候选，以及本次是否有可用的细节数据（写入每个结构候选的 has_detail）"""
+        with stage("structure"):
+            struct_candidates = self._retrieve_from_structure_map(caption, scene, top_k, last_top1_id)
+        with stage("detail"):
+            if self.alignment == "node":
+                detail_candidates = self._retrieve_detail_by_node(caption, scene)
+            else:
+                detail_candidates = self._retrieve_from_detail_map(caption, scene, top_k)
+        
+        # 检查detail数据可用性
+        has_detail_data = self._has_detail_data(scene) and len(detail_candidates) > 0
+        
+        # 修复：为每个candidate添加has_detail标记
+        for candidate in struct_candidates:
+            candidate["has_detail"] = has_detail_data
+        return struct_candidates, detail_candidates, has_detail_data
+    
+    def fusion_inputs(self, caption, top_k=10, scene_filter=None, state=None):
+        """只跑两个通道，返回 (FusionInputs, has_detail)，不融合、不更新 state（离线参数扫描用）
+
+        场景未知或结构通道没有候选时返回 None。
+        """
+        scene = self.registry.get(scene_filter)
+        if scene is None:
+            return None
+        state = state or RetrievalState()
+        struct_candidates, detail_candidates, has_detail_data = self._channel_candidates(
+            caption, scene, top_k, state.last_top1_id)
+        if not struct_candidates:
+            return None
+        inputs = self._fusion_inputs(struct_candidates, detail_candidates, caption, scene, state)
+        return inputs, has_detail_data
+    
+    def retrieve(self, caption, top_k=10, scene_filter=None, state=None):
+        """增强双通道检索：使用改进的融合策略，返回候选列表
+        
+        state: 会话级 RetrievalState（可选）。检索过程中读取 last_top1_id 做多样性惩罚，
+        结束后原地更新 last_top1_id / repeat_count，由调用方负责持久化。
+        """
+        try:
+            scene = self.registry.get(scene_filter)
+            if scene is None:
+                log.warning("unknown scene: %s", scene_filter)
+                return []
+            
+            if state is None:
+                state = RetrievalState()
+            last_top1_id = state.last_top1_id
+            
+            # 步骤A：通道内校准 - 获取两个通道的候选
+            struct_candidates, detail_candidates, has_detail_data = self._channel_candidates(
+                caption, scene, top_k, last_top1_id)
+            
+            if not struct_candidates:
+                log.warning("no candidates from structure map: %s", scene_filter)
+                return []
+            
+            # 步骤B：通道间融合（对数几率相加）
+            with stage("fusion"):
+                fused_candidates = self._enhanced_fusion(
+                    struct_candidates, detail_candidates, caption, scene, state
+                )
+            
+            if not fused_candidates:
+                log.warning("fusion returned no candidates: %s", scene_filter)
+                return struct_candidates  # 回退到结构通道
+            
+            # 🔧 FIX: 添加多样性识别机制，避免总是识别同一个POI
+            # 检查是否连续多次识别同一个POI
+            current_top1_id = fused_candidates[0]['id']
+            repeat_count = state.advance(current_top1_id)
+            # 如果连续识别超过3次，降低该POI的分数
+            if repeat_count > 3:
+                log.debug("repeat top1 %s x%d, applying diversity penalty", current_top1_id, repeat_count)
+                for candidate in fused_candidates:
+                    if candidate['id'] == current_top1_id:
+                        candidate['score'] *= 0.7  # 降低30%分数
+                        break
+                # 重新排序
+                fused_candidates.sort(key=lambda x: x["score"], reverse=True)
+            
+            # 按融合分数排序
+            fused_candidates.sort(key=lambda x: x["score"], reverse=True)
+            
+            # 步骤C：输出置信度与margin（增强版）
+            top1_score = fused_candidates[0]['score']
+            top2_score = fused_candidates[1]['score'] if len(fused_candidates) > 1 else 0
+            
+            # 🔧 FIX: 改进confidence计算，避免过于固定
+            # 基于margin和top1_score的动态confidence计算
+            base_margin = top1_score - top2_score
+            
+            # 动态confidence：结合margin和top1_score
+            if base_margin > 0.3:  # 高margin时给予高confidence
+                confidence = min(0.95, top1_score * 0.9 + base_margin * 0.3)
+            elif base_margin > 0.1:  # 中等margin时给予中等confidence
+                confidence = min(0.85, top1_score * 0.8 + base_margin * 0.2)
+            else:  # 低margin时降低confidence
+                confidence = max(0.5, top1_score * 0.6 + base_margin * 0.1)
+            
+            # 增强margin计算：使用指数放大和连续性boost
+            # 连续性boost增强margin
+            top1_boost = fused_candidates[0].get('boost_value', 0.0)
+            margin_boost = top1_boost * 0.3  # boost对margin的贡献
+            
+            # 指数放大margin（让差异更明显）
+            enhanced_margin = base_margin * (1.0 + margin_boost)
+            if enhanced_margin > 0:
+                enhanced_margin = enhanced_margin ** 0.8  # 指数0.8，让差异更突出
+            
+            margin = enhanced_margin
+            
+            # 🔧 FIX: 更合理的confidence和margin范围
+            confidence = max(0.3, min(0.95, confidence))  # 允许更低的confidence
+            margin = max(0.02, min(0.9, margin))  # 允许更低的margin
+            
+            # 为每个候选添加confidence和margin信息
+            for i, candidate in enumerate(fused_candidates):
+                candidate["confidence"] = confidence if i == 0 else confidence * 0.8
+                candidate["margin"] = margin
+                candidate["retrieval_method"] = "enhanced_dual_channel_fusion"
+                candidate["has_detail"] = has_detail_data  # 添加detail可用性标记
+            
+            if trace_enabled():
+                trace_event("retrieve", site_id=scene_filter, caption=caption,
+                            struct_top=[c["id"] for c in struct_candidates[:3]],
+                            detail_top=[c["id"] for c in detail_candidates[:3]],
+                            top=[(c["id"], round(c["score"], 4)) for c in fused_candidates[:3]],
+                            base_margin=round(base_margin, 4), margin=round(margin, 4),
+                            confidence=round(confidence, 4), repeat_count=repeat_count,
+                            has_detail=has_detail_data)
+            
+            return fused_candidates
+            
+        except Exception as e:
+            log.warning("enhanced dual-channel retrieval failed: %s", e)
+            return []
+    
+    def _retrieve_from_structure_map(self, caption, scene, top_k, last_top1_id=None):
+        """从场景模型的结构节点中检索（结构通道）"""
+        try:
+            processed_nodes = scene.nodes
+            if not processed_nodes:
+                log.warning("no nodes found in %s", scene.structure_file)
+                return []
+            
+            # 计算每个节点的相似度分数
+            candidates = []
+            caption_lower = caption.lower()
+            bm25_scores = self._bm25_node_scores(scene, caption_lower, last_top1_id)
+            
+            for i, node in enumerate(processed_nodes):
+                node_id = node.get("id", "")
+                if not node_id:
+                    continue
+                
+                # 计算检索分数
+                if bm25_scores is not None:
+                    score = float(bm25_scores[i])
+                else:
+                    score = self._calculate_node_score(node, caption_lower, last_top1_id)
+                
+                candidates.append({
+                    "id": node_id,
+                    "score": score,
+                    "text": node.get("name", ""),
+                    "score_nl": score,
+                    "score_struct": score,
+                    "provider": "ft",
+                    "bonus_keywords": 0.0,
+                    "bonus_bearing": 0.0,
+                    "alpha_used": 0.8,
+                    "retrieval_method": "structure_channel"
+                })
+            
+            # 语义去重：合并语义相似的节点
+            deduplicated_candidates = self._semantic_deduplication(candidates, caption_lower, scene.dedup_groups)
+            
+            # 返回top_k个候选
+            deduplicated_candidates.sort(key=lambda x: x["score"], reverse=True)
+            return deduplicated_candidates[:top_k]
+            
+        except Exception as e:
+            log.warning("structure channel failed: %s", e)
+            return []
+    
+    def _bm25_node_scores(self, scene, caption_lower, last_top1_id=None):
+        """BM25F 结构通道分数（与 scene.nodes 顺序一致）；未启用时返回 None
+
+        与启发式打分一样，对上一帧 top1 施加 ×0.8 的多样性惩罚。
+        """
+        if self.lexical_scorer != "bm25" or scene.bm25_nodes is None:
+            return None
+        scores = scene.bm25_nodes.scores(caption_lower)
+        if last_top1_id is not None:
+            for i, node in enumerate(scene.nodes):
+                if node.get("id") == last_top1_id:
+                    scores[i] *= 0.8
+        return scores
+    
+    def _lexical_detail_index(self, scene):
+        """细节通道打分索引：DetailIndex（启发式）或 BM25FIndex，二者接口相同"""
+        if self.lexical_scorer == "bm25" and scene.bm25_details is not None:
+            return scene.bm25_details
+        return scene.detail_index
+    
+    def _retrieve_from_detail_map(self, caption, scene, top_k):
+        """从场景模型的细节记录中检索（细节通道，按位置对齐模式）
+
+        通过倒排索引只对与 caption 有共同词的记录打分，再用堆取 top_k。
+        """
+        try:
+            if not scene.detail_records:
+                log.debug("no detail records: %s", scene.detail_file)
+                return []
+            
+            detail_candidates = []
+            index = self._lexical_detail_index(scene)
+            for idx, score in index.top_k(caption.lower(), top_k, scene.hinted_records):
+                detail_item = scene.detail_records[idx]
+                detail_candidates.append({
+                    "id": detail_item.get("node_hint", ""),
+                    "score": score,
+                    "text": detail_item.get("nl_text", ""),
+                    "score_nl": score,
+                    "score_detail": score,
+                    "provider": "ft",
+                    "retrieval_method": "detail_channel"
+                })
+            return detail_candidates
+            
+        except Exception as e:
+            log.warning("detail channel failed: %s", e)
+            return []
+    
+    def _retrieve_detail_by_node(self, caption, scene):
+        """细节通道（节点对齐）：命中记录只打分一次，再按细节键聚合为每个节点一个分数
+
+        返回按分数降序的节点级候选（不截断），融合时按节点ID与结构候选对齐。
+        """
+        try:
+            if not scene.detail_records:
+                log.debug("no detail records: %s", scene.detail_file)
+                return []
+            
+            # 只对与 caption 有共同词的记录打分，其余记录为 0 分
+            matches = self._lexical_detail_index(scene).score_matches(caption.lower())
+            aggregated = fusion_kernel.aggregate_sparse(
+                matches, scene.detail_key_index, scene.detail_key_sizes, self.detail_aggregation)
+            
+            detail_candidates = [{
+                "id": key,
+                "score": float(score),
+                "score_nl": float(score),
+                "score_detail": float(score),
+                "records": len(scene.detail_by_key.get(key, ())),
+                "provider": "ft",
+                "retrieval_method": "detail_channel_node"
+            } for key, score in zip(scene.detail_keys, aggregated) if np.isfinite(score)]
+            detail_candidates.sort(key=lambda x: x["score"], reverse=True)
+            return detail_candidates
+            
+        except Exception as e:
+            log.warning("detail channel failed: %s", e)
+            return []
+    
+    def _align_detail_to_nodes(self, struct_candidates, detail_candidates, scene):
+        """把节点级细节分数按 结构节点ID → 细节键 对齐到结构候选上
+
+        返回 (对齐后的细节分数列表, 两个通道top1是否为不同节点)。没有细节记录的节点记 0。
+        """
+        if not detail_candidates:
+            return [0.0] * len(struct_candidates), False
+        by_key = {c["id"]: c["score"] for c in detail_candidates}
+        aligned = [by_key.get(scene.alias_for(c["id"]), 0.0) for c in struct_candidates]
+        return aligned, int(np.argmax(aligned)) != 0
+    
+    def _calculate_node_score(self, node, caption_lower, last_top1_id=None):
+        """计算节点的检索分数（结构通道）- 增强版"""
+        score = 0.0
+        
+        # 🔧 FIX: 改进语义匹配，避免过于宽泛的匹配
+        # 1. 基于检索词的分数（更严格的匹配）
+        retrieval = node.get("retrieval", {})
+        index_terms = retrieval.get("index_terms", [])
+        tags = retrieval.get("tags", [])
+        
+        # 关键词匹配（更严格的权重分配）
+        for term in index_terms + tags:
+            term_lower = term.lower()
+            if term_lower in caption_lower:
+                # 空间概念给予更高权重
+                if any(space_word in term_lower for space_word in ["open", "space", "area", "large", "atrium"]):
+                    score += 0.4  # 空间概念权重
+                elif "box" in term_lower or "boxes" in term_lower:
+                    # 🔧 FIX: 降低box相关词的权重，避免过度匹配
+                    score += 0.15  # 从0.3降低到0.15
+                else:
+                    score += 0.3
+            elif any(word in caption_lower for word in term_lower.split()):
+                if any(space_word in term_lower for space_word in ["open", "space", "area", "large", "atrium"]):
+                    score += 0.2
+                elif "box" in term_lower or "boxes" in term_lower:
+                    # 🔧 FIX: 降低box相关词的部分匹配权重
+                    score += 0.08  # 从0.15降低到0.08
+                else:
+                    score += 0.15
+        
+        # 2. 基于节点名称的分数（更精确的匹配）
+        node_name = node.get("name", "").lower()
+        if node_name:
+            # 检查空间概念关键词
+            space_keywords = ["open", "space", "area", "large", "atrium", "cluster"]
+            space_match = any(space_word in node_name for space_word in space_keywords)
+            
+            if space_match and any(word in caption_lower for word in ["open", "space", "large"]):
+                score += 0.3  # 空间概念匹配给予更高权重
+            elif any(word in caption_lower for word in node_name.split()):
+                # 🔧 FIX: 降低box相关节点的名称匹配权重
+                if "box" in node_name or "boxes" in node_name:
+                    score += 0.1  # 从0.2降低到0.1
+                else:
+                    score += 0.2
+        
+        # 3. 基于地标的分数
+        landmarks = node.get("landmarks", [])
+        for landmark in landmarks:
+            if isinstance(landmark, dict):
+                landmark_term = landmark.get("term", "").lower()
+                if landmark_term and any(word in caption_lower for word in landmark_term.split()):
+                    score += 0.1
+            elif isinstance(landmark, str) and landmark.startswith("lm_"):
+                # 地标ID匹配
+                landmark_id = landmark.lower()
+                if any(word in caption_lower for word in landmark_id.split("_")):
+                    score += 0.1
+        
+        # 4. 基于类别的分数
+        categories = node.get("categories", [])
+        for category in categories:
+            if category.lower() in caption_lower:
+                score += 0.1
+        
+        # 5. 新增：空间概念语义匹配（解决"large open space"问题）
+        # 检查caption中的空间概念是否与节点匹配
+        space_concepts = {
+            "large open space": ["open", "space", "large", "area", "atrium", "cluster"],
+            "open space": ["open", "space", "area", "atrium"],
+            "open area": ["open", "area", "space", "atrium"],
+            "atrium": ["atrium", "open", "space", "area"]
+        }
+        
+        for caption_concept, keywords in space_concepts.items():
+            if caption_concept in caption_lower:
+                # 检查节点是否包含相关空间概念
+                node_text = f"{node.get('name', '')} {' '.join(index_terms)} {' '.join(tags)}"
+                node_text_lower = node_text.lower()
+                
+                if any(keyword in node_text_lower for keyword in keywords):
+                    score += 0.25  # 空间概念语义匹配给予额外权重
+                    break
+        
+        # 🔧 FIX: 添加多样性惩罚，避免总是选择同一个POI
+        if last_top1_id is not None and node.get("id") == last_top1_id:
+            score *= 0.8  # 连续选择同一POI时降低20%分数
+        
+        return min(1.0, score)  # 限制最大分数为1.0
+    
+    def _semantic_deduplication(self, candidates, caption_lower, group_table=None):
+        """语义去重：合并语义相似的节点，避免返回重复的TV screen等
+
+        group_table: 场景加载时预先计算的 (节点ID, 名称) -> 分组标签（scene.dedup_groups）；
+        表中没有的候选（或带 name 字段的候选）现场计算，结果相同。
+        """
+        if not candidates:
+            return candidates
+        group_table = group_table or {}
+        
+        # 按语义组分组候选
+        grouped_candidates = {}
+        for candidate in candidates:
+            key = group_key(candidate)
+            if "name" not in candidate and key in group_table:
+                final_group = group_table[key]
+            else:
+                final_group = semantic_group(candidate["id"], candidate.get("text", ""), candidate.get("name", ""))
+            # 不属于任何组的候选，单独处理
+            grouped_candidates.setdefault(final_group or "other", []).append(candidate)
+        
+        # 对每个语义组，选择最高分的候选
+        deduplicated = []
+        for group_name, group_candidates in grouped_candidates.items():
+            if group_name == "other":
+                # 其他候选直接添加
+                deduplicated.extend(group_candidates)
+            else:
+                # 语义组选择最高分的
+                if len(group_candidates) > 1:
+                    log.debug("semantic dedup: %s has %d candidates", group_name, len(group_candidates))
+                
+                # 选择最高分的候选
+                best_candidate = max(group_candidates, key=lambda x: x["score"])
+                best_candidate["semantic_group"] = group_name
+                best_candidate["merged_candidates"] = len(group_candidates)
+                deduplicated.append(best_candidate)
+        
+        return deduplicated
+    
+    def _calculate_detail_score(self, detail_item, caption_lower):
+        """计算detail分数（细节通道）- 增强版"""
+        score = 0.0
+        
+        # 1. 基于自然语言描述的分数（增强空间概念权重）
+        nl_text = detail_item.get("nl_text", "").lower()
+        if nl_text:
+            # 关键词匹配
+            keywords = nl_text.split()
+            for keyword in keywords:
+                if keyword in caption_lower:
+                    # 空间概念给予更高权重
+                    if any(space_word in keyword for space_word in ["open", "space", "area", "large", "atrium", "cluster"]):
+                        score += 0.3  # 空间概念权重从0.2提升到0.3
+                    else:
+                        score += 0.2
+                elif len(keyword) > 3 and any(word in caption_lower for word in keyword.split()):
+                    if any(space_word in keyword for space_word in ["open", "space", "area", "large", "atrium", "cluster"]):
+                        score += 0.15  # 空间概念权重从0.1提升到0.15
+                    else:
+                        score += 0.1
+        
+        # 2. 基于结构化文本的分数
+        struct_text = detail_item.get("struct_text", "").lower()
+        if struct_text:
+            # 解析结构化特征
+            struct_features = struct_text.split(";")
+            for feature in struct_features:
+                if feature.strip() and any(word in caption_lower for word in feature.split()):
+                    score += 0.15
+        
+        # 3. 基于空间关系的分数
+        spatial_info = detail_item.get("spatial_info", {})
+        for relation, landmark in spatial_info.items():
+            if landmark and any(word in caption_lower for word in str(landmark).split()):
+                score += 0.1
+        
+        # 4. 新增：空间概念语义匹配（与结构通道保持一致）
+        space_concepts = {
+            "large open space": ["open", "space", "large", "area", "atrium", "cluster"],
+            "open space": ["open", "space", "area", "atrium"],
+            "open area": ["open", "area", "space", "atrium"],
+            "atrium": ["atrium", "open", "space", "area"]
+        }
+        
+        for caption_concept, keywords in space_concepts.items():
+            if caption_concept in caption_lower:
+                # 检查detail文本是否包含相关空间概念
+                detail_text = f"{nl_text} {struct_text}"
+                if any(keyword in detail_text for keyword in keywords):
+                    score += 0.2  # 空间概念语义匹配给予额外权重
+                    break
+        
+        return min(1.0, score)  # 限制最大分数为1.0
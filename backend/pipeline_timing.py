@@ -0,0 +1,191 @@
+"""
+Locate pipeline execution pool and per-stage timing
+定位流水线的线程池执行 + 分阶段计时
+
+- run_in_pool(fn, *args): 把 CPU 密集的阶段（BLIP、检索、融合、校准、写日志）放到工作线程池，
+  事件循环只处理 I/O；通过 contextvars.copy_context() 把当前请求的计时器带进工作线程
+- submit_detached(fn, *args): 响应返回后才完成的后台任务（如首张照片的日志 caption），同一线程池执行，
+  不带请求的计时器 / 剖析上下文
+- stage(name): 上下文管理器，记录当前请求某个阶段的耗时（没有计时器时为空操作）
+- STAGE_HISTOGRAMS: 进程内按阶段聚合的耗时直方图
+- timed(name) / COMPONENT_HISTOGRAMS: 定位流水线之外的组件耗时（ASR 解码/转写、LLM 调用）
+- pool_queue_depth() / pool_inflight(): 定位线程池的排队与在途任务数（/metrics 的 gauge）
+- 请求被剖析时（request_profiler），run_in_pool 提交的任务在工作线程上一并剖析
+"""
+
+import os
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from request_profiler import bind_profile
+
+# 标准阶段（顺序即展示顺序）
+LOCATE_STAGES = ("decode", "caption", "structure", "detail", "fusion",
+                 "detail_attach", "calibration", "logging", "total")
+
+# 直方图桶上界（毫秒）
+DEFAULT_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+LOCATE_POOL_WORKERS = int(os.getenv("LOCATE_POOL_WORKERS", str(min(8, (os.cpu_count() or 2)))))
+
+PIPELINE_EXECUTOR = ThreadPoolExecutor(max_workers=LOCATE_POOL_WORKERS, thread_name_prefix="locate")
+
+_CURRENT_TIMER: contextvars.ContextVar = contextvars.ContextVar("locate_stage_timer", default=None)
+
+_INFLIGHT = 0
+_INFLIGHT_LOCK = threading.Lock()
+
+
+class StageTimer:
+    """单个请求的阶段计时（同一阶段多次进入时累加）"""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.stages_ms: Dict[str, float] = {}
+
+    def add(self, name: str, ms: float):
+        self.stages_ms[name] = self.stages_ms.get(name, 0.0) + ms
+
+    def finish(self) -> Dict[str, float]:
+        """写入 total 并返回按标准阶段排序的耗时字典（毫秒，保留3位小数）"""
+        self.stages_ms["total"] = (time.perf_counter() - self.t0) * 1000.0
+        ordered = {k: round(self.stages_ms[k], 3) for k in LOCATE_STAGES if k in self.stages_ms}
+        for k, v in self.stages_ms.items():
+            if k not in ordered:
+                ordered[k] = round(v, 3)
+        return ordered
+
+
+def start_request_timer() -> StageTimer:
+    timer = StageTimer()
+    _CURRENT_TIMER.set(timer)
+    return timer
+
+
+def current_timer() -> Optional[StageTimer]:
+    return _CURRENT_TIMER.get()
+
+
+@contextmanager
+def stage(name: str):
+    """记录当前请求中 name 阶段的耗时"""
+    timer = _CURRENT_TIMER.get()
+    if timer is None:
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, (time.perf_counter() - t) * 1000.0)
+
+
+def _track_inflight(delta: int):
+    global _INFLIGHT
+    with _INFLIGHT_LOCK:
+        _INFLIGHT += delta
+
+
+async def run_in_pool(fn, *args, **kwargs):
+    """在定位线程池中执行同步函数，保留当前请求的上下文（计时器等）"""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    _track_inflight(1)
+    try:
+        return await loop.run_in_executor(PIPELINE_EXECUTOR,
+                                          functools.partial(ctx.run, bind_profile(fn), *args, **kwargs))
+    finally:
+        _track_inflight(-1)
+
+
+def submit_detached(fn, *args, **kwargs) -> Future:
+    """提交不属于任何请求阶段的后台任务；计入在途任务数，不计入请求的阶段耗时"""
+    _track_inflight(1)
+    future = PIPELINE_EXECUTOR.submit(fn, *args, **kwargs)
+    future.add_done_callback(lambda _: _track_inflight(-1))
+    return future
+
+
+def pool_inflight() -> int:
+    """已提交到定位线程池、尚未完成的任务数（排队 + 执行中）"""
+    return _INFLIGHT
+
+
+def pool_queue_depth() -> int:
+    """定位线程池中等待空闲线程的任务数"""
+    return PIPELINE_EXECUTOR._work_queue.qsize()
+
+
+class StageHistograms:
+    """按阶段聚合的累积直方图（Prometheus 风格：le 桶 + sum + count）"""
+
+    def __init__(self, buckets_ms=DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict] = {}
+
+    def observe(self, name: str, ms: float):
+        with self._lock:
+            h = self._data.get(name)
+            if h is None:
+                h = {"counts": [0] * (len(self.buckets_ms) + 1), "sum": 0.0, "count": 0}
+                self._data[name] = h
+            idx = len(self.buckets_ms)
+            for i, le in enumerate(self.buckets_ms):
+                if ms <= le:
+                    idx = i
+                    break
+            h["counts"][idx] += 1
+            h["sum"] += ms
+            h["count"] += 1
+
+    def observe_all(self, timings_ms: Dict[str, float]):
+        for name, ms in timings_ms.items():
+            self.observe(name, ms)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """返回每个阶段的累积桶计数、总和、次数和均值"""
+        out = {}
+        with self._lock:
+            for name, h in self._data.items():
+                cumulative, running = {}, 0
+                for le, c in zip(self.buckets_ms, h["counts"]):
+                    running += c
+                    cumulative[str(le)] = running
+                cumulative["+Inf"] = h["count"]
+                out[name] = {
+                    "buckets_ms": cumulative,
+                    "sum_ms": round(h["sum"], 3),
+                    "count": h["count"],
+                    "mean_ms": round(h["sum"] / h["count"], 3) if h["count"] else 0.0,
+                }
+        return out
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+
+STAGE_HISTOGRAMS = StageHistograms()
+# 定位流水线之外的组件（ASR 解码 / 转写、LLM 调用）
+COMPONENT_HISTOGRAMS = StageHistograms()
+
+
+@contextmanager
+def timed(name: str):
+    """记录一次组件调用的耗时到 COMPONENT_HISTOGRAMS；处于请求计时器内时同时计入该请求"""
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t) * 1000.0
+        COMPONENT_HISTOGRAMS.observe(name, ms)
+        timer = _CURRENT_TIMER.get()
+        if timer is not None:
+            timer.add(name, ms)
@@ -0,0 +1,137 @@
+"""
+Prometheus text exposition for /metrics
+把进程内的阶段直方图和 gauge 渲染成 Prometheus 文本格式（0.0.4），不依赖 prometheus_client 或外部服务。
+
+- textnavi_locate_stage_seconds{stage=...}：/api/locate 各阶段（decode=图片解码，caption=BLIP 生成，
+  structure / detail / fusion / detail_attach / calibration，logging=写日志，total）
+- textnavi_component_seconds{component=...}：asr_decode、asr_transcribe、llm_call
+- GAUGES 中注册的 gauge / counter：线程池排队深度、在途任务、模型内存、进程常驻内存等
+
+直方图内部以毫秒统计，输出时按 Prometheus 约定换算成秒。
+"""
+
+import os
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from pipeline_timing import (
+    COMPONENT_HISTOGRAMS, LOCATE_POOL_WORKERS, STAGE_HISTOGRAMS, StageHistograms,
+    pool_inflight, pool_queue_depth,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+GaugeValue = Union[None, float, int, Dict[str, float]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NaN"
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_histograms(name: str, help_text: str, label: str, histograms: StageHistograms) -> List[str]:
+    """把 StageHistograms（毫秒）渲染为以秒为单位的 Prometheus histogram"""
+    snap = histograms.snapshot()
+    if not snap:
+        return []
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for key in sorted(snap):
+        h = snap[key]
+        lv = f'{label}="{_escape(key)}"'
+        for le, count in h["buckets_ms"].items():
+            le_s = "+Inf" if le == "+Inf" else _fmt(float(le) / 1000.0)
+            lines.append(f'{name}_bucket{{{lv},le="{le_s}"}} {count}')
+        lines.append(f"{name}_sum{{{lv}}} {_fmt(h['sum_ms'] / 1000.0)}")
+        lines.append(f"{name}_count{{{lv}}} {h['count']}")
+    return lines
+
+
+class GaugeRegistry:
+    """按名称注册的回调指标；抓取时调用回调取值（回调出错或返回 None 时跳过该指标）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Tuple[str, str, Optional[str], Callable[[], GaugeValue]]] = {}
+
+    def register(self, name: str, help_text: str, fn: Callable[[], GaugeValue], label: Optional[str] = None,
+                 kind: str = "gauge"):
+        """fn 返回数值；给出 label 时返回 {标签值: 数值}。同名重复注册会覆盖"""
+        with self._lock:
+            self._metrics[name] = (kind, help_text, label, fn)
+
+    def unregister(self, name: str):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for name, (kind, help_text, label, fn) in metrics:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            if label:
+                samples = [(f'{{{label}="{_escape(k)}"}}', v) for k, v in sorted(value.items()) if v is not None]
+            else:
+                samples = [("", value)]
+            if not samples:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{labels} {_fmt(v)}" for labels, v in samples]
+        return lines
+
+
+GAUGES = GaugeRegistry()
+
+
+def process_resident_bytes() -> Optional[int]:
+    """当前进程常驻内存（Linux /proc；其他平台返回 None）"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def torch_module_bytes(module) -> Optional[int]:
+    """torch 模块参数与缓冲区占用的字节数；模块未加载时返回 None"""
+    if module is None:
+        return None
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+GAUGES.register("textnavi_locate_pool_workers", "Worker threads in the locate pool",
+                lambda: LOCATE_POOL_WORKERS)
+GAUGES.register("textnavi_locate_pool_queue_depth", "Locate pool tasks waiting for a free worker",
+                pool_queue_depth)
+GAUGES.register("textnavi_locate_pool_inflight", "Locate pool tasks submitted and not yet finished",
+                pool_inflight)
+GAUGES.register("process_resident_memory_bytes", "Resident memory size in bytes", process_resident_bytes)
+
+
+def render_metrics() -> str:
+    lines = []
+    lines += render_histograms(
+        "textnavi_locate_stage_seconds",
+        "Per-stage latency of /api/locate (decode=image decode, caption=BLIP generate, logging=log write)",
+        "stage", STAGE_HISTOGRAMS)
+    lines += render_histograms(
+        "textnavi_component_seconds", "Latency of ASR decode / ASR transcribe / LLM calls",
+        "component", COMPONENT_HISTOGRAMS)
+    lines += GAUGES.render()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,52 @@
+"""
+Precompiled structure-channel query filters
+结构通道的稳态词过滤与反证（negative）提示惩罚，正则与替换表在模块加载时构建一次：
+
+1. 稳态过滤：一个前瞻正则一次扫描找出 caption 中出现的可移动物体，只对出现的词执行原有的替换序列
+   （" w " / "w " / " w" 及复数形式）。结果与原逐词 str.replace 实现逐字相同，包括其子串语义
+   （"a bookshelf with books" → "a shelf with s"）；caption 中没有可移动物体时只有这一次扫描
+2. 反证提示：候选自身携带的 retrieval.negative 提示，每个不同的提示作为子串出现计 1 次
+   （与原 apply_negatives 相同；当前结构候选不携带提示，因此不产生惩罚）
+"""
+
+import re
+from typing import Any, Dict
+
+# 可移动物体：结构通道不应依赖它们定位
+MOVABLE = ("suitcase", "bag", "backpack", "person", "cup", "bottle", "laptop", "phone", "book")
+# 低可信度词的权重（不修改原始文本）
+LOW_TRUST = {"box": 0.5, "bins": 0.6, "item": 0.7, "stuff": 0.6, "thing": 0.5, "object": 0.5}
+NEGATIVE_PENALTY = 0.15
+
+# 前瞻交替式：每个位置都尝试匹配，互相重叠的出现（如 "cuperson"）也都能找到
+_MOVABLE_RE = re.compile("(?=(%s))" % "|".join(re.escape(w) for w in MOVABLE))
+# 每个词的替换序列（单数、复数；顺序同原实现）
+_REPLACEMENTS = {w: (f" {w} ", f"{w} ", f" {w}", f" {w}s ", f"{w}s ", f" {w}s") for w in MOVABLE}
+
+
+def term_weight(token: str) -> float:
+    """获取词的权重，不修改原始文本"""
+    return LOW_TRUST.get(token.lower(), 1.0)
+
+
+def stable_query(text: str) -> str:
+    """结构通道专用：过滤可移动物体（含复数形式），保留固定地标；清理多余空格与结尾标点
+
+    替换只会删除字符并插入空格，不会拼出新的可移动物体，所以跳过未出现的词不改变结果。
+    """
+    t = text.lower()
+    found = set(_MOVABLE_RE.findall(t))
+    for w in MOVABLE:
+        if w in found:
+            for old in _REPLACEMENTS[w]:
+                t = t.replace(old, " ")
+    cleaned = " ".join(t.split())
+    return cleaned.rstrip(" .")
+
+
+def negative_hits(candidate: Dict[str, Any], query_text: str) -> int:
+    """候选携带的不同 negative 提示中作为子串出现在 query_text（已小写）中的个数"""
+    negative = candidate.get("retrieval", {}).get("negative")
+    if not negative:
+        return 0
+    return sum(1 for n in set(negative) if n in query_text)
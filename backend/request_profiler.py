@@ -0,0 +1,438 @@
+"""
+Opt-in per-request profiling for /api/locate and /api/qa
+按请求开启的性能剖析：默认完全关闭，只有带 X-Profile 请求头或会话开关开启时才剖析该请求。
+
+开启方式:
+- 请求头 X-Profile: 1 | sample | cprofile（单个请求）
+- POST /api/profiling/set {"session_id", "enabled", "mode", "max_requests"}：该会话接下来的
+  max_requests 个请求被剖析，用完后开关自动关闭（短时突发，避免长时间带着剖析器运行）
+
+两种方式都只有在服务端允许时才生效：请求头只在 PROFILING_ENABLED=true 或请求带有正确的管理令牌
+（X-Admin-Token 请求头）时被理会；PROFILING_ENABLED 关闭时打开会话开关需要管理令牌。
+cprofile 模式只对带管理令牌的请求 / 开关生效，其余请求退回 sample。
+
+模式:
+- sample：后台线程每 PROFILE_SAMPLE_INTERVAL_MS 毫秒读取一次绑定线程的调用栈（sys._current_frames），
+  被剖析的代码本身不插桩，开销低；输出折叠栈（profile.folded，flamegraph.pl / speedscope 可读）
+  和 speedscope JSON（profile.speedscope.json）
+- cprofile：确定性剖析，开销大，只适合短时突发；输出 profile.pstats 和文本摘要 profile.txt。
+  同一时间只允许一个 cprofile 请求，其余请求自动退回 sample
+
+被剖析的线程：run_in_pool 提交到定位线程池的任务（bind），以及处理函数用 profile.thread() 包住的
+同步代码段（/api/qa 在事件循环线程上同步运行的部分）。剖析器不会跨 await 挂在事件循环线程上，
+否则同一线程上交错运行的其他请求也会被计入。
+
+输出目录: {PROFILE_DIR}/{session_id}/{req_id}/，meta.json 记录端点、模式、耗时和文件列表，
+通过 GET /api/admin/profiles 列出。最多保留 PROFILE_KEEP 个剖析，每次写出后删除最旧的。
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import pstats
+import cProfile
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.getenv("LOG_DIR", "logs"), "profiles"))
+PROFILE_HEADER = "X-Profile"
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))      # 最多保留的剖析数（按创建时间删除最旧的）
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "30"))   # 采样线程的最长运行时间
+PROFILE_BURST_REQUESTS = int(os.getenv("PROFILE_BURST_REQUESTS", "20"))  # 会话开关默认剖析的请求数
+
+PROFILE_MODES = ("sample", "cprofile")
+META_FILE = "meta.json"
+
+_SAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]")
+
+Frame = Tuple[str, str, int]   # (函数名, 文件名, 起始行号)
+
+_CURRENT_PROFILE: contextvars.ContextVar = contextvars.ContextVar("request_profile", default=None)
+_SLOT: contextvars.ContextVar = contextvars.ContextVar("request_profile_slot", default=None)
+
+_CPROFILE_LOCK = threading.Lock()
+
+
+def safe_name(value: Any) -> str:
+    """会话 / 请求 ID 转成安全的目录名（不允许路径分隔符和 ..）"""
+    name = _SAFE_NAME.sub("_", str(value or ""))[:128].strip(".")
+    return name or "_"
+
+
+def parse_mode(value: Optional[str]) -> Optional[str]:
+    """X-Profile 请求头 / 开关取值 → 'sample' | 'cprofile' | None"""
+    v = (value or "").strip().lower()
+    if v in ("1", "true", "on", "yes", "sample"):
+        return "sample"
+    if v == "cprofile":
+        return "cprofile"
+    return None
+
+
+class SamplingProfiler:
+    """后台线程按固定间隔采样已绑定线程的调用栈，按栈聚合样本数"""
+
+    def __init__(self, interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS, max_seconds: float = PROFILE_MAX_SECONDS):
+        self.interval = max(interval_ms, 0.5) / 1000.0
+        self.max_seconds = max_seconds
+        self.stacks: Counter = Counter()   # tuple[Frame, ...]（根在前）-> 样本数
+        self.samples = 0
+        self._threads: Dict[int, int] = {}  # 线程 ident -> attach 次数
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def attach(self, ident: int):
+        with self._lock:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+
+    def detach(self, ident: int):
+        with self._lock:
+            n = self._threads.get(ident, 0) - 1
+            if n > 0:
+                self._threads[ident] = n
+            else:
+                self._threads.pop(ident, None)
+
+    def sample_once(self):
+        with self._lock:
+            idents = list(self._threads)
+        if not idents:
+            return
+        frames = sys._current_frames()
+        for ident in idents:
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+            self.samples += 1
+
+    def _run(self):
+        deadline = time.perf_counter() + self.max_seconds
+        while not self._stop.wait(self.interval):
+            if time.perf_counter() > deadline:
+                break
+            self.sample_once()
+
+
+def _frame_label(frame: Frame) -> str:
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def write_collapsed(stacks: Counter, path: str):
+    """折叠栈格式：每行 'root;child;leaf count'"""
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            f.write(";".join(_frame_label(fr).replace(";", ",") for fr in stack) + f" {count}\n")
+
+
+def write_speedscope(stacks: Counter, path: str, name: str, interval_ms: float):
+    """speedscope 文件格式（sampled profile，权重单位毫秒）"""
+    frame_index: Dict[Frame, int] = {}
+    frames = []
+    samples, weights = [], []
+    for stack, count in stacks.most_common():
+        idx = []
+        for fr in stack:
+            if fr not in frame_index:
+                frame_index[fr] = len(frames)
+                frames.append({"name": fr[0], "file": fr[1], "line": fr[2]})
+            idx.append(frame_index[fr])
+        samples.append(idx)
+        weights.append(round(count * interval_ms, 3))
+    total = round(sum(weights), 3)
+    doc = {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "exporter": "textnavi-request-profiler",
+        "name": name,
+        "activeProfileIndex": 0,
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled", "name": name, "unit": "milliseconds",
+            "startValue": 0, "endValue": total, "samples": samples, "weights": weights,
+        }],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f)
+
+
+class RequestProfile:
+    """一个请求的剖析会话：start → bind / attach 线程 → write"""
+
+    def __init__(self, session_id: str, req_id: str, endpoint: str, mode: str = "sample",
+                 interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS):
+        self.session_id = session_id
+        self.req_id = req_id
+        self.endpoint = endpoint
+        self.requested_mode = mode
+        self.mode = mode
+        self.interval_ms = interval_ms
+        self.created = datetime.utcnow().isoformat()
+        self._t0 = None
+        self._t1 = None
+        self._sampler: Optional[SamplingProfiler] = None
+        self._stats: Optional[pstats.Stats] = None
+        self._stats_lock = threading.Lock()
+        self._owns_cprofile = False
+
+    def start(self) -> "RequestProfile":
+        if self.mode == "cprofile":
+            self._owns_cprofile = _CPROFILE_LOCK.acquire(blocking=False)
+            if not self._owns_cprofile:
+                self.mode = "sample"   # 已有 cprofile 请求在运行
+        if self.mode == "sample":
+            self._sampler = SamplingProfiler(self.interval_ms)
+            self._sampler.start()
+        self._t0 = time.perf_counter()
+        return self
+
+    @contextmanager
+    def thread(self):
+        """在当前线程上剖析 with 块内的代码"""
+        if self.mode == "cprofile":
+            prof = cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError:   # 该线程上已有其他剖析器
+                yield
+                return
+            try:
+                yield
+            finally:
+                prof.disable()
+                with self._stats_lock:
+                    if self._stats is None:
+                        self._stats = pstats.Stats(prof)
+                    else:
+                        self._stats.add(prof)
+        else:
+            ident = threading.get_ident()
+            self._sampler.attach(ident)
+            try:
+                yield
+            finally:
+                self._sampler.detach(ident)
+
+    def bind(self, fn):
+        """包装 fn：在执行它的线程上剖析（run_in_pool 用）"""
+        def _profiled(*args, **kwargs):
+            with self.thread():
+                return fn(*args, **kwargs)
+        return _profiled
+
+    def stop(self):
+        if self._t1 is not None:
+            return
+        self._t1 = time.perf_counter()
+        if self._sampler is not None:
+            self._sampler.stop()
+        if self._owns_cprofile:
+            self._owns_cprofile = False
+            _CPROFILE_LOCK.release()
+
+    @property
+    def duration_ms(self) -> float:
+        end = self._t1 if self._t1 is not None else time.perf_counter()
+        return round((end - self._t0) * 1000.0, 2) if self._t0 is not None else 0.0
+
+    def write(self, root: str = PROFILE_DIR, keep: int = PROFILE_KEEP) -> Dict[str, Any]:
+        """停止剖析并写出文件，返回 meta；之后只保留最新的 keep 个剖析"""
+        self.stop()
+        out_dir = os.path.join(root, safe_name(self.session_id), safe_name(self.req_id))
+        os.makedirs(out_dir, exist_ok=True)
+        name = f"{self.endpoint} {self.session_id}/{self.req_id}"
+        files = []
+        samples = None
+        if self._sampler is not None:
+            samples = self._sampler.samples
+            write_collapsed(self._sampler.stacks, os.path.join(out_dir, "profile.folded"))
+            write_speedscope(self._sampler.stacks, os.path.join(out_dir, "profile.speedscope.json"),
+                             name, self.interval_ms)
+            files += ["profile.folded", "profile.speedscope.json"]
+        elif self._stats is not None:
+            self._stats.dump_stats(os.path.join(out_dir, "profile.pstats"))
+            buf = io.StringIO()
+            self._stats.stream = buf
+            self._stats.sort_stats("cumulative").print_stats(40)
+            with open(os.path.join(out_dir, "profile.txt"), "w", encoding="utf-8") as f:
+                f.write(buf.getvalue())
+            files += ["profile.pstats", "profile.txt"]
+        meta = {
+            "session_id": self.session_id,
+            "req_id": self.req_id,
+            "endpoint": self.endpoint,
+            "mode": self.mode,
+            "requested_mode": self.requested_mode,
+            "created": self.created,
+            "duration_ms": self.duration_ms,
+            "samples": samples,
+            "interval_ms": self.interval_ms if self.mode == "sample" else None,
+            "files": files,
+            "path": os.path.join(safe_name(self.session_id), safe_name(self.req_id)),
+        }
+        with open(os.path.join(out_dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        prune_profiles(root, keep)
+        return meta
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _CURRENT_PROFILE.get()
+
+
+def bind_profile(fn):
+    """当前请求在剖析时，返回会在执行线程上剖析的 fn；否则原样返回"""
+    profile = _CURRENT_PROFILE.get()
+    return fn if profile is None else profile.bind(fn)
+
+
+# ---- 会话开关 ----
+
+def claim_session_profile(store, ns: str, session_id: str) -> Optional[str]:
+    """会话开关开启时消耗一次剩余次数并返回模式；次数用完后自动关闭"""
+    cur = store.get(ns, session_id)
+    if not cur or not cur.get("enabled"):
+        return None
+    claimed = {}
+
+    def _apply(state):
+        claimed.clear()
+        if state.get("enabled") and state.get("remaining", 0) > 0:
+            state["remaining"] -= 1
+            claimed["mode"] = state.get("mode") or "sample"
+        if state.get("remaining", 0) <= 0:
+            state["enabled"] = False
+        return state
+
+    store.update(ns, session_id, _apply, {"enabled": False, "mode": "sample", "remaining": 0})
+    return claimed.get("mode")
+
+
+# ---- 请求作用域：HTTP 中间件开槽，处理函数在拿到 session_id / req_id 后开始剖析 ----
+
+def open_slot(header_value: Optional[str] = None, allow_cprofile: bool = False):
+    """中间件调用：记录请求头里的模式（服务端不允许时传 None），返回 token（交给 close_slot）
+
+    allow_cprofile=False 时 cprofile 请求退回 sample（只有带管理令牌的请求可以选 cprofile）。
+    """
+    mode = parse_mode(header_value)
+    if mode == "cprofile" and not allow_cprofile:
+        mode = "sample"
+    return _SLOT.set({"header_mode": mode, "profile": None})
+
+
+def close_slot(token) -> Optional[RequestProfile]:
+    """中间件调用：取出本请求的剖析（未剖析时为 None）并恢复上下文"""
+    slot = _SLOT.get()
+    _SLOT.reset(token)
+    if not slot:
+        return None
+    return slot["profile"]
+
+
+def begin_request_profile(session_id: str, req_id: str, endpoint: str, store=None,
+                          ns: str = None) -> Optional[RequestProfile]:
+    """处理函数调用：按请求头或会话开关决定是否剖析本请求
+
+    只剖析 bind 的线程池任务；在调用线程上同步运行的代码段由调用方用 profile.thread() 包住。
+    """
+    slot = _SLOT.get()
+    if slot is None:
+        return None
+    mode = slot["header_mode"]
+    if mode is None and store is not None and ns:
+        mode = claim_session_profile(store, ns, session_id)
+    if mode is None:
+        return None
+    profile = RequestProfile(session_id, req_id, endpoint, mode).start()
+    _CURRENT_PROFILE.set(profile)
+    slot["profile"] = profile
+    return profile
+
+
+# ---- 列表 ----
+
+def list_profiles(root: str = PROFILE_DIR, session_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+    """按创建时间倒序列出已写出的剖析（读取各目录的 meta.json）"""
+    if not os.path.isdir(root):
+        return []
+    sessions = [safe_name(session_id)] if session_id else sorted(os.listdir(root))
+    out = []
+    for sess in sessions:
+        sess_dir = os.path.join(root, sess)
+        if not os.path.isdir(sess_dir):
+            continue
+        for req in os.listdir(sess_dir):
+            meta_path = os.path.join(sess_dir, req, META_FILE)
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    out.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    out.sort(key=lambda m: m.get("created", ""), reverse=True)
+    return out[:limit] if limit else out
+
+
+def prune_profiles(root: str = PROFILE_DIR, keep: int = PROFILE_KEEP) -> int:
+    """只保留最新的 keep 个剖析目录（按 meta.json 的修改时间），删除其余的，返回删除数；keep<=0 不限制"""
+    if keep <= 0 or not os.path.isdir(root):
+        return 0
+    entries = []
+    for sess in os.listdir(root):
+        sess_dir = os.path.join(root, sess)
+        if not os.path.isdir(sess_dir):
+            continue
+        for req in os.listdir(sess_dir):
+            req_dir = os.path.join(sess_dir, req)
+            try:
+                entries.append((os.path.getmtime(os.path.join(req_dir, META_FILE)), req_dir))
+            except OSError:
+                continue
+    if len(entries) <= keep:
+        return 0
+    entries.sort()
+    removed = 0
+    for _, req_dir in entries[:len(entries) - keep]:
+        shutil.rmtree(req_dir, ignore_errors=True)
+        removed += 1
+        sess_dir = os.path.dirname(req_dir)
+        try:
+            os.rmdir(sess_dir)   # 会话目录已空时一并删除
+        except OSError:
+            pass
+    return removed
+
+
+def profile_file_path(root: str, session_id: str, req_id: str, name: str) -> Optional[str]:
+    """某个剖析文件的路径；名称不合法或文件不存在时返回 None"""
+    if name != safe_name(name):
+        return None
+    path = os.path.join(root, safe_name(session_id), safe_name(req_id), name)
+    return path if os.path.isfile(path) else None
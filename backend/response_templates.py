@@ -0,0 +1,185 @@
+"""
+Precomputed per-site response templates
+按 (站点, provider) 预先构建的响应模板：首张照片的预设输出、LLM 推理用的匹配数据、按语言的节点位置说明。
+
+- 预设输出文件（清单 presets）只在构建时读取并解析一次，首张照片不再逐请求打开 JSONL
+- 节点位置说明（原 generate_scene_a/b_structure_info 中的分支）是按站点 / 语言的静态字符串表；
+  新站点可在清单 index 中声明 "templates": <json 文件>，格式 {"zh": {node_id: 文本}, "en": {...}}，覆盖内置表
+- 未知节点使用按语言的格式串，只在请求时插入 node_id 等动态值
+- 服务启动时 warm() 为清单中每个站点 / provider 构建一次；源文件变化后（按 mtime / 大小）下次访问时重建
+"""
+
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+from scene_registry import SceneRegistry, source_stamp
+from structured_log import get_logger
+
+log = get_logger("templates")
+
+CHECK_INTERVAL_S = 2.0          # 两次检查源文件是否变化的最小间隔
+DEFAULT_LANG = "en"
+DEFAULT_PRESET_OUTPUT = "Welcome! Please take a photo to start exploring."
+LOCATION_FALLBACK = {
+    "zh": "当前位置：{node_id}。请告诉我您要去哪里。",
+    "en": "Current location: {node_id}. Please tell me where you want to go.",
+}
+
+# 内置站点的节点位置说明（基于 Structure 文件的拓扑信息）
+NODE_INSTRUCTIONS: Dict[str, Dict[str, Dict[str, str]]] = {
+    "SCENE_A_MS": {
+        "zh": {
+            "dp_ms_entrance": "您在Maker Space入口。直行约6步到达3D打印机桌，然后左转继续前进进入中庭。",
+            "yline_start": "您在黄色引导线起点。直行约3步到达椅子位置，然后继续沿引导线前进。",
+            "chair_on_yline": "您在黄色引导线上的椅子旁。继续直行约2步，引导线将向左弯曲。",
+            "yline_bend_mid": "您在黄色引导线弯曲处。直行约7步到达窗户和软座区域，然后进入中庭。",
+            "atrium_edge": "您在中庭边缘，靠近窗户和软座。右转约5步到达电视区域。",
+            "tv_zone": "您在电视区域。前方约4步到达小会议桌，然后继续前进到橙色沙发。",
+            "small_table_mid": "您在低矮会议桌旁。直行约3步到达橙色沙发角落。",
+            "orange_sofa_corner": "您已到达橙色沙发角落，靠墙放置。导航任务完成！",
+        },
+        "en": {
+            "dp_ms_entrance": "You are at the Maker Space entrance. Walk straight about 6 steps to reach the 3D printer table, then turn left to continue into the atrium.",
+            "yline_start": "You are at the yellow line start. Walk straight about 3 steps to reach the chair position, then continue along the guide line.",
+            "chair_on_yline": "You are at the chair on the yellow line. Continue straight about 2 steps, the line will bend left.",
+            "yline_bend_mid": "You are at the yellow line bend. Walk straight about 7 steps to reach the windows and soft seats, then enter the atrium.",
+            "atrium_edge": "You are at the atrium edge, near windows and soft seats. Turn right about 5 steps to reach the TV zone.",
+            "tv_zone": "You are in the TV zone. Walk forward about 4 steps to reach the small meeting table, then continue to the orange sofa.",
+            "small_table_mid": "You are at the low meeting table. Walk straight about 3 steps to reach the orange sofa corner.",
+            "orange_sofa_corner": "You have reached the orange sofa corner, against the wall. Navigation task completed!",
+        },
+    },
+    "SCENE_B_STUDIO": {
+        "zh": {
+            "atrium_desks_hub": "您在中央工作台区域，面向大电视屏幕。左侧是窗户墙，右侧是橙色沙发区域。",
+            "node_left_to_windows": "您正在向左转向窗户方向。直行约2步到达窗户边缘的软座区域。",
+            "atrium_windows_edge": "您在窗户边缘的软座区域。向后转约3步到达小白色会议桌，然后继续前进到橙色沙发。",
+            "poi_small_table": "您在白色会议桌旁，桌上有紫色椅子。直行约2步到达橙色沙发区域。",
+            "poi_orange_green_sofa": "您已到达橙色沙发区域，沙发靠墙放置。附近有绿色高背扶手椅和两个黑色边桌。",
+        },
+        "en": {
+            "atrium_desks_hub": "You are at the central desks hub, facing the large TV screen. To your left is the windows wall, to your right is the orange sofa area.",
+            "node_left_to_windows": "You are turning left toward the windows. Walk straight about 2 steps to reach the soft seats area at the window edge.",
+            "atrium_windows_edge": "You are at the soft seats area by the windows. Turn around and walk about 3 steps to reach the small white meeting table, then continue to the orange sofa.",
+            "poi_small_table": "You are at the white meeting table with purple chairs. Walk straight about 2 steps to reach the orange sofa area.",
+            "poi_orange_green_sofa": "You have reached the orange sofa area, with the sofa against the wall. Nearby are a green high-back armchair and two black side tables.",
+        },
+    },
+}
+
+
+@dataclass(frozen=True)
+class SiteTemplates:
+    """一个 (站点, provider) 的预计算响应；matching_data 由所有请求共享，只读"""
+    site_id: str
+    provider: str
+    preset_output: str = DEFAULT_PRESET_OUTPUT
+    matching_data: Dict[str, Any] = field(default_factory=dict)
+    nodes: Dict[str, Dict[str, str]] = field(default_factory=dict)     # lang -> node_id -> 文本
+
+    def location_info(self, node_id: str, lang: str = DEFAULT_LANG) -> str:
+        lang = lang if lang in LOCATION_FALLBACK else DEFAULT_LANG
+        text = self.nodes.get(lang, {}).get(node_id)
+        return text if text is not None else LOCATION_FALLBACK[lang].format(node_id=node_id)
+
+
+def read_preset_record(path: Optional[str]) -> Dict[str, Any]:
+    """预设输出 JSONL 的首行记录；文件缺失、为空或无法解析时返回 {}"""
+    if not path:
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            first_line = f.readline().strip()
+        return json.loads(first_line) if first_line else {}
+    except (OSError, ValueError) as e:
+        log.warning("failed to load preset output from %s: %s", os.path.basename(path), e)
+        return {}
+
+
+def read_node_instructions(path: str) -> Dict[str, Dict[str, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {lang: {str(k): str(v) for k, v in nodes.items()} for lang, nodes in data.items()}
+
+
+class ResponseTemplates:
+    """按 (站点, provider) 缓存 SiteTemplates；预设文件或模板文件变化后重建"""
+
+    def __init__(self, registry: Optional[SceneRegistry] = None, check_interval_s: float = CHECK_INTERVAL_S):
+        self.registry = registry
+        self.check_interval_s = check_interval_s
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], Tuple[float, Tuple, SiteTemplates]] = {}
+
+    def attach(self, registry: SceneRegistry):
+        """使用服务的 SceneRegistry（站点清单）"""
+        with self._lock:
+            self.registry = registry
+            self._entries.clear()
+
+    def site_registry(self) -> SceneRegistry:
+        if self.registry is None:
+            self.registry = SceneRegistry()
+        return self.registry
+
+    def _sources(self, site_id: str, provider: str) -> Tuple[Optional[str], Optional[str]]:
+        registry = self.site_registry()
+        return registry.preset_file(provider, site_id), registry.index_file(site_id, "templates")
+
+    def _build(self, site_id: str, provider: str, preset_path: Optional[str],
+               templates_path: Optional[str]) -> SiteTemplates:
+        record = read_preset_record(preset_path)
+        nodes = NODE_INSTRUCTIONS.get(site_id, {})
+        if templates_path:
+            try:
+                nodes = read_node_instructions(templates_path)
+            except (OSError, ValueError, AttributeError) as e:
+                log.warning("invalid response templates %s: %s", templates_path, e)
+        templates = SiteTemplates(site_id, provider, record.get("output") or DEFAULT_PRESET_OUTPUT, record, nodes)
+        log.info("response templates built", extra={"fields": {
+            "site_id": site_id, "provider": provider, "preset": bool(record),
+            "nodes": {lang: len(texts) for lang, texts in nodes.items()}}})
+        return templates
+
+    def get(self, site_id: str, provider: str) -> SiteTemplates:
+        """(站点, provider) 的模板；首次访问或源文件变化时构建"""
+        key = (site_id, (provider or "").lower())
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[0] < self.check_interval_s:
+            return entry[2]
+        with self._lock:
+            sources = self._sources(*key)
+            stamp = source_stamp(f for f in sources if f)
+            if entry is not None and entry[1] == stamp:
+                templates = entry[2]
+            else:
+                templates = self._build(key[0], key[1], *sources)
+            self._entries[key] = (now, stamp, templates)
+            return templates
+
+    def warm(self) -> int:
+        """为清单中每个站点声明的每个 provider 预先构建模板，返回构建数"""
+        registry = self.site_registry()
+        count = 0
+        for site_id in registry.sites():
+            for provider in registry.spec(site_id).presets:
+                self.get(site_id, provider)
+                count += 1
+        return count
+
+    def preset_output(self, provider: str, site_id: str) -> str:
+        return self.get(site_id, provider).preset_output
+
+    def matching_data(self, provider: str, site_id: str) -> Dict[str, Any]:
+        return self.get(site_id, provider).matching_data
+
+    def location_info(self, site_id: str, node_id: str, lang: str = DEFAULT_LANG, provider: str = "") -> str:
+        return self.get(site_id, provider).location_info(node_id, lang)
+
+
+RESPONSE_TEMPLATES = ResponseTemplates()
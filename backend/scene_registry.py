@@ -0,0 +1,722 @@
+"""
+Immutable per-site scene registry
+按站点缓存的只读场景模型：结构图节点、拓扑邻接表、细节记录在首次使用时加载一次，
+之后所有请求共享同一个 SceneModel，检索过程不再修改任何共享状态。
+
+站点由清单文件声明（data/sites.json，以及 data/sites.d/*.json 片段），每个站点给出
+结构/细节/预设输出文件与索引产物；新增楼层只需放入数据文件和清单条目，不用修改 app.py。
+常驻内存的站点数与估算内存均有上限，超出时按 LRU 淘汰（正在使用的 SceneModel 不受影响，
+淘汰后下次访问重新加载）。
+
+热更新：reload() 在后台重新构建站点的 SceneModel，构建完成后在锁内原子替换并递增该站点的版本号；
+正在处理的请求通过 pin() 固定自己使用的 SceneModel，不会在请求中途看到新旧数据混用。
+SceneWatcher 轮询数据文件的 (mtime, size)，变化且稳定后自动触发 reload。
+"""
+
+import os
+import re
+import glob
+import json
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from structured_log import get_logger
+from detail_index import DetailIndex
+from bm25_channel import BM25FIndex, build_detail_index, build_node_index
+from semantic_groups import build_group_table
+
+log = get_logger("scene")
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+# 关键词兜底：别名解析后仍无细节记录时，按锚点关键词回退到这些细节键（按顺序匹配第一条规则）
+DETAIL_KEYWORD_FALLBACK = (
+    (("entrance", "door"), ("dp_ms_entrance",)),
+    (("atrium",), ("atrium_edge",)),
+    (("printer",), ("tv_zone", "desks_cluster")),
+    (("box",), ("storage_corner", "orange_sofa_corner")),
+    (("bookshelf", "qr"), ("chair_on_yline",)),
+    (("trash", "bin"), ("small_table_mid",)),
+)
+
+_POI_CODE_RE = re.compile(r"^(poi\d+)")
+
+# 站点清单（相对路径均相对于主清单所在目录）
+SITE_MANIFEST = os.getenv("SITE_MANIFEST", os.path.join(DATA_DIR, "sites.json"))
+SITE_MANIFEST_DIR = "sites.d"
+# 常驻站点上限与估算内存上限（MB），超出按 LRU 淘汰
+SCENE_MAX_RESIDENT = int(os.getenv("SCENE_MAX_RESIDENT", "16"))
+SCENE_MAX_MB = float(os.getenv("SCENE_MAX_MB", "512"))
+# 解析后的 Python 对象约为磁盘 JSON 大小的数倍，用于估算常驻内存
+JSON_MEMORY_FACTOR = 6
+# 数据文件轮询间隔（秒），0 表示不启动文件监视
+SCENE_WATCH_INTERVAL = float(os.getenv("SCENE_WATCH_INTERVAL", "0"))
+
+# 当前请求固定使用的场景模型：(注册表id, site_id) -> SceneModel
+_PINNED: contextvars.ContextVar = contextvars.ContextVar("pinned_scenes", default=None)
+
+# 没有清单文件时的内置站点 → (结构文件, 细节文件)
+SITE_FILES = {
+    "SCENE_A_MS": ("Sense_A_Finetuned.fixed.jsonl", "Sense_A_MS.jsonl"),
+    "SCENE_B_STUDIO": ("Sense_B_Finetuned.fixed.jsonl", "Sense_B_Studio.jsonl"),
+}
+
+
+@dataclass(frozen=True)
+class SiteSpec:
+    """清单中的一个站点（路径均已解析为绝对路径）"""
+    site_id: str
+    structure_file: str
+    detail_file: str
+    name: str = ""
+    presets: Dict[str, str] = field(default_factory=dict)     # provider -> 预设输出文件
+    index: Dict[str, str] = field(default_factory=dict)       # 产物名 -> 文件（embeddings / ids / faiss ...）
+
+    def preset_file(self, provider: str) -> Optional[str]:
+        return self.presets.get((provider or "").lower())
+
+    def source_files(self) -> Tuple[str, ...]:
+        """热更新需要监视的全部文件"""
+        files = [self.structure_file, self.detail_file, *self.presets.values(), *self.index.values()]
+        return tuple(dict.fromkeys(f for f in files if f))
+
+
+def source_stamp(files) -> Tuple[Tuple[str, int, int], ...]:
+    """文件指纹：(路径, mtime_ns, 大小)，不存在的文件记为 (路径, 0, -1)"""
+    out = []
+    for path in files:
+        try:
+            st = os.stat(path)
+            out.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            out.append((path, 0, -1))
+    return tuple(out)
+
+
+def _spec_from_entry(site_id: str, entry: Dict[str, Any], base_dir: str) -> SiteSpec:
+    def resolve(path):
+        return os.path.normpath(os.path.join(base_dir, path)) if path else ""
+    return SiteSpec(
+        site_id=site_id,
+        structure_file=resolve(entry.get("structure")),
+        detail_file=resolve(entry.get("detail")),
+        name=entry.get("name", ""),
+        presets={k.lower(): resolve(v) for k, v in (entry.get("presets") or {}).items() if v},
+        index={k: resolve(v) for k, v in (entry.get("index") or {}).items() if v},
+    )
+
+
+def load_site_manifest(manifest_path: str = SITE_MANIFEST, data_dir: str = DATA_DIR) -> Dict[str, SiteSpec]:
+    """读取站点清单及同目录 sites.d/*.json 片段（按文件名顺序，后者覆盖前者）
+
+    片段中的相对路径同样相对于主清单所在目录，数据文件统一放在数据目录下。清单不存在时回退到内置 SITE_FILES（相对于 data_dir）。条目缺少 structure 的站点被忽略。
+    """
+    specs: Dict[str, SiteSpec] = {}
+    base_dir = os.path.dirname(os.path.abspath(manifest_path)) if manifest_path else data_dir
+    paths = []
+    if manifest_path and os.path.exists(manifest_path):
+        paths.append(manifest_path)
+        paths.extend(sorted(glob.glob(os.path.join(os.path.dirname(manifest_path), SITE_MANIFEST_DIR, "*.json"))))
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            log.warning("site manifest unreadable: %s (%s)", path, e)
+            continue
+        for site_id, entry in (doc.get("sites") or {}).items():
+            if not isinstance(entry, dict) or not entry.get("structure"):
+                log.warning("site %s in %s has no structure file, skipped", site_id, path)
+                continue
+            specs[site_id] = _spec_from_entry(site_id, entry, base_dir)
+
+    if not paths:
+        specs = {site_id: _spec_from_entry(site_id, {"structure": s, "detail": d}, data_dir)
+                 for site_id, (s, d) in SITE_FILES.items()}
+    return specs
+
+
+@dataclass(frozen=True)
+class SceneModel:
+    """单个站点的只读场景数据"""
+    site_id: str
+    structure_file: str
+    detail_file: str
+    structure_data: Dict[str, Any]
+    nodes: Tuple[Dict[str, Any], ...]                   # 结构通道节点（已统一为对象格式）
+    topology_graph: Dict[str, Tuple[str, ...]]          # node_id -> 邻居
+    detail_records: Tuple[Dict[str, Any], ...]          # 细节文件全部记录（文件顺序）
+    detail_by_hint: Dict[str, Tuple[Dict[str, Any], ...]] = field(default_factory=dict)
+    detail_by_key: Dict[str, Tuple[Dict[str, Any], ...]] = field(default_factory=dict)
+    alias_table: Dict[str, str] = field(default_factory=dict)          # 结构节点ID -> 细节键
+    details_by_node: Dict[str, Tuple[Dict[str, Any], ...]] = field(default_factory=dict)
+    detail_keys: Tuple[str, ...] = ()                   # 细节键（首次出现顺序）
+    detail_key_index: Optional[np.ndarray] = None       # 每条细节记录 -> detail_keys 下标（无键为 -1）
+    detail_key_sizes: Optional[np.ndarray] = None       # 每个细节键的记录数
+    detail_index: Optional[DetailIndex] = None          # 细节记录倒排索引
+    hinted_records: frozenset = frozenset()             # 带 node_hint 的记录下标
+    bm25_nodes: Optional[BM25FIndex] = None             # 结构通道 BM25F 索引（与 nodes 顺序一致）
+    bm25_details: Optional[BM25FIndex] = None           # 细节通道 BM25F 索引（与 detail_records 顺序一致）
+    dedup_groups: Dict[Tuple[str, str], Optional[str]] = field(default_factory=dict)  # (节点ID, 名称) -> 语义去重分组
+    has_detail: bool = False
+    approx_bytes: int = 0                               # 估算的常驻内存（LRU 内存上限用）
+    version: int = 1                                    # 数据版本（每次热更新 +1）
+    source_stamp: Tuple[Tuple[str, int, int], ...] = () # 加载时的源文件指纹
+
+    @property
+    def topology_empty(self) -> bool:
+        return len(self.topology_graph) == 0
+
+    def neighbors(self, node_id: str) -> Tuple[str, ...]:
+        return self.topology_graph.get(node_id, ())
+
+    def details_for_hint(self, node_hint: str) -> List[Dict[str, Any]]:
+        return list(self.detail_by_hint.get(node_hint, ()))
+
+    def alias_for(self, node_id: str) -> str:
+        """结构节点ID → 细节键（无映射时返回原ID）"""
+        return self.alias_table.get(node_id, node_id)
+
+    def details_for_node(self, node_id: str) -> List[Dict[str, Any]]:
+        """节点的细节记录（结构节点走预计算表，其它ID按细节键+关键词兜底解析）"""
+        details = self.details_by_node.get(node_id)
+        if details is None:
+            details = _resolve_details(self.alias_for(node_id), self.detail_by_key, self.detail_records)
+        return list(details)
+
+
+@dataclass
+class RetrievalState:
+    """每个会话的检索状态（由调用方持有并显式传入 retrieve）"""
+    last_top1_id: Optional[str] = None
+    repeat_count: int = 0
+
+    def advance(self, top1_id: str) -> int:
+        """记录本次 top1，返回连续识别次数"""
+        if self.last_top1_id is not None and top1_id == self.last_top1_id:
+            self.repeat_count += 1
+        else:
+            self.repeat_count = 1
+        self.last_top1_id = top1_id
+        return self.repeat_count
+
+    def rebase(self, base: "RetrievalState", current: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """把本次检索相对 base（检索前读到的状态）的推进重放到后端的当前值上
+
+        配合 SessionBackend.update 使用：同一会话的并发请求各自的 advance 都会保留，不会互相覆盖。
+        """
+        state = RetrievalState.from_dict(current)
+        if self != base and self.last_top1_id is not None:
+            state.advance(self.last_top1_id)
+        return state.to_dict()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"last_top1_id": self.last_top1_id, "repeat_count": self.repeat_count}
+
+    @classmethod
+    def from_dict(cls, d: Optional[Dict[str, Any]]) -> "RetrievalState":
+        d = d or {}
+        return cls(last_top1_id=d.get("last_top1_id"), repeat_count=int(d.get("repeat_count", 0) or 0))
+
+
+def _read_structure_doc(path: str) -> Optional[Dict[str, Any]]:
+    """读取textmap文件 - 支持JSON和JSONL两种格式（JSONL只读取第一行）"""
+    if not os.path.exists(path):
+        log.warning("structure file not found: %s", path)
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        return json.loads(line)
+        except Exception as e:
+            log.warning("cannot read structure file %s: %s", path, e)
+    return None
+
+
+def _extract_nodes(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """提取节点 - 检查input.topology和顶级topology，并把字符串节点转换为对象格式"""
+    nodes = []
+    if "input" in doc and "topology" in doc["input"]:
+        nodes = doc["input"]["topology"].get("nodes", [])
+    elif "topology" in doc:
+        nodes = doc["topology"].get("nodes", [])
+
+    if nodes and isinstance(nodes[0], str):
+        # 字符串数组格式：从pois中补全节点信息
+        pois = doc.get("input", {}).get("pois", {})
+        retrieval = doc.get("input", {}).get("retrieval", {})
+        processed = []
+        for node_id in nodes:
+            node_info = pois.get(node_id)
+            processed.append({
+                "id": node_id,
+                "name": node_info.get("name", "") if node_info else node_id,
+                "retrieval": retrieval,
+                "landmarks": [],
+                "categories": []
+            })
+        return processed
+    return list(nodes)
+
+
+def _build_topology_graph(doc: Dict[str, Any]) -> Dict[str, Tuple[str, ...]]:
+    """构建拓扑邻接表（无向）"""
+    topology = doc.get("input", {}).get("topology", {})
+    nodes = topology.get("nodes", [])
+    edges = topology.get("edges", [])
+    if not nodes:
+        return {}
+
+    graph = {}
+    for node in nodes:
+        node_id = node["id"] if isinstance(node, dict) else node
+        neighbors = []
+        for edge in edges:
+            if edge["from"] == node_id:
+                neighbors.append(edge["to"])
+            elif edge["to"] == node_id:
+                neighbors.append(edge["from"])
+        graph[node_id] = tuple(neighbors)
+    return graph
+
+
+def _read_detail_records(path: str) -> List[Dict[str, Any]]:
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                log.warning("%s line %d: JSON decode error: %s", path, line_num, e)
+    return records
+
+
+def detail_key(item: Dict[str, Any]) -> str:
+    """细节记录的键：优先 node_hint，其次 fusion.links.textmap_node_id"""
+    hint = item.get("node_hint")
+    if hint:
+        return hint
+    links = (item.get("fusion") or {}).get("links") or {}
+    return links.get("textmap_node_id") or ""
+
+
+def _record_poi_codes(item: Dict[str, Any]) -> List[str]:
+    poi = item.get("poi") or {}
+    if poi.get("code"):
+        return [str(poi["code"]).lower()]
+    return [str(c).lower() for c in poi.get("codes") or []]
+
+
+def build_alias_table(node_ids: List[str], records: List[Dict[str, Any]]) -> Dict[str, str]:
+    """根据细节记录中的 poi.code/poi.codes 生成 结构节点ID → 细节键 映射
+
+    结构节点ID以 POI 编号开头（如 poi03_black_drawer_cabinet）。优先取文件中第一条
+    只标注该 POI 的记录，其次取第一条在 codes 列表中包含该 POI 的记录。
+    """
+    single, shared = {}, {}
+    for item in records:
+        key = detail_key(item)
+        codes = _record_poi_codes(item)
+        if not key or not codes:
+            continue
+        target = single if len(codes) == 1 else shared
+        for code in codes:
+            target.setdefault(code, key)
+
+    table = {}
+    for node_id in node_ids:
+        m = _POI_CODE_RE.match(node_id.lower())
+        if not m:
+            continue
+        alias = single.get(m.group(1)) or shared.get(m.group(1))
+        if alias:
+            table[node_id] = alias
+    return table
+
+
+def _resolve_details(anchor: str, by_key: Dict[str, Tuple[Dict[str, Any], ...]],
+                     records) -> Tuple[Dict[str, Any], ...]:
+    """细节键精确匹配，0命中时按关键词兜底（保持文件顺序）"""
+    details = by_key.get(anchor)
+    if details:
+        return details
+    k = anchor.lower()
+    for keywords, keys in DETAIL_KEYWORD_FALLBACK:
+        if any(w in k for w in keywords):
+            return tuple(item for item in records if detail_key(item) in keys)
+    return ()
+
+
+def _readonly(arr: np.ndarray) -> np.ndarray:
+    arr.setflags(write=False)
+    return arr
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _estimate_bytes(structure_file: str, detail_file: str, arrays) -> int:
+    """常驻内存估算：解析后的 JSON 按磁盘大小的倍数计，加上预计算数组"""
+    json_bytes = (_file_size(structure_file) + _file_size(detail_file)) * JSON_MEMORY_FACTOR
+    return int(json_bytes + sum(a.nbytes for a in arrays if a is not None))
+
+
+def load_scene_model(site_id: str, data_dir: str = DATA_DIR, spec: Optional[SiteSpec] = None,
+                     version: int = 1) -> Optional[SceneModel]:
+    """从数据文件构建 SceneModel；未知站点返回 None
+
+    spec: 清单中的站点条目；省略时按 data_dir 下的清单查找
+    """
+    if spec is None:
+        spec = load_site_manifest(os.path.join(data_dir, "sites.json"), data_dir).get(site_id)
+    if spec is None:
+        log.warning("unknown scene: %s", site_id)
+        return None
+
+    structure_file = spec.structure_file
+    detail_file = spec.detail_file
+    # 先取指纹再读文件：读取期间若文件又被修改，指纹不一致，监视器会再触发一次重载
+    stamp = source_stamp(spec.source_files())
+
+    doc = _read_structure_doc(structure_file) or {}
+    nodes = _extract_nodes(doc) if doc else []
+    try:
+        topology_graph = _build_topology_graph(doc)
+    except Exception as e:
+        log.warning("topology graph build failed for %s: %s", site_id, e)
+        topology_graph = {}
+    if not topology_graph:
+        log.warning("empty topology graph: %s", site_id)
+
+    records = _read_detail_records(detail_file)
+    by_hint, by_key = {}, {}
+    for item in records:
+        hint = item.get("node_hint", "")
+        if hint:
+            by_hint.setdefault(hint, []).append(item)
+        key = detail_key(item)
+        if key:
+            by_key.setdefault(key, []).append(item)
+    by_key = {k: tuple(v) for k, v in by_key.items()}
+    key_pos = {k: i for i, k in enumerate(by_key)}
+
+    # 别名表与节点细节表在加载时一次性生成，请求路径只做字典查找
+    node_ids = [n["id"] for n in nodes if isinstance(n, dict) and n.get("id")]
+    alias_table = build_alias_table(node_ids, records)
+    details_by_node = {
+        node_id: _resolve_details(alias_table.get(node_id, node_id), by_key, records)
+        for node_id in node_ids
+    }
+
+    scene_tags = doc.get("input", {}).get("retrieval", {}).get("tags", []) if doc else []
+
+    has_detail = bool(detail_file) and os.path.exists(detail_file) and os.path.getsize(detail_file) > 0
+    detail_key_index = _readonly(np.array([key_pos.get(detail_key(item), -1) for item in records], dtype=np.intp))
+    detail_key_sizes = _readonly(np.array([len(v) for v in by_key.values()], dtype=np.float64))
+    bm25_nodes = build_node_index(nodes, details_by_node, scene_tags)
+    bm25_details = build_detail_index(records)
+
+    model = SceneModel(
+        site_id=site_id,
+        structure_file=structure_file,
+        detail_file=detail_file,
+        structure_data=doc,
+        nodes=tuple(nodes),
+        topology_graph=topology_graph,
+        detail_records=tuple(records),
+        detail_by_hint={k: tuple(v) for k, v in by_hint.items()},
+        detail_by_key=by_key,
+        detail_keys=tuple(by_key.keys()),
+        detail_key_index=detail_key_index,
+        detail_key_sizes=detail_key_sizes,
+        detail_index=DetailIndex(records),
+        hinted_records=frozenset(i for i, item in enumerate(records) if item.get("node_hint")),
+        bm25_nodes=bm25_nodes,
+        bm25_details=bm25_details,
+        dedup_groups=build_group_table(nodes),
+        alias_table=alias_table,
+        details_by_node=details_by_node,
+        has_detail=has_detail,
+        approx_bytes=_estimate_bytes(structure_file, detail_file, (
+            detail_key_index, detail_key_sizes,
+            bm25_nodes.doc_ids, bm25_nodes.weights, bm25_details.doc_ids, bm25_details.weights)),
+        version=version,
+        source_stamp=stamp,
+    )
+    log.info("scene model loaded", extra={"fields": {
+        "site_id": site_id, "nodes": len(nodes), "detail_records": len(records),
+        "hinted_nodes": len(by_hint), "aliased_nodes": len(alias_table),
+        "approx_bytes": model.approx_bytes, "version": version}})
+    return model
+
+
+class SceneRegistry:
+    """站点 → SceneModel 的懒加载注册表（线程安全，加载后只读）
+
+    站点列表来自清单；常驻站点数超过 max_resident 或估算内存超过 max_mb 时，
+    淘汰最久未使用的站点（刚加载的站点不会被立即淘汰）。
+    冷加载在注册表锁之外进行（同一站点的并发请求共享一次加载），不阻塞其他站点的 get()。
+    reload() 在后台重建并原子替换站点模型，版本号按站点单调递增（淘汰后重新加载不改变版本）。
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR, manifest_path: Optional[str] = None,
+                 max_resident: Optional[int] = None, max_mb: Optional[float] = None):
+        self.data_dir = data_dir
+        if manifest_path is None:
+            manifest_path = SITE_MANIFEST if data_dir == DATA_DIR else os.path.join(data_dir, "sites.json")
+        self.manifest_path = manifest_path
+        self.max_resident = max(1, max_resident if max_resident is not None else SCENE_MAX_RESIDENT)
+        self.max_bytes = int((max_mb if max_mb is not None else SCENE_MAX_MB) * 1024 * 1024)
+        self._specs = load_site_manifest(manifest_path, data_dir)
+        self._manifest_stamp = self._read_manifest_stamp()
+        self._models: "OrderedDict[str, SceneModel]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._loading: Dict[str, Future] = {}     # 正在冷加载的站点 -> 加载结果
+        self._reload_lock = threading.Lock()
+        self._reloader: Optional[ThreadPoolExecutor] = None
+        self._listeners: List[Callable[[str, SceneModel], None]] = []
+        self.loads = 0
+        self.evictions = 0
+        self.reloads = 0
+
+    def get(self, site_id: Optional[str]) -> Optional[SceneModel]:
+        if not site_id:
+            return None
+        pinned = _PINNED.get()
+        if pinned:
+            model = pinned.get((id(self), site_id))
+            if model is not None:
+                return model
+        with self._lock:
+            model = self._models.get(site_id)
+            if model is not None:
+                self._models.move_to_end(site_id)
+                return model
+            spec = self._specs.get(site_id)
+            if spec is None:
+                log.warning("unknown scene: %s", site_id)
+                return None
+            loading = self._loading.get(site_id)
+            if loading is None:
+                loading = self._loading[site_id] = Future()
+                owner, version = True, self._versions.get(site_id, 1)
+            else:
+                owner = False
+        if not owner:
+            # 同一站点正在由另一个请求加载：等待其结果，不重复加载
+            return loading.result()
+        # 读文件、建别名 / 倒排 / BM25 表都在锁外进行：其他站点（包括已常驻的）的 get 不受影响
+        try:
+            model = load_scene_model(site_id, self.data_dir, spec, version)
+        except BaseException as e:
+            with self._lock:
+                self._loading.pop(site_id, None)
+            loading.set_exception(e)
+            raise
+        with self._lock:
+            self._loading.pop(site_id, None)
+            current = self._models.get(site_id)
+            if current is not None:
+                # 加载期间 reload() 已装入更新的版本
+                model = current
+            elif model is not None:
+                self.loads += 1
+                self._versions.setdefault(site_id, model.version)
+                self._models[site_id] = model
+                self._evict()
+        loading.set_result(model)
+        return model
+
+    def peek(self, site_id: Optional[str]) -> Optional[SceneModel]:
+        """已常驻的站点模型；不触发加载，也不改变 LRU 顺序"""
+        with self._lock:
+            return self._models.get(site_id) if site_id else None
+
+    def pin(self, site_id: Optional[str]) -> Optional[SceneModel]:
+        """把站点当前的 SceneModel 固定到当前上下文（请求）：之后本请求内的 get() 都返回同一版本"""
+        model = self.get(site_id)
+        if model is not None:
+            pinned = dict(_PINNED.get() or {})
+            pinned[(id(self), site_id)] = model
+            _PINNED.set(pinned)
+        return model
+
+    def version(self, site_id: Optional[str]) -> Optional[int]:
+        """站点的当前数据版本（尚未加载过的站点为 None）"""
+        return self._versions.get(site_id) if site_id else None
+
+    def _evict(self):
+        """按 LRU 淘汰，直到满足站点数与内存上限（至少保留最近使用的一个）"""
+        while len(self._models) > 1 and (
+                len(self._models) > self.max_resident or self.resident_bytes() > self.max_bytes):
+            site_id, model = self._models.popitem(last=False)
+            self.evictions += 1
+            log.info("scene model evicted", extra={"fields": {
+                "site_id": site_id, "approx_bytes": model.approx_bytes,
+                "resident": len(self._models)}})
+
+    # ---- 热更新 ----
+
+    def add_reload_listener(self, fn: Callable[[str, SceneModel], None]):
+        """注册重载回调 fn(site_id, new_model)，在后台重载线程中调用（如预热向量索引）"""
+        self._listeners.append(fn)
+
+    def reload(self, site_id: str) -> Optional[SceneModel]:
+        """同步重建站点模型并原子替换，返回新模型；失败或新数据明显不完整时保留旧模型并返回 None"""
+        with self._reload_lock:
+            spec = self._specs.get(site_id)
+            if spec is None:
+                log.warning("reload of unknown scene: %s", site_id)
+                return None
+            old = self._models.get(site_id)
+            version = self._versions.get(site_id, 0) + 1
+            try:
+                model = load_scene_model(site_id, self.data_dir, spec, version)
+            except Exception as e:
+                log.warning("scene reload failed for %s: %s", site_id, e)
+                return None
+            if model is None or (not model.nodes and (old is None or old.nodes)):
+                # 结构文件缺失或正被改写（解析失败）时不要用空模型替换
+                log.warning("scene reload of %s produced no nodes, keeping version %s",
+                            site_id, self._versions.get(site_id))
+                return None
+            with self._lock:
+                self._versions[site_id] = version
+                self._models[site_id] = model
+                self._models.move_to_end(site_id)
+                self.reloads += 1
+                self._evict()
+            log.info("scene model reloaded", extra={"fields": {"site_id": site_id, "version": version}})
+        # 回调在释放 _reload_lock 后调用，慢回调不会阻塞其他站点的重载
+        for fn in list(self._listeners):
+            try:
+                fn(site_id, model)
+            except Exception as e:
+                log.warning("reload listener failed for %s: %s", site_id, e)
+        return model
+
+    def reload_async(self, site_id: str) -> Future:
+        """在后台线程中 reload；请求继续使用旧模型直到替换完成"""
+        with self._lock:
+            if self._reloader is None:
+                self._reloader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scene-reload")
+        return self._reloader.submit(self.reload, site_id)
+
+    def _read_manifest_stamp(self):
+        files = [self.manifest_path] if self.manifest_path else []
+        if self.manifest_path:
+            files += sorted(glob.glob(os.path.join(os.path.dirname(self.manifest_path), SITE_MANIFEST_DIR, "*.json")))
+        return source_stamp(files)
+
+    def reload_manifest(self) -> List[str]:
+        """重新读取站点清单，返回条目有变化且已常驻（需要重载）的站点"""
+        specs = load_site_manifest(self.manifest_path, self.data_dir)
+        with self._lock:
+            changed = [sid for sid, model in self._models.items() if specs.get(sid) != self._specs.get(sid)]
+            self._specs = specs
+            self._manifest_stamp = self._read_manifest_stamp()
+        return changed
+
+    def stale_sites(self) -> List[str]:
+        """源文件指纹与加载时不同的常驻站点"""
+        with self._lock:
+            models = list(self._models.items())
+        specs = self._specs
+        return [sid for sid, model in models
+                if sid in specs and model.source_stamp != source_stamp(specs[sid].source_files())]
+
+    def manifest_changed(self) -> bool:
+        return self._read_manifest_stamp() != self._manifest_stamp
+
+    def reload_queue_depth(self) -> int:
+        """等待后台重载的任务数（/metrics 的 gauge）"""
+        reloader = self._reloader
+        return reloader._work_queue.qsize() if reloader is not None else 0
+
+    def resident_bytes(self) -> int:
+        return sum(m.approx_bytes for m in self._models.values())
+
+    def resident(self) -> List[str]:
+        """当前常驻的站点（最久未使用在前）"""
+        with self._lock:
+            return list(self._models.keys())
+
+    def spec(self, site_id: Optional[str]) -> Optional[SiteSpec]:
+        return self._specs.get(site_id) if site_id else None
+
+    def preset_file(self, provider: str, site_id: Optional[str]) -> Optional[str]:
+        """provider + 站点 → 预设输出文件（清单未声明时为 None）"""
+        spec = self.spec(site_id)
+        return spec.preset_file(provider) if spec else None
+
+    def index_file(self, site_id: Optional[str], artifact: str) -> Optional[str]:
+        """站点索引产物路径（embeddings / ids / faiss ...）"""
+        spec = self.spec(site_id)
+        return spec.index.get(artifact) if spec else None
+
+    def sites(self) -> List[str]:
+        return list(self._specs.keys())
+
+
+class SceneWatcher(threading.Thread):
+    """轮询站点清单与常驻站点的源文件，变化后（连续两次轮询指纹相同，避免读到写了一半的文件）后台重载"""
+
+    def __init__(self, registry: SceneRegistry, interval: float = SCENE_WATCH_INTERVAL):
+        super().__init__(name="scene-watcher", daemon=True)
+        self.registry = registry
+        self.interval = max(0.1, interval)
+        self._stop_event = threading.Event()
+        self._pending: Dict[str, Any] = {}      # site_id / "__manifest__" -> 上次看到的新指纹
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                log.warning("scene watcher poll failed: %s", e)
+
+    def _settled(self, key: str, stamp) -> bool:
+        """指纹与上次轮询相同才视为写入完成"""
+        if self._pending.get(key) == stamp:
+            del self._pending[key]
+            return True
+        self._pending[key] = stamp
+        return False
+
+    def poll(self) -> List[str]:
+        """检查一次，返回本次触发重载的站点"""
+        registry = self.registry
+        triggered = []
+        if registry.manifest_changed() and self._settled("__manifest__", registry._read_manifest_stamp()):
+            triggered.extend(registry.reload_manifest())
+        for site_id in registry.stale_sites():
+            stamp = source_stamp(registry.spec(site_id).source_files())
+            if site_id not in triggered and self._settled(site_id, stamp):
+                triggered.append(site_id)
+        for site_id in triggered:
+            log.info("scene source changed, reloading", extra={"fields": {"site_id": site_id}})
+            registry.reload(site_id)
+        return triggered
@@ -0,0 +1,111 @@
+"""
+Precomputed semantic-dedup labels
+结构通道语义去重的分组标签：只依赖候选的静态字段（节点ID / 名称），在场景加载时对每个节点计算一次，
+请求路径上的去重只需按标签做一次 O(n) 分组。
+
+分组规则与原先 `_semantic_deduplication` 内联实现相同：
+1. 实体别名优先：节点ID 等于规范名称时，使用其第一个别名（细节数据ID）作为分组
+2. 否则按语义组关键词打分（ID 命中 +2，文本 +1.5，名称 +1.0），取最高分的组；低于 1.0 不分组
+"""
+
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+# 语义相似组 - 增强版，更精确的区分
+SEMANTIC_GROUPS: Dict[str, Tuple[str, ...]] = {
+    "tv_screen_group": (
+        "tv screen", "large tv screen", "large tv screen near entry",
+        "tv", "television", "display", "screen", "monitor"
+    ),
+    "window_group": (
+        "glass window", "window wall", "windows", "glass", "window"
+    ),
+    "sofa_group": (
+        "orange sofa", "sofa", "couch", "seating"
+    ),
+    "chair_group": (
+        "chair", "chair_on", "yline", "seating", "stool"
+    ),
+    "space_group": (
+        "open space", "large open space", "open area", "atrium", "space"
+    ),
+    "boxes_group": (
+        "boxes", "box", "cardboard", "stacked", "floor", "on floor"
+    ),
+    "desk_group": (
+        "desk", "desks", "workbench", "workstation", "computer"
+    ),
+    "table_group": (
+        "table", "surface", "counter", "small_table"
+    ),
+    "storage_group": (
+        "storage", "shelf", "cabinet", "drawer", "container"
+    ),
+    "wall_group": (
+        "wall", "drawer_wall", "component_wall", "partition"
+    ),
+}
+
+# 实体别名映射，识别同一实体的不同表示（修复节点ID不匹配）
+ENTITY_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "poi01_entrance_glass_door": ("dp_ms_entrance", "entrance", "glass door"),
+    "poi02_green_trash_bin": ("yline_start", "trash bin", "green bin"),
+    "poi03_black_drawer_cabinet": ("yline_bend_mid", "drawer cabinet", "black cabinet"),
+    "poi04_wall_3d_printers": ("atrium_edge", "3d printers", "wall printers"),
+    "poi05_desk_3d_printer": ("tv_zone", "desk printer", "3d printer"),
+    "poi06_small_open_3d_printer": ("storage_corner", "small printer", "open printer"),
+    "poi07_cardboard_boxes": ("orange_sofa_corner", "cardboard boxes", "boxes"),
+    "poi08_to_atrium": ("desks_cluster", "atrium", "to atrium"),
+    "poi09_qr_bookshelf": ("chair_on_yline", "qr bookshelf", "bookshelf"),
+    "poi10_metal_display_cabinet": ("small_table_mid", "metal cabinet", "display cabinet"),
+}
+
+# 规范名称 -> 分组（第一个别名作为细节数据ID）
+_ENTITY_GROUP = {canonical: aliases[0] for canonical, aliases in ENTITY_ALIASES.items()}
+
+GroupKey = Tuple[str, str]
+
+
+def semantic_group(candidate_id: str, text: str = "", name: str = "") -> Optional[str]:
+    """候选的去重分组；None 表示不属于任何组"""
+    candidate_id, text, name = candidate_id.lower(), text.lower(), name.lower()
+
+    entity_group = _ENTITY_GROUP.get(candidate_id)
+    if entity_group:
+        return entity_group
+
+    assigned_group = None
+    best_match_score = 0
+    for group_name, keywords in SEMANTIC_GROUPS.items():
+        match_score = 0
+        for keyword in keywords:
+            if keyword in candidate_id:
+                match_score += 2  # ID匹配给予最高权重
+            if keyword in text:
+                match_score += 1.5  # 文本匹配给予高权重
+            if keyword in name:
+                match_score += 1.0  # 名称匹配给予中等权重
+        # 选择匹配度最高的组（同分取先出现的组）
+        if match_score > best_match_score:
+            best_match_score = match_score
+            assigned_group = group_name
+
+    # 如果匹配度太低，则不分组
+    return assigned_group if best_match_score >= 1.0 else None
+
+
+def group_key(candidate: Dict[str, Any]) -> GroupKey:
+    """分组表的键：候选的 (ID, 文本)；结构通道候选的文本即节点名称，且不带 name 字段"""
+    return candidate["id"], candidate.get("text", "")
+
+
+def build_group_table(nodes: Sequence[Dict[str, Any]]) -> Dict[GroupKey, Optional[str]]:
+    """场景加载时为每个结构节点预先计算分组标签"""
+    table: Dict[GroupKey, Optional[str]] = {}
+    for node in nodes:
+        node_id = node.get("id", "") if isinstance(node, dict) else ""
+        if not node_id:
+            continue
+        key = (node_id, node.get("name", ""))
+        if key not in table:
+            table[key] = semantic_group(node_id, key[1])
+    return table
@@ -0,0 +1,193 @@
+"""
+Session / state backend for the TextNavi API
+会话状态后端：把 SESSIONS、LOG_SWITCH、拍照计数和检索器的连续识别状态从模块全局变量中抽出来，
+这样 `uvicorn app:app --workers N` 下所有 worker 看到的是同一份状态。
+
+Backends:
+- memory: 进程内字典 + RLock（默认，单 worker 行为与之前完全一致）
+- sqlite: 本地 SQLite 文件（WAL 模式），多 worker 共享，按 key 原子更新
+
+环境变量:
+- SESSION_BACKEND = memory | sqlite
+- SESSION_DB_PATH = SQLite 文件路径（默认 backend/session_state.db）
+"""
+
+import os
+import copy
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, List, Optional
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), "session_state.db")
+
+# 命名空间
+SESSION_NS = "session"          # session_id -> 会话字典（位置/朝向/置信度历史）
+LOG_SWITCH_NS = "log_switch"    # "{session_id}|{provider}" -> {"enabled": bool, "run_id": str}
+PHOTO_COUNT_NS = "photo_count"  # "{session_id}_{provider}_{site_id}" -> int
+RETRIEVER_NS = "retriever"      # "{session_id}_{provider}_{site_id}" -> {"last_top1_id": str, "repeat_count": int}
+PROFILE_NS = "profile"          # session_id -> {"enabled": bool, "mode": "sample"|"cprofile", "remaining": int}
+
+_MISSING = object()
+
+
+class SessionBackend(ABC):
+    """会话状态后端接口：按 (namespace, key) 存取 JSON 可序列化的值"""
+
+    name = "base"
+
+    @abstractmethod
+    def get(self, ns: str, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, ns: str, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, ns: str, key: str, fn: Callable[[Any], Any], default: Any = None) -> Any:
+        """原子读-改-写：fn(当前值或default) 的返回值写回并返回"""
+        raise NotImplementedError
+
+    def compare_and_set(self, ns: str, key: str, expected: Any, value: Any, default: Any = None) -> bool:
+        """当前值（缺失时视为 default）等于 expected 时写入 value，返回是否写入"""
+        swapped = [False]
+
+        def _cas(cur):
+            if cur == expected:
+                swapped[0] = True
+                return value
+            return cur
+
+        self.update(ns, key, _cas, default)
+        return swapped[0]
+
+    @abstractmethod
+    def delete(self, ns: str, key: str) -> None:
+        raise NotImplementedError
+
+    def contains(self, ns: str, key: str) -> bool:
+        return self.get(ns, key, _MISSING) is not _MISSING
+
+    @abstractmethod
+    def keys(self, ns: str) -> List[str]:
+        raise NotImplementedError
+
+
+class InProcessSessionBackend(SessionBackend):
+    """进程内实现：单 worker 默认后端"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def get(self, ns, key, default=None):
+        with self._lock:
+            bucket = self._data.get(ns)
+            if bucket is None or key not in bucket:
+                return default
+            # 返回副本：调用方修改后必须 set/update 回来，与 SQLite 后端语义一致
+            return copy.deepcopy(bucket[key])
+
+    def set(self, ns, key, value):
+        with self._lock:
+            self._data.setdefault(ns, {})[key] = copy.deepcopy(value)
+
+    def update(self, ns, key, fn, default=None):
+        with self._lock:
+            bucket = self._data.setdefault(ns, {})
+            cur = copy.deepcopy(bucket[key]) if key in bucket else copy.deepcopy(default)
+            new = fn(cur)
+            bucket[key] = copy.deepcopy(new)
+            return new
+
+    def delete(self, ns, key):
+        with self._lock:
+            self._data.get(ns, {}).pop(key, None)
+
+    def keys(self, ns):
+        with self._lock:
+            return list(self._data.get(ns, {}).keys())
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """SQLite 实现：多个 worker 进程共享同一个数据库文件"""
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, timeout: float = 10.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._local = threading.local()
+        d = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(d, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " PRIMARY KEY (ns, key))"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程共享，每个线程一个连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, ns, key, default=None):
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE ns=? AND key=?", (ns, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, ns, key, value):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (ns, key, value) VALUES (?, ?, ?)",
+            (ns, key, json.dumps(value, ensure_ascii=False)),
+        )
+
+    def update(self, ns, key, fn, default=None):
+        conn = self._conn()
+        # BEGIN IMMEDIATE 先拿写锁，保证跨进程的读-改-写是原子的
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM kv WHERE ns=? AND key=?", (ns, key)
+            ).fetchone()
+            cur = json.loads(row[0]) if row else copy.deepcopy(default)
+            new = fn(cur)
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (ns, key, value) VALUES (?, ?, ?)",
+                (ns, key, json.dumps(new, ensure_ascii=False)),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return new
+
+    def delete(self, ns, key):
+        self._conn().execute("DELETE FROM kv WHERE ns=? AND key=?", (ns, key))
+
+    def keys(self, ns):
+        rows = self._conn().execute("SELECT key FROM kv WHERE ns=?", (ns,)).fetchall()
+        return [r[0] for r in rows]
+
+
+def create_session_backend(kind: Optional[str] = None, db_path: Optional[str] = None) -> SessionBackend:
+    """根据 SESSION_BACKEND 环境变量创建后端"""
+    kind = (kind or os.getenv("SESSION_BACKEND", "memory")).lower()
+    if kind == "sqlite":
+        path = db_path or os.getenv("SESSION_DB_PATH", DEFAULT_DB_PATH)
+        print(f"✅ Session backend: sqlite ({path})")
+        return SQLiteSessionBackend(path)
+    if kind != "memory":
+        print(f"⚠️ Unknown SESSION_BACKEND={kind}, falling back to memory")
+    return InProcessSessionBackend()
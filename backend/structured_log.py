@@ -0,0 +1,163 @@
+"""
+Structured, level-gated logging for the locate/retrieval hot path
+检索热路径的结构化日志：
+
+- get_logger(name): 标准库 logging，统一挂在 "textnavi" 下；级别由 LOG_LEVEL 控制（默认 WARNING），
+  INFO/DEBUG 记录可按 LOG_SAMPLE_RATE 采样。记录先进入内存队列，由后台线程格式化为 JSON 行
+  写到 stderr，请求线程不会被慢速日志收集器阻塞。
+- RequestTrace: 每个请求的调试轨迹，只有在 debug=1 或 LOG_SWITCH 开启时才创建；
+  trace_event() 在没有轨迹时是空操作，请求结束时整条轨迹作为一条 JSON 记录输出。
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional
+
+ROOT_LOGGER = "textnavi"
+TRACE_LOGGER = "textnavi.trace"
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+_CURRENT_TRACE: contextvars.ContextVar = contextvars.ContextVar("request_trace", default=None)
+
+_configure_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """一条日志 = 一行 JSON（extra={"fields": {...}} 中的字段展开到顶层）"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            payload.update(fields)
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """按比例采样 WARNING 以下的记录；请求轨迹和告警不采样"""
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1.0 or record.levelno >= logging.WARNING or record.name == TRACE_LOGGER:
+            return True
+        return random.random() < self.rate
+
+
+def configure_logging(level: str = None, sample_rate: float = None, stream=None) -> logging.Logger:
+    """配置 textnavi 根日志器（幂等；重复调用只更新级别和采样率）"""
+    global _listener
+    root = logging.getLogger(ROOT_LOGGER)
+    with _configure_lock:
+        root.setLevel(level or LOG_LEVEL)
+        rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+        if _listener is None:
+            log_queue = queue.SimpleQueue()
+            queue_handler = QueueHandler(log_queue)
+            queue_handler.addFilter(SamplingFilter(rate))
+            stream_handler = logging.StreamHandler(stream or sys.stderr)
+            stream_handler.setFormatter(JsonFormatter())
+            _listener = QueueListener(log_queue, stream_handler)
+            _listener.start()
+            atexit.register(_listener.stop)
+            root.addHandler(queue_handler)
+            root.propagate = False
+        else:
+            for handler in root.handlers:
+                for f in handler.filters:
+                    if isinstance(f, SamplingFilter):
+                        f.rate = rate
+        # 轨迹记录只由 debug/LOG_SWITCH 控制，不受 LOG_LEVEL 影响
+        logging.getLogger(TRACE_LOGGER).setLevel(logging.INFO)
+    return root
+
+
+def get_logger(name: str) -> logging.Logger:
+    if _listener is None:
+        configure_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def flush_logs():
+    """等待队列中的日志写完（测试/退出时使用）"""
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener.start()
+
+
+class RequestTrace:
+    """单个请求的调试轨迹"""
+
+    def __init__(self, **fields):
+        self.t0 = time.perf_counter()
+        self.fields: Dict[str, Any] = dict(fields)
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def event(self, name: str, **data):
+        entry = {"event": name, "t_ms": round((time.perf_counter() - self.t0) * 1000.0, 3)}
+        entry.update(data)
+        with self._lock:
+            self.events.append(entry)
+
+    def to_record(self) -> Dict[str, Any]:
+        with self._lock:
+            record = dict(self.fields)
+            record["events"] = list(self.events)
+        return record
+
+
+def start_trace(enabled: bool, **fields) -> Optional[RequestTrace]:
+    """为当前请求开启调试轨迹；enabled 为 False 时清空当前轨迹并返回 None"""
+    trace = RequestTrace(**fields) if enabled else None
+    _CURRENT_TRACE.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _CURRENT_TRACE.get()
+
+
+def trace_enabled() -> bool:
+    return _CURRENT_TRACE.get() is not None
+
+
+def trace_event(name: str, **data):
+    """向当前请求轨迹追加一个事件（未开启轨迹时为空操作）"""
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        trace.event(name, **data)
+
+
+def finish_trace(**fields) -> Optional[Dict[str, Any]]:
+    """结束当前请求轨迹：作为一条 JSON 记录输出，并返回该记录"""
+    trace = _CURRENT_TRACE.get()
+    if trace is None:
+        return None
+    trace.fields.update(fields)
+    record = trace.to_record()
+    get_logger("trace").info("request_trace", extra={"fields": record})
+    _CURRENT_TRACE.set(None)
+    return record
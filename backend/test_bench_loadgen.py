@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+测试压测工具：按会话流程调用各端点，统计延迟/错误率/饱和曲线；本地 LLM 替身兼容 OpenAI 接口
+"""
+
+import os
+import sys
+import json
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from bench.llm_stub import LLMStubServer
+from bench.loadgen import Assets, FlowProfile, run_load_test, saturation
+
+
+class FakeBackend(BaseHTTPRequestHandler):
+    """最小的后端替身：记录收到的请求路径，/api/asr 固定返回 500 以验证错误统计"""
+    protocol_version = "HTTP/1.1"
+    seen = []
+    lock = threading.Lock()
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith("/api/metrics/stages"):
+            self._reply(200, {"ok": True, "pool_workers": 4,
+                              "stages": {"total": {"mean_ms": 12.5, "count": 3, "buckets_ms": {}, "sum_ms": 37.5}}})
+        else:
+            self._reply(404, {})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with self.lock:
+            FakeBackend.seen.append((self.path, body))
+        if self.path == "/api/asr":
+            self._reply(500, {"detail": "asr down"})
+        elif self.path == "/api/locate":
+            self._reply(200, {"req_id": "r", "node_id": "poi01_entrance_glass_door"})
+        else:
+            self._reply(200, {"ok": True})
+
+
+def test_session_flow_and_report():
+    """每个会话依次调用 start → locate(first) → locate+tts → asr → qa；错误率与饱和曲线正确"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBackend)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        assets = Assets.load()
+        report = run_load_test(url, users=(1, 2), duration_s=0.5,
+                               profile=FlowProfile(locates_per_session=2, think_ms=0), assets=assets,
+                               slo_ms=1000)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    level = report["levels"][1]
+    assert level["users"] == 2 and level["sessions_completed"] > 0
+    eps = level["endpoints"]
+    assert set(eps) == {"start", "locate_first", "locate", "tts_start", "asr", "qa"}
+    assert eps["asr"]["error_rate"] == 1.0 and eps["asr"]["errors_by_status"] == {"500": eps["asr"]["requests"]}
+    assert eps["locate"]["errors"] == 0 and eps["locate"]["histogram_ms"]["+Inf"] == eps["locate"]["requests"]
+    assert abs(eps["locate"]["requests"] - 2 * eps["locate_first"]["requests"]) <= 2
+    assert level["server"]["stages_mean_ms"]["total"] == 12.5
+
+    paths = [p for p, _ in FakeBackend.seen]
+    first = paths.index("/api/start")
+    assert paths[first:first + 7] == ["/api/start", "/api/locate", "/api/locate", "/api/metrics/tts_start",
+                                      "/api/locate", "/api/metrics/tts_start", "/api/asr"]
+    locate_body = [b for p, b in FakeBackend.seen if p == "/api/locate"][0]
+    assert b'name="first_photo"\r\n\r\ntrue' in locate_body and b"\x89PNG" in locate_body
+
+    # asr 全部失败，整体错误率超过 1%：没有满足 SLO 的档位
+    assert report["saturation"]["max_users_within_slo"] == 0
+    assert json.loads(json.dumps(report)) == report
+    print("✅ 会话流程与压测报告")
+
+
+def test_saturation_picks_largest_level_within_slo():
+    levels = [{"users": u, "throughput_rps": u * 10.0, "error_rate": err,
+               "endpoints": {"locate": {"latency_ms": {"p95": p95}}}, "server": None}
+              for u, p95, err in ((1, 200, 0), (4, 900, 0), (8, 2500, 0.0), (16, 9000, 0.2))]
+    sat = saturation(levels, slo_ms=3000)
+    assert sat["max_users_within_slo"] == 8 and [c["within_slo"] for c in sat["curve"]] == [True, True, True, False]
+    print("✅ 饱和曲线")
+
+
+def test_llm_stub_openai_compatible():
+    """chat.completions 请求返回 OpenAI 格式；json_object 时返回意图 JSON"""
+    stub = LLMStubServer().start()
+    try:
+        def post(payload):
+            req = urllib.request.Request(stub.base_url + "/chat/completions", data=json.dumps(payload).encode(),
+                                         headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(req, timeout=5) as resp:
+                return json.loads(resp.read())
+
+        answer = post({"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "where am i"}]})
+        assert answer["object"] == "chat.completion" and answer["choices"][0]["message"]["role"] == "assistant"
+        intent = post({"model": "m", "response_format": {"type": "json_object"}, "messages": []})
+        assert json.loads(intent["choices"][0]["message"]["content"]) == {"intent": "unknown"}
+        assert stub.calls == 2
+    finally:
+        stub.stop()
+    print("✅ LLM 替身兼容 OpenAI 接口")
+
+
+if __name__ == "__main__":
+    test_session_flow_and_report()
+    test_saturation_picks_largest_level_within_slo()
+    test_llm_stub_openai_compatible()
+    print("🎉 压测工具测试全部通过")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+测试离线回放基准：报告包含各阶段分位数、多并发吞吐与内存分配，可序列化并与基线对比
+"""
+
+import os
+import sys
+import csv
+import copy
+import json
+import shutil
+import tempfile
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from bench.corpus import DEFAULT_CORPUS, load_corpus
+from bench.replay import compare_reports, run_benchmark
+from bench.stubs import StubLLMClient
+
+
+def test_report_shape():
+    """报告覆盖检索/融合/校准阶段，分位数单调，可 JSON 往返"""
+    report = run_benchmark(DEFAULT_CORPUS, concurrency=(1, 2), requests=30, warmup=5, alloc_samples=5)
+    for name in ("caption", "structure", "detail", "fusion", "calibration", "total"):
+        s = report["stages_ms"][name]
+        assert s["count"] == 30 and 0 <= s["p50"] <= s["p95"] <= s["p99"], name
+    assert [level["workers"] for level in report["concurrency"]] == [1, 2]
+    assert all(level["errors"] == 0 and level["throughput_rps"] > 0 for level in report["concurrency"])
+    assert report["allocations"]["requests"] == 5 and report["allocations"]["peak_kib"]["p50"] > 0
+    assert report["quality"]["labeled"] > 0 and report["quality"]["top1_accuracy"] is not None
+    assert json.loads(json.dumps(report)) == report
+    print("✅ 报告结构完整")
+
+
+def test_compare_flags_regressions():
+    """与自身对比无回退；阶段变慢、吞吐下降、结果改变都会被列出"""
+    report = run_benchmark(DEFAULT_CORPUS, concurrency=(1,), requests=20, warmup=0, alloc_samples=0)
+    assert compare_reports(report, report) == []
+
+    slower = copy.deepcopy(report)
+    slower["stages_ms"]["fusion"]["p50"] = report["stages_ms"]["fusion"]["p50"] * 2 + 1.0
+    slower["concurrency"][0]["throughput_rps"] = report["concurrency"][0]["throughput_rps"] / 2
+    slower["quality"]["top1_accuracy"] = -1
+    metrics = {r["metric"] for r in compare_reports(report, slower)}
+    assert metrics == {"stages_ms.fusion.p50", "concurrency.1.throughput_rps", "quality.top1_accuracy"}, metrics
+    print("✅ 基线对比检出回退")
+
+
+def test_corpus_from_locate_log():
+    """从 locate_log.csv 读取语料：跳过 warmup 行和空 caption"""
+    tmp = tempfile.mkdtemp(prefix="bench_")
+    try:
+        path = os.path.join(tmp, "locate_log.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["site_id", "run_id", "phase", "session_id", "provider", "caption", "gt_node_id"])
+            w.writerow(["SCENE_A_MS", "WARMUP", "warmup", "T1", "ft", "First photo - preset output", ""])
+            w.writerow(["SCENE_A_MS", "R1", "trial", "T1", "ft", "a bookshelf with a qr code", "poi09_qr_bookshelf"])
+            w.writerow(["SCENE_A_MS", "R1", "trial", "T1", "ft", "", ""])
+        entries = load_corpus(path)
+        assert len(entries) == 1 and entries[0].gt_node_id == "poi09_qr_bookshelf" and entries[0].session_id == "T1"
+    finally:
+        shutil.rmtree(tmp)
+    print("✅ 试验日志语料")
+
+
+def test_llm_stub():
+    """LLM 替身兼容 client.chat.completions.create 调用方式"""
+    client = StubLLMClient()
+    resp = client.chat.completions.create(model="m", messages=[])
+    assert json.loads(resp.choices[0].message.content) == {"intent": "unknown"} and client.calls == 1
+    print("✅ LLM 替身")
+
+
+if __name__ == "__main__":
+    test_report_shape()
+    test_compare_flags_regressions()
+    test_corpus_from_locate_log()
+    test_llm_stub()
+    print("🎉 离线回放基准测试全部通过")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+测试融合超参数扫描：默认参数的重放与 bench.replay 的 pipeline 目标逐条一致，
+网格 / 随机参数生成、排名、进程池执行与采集缓存
+"""
+
+import os
+import sys
+import json
+import tempfile
+import contextlib
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from enhanced_retriever import EnhancedDualChannelRetriever
+from bench.corpus import DEFAULT_CORPUS, load_corpus
+from bench.replay import PipelineTarget, quality
+from bench.sweep import (
+    CapturedBatch, capture_rows, default_params, evaluate, grid_configs, load_capture, load_topology, parse_grid,
+    random_configs, replay, resolve_weights, run_sweep, sweep,
+)
+
+
+def _pipeline_outcomes(corpus):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        target = PipelineTarget()
+        return target, [target.locate(e) for e in corpus]
+
+
+def test_default_params_match_pipeline():
+    """默认参数下每条请求的 top1、置信度与低置信度标记与真实流水线相同（含重复识别惩罚）"""
+    corpus = [e for e in load_corpus(DEFAULT_CORPUS) for _ in range(5)]   # 连续重复，触发多样性惩罚
+    target, outcomes = _pipeline_outcomes(corpus)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        rows = capture_rows(corpus, EnhancedDualChannelRetriever(target.registry), load_topology())
+    batch = CapturedBatch(rows)
+    assert batch.penalize.any()
+
+    params = default_params()
+    out = replay(batch, params)
+    for i, (row, ref) in enumerate(zip(rows, outcomes)):
+        assert row["ids"][out["top1"][i]] == ref["node_id"], i
+        assert abs(out["confidence"][i] - ref["confidence"]) < 1e-12, i
+        assert bool(out["low_conf"][i]) == ref["low_conf"], i
+
+    result = evaluate(batch, params)
+    expected = quality(list(zip(corpus, outcomes)))
+    assert result["labeled"] == expected["labeled"]
+    assert result["top1_accuracy"] == expected["top1_accuracy"]
+    assert result["low_conf_rate"] == expected["low_conf_rate"]
+    assert result["hop1_accuracy"] >= result["top1_accuracy"]
+    print("✅ 默认参数与流水线逐条一致")
+
+
+def test_param_space():
+    """网格展开、随机采样可复现、alpha/beta 补全"""
+    base = default_params()
+    grid = parse_grid(["structure_tau=0.1,0.2", "alpha=none,0.4"])
+    assert grid == {"structure_tau": [0.1, 0.2], "alpha": [None, 0.4]}
+    configs = grid_configs(grid, base)
+    assert len(configs) == 4 and all(c["detail_tau"] == base["detail_tau"] for c in configs)
+    try:
+        parse_grid(["bogus=1"])
+        assert False, "unknown parameter accepted"
+    except ValueError:
+        pass
+
+    a, b = random_configs(5, base, seed=3), random_configs(5, base, seed=3)
+    assert a == b and len({json.dumps(c, sort_keys=True) for c in a}) == 5
+    assert all(0.05 <= c["structure_tau"] <= 0.50 for c in a)
+    assert resolve_weights(base) is None and resolve_weights({"alpha": 0.4, "beta": None}) == (0.4, 0.6)
+    print("✅ 参数空间")
+
+
+def test_sweep_ranking_and_cache():
+    """结果按 Top-1 / ±1 跳 / 低置信度比例排序；进程池与单进程结果相同；缓存按版本键复用"""
+    with tempfile.TemporaryDirectory() as d:
+        cache = os.path.join(d, "capture.json")
+        capture = load_capture(DEFAULT_CORPUS, cache)
+        assert os.path.exists(cache) and load_capture(DEFAULT_CORPUS, cache)["created"] == capture["created"]
+
+        configs = random_configs(120, capture["defaults"], seed=5)
+        local = run_sweep(capture, configs, workers=1)
+        pooled = run_sweep(capture, configs, workers=2, chunk_size=30)
+        assert local == pooled
+        keys = [(-r["top1_accuracy"], -r["hop1_accuracy"], r["low_conf_rate"]) for r in local]
+        assert keys == sorted(keys)
+
+        report = sweep(DEFAULT_CORPUS, parse_grid(["sharpen_tau=0.2,0.25,0.3"]), workers=1, cache_path=cache)
+        assert report["mode"] == "grid" and report["configs"] == 3   # 0.25 即默认参数，不重复评估
+        assert report["baseline"]["params"] == capture["defaults"]
+        assert report["baseline"] in report["results"]
+        assert json.loads(json.dumps(report)) == report
+    print("✅ 排名、进程池与采集缓存")
+
+
+if __name__ == "__main__":
+    test_default_params_match_pipeline()
+    test_param_space()
+    test_sweep_ranking_and_cache()
+    print("🎉 超参数扫描测试全部通过")
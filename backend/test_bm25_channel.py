@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+测试 BM25F 词法通道：IDF 压低常见词、字段权重生效、稀疏索引与逐文档公式一致、可作为 retrieve() 的打分器
+"""
+
+import os
+import sys
+import io
+import math
+import contextlib
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from bm25_channel import BM25FIndex, tokenize
+from enhanced_retriever import EnhancedDualChannelRetriever
+from scene_registry import RetrievalState
+
+DOCS = [
+    {"name": "Main desk", "nl_text": "a desk in the room with a lamp"},
+    {"name": "Side desk", "nl_text": "a desk in the room near the window"},
+    {"name": "Bench", "nl_text": "a desk in the room with an oscilloscope"},
+    {"name": "Sofa corner", "nl_text": "a green sofa in the room"},
+]
+
+
+def _retriever(**kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return EnhancedDualChannelRetriever(**kwargs)
+
+
+def _reference_score(index, docs, query):
+    """按 BM25F 公式逐文档直接计算（不经稀疏数组）"""
+    fields = [f for f, w in index.field_weights.items() if w > 0]
+    toks = [{f: tokenize(d.get(f, "")) for f in fields} for d in docs]
+    avg = {f: sum(len(t[f]) for t in toks) / len(docs) for f in fields}
+    terms = [t for t in dict.fromkeys(tokenize(query)) if t in index.vocab]
+    out = []
+    for t_doc in toks:
+        total, upper = 0.0, 0.0
+        for t in terms:
+            df = sum(1 for x in toks if any(t in x[f] for f in fields))
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            tf = sum(index.field_weights[f] * t_doc[f].count(t)
+                     / (1 - index.b + index.b * len(t_doc[f]) / avg[f]) for f in fields if t_doc[f])
+            total += idf * tf * (index.k1 + 1) / (tf + index.k1) if tf else 0.0
+            upper += idf * (index.k1 + 1)
+        out.append(total / upper if upper else 0.0)
+    return out
+
+
+def test_idf_downweights_common_words():
+    """"desk"/"room" 出现在多数文档中，区分性词 "oscilloscope" 主导排序"""
+    index = BM25FIndex(DOCS)
+    scores = index.scores("a desk in a room with an oscilloscope")
+    assert int(scores.argmax()) == 2
+    assert index.idf[index.vocab["oscilloscope"]] > 3 * index.idf[index.vocab["desk"]]
+    assert all(0.0 <= s < 1.0 for s in scores)
+    print(f"✅ IDF 压低常见词: {[round(float(s), 3) for s in scores]}")
+
+
+def test_field_weights():
+    """同一个词出现在 name 字段比出现在 nl_text 字段得分更高"""
+    index = BM25FIndex([{"name": "sofa", "nl_text": "a chair"}, {"name": "chair", "nl_text": "a sofa"}])
+    scores = index.scores("sofa")
+    assert scores[0] > scores[1] > 0
+    print("✅ 字段权重生效")
+
+
+def test_sparse_scores_match_formula():
+    """稀疏预计算结果与逐文档公式一致"""
+    index = BM25FIndex(DOCS)
+    for query in ("desk lamp", "green sofa room", "oscilloscope window", "nothing here", ""):
+        got = index.scores(query)
+        expected = _reference_score(index, DOCS, query)
+        assert max(abs(a - b) for a, b in zip(got, expected)) < 1e-12, query
+    matches = index.score_matches("green sofa")
+    assert list(matches) == [3]
+    assert index.top_k("green sofa", 2) == [(3, matches[3]), (0, 0.0)]
+    print("✅ 稀疏索引与 BM25F 公式一致")
+
+
+def test_drop_in_scorer_for_retrieve():
+    """lexical_scorer="bm25" 时 retrieve() 两个通道都使用 BM25F 分数"""
+    retriever = _retriever(lexical_scorer="bm25", alignment="node")
+    scene = retriever.registry.get("SCENE_A_MS")
+    caption = "a black cabinet with drawers"
+    struct = retriever._retrieve_from_structure_map(caption, scene, 10)
+    expected = {n["id"]: float(s) for n, s in zip(scene.nodes, scene.bm25_nodes.scores(caption))}
+    for c in struct:
+        assert abs(c["score"] - expected[c["id"]]) < 1e-12
+    fused = retriever.retrieve(caption, 10, "SCENE_A_MS", RetrievalState())
+    assert fused[0]["id"] == "poi03_black_drawer_cabinet"
+
+    default = _retriever(alignment="node")
+    assert default.lexical_scorer == "heuristic"
+    print(f"✅ BM25F 作为检索打分器: top1={fused[0]['id']}")
+
+
+if __name__ == "__main__":
+    test_idf_downweights_common_words()
+    test_field_weights()
+    test_sparse_scores_match_formula()
+    test_drop_in_scorer_for_retrieve()
+    print("🎉 BM25F 词法通道测试全部通过")
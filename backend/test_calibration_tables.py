@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+测试按站点的标定表：保序 / Platt 拟合、表文件读写、数据版本校验与热更新、
+calculate_calibrated_confidence_and_margin 查表（不再打印）、离线拟合命令行
+"""
+
+import io
+import os
+import sys
+import csv
+import tempfile
+import contextlib
+
+import numpy as np
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from calibration import calculate_calibrated_confidence_and_margin, calibrate_confidence
+from calibration_tables import (
+    CALIBRATION_TABLES, CalibrationTable, fit_table, load_table, save_table, scene_data_version,
+)
+from scene_registry import SceneRegistry
+
+SITE = "SCENE_A_MS"
+
+
+def _synthetic(n=600, seed=7):
+    """margin 越大越可能命中：P(hit) = sigmoid(10 * margin - 2)"""
+    rng = np.random.default_rng(seed)
+    margins = rng.uniform(0.0, 0.6, n)
+    hits = rng.random(n) < 1 / (1 + np.exp(-(10 * margins - 2)))
+    return margins, hits
+
+
+@contextlib.contextmanager
+def _tables_in(table_dir):
+    """让全局 CALIBRATION_TABLES 临时使用 table_dir，结束后恢复"""
+    saved = (CALIBRATION_TABLES.table_dir, CALIBRATION_TABLES.check_interval_s, CALIBRATION_TABLES.enabled)
+    CALIBRATION_TABLES.table_dir, CALIBRATION_TABLES.check_interval_s, CALIBRATION_TABLES.enabled = table_dir, 0.0, True
+    CALIBRATION_TABLES.attach(SceneRegistry())
+    try:
+        yield CALIBRATION_TABLES
+    finally:
+        CALIBRATION_TABLES.table_dir, CALIBRATION_TABLES.check_interval_s, CALIBRATION_TABLES.enabled = saved
+        CALIBRATION_TABLES.attach(SceneRegistry())
+
+
+def test_fit_methods():
+    """保序回归单调且贴近真实命中率；Platt 恢复正斜率；向量查表与逐个查表一致"""
+    margins, hits = _synthetic()
+    iso = fit_table(SITE, margins, hits, "isotonic")
+    assert np.all(np.diff(iso.margins) > 0) and np.all(np.diff(iso.confidence) >= 0)
+    assert iso(0.0) < 0.4 and iso(0.6) > 0.9
+    assert iso.samples == 600 and iso.hits == int(hits.sum()) and iso.meta["brier"] < 0.2
+    grid = np.linspace(-0.1, 0.8, 50)
+    assert np.allclose(iso(grid), [iso(float(m)) for m in grid])
+
+    platt = fit_table(SITE, margins, hits, "platt")
+    a, b = platt.meta["platt"]["a"], platt.meta["platt"]["b"]
+    assert 6 < a < 14 and -3.5 < b < -0.5
+    assert abs(platt(0.3) - 1 / (1 + np.exp(-(10 * 0.3 - 2)))) < 0.06
+
+    try:
+        CalibrationTable(SITE, np.array([0.0, 0.1]), np.array([0.8, 0.2]))
+        assert False, "non-monotone table accepted"
+    except ValueError:
+        pass
+    try:
+        fit_table(SITE, margins, hits, "histogram")
+        assert False, "unknown method accepted"
+    except ValueError:
+        pass
+    print("✅ 保序回归 / Platt 拟合")
+
+
+def test_versioned_loading():
+    """表文件往返无损；数据版本不符或站点不符时不使用；表文件更新后重新加载"""
+    margins, hits = _synthetic()
+    with tempfile.TemporaryDirectory() as d, _tables_in(d) as tables:
+        assert tables.get(SITE) is None
+        spec = tables.site_registry().spec(SITE)
+        table = fit_table(SITE, margins, hits, "isotonic", data_version=scene_data_version(spec))
+        path = tables.path_for(SITE)
+        assert path == os.path.join(d, SITE + ".json")
+        save_table(table, path)
+        loaded = load_table(path)
+        assert np.array_equal(loaded.margins, table.margins) and np.array_equal(loaded.confidence, table.confidence)
+
+        current = tables.get(SITE)
+        assert current is not None and np.array_equal(current.confidence, table.confidence)
+        assert tables.get(SITE) is current
+        assert tables.status()[SITE]["method"] == "isotonic"
+
+        stale = fit_table(SITE, margins, hits, "platt", data_version="0000000000000000")
+        save_table(stale, path)
+        os.utime(path, (1, 1))
+        assert tables.get(SITE) is None, "table fit on other scene data used"
+
+        save_table(fit_table("SCENE_B_STUDIO", margins, hits, "isotonic"), path)
+        os.utime(path, (2, 2))
+        assert tables.get(SITE) is None, "table for another site used"
+
+        save_table(fit_table(SITE, margins, hits, "platt", data_version=scene_data_version(spec)), path)
+        os.utime(path, (3, 3))
+        assert tables.get(SITE).method == "platt"
+    print("✅ 数据版本校验与热更新")
+
+
+def test_confidence_uses_table():
+    """有表时 confidence 取表值，没有表时与 sigmoid 映射一致；不向 stdout 打印"""
+    candidates = [{"id": "n1", "score": 0.62, "has_detail": True}, {"id": "n2", "score": 0.41}]
+    margins, hits = _synthetic()
+    with tempfile.TemporaryDirectory() as d, _tables_in(d) as tables:
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            conf, margin, s1, s2 = calculate_calibrated_confidence_and_margin(candidates, site_id=SITE)
+        assert abs(margin - 0.21) < 1e-12 and (s1, s2) == (0.62, 0.41)
+        assert conf == calibrate_confidence(margin, True, None, None, True, 1.0)[0]
+
+        spec = tables.site_registry().spec(SITE)
+        table = fit_table(SITE, margins, hits, "isotonic", data_version=scene_data_version(spec))
+        save_table(table, tables.path_for(SITE))
+        with contextlib.redirect_stdout(out):
+            conf, margin, _, _ = calculate_calibrated_confidence_and_margin(candidates, site_id=SITE)
+            assert calculate_calibrated_confidence_and_margin(candidates[:1], site_id=SITE) == (0.0, 0.0, 0.0, 0.0)
+        assert conf == table(margin)
+        assert out.getvalue() == ""
+    print("✅ 查表置信度")
+
+
+def test_fit_cli():
+    """从试验日志拟合并写出可加载的表；样本不足的站点跳过"""
+    from bench.fit_calibration import main
+
+    margins, hits = _synthetic(200)
+    with tempfile.TemporaryDirectory() as d:
+        log_path = os.path.join(d, "logs", "locate_log.csv")
+        os.makedirs(os.path.dirname(log_path))
+        with open(log_path, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["site_id", "phase", "margin", "hit_top1"])
+            w.writerow([SITE, "warmup", "", ""])
+            w.writerows([SITE, "trial", f"{m:.4f}", "true" if h else "false"] for m, h in zip(margins, hits))
+            w.writerow(["SCENE_B_STUDIO", "trial", "0.2", "true"])
+            w.writerow([SITE, "trial", "0.3", ""])
+        out_dir = os.path.join(d, "calibration")
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert main(["--logs", os.path.join(d, "logs"), "--out-dir", out_dir]) == 0
+            assert main(["--logs", log_path, "--min-samples", "1000"]) == 1
+        assert sorted(os.listdir(out_dir)) == [SITE + ".json"]
+        table = load_table(os.path.join(out_dir, SITE + ".json"))
+        assert table.samples == 200 and table.method == "isotonic"
+        assert table.data_version == scene_data_version(SceneRegistry().spec(SITE))
+    print("✅ 离线拟合命令行")
+
+
+if __name__ == "__main__":
+    test_fit_methods()
+    test_versioned_loading()
+    test_confidence_uses_table()
+    test_fit_cli()
+    print("🎉 标定表测试全部通过")
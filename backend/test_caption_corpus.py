@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+测试从试验日志抽取 caption 语料：去重与过滤、版本号稳定、图片哈希与离线 caption 缓存、与回放语料格式兼容
+"""
+
+import os
+import sys
+import csv
+import tempfile
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from bench.caption_corpus import extract, find_logs, main, write_corpus
+from bench.corpus import corpus_meta, load_corpus
+from caption_cache import image_digest, load_caption_cache
+
+HEADER = ["site_id", "run_id", "ts_iso", "req_id", "session_id", "provider", "phase", "caption",
+          "top1_id", "top1_score", "gt_node_id"]
+
+
+def _write_log(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(HEADER)
+        w.writerows(rows)
+
+
+def _trial_logs(root):
+    _write_log(os.path.join(root, "logs", "ft", "locate_log.csv"), [
+        ["SCENE_A_MS", "WARMUP", "", "r0", "T1", "ft", "warmup", "First photo - preset output", "", "", ""],
+        ["SCENE_A_MS", "R1", "", "r1", "T1", "ft", "trial", "a black cabinet  with drawers", "n3", "0.4", "poi03"],
+        ["SCENE_A_MS", "R1", "", "r2", "T1", "ft", "trial", "a black cabinet with drawers", "n3", "0.4", "poi03"],
+        ["SCENE_A_MS", "R1", "", "r3", "T1", "ft", "trial", "BLIP_FAILED:oom", "", "", "poi03"],
+        ["SCENE_A_MS", "R1", "", "r4", "T1", "ft", "trial", "a glass door", "n1", "0.5", ""],
+    ])
+    _write_log(os.path.join(root, "logs", "base", "locate_log.csv"), [
+        ["SCENE_A_MS", "R2", "", "r5", "T2", "base", "trial", "a black cabinet with drawers", "n3", "0.3", "poi03"],
+        ["SCENE_B_STUDIO", "R2", "", "r6", "T2", "base", "trial", "a black cabinet with drawers", "", "", "b07"],
+    ])
+
+
+def _build(root, out, **kwargs):
+    entries, sources = extract(find_logs([os.path.join(root, "logs")]), **kwargs)
+    return write_corpus(entries, out, sources)
+
+
+def test_extract_dedup():
+    """跳过 warmup / 预设输出 / BLIP 失败；按 (站点, caption, 真值) 去重并计数"""
+    with tempfile.TemporaryDirectory() as d:
+        _trial_logs(d)
+        logs = find_logs([os.path.join(d, "logs")])
+        assert [os.path.basename(os.path.dirname(p)) for p in logs] == ["base", "ft"]
+        entries, sources = extract(logs)
+        keys = [(e["site_id"], e["caption"], e.get("gt_node_id"), e["count"]) for e in entries]
+        assert keys == [("SCENE_A_MS", "a black cabinet with drawers", "poi03", 3),
+                        ("SCENE_B_STUDIO", "a black cabinet with drawers", "b07", 1),
+                        ("SCENE_A_MS", "a glass door", None, 1)]
+        assert entries[0]["session_id"] == "T2" and entries[0]["req_id"] == "r5"
+        assert [s["rows_used"] for s in sources] == [2, 3]
+
+        labeled, _ = extract(logs, labeled_only=True)
+        assert len(labeled) == 2
+        per_session, _ = extract(logs, per_session=True)
+        assert len(per_session) == 4
+    print("✅ 去重与过滤")
+
+
+def test_versioned_corpus_roundtrip():
+    """写出的语料可被 bench.corpus 读取；内容不变时 corpus_version 不变"""
+    with tempfile.TemporaryDirectory() as d:
+        _trial_logs(d)
+        out = os.path.join(d, "corpus", "trial.jsonl")
+        assert main([os.path.join(d, "logs"), "--out", out]) == 0
+        meta = corpus_meta(out)
+        assert meta["format"] == "textnavi.caption_corpus" and meta["entries"] == 3 and meta["requests"] == 5
+        entries = load_corpus(out)
+        assert len(entries) == 3 and entries[2].gt_node_id is None and entries[1].site_id == "SCENE_B_STUDIO"
+
+        assert _build(d, out)["corpus_version"] == meta["corpus_version"]
+        _write_log(os.path.join(d, "logs", "extra", "locate_log.csv"),
+                   [["SCENE_A_MS", "R3", "", "r7", "T3", "ft", "trial", "a red chair", "", "", "poi05"]])
+        assert _build(d, out)["corpus_version"] != meta["corpus_version"]
+        try:
+            main([os.path.join(d, "missing"), "--out", out])
+            assert False, "missing logs accepted"
+        except SystemExit as e:
+            assert e.code != 0
+    print("✅ 版本化语料与回放格式兼容")
+
+
+def test_image_hashes_feed_caption_cache():
+    """按 req_id 匹配照片，记录 sha256；CaptionCache 按图片字节查回录制的 caption"""
+    with tempfile.TemporaryDirectory() as d:
+        _trial_logs(d)
+        photos = os.path.join(d, "photos")
+        os.makedirs(photos)
+        images = {"r1": b"\x89PNG cabinet-1", "r2": b"\x89PNG cabinet-2", "r4": b"\xff\xd8 door"}
+        for req_id, data in images.items():
+            with open(os.path.join(photos, req_id + (".jpg" if req_id == "r4" else ".png")), "wb") as f:
+                f.write(data)
+        with open(os.path.join(photos, "notes.txt"), "w") as f:
+            f.write("not an image")
+
+        out = os.path.join(d, "trial.jsonl")
+        meta = _build(d, out, images_dir=photos)
+        assert meta["images"] == 3
+        cabinet = load_corpus(out)[0]
+        assert cabinet.image and os.path.exists(cabinet.image)
+
+        cache = load_caption_cache(out)
+        assert len(cache) == 3
+        assert cache.get(images["r2"]) == "a black cabinet with drawers"
+        assert cache.lookup(image_digest(images["r4"])) == "a glass door"
+        assert cache.get(b"unseen photo") is None
+        assert cache.stats() == {"images": 3, "hits": 2, "misses": 1}
+        assert load_caption_cache("") is None
+    print("✅ 图片哈希与离线 caption 缓存")
+
+
+if __name__ == "__main__":
+    test_extract_dedup()
+    test_versioned_corpus_roundtrip()
+    test_image_hashes_feed_caption_cache()
+    print("🎉 caption 语料测试全部通过")
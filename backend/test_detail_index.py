@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+测试细节通道倒排索引：分数与逐条打分逐位相等，top-k 与全量排序截断一致，只对命中记录打分
+"""
+
+import os
+import sys
+import io
+import contextlib
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from detail_index import DetailIndex
+from enhanced_retriever import EnhancedDualChannelRetriever
+
+CAPTIONS = [
+    "a glass door with a yellow line on the floor and a green trash bin",
+    "a large open space with a sofa and a tv screen",
+    "a room with a desk and a 3d printer",
+    "cardboard boxes on the floor near a shelf",
+    "a bookshelf with a qr code",
+    "a person standing in a large open space near windows",
+    "an atrium with an open area",
+    "a tv screen and a purple chair",
+    "",
+    "xyz",
+]
+
+
+def _retriever():
+    with contextlib.redirect_stdout(io.StringIO()):
+        return EnhancedDualChannelRetriever(alignment="index")
+
+
+def test_scores_match_linear_scorer():
+    """索引打分与 _calculate_detail_score 逐位相等（未命中记录为 0）"""
+    retriever = _retriever()
+    checked = 0
+    for site_id in ("SCENE_A_MS", "SCENE_B_STUDIO"):
+        scene = retriever.registry.get(site_id)
+        for caption in CAPTIONS:
+            caption_lower = caption.lower()
+            matches = scene.detail_index.score_matches(caption_lower)
+            for i, item in enumerate(scene.detail_records):
+                expected = retriever._calculate_detail_score(item, caption_lower)
+                assert matches.get(i, 0.0) == expected, (site_id, caption, i)
+                checked += 1
+    print(f"✅ {checked} 个 (caption, 记录) 分数与逐条打分一致")
+
+
+def test_top_k_matches_full_sort():
+    """堆 top-k（含 0 分补齐）与全量稳定排序后截断一致"""
+    retriever = _retriever()
+    scene = retriever.registry.get("SCENE_A_MS")
+    for caption in CAPTIONS:
+        caption_lower = caption.lower()
+        full = [(i, retriever._calculate_detail_score(scene.detail_records[i], caption_lower))
+                for i in sorted(scene.hinted_records)]
+        full.sort(key=lambda x: x[1], reverse=True)
+        for k in (1, 3, 10, 100):
+            assert scene.detail_index.top_k(caption_lower, k, scene.hinted_records) == full[:k], (caption, k)
+    print("✅ top-k 与全量排序截断一致")
+
+
+def test_cost_scales_with_matches():
+    """语料增大时只对命中记录打分"""
+    filler = [{"nl_text": f"plain wall segment {i}", "struct_text": "wall; plaster"} for i in range(5000)]
+    target = {"nl_text": "a green trash bin by the door", "struct_text": "bin; green"}
+    index = DetailIndex(filler + [target])
+    matches = index.score_matches("a green trash bin")
+    assert list(matches) == [5000] and matches[5000] > 0
+    assert index.top_k("a green trash bin", 1) == [(5000, matches[5000])]
+    print(f"✅ {len(index)} 条记录中只对 {len(matches)} 条命中记录打分")
+
+
+if __name__ == "__main__":
+    test_scores_match_linear_scorer()
+    test_top_k_matches_full_sort()
+    test_cost_scales_with_matches()
+    print("🎉 细节倒排索引测试全部通过")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+测试内存映射向量索引格式：读写往返、mmap 只读打开、与旧 .npz 内容一致、版本/形状校验
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from embedding_store import (
+    load_legacy_npz, open_embedding_index, save_embedding_index,
+)
+
+MODEL_DIR = os.path.join(current_dir, "models")
+
+
+def test_round_trip_is_memory_mapped():
+    """写出后以只读内存映射打开，内容与元数据一致，不留临时文件"""
+    tmp = tempfile.mkdtemp(prefix="emb_")
+    try:
+        rng = np.random.default_rng(0)
+        X = rng.standard_normal((50, 8)).astype(np.float32)
+        items = [{"id": f"n{i}"} for i in range(50)]
+        meta_path = save_embedding_index(os.path.join(tmp, "scene"), {"X": X}, items, [f"t{i}" for i in range(50)],
+                                         model="test-model")
+        index = open_embedding_index(os.path.join(tmp, "scene"))
+        assert isinstance(index["X"], np.memmap) and not index["X"].flags.writeable
+        assert np.array_equal(index["X"], X)
+        assert index.items == items and index.texts[3] == "t3" and index.meta["model"] == "test-model"
+        assert sorted(os.listdir(tmp)) == ["scene.X.npy", "scene.meta.json"]
+        assert meta_path == os.path.join(tmp, "scene.meta.json")
+    finally:
+        shutil.rmtree(tmp)
+    print("✅ 读写往返，mmap 只读打开")
+
+
+def test_shipped_indexes_match_legacy():
+    """仓库中的新格式索引与旧 .npz（+ ids.json）内容一致"""
+    pairs = [("SCENE_A_MS", "SCENE_A_MS.ids.json"), ("SCENE_B_STUDIO", "SCENE_B_STUDIO.ids.json"),
+             ("index_dual", "index_meta.json")]
+    for prefix, ids_name in pairs:
+        legacy = load_legacy_npz(os.path.join(MODEL_DIR, prefix + ".npz"), os.path.join(MODEL_DIR, ids_name))
+        index = open_embedding_index(os.path.join(MODEL_DIR, prefix))
+        assert set(index.arrays) == set(legacy.arrays), prefix
+        for name, arr in legacy.arrays.items():
+            assert np.array_equal(index[name], arr), (prefix, name)
+        assert index.items == legacy.items and index.texts == legacy.texts, prefix
+    print("✅ 新格式索引与旧 .npz 一致")
+
+
+def test_rejects_mismatched_sidecar():
+    """格式版本或矩阵形状与侧车不符时拒绝打开"""
+    tmp = tempfile.mkdtemp(prefix="emb_")
+    try:
+        meta_path = save_embedding_index(os.path.join(tmp, "scene"), {"X": np.zeros((4, 3))})
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        for patch in ({"version": 99}, {"arrays": {"X": {"file": "scene.X.npy", "shape": [5, 3], "dtype": "float32"}}}):
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(dict(meta, **patch), f)
+            try:
+                open_embedding_index(meta_path)
+            except ValueError:
+                continue
+            raise AssertionError(f"accepted bad sidecar: {patch}")
+    finally:
+        shutil.rmtree(tmp)
+    print("✅ 版本与形状校验")
+
+
+if __name__ == "__main__":
+    test_round_trip_is_memory_mapped()
+    test_shipped_indexes_match_legacy()
+    test_rejects_mismatched_sidecar()
+    print("🎉 向量索引格式测试全部通过")
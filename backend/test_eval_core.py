@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+测试 tools/eval_core.py：列式读取、会话分组索引、向量化指标与按 mtime 的缓存
+"""
+
+import os
+import sys
+import csv
+import time
+import tempfile
+import statistics
+
+import numpy as np
+
+# 添加 tools 目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+tools_dir = os.path.join(current_dir, "tools")
+if tools_dir not in sys.path:
+    sys.path.insert(0, tools_dir)
+
+from eval_core import (
+    clarification_metrics, latency_metrics, load_table, localization_metrics, low_confidence_metrics,
+    misbelief_metrics, recovery_metrics, rq3_session_metrics, session_metrics, summary_stats, top1_breakdown,
+)
+
+LOCATE_HEADER = ["session_id", "run_id", "site_id", "provider", "top1_score", "margin", "gt_node_id",
+                 "hit_top1", "hit_top2", "hit_hop1", "low_conf", "low_conf_rule", "misbelief",
+                 "clarification_triggered"]
+LOCATE_ROWS = [
+    ["S2", "R1", "A", "ft", "0.9", "0.2", "n1", "True", "True", "True", "False", "", "False", "False"],
+    ["S1", "R1", "A", "ft", "0.5", "0.1", "n2", "false", "TRUE", "1", "True", "margin", "yes", "true"],
+    ["S2", "R2", "B", "base", "x", "", "", "", "", "", "true", "score", "", ""],
+    ["S1", "R2", "B", "base", "0.2", "0.01", " ", "", "", "", "True", "margin", "", ""],
+    ["S2", "R2", "A", "ft", "0.75", "0.08", "n3", "yes", "yes", "yes", "False", "", "False", "True"],
+]
+
+
+def _write(path, header, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        w.writerows(rows)
+
+
+def test_locate_metrics():
+    """Top-k / 低置信 / 误信 / 按会话分组与逐行计算一致"""
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "locate_log.csv")
+        _write(path, LOCATE_HEADER, LOCATE_ROWS + [["S3"]])   # 短行补空串
+        t = load_table(path)
+        assert len(t) == 6
+
+        loc = localization_metrics(t)
+        assert (loc["total_labeled"], loc["hit_top1"], loc["hit_top2"], loc["hit_hop1"]) == (3, 2, 3, 3)
+        low = low_confidence_metrics(t)
+        assert low["low_conf_count"] == 3 and low["low_conf_reasons"] == {"margin": 2, "score": 1}
+        assert list(low["low_conf_reasons"]) == ["margin", "score"]   # 首次出现顺序，同 dict(Counter)
+        mb = misbelief_metrics(t)
+        assert (mb["misbelief_count"], mb["clarification_triggered_count"]) == (1, 2)
+
+        sessions = session_metrics(t)
+        assert list(sessions) == ["S2", "S1", "S3"]   # 按首次出现顺序
+        assert sessions["S2"] == {"total_samples": 3, "labeled_samples": 2, "hit_top1": 2,
+                                  "correct_predictions": 2, "low_conf": 1, "misbelief": 0}
+        assert t.index("run_id").count_of("R2") == 3
+        assert list(t.index("session_id").rows("S1")) == [1, 3]
+
+        top1 = top1_breakdown(t)
+        assert top1["by_provider"] == {"ft": {"total": 3, "correct": 2}}
+        assert top1["confidence_ranges"]["high"] == {"count": 2, "correct": 2}
+        assert top1["confidence_ranges"]["medium"] == {"count": 1, "correct": 0}
+        assert top1["margin_ranges"]["large"]["count"] == 1 and top1["margin_ranges"]["medium"]["count"] == 2
+    print("✅ 定位日志指标")
+
+
+def test_mtime_cache():
+    """文件未变化时复用已解析的表和结果；追加写入后重新读取"""
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "locate_log.csv")
+        _write(path, LOCATE_HEADER, LOCATE_ROWS)
+        t1 = load_table(path)
+        m1 = session_metrics(t1)
+        assert load_table(path) is t1 and session_metrics(load_table(path)) is m1
+
+        time.sleep(0.01)
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(LOCATE_ROWS[0])
+        t2 = load_table(path)
+        assert t2 is not t1 and session_metrics(t2)["S2"]["total_samples"] == 4
+    print("✅ 按 mtime 缓存")
+
+
+def test_latency_clarification_recovery():
+    """延迟分布、澄清会话取最后一条结束记录、恢复时间与 RQ3 按会话汇总"""
+    with tempfile.TemporaryDirectory() as d:
+        lat_path = os.path.join(d, "latency_log.csv")
+        _write(lat_path, ["e2e_latency_ms"], [["400"], ["500"], ["1.5"], [""], ["6000"]])
+        lat = latency_metrics(load_table(lat_path))
+        assert lat["count"] == 3 and lat["min"] == 400 and lat["max"] == 6000
+        assert lat["distribution"] == {"0-500ms": 1, "500ms-1s": 1, "1s-2s": 0, "2s-5s": 0, "5s+": 1}
+
+        clar_path = os.path.join(d, "clarification_log.csv")
+        _write(clar_path, ["clarification_id", "session_id", "clarification_success", "total_rounds"], [
+            ["c1", "S1", "", ""], ["c1", "S1", "False", "2"], ["c2", "S9", "", ""],
+            ["c1", "S1", "True", "3"], ["c3", "S1", "true", "1"], ["", "S1", "True", "4"],
+        ])
+        clar = clarification_metrics(load_table(clar_path))
+        assert clar["id_groups"] == 3
+        assert clar["sessions"] == [("c1", 3, True), ("c3", 1, True)]
+        assert clar["round_distribution"] == {1: 1, 3: 1} and clar["avg_rounds"] == 2.0
+        assert list(clar["round_distribution"]) == [3, 1] and type(clar["avg_rounds"]) is int
+
+        rec_path = os.path.join(d, "recovery_log.csv")
+        _write(rec_path, ["session_id", "recovery_duration_ms"], [["S1", "800"], ["S4", "12000"], ["S1", ""]])
+        rec = recovery_metrics(load_table(rec_path))
+        assert rec["completed"] == 2 and rec["total_recoveries"] == 2 and rec["mean_time"] == 6400
+        assert rec["time_distribution"]["0-1s"] == 1 and rec["time_distribution"]["10-30s"] == 1
+
+        loc_path = os.path.join(d, "locate_log.csv")
+        _write(loc_path, LOCATE_HEADER, LOCATE_ROWS)
+        per = rq3_session_metrics(load_table(loc_path), load_table(clar_path), load_table(rec_path))
+        assert list(per) == ["S2", "S1", "S9", "S4"]
+        assert per["S1"] == {"labeled": 1, "misbelief": 1, "clarification_sessions": 2, "recoveries": 2}
+        assert per["S9"]["clarification_sessions"] == 1
+    print("✅ 延迟 / 澄清 / 恢复指标")
+
+
+def test_summary_stats_like_statistics():
+    """汇总统计的值、类型与键顺序同 statistics 实现（JSON 结果文件逐字节不变）"""
+    for sample in ([5155], [400, 900], [400, 900, 6000], [3, 1, 2, 2], [7, 8, 10, 9, 1]):
+        out = summary_stats(np.array(sample, dtype=np.int64))
+        assert list(out) == ["count", "mean", "median", "p90", "p95", "min", "max"]
+        for key, expected in (("mean", statistics.mean(sample)), ("median", statistics.median(sample)),
+                              ("min", min(sample)), ("max", max(sample))):
+            assert out[key] == expected and type(out[key]) is type(expected), (sample, key, out[key])
+    assert summary_stats(np.array([5155]))["p90"] == "N/A"
+    print("✅ 汇总统计与 statistics 一致")
+
+
+if __name__ == "__main__":
+    test_locate_metrics()
+    test_mtime_cache()
+    test_latency_clarification_recovery()
+    test_summary_stats_like_statistics()
+    print("🎉 评估内核测试全部通过")
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+融合内核一致性测试：向量化 fusion_kernel.fuse 与原逐候选实现的结果误差 < 1e-9，
+并检查候选数从 10 增加到 1000 时融合耗时基本持平
+"""
+
+import os
+import sys
+import io
+import math
+import time
+import random
+import contextlib
+
+import numpy as np
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+import fusion_kernel
+from enhanced_retriever import EnhancedDualChannelRetriever
+from scene_registry import RetrievalState
+
+TOL = 1e-9
+
+
+# ---- 原 _enhanced_fusion 的逐候选实现（作为对照） ----
+
+def legacy_calibration(scores, tau):
+    if not scores:
+        return []
+    scaled_scores = [score / tau for score in scores]
+    max_score = max(scaled_scores)
+    exp_scores = [np.exp(score - max_score) for score in scaled_scores]
+    sum_exp = sum(exp_scores)
+    probabilities = [exp_score / sum_exp for exp_score in exp_scores]
+    max_prob_idx = probabilities.index(max(probabilities))
+    top1_prob = probabilities[max_prob_idx]
+    if top1_prob < 0.3:
+        probabilities[max_prob_idx] = min(0.8, top1_prob * 1.1)
+        remaining_prob = 1.0 - probabilities[max_prob_idx]
+        other_probs = [p for i, p in enumerate(probabilities) if i != max_prob_idx]
+        if other_probs and sum(other_probs) > 0:
+            for i in range(len(probabilities)):
+                if i != max_prob_idx:
+                    probabilities[i] = (probabilities[i] / sum(other_probs)) * remaining_prob
+    return probabilities
+
+
+def legacy_entropy(probabilities):
+    if not probabilities:
+        return 1.0
+    entropy = 0.0
+    for p in probabilities:
+        if p > 0:
+            entropy -= p * np.log(p)
+    return entropy
+
+
+def legacy_weights(struct_entropy, detail_entropy):
+    struct_clarity = 1.0 - struct_entropy
+    detail_clarity = 1.0 - detail_entropy
+    total_clarity = struct_clarity + detail_clarity
+    if total_clarity > 0:
+        alpha = max(0.1, min(0.9, struct_clarity / total_clarity))
+        beta = max(0.1, min(0.9, detail_clarity / total_clarity))
+        total_weight = alpha + beta
+        return alpha / total_weight, beta / total_weight
+    return 0.65, 0.35
+
+
+def legacy_sharpen(probs, tau):
+    def softmax(x):
+        x = np.asarray(x, dtype=np.float64)
+        x = x - np.max(x)
+        e = np.exp(x)
+        s = e.sum()
+        return e / (s if s > 0 else 1.0)
+
+    probs_array = np.array(probs)
+    if np.max(probs_array) - np.min(probs_array) > 0.5:
+        tau = max(0.3, tau)
+    p = np.clip(np.asarray(probs, dtype=np.float64), 1e-12, 1.0 - 1e-12)
+    sharpened_array = np.clip(softmax((np.log(p) - np.log(1.0 - p)) / max(tau, 1e-6)), 0.05, 0.8)
+    total = np.sum(sharpened_array)
+    if total > 0:
+        sharpened_array = sharpened_array / total
+    return sharpened_array.tolist()
+
+
+def legacy_fuse(struct_scores, detail_scores, boosts, topo, top1_ids_differ,
+                structure_tau=0.15, detail_tau=0.20, gamma=0.15):
+    def prob_to_logit(p, eps=1e-6):
+        p = min(max(p, eps), 1 - eps)
+        return math.log(p / (1 - p))
+
+    struct_probs = legacy_calibration(struct_scores, structure_tau)
+    detail_probs = legacy_calibration(detail_scores, detail_tau)
+    alpha, beta = legacy_weights(legacy_entropy(struct_probs), legacy_entropy(detail_probs))
+    alpha_final, beta_final = alpha, beta
+    if top1_ids_differ:
+        s_logit, d_logit = prob_to_logit(struct_probs[0]), prob_to_logit(detail_probs[0])
+        if abs(s_logit - d_logit) > 0.5:
+            alpha_final, beta_final = alpha * 0.7, beta * 1.1
+    fused = []
+    for i in range(len(struct_scores)):
+        fused_logit = alpha_final * prob_to_logit(struct_probs[i])
+        fused_logit += beta_final * (prob_to_logit(detail_probs[i]) if i < len(detail_probs) else 0.0)
+        fused_logit += gamma * boosts[i] + topo[i]
+        fused.append(1 / (1 + np.exp(-fused_logit)))
+    return alpha, beta, legacy_sharpen(fused, 0.25)
+
+
+def _random_case(rng, n):
+    struct_scores = sorted((rng.uniform(-1.0, 3.0) for _ in range(n)), reverse=True)
+    detail_n = rng.choice([n, max(1, n // 2), n + 3])
+    detail_scores = sorted((rng.uniform(0.0, 2.0) for _ in range(detail_n)), reverse=True)
+    boosts = [min(0.5, rng.choice([0.0, 0.05, 0.1, 0.35, 0.9])) for _ in range(n)]
+    topo = [rng.choice([0.0, 0.0, 0.10, 0.25]) for _ in range(n)]
+    return struct_scores, detail_scores, boosts, topo, rng.random() < 0.5
+
+
+def test_kernel_matches_legacy_random():
+    """随机分数（1~1000 个候选、不同长度的细节通道）下与逐候选实现一致"""
+    rng = random.Random(7)
+    worst = 0.0
+    for n in [1, 2, 3, 10, 37, 200, 1000] * 5:
+        struct_scores, detail_scores, boosts, topo, differ = _random_case(rng, n)
+        alpha, beta, expected = legacy_fuse(struct_scores, detail_scores, boosts, topo, differ)
+        result = fusion_kernel.fuse(struct_scores, detail_scores, boosts, topo,
+                                    structure_tau=0.15, detail_tau=0.20, gamma=0.15,
+                                    top1_ids_differ=differ)
+        assert abs(result.alpha - alpha) < TOL and abs(result.beta - beta) < TOL
+        diff = float(np.max(np.abs(result.sharpened - np.asarray(expected))))
+        worst = max(worst, diff)
+        assert diff < TOL, (n, diff)
+    print(f"✅ 随机用例与逐候选实现一致（最大误差 {worst:.2e}）")
+
+
+def test_batch_matches_per_row():
+    """fuse_batch 逐行与 fuse 一致（含空行、固定权重、细节通道长短不一）"""
+    rng = random.Random(11)
+    cases = [_random_case(rng, rng.choice([1, 2, 3, 7, 12])) for _ in range(200)]
+    cases.append(([], [0.3], [], [], True))
+    rows = lambda k: [c[k] for c in cases]
+    struct, struct_mask = fusion_kernel.pad_rows(rows(0))
+    detail, detail_mask = fusion_kernel.pad_rows(rows(1))
+    boosts, _ = fusion_kernel.pad_rows(rows(2))
+    topo, _ = fusion_kernel.pad_rows(rows(3))
+    for weights in (None, (0.35, 0.65)):
+        batch = fusion_kernel.fuse_batch(struct, struct_mask, detail, detail_mask, boosts, topo,
+                                         np.array(rows(4)), structure_tau=0.15, detail_tau=0.20, gamma=0.15,
+                                         weights=weights)
+        for i, (s, d, b, t, differ) in enumerate(cases):
+            if not s:
+                assert not batch[i].any()
+                continue
+            result = fusion_kernel.fuse(s, d, b, t, structure_tau=0.15, detail_tau=0.20, gamma=0.15,
+                                        top1_ids_differ=differ, weights=weights)
+            assert np.max(np.abs(batch[i, :len(s)] - result.sharpened)) < TOL, i
+    print("✅ 批量内核与逐行 fuse 一致")
+
+
+def test_retriever_fusion_matches_legacy():
+    """真实场景检索时（按位置对齐模式），融合分数与逐候选实现一致"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        retriever = EnhancedDualChannelRetriever(alignment="index")
+    for site_id, caption in [("SCENE_A_MS", "a glass door with a green trash bin"),
+                             ("SCENE_A_MS", "cardboard boxes on the floor near a shelf"),
+                             ("SCENE_B_STUDIO", "a tv screen and a purple chair")]:
+        scene = retriever.registry.get(site_id)
+        struct = retriever._retrieve_from_structure_map(caption, scene, 10)
+        detail = retriever._retrieve_from_detail_map(caption, scene, 10)
+        struct_scores = [c["score"] for c in struct]
+        detail_scores = [c["score"] for c in detail] if detail else [0.0] * len(struct)
+        boosts = [retriever._calculate_continuity_boost(c, caption, scene) for c in struct]
+        differ = bool(detail) and struct[0]["id"] != detail[0]["id"]
+        _, _, expected = legacy_fuse(struct_scores, detail_scores, boosts, [0.0] * len(struct), differ)
+
+        fused = retriever._enhanced_fusion(struct, detail, caption, scene, RetrievalState())
+        got = [c["score"] for c in fused]
+        assert max(abs(a - b) for a, b in zip(got, expected)) < TOL, site_id
+    print("✅ 检索器融合分数与逐候选实现一致")
+
+
+def _median_time(fn, repeats=30):
+    samples = []
+    for _ in range(repeats):
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def test_kernel_cost_is_flat():
+    """候选数 10 → 1000 时内核耗时基本持平（逐候选实现约线性增长 100 倍）"""
+    rng = random.Random(3)
+    timings = {}
+    for n in (10, 1000):
+        struct_scores, detail_scores, boosts, topo, _ = _random_case(rng, n)
+        timings[n] = _median_time(lambda: fusion_kernel.fuse(
+            struct_scores, detail_scores, boosts, topo,
+            structure_tau=0.15, detail_tau=0.20, gamma=0.15, top1_ids_differ=True))
+    ratio = timings[1000] / timings[10]
+    assert ratio < 10, timings
+    print(f"✅ 内核耗时: n=10 {timings[10]*1e6:.0f}µs, n=1000 {timings[1000]*1e6:.0f}µs (×{ratio:.1f})")
+
+
+if __name__ == "__main__":
+    test_kernel_matches_legacy_random()
+    test_batch_matches_per_row()
+    test_retriever_fusion_matches_legacy()
+    test_kernel_cost_is_flat()
+    print("🎉 融合内核一致性测试全部通过")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+测试增量索引构建：按内容哈希复用已有向量，只对新增/改动文本编码，--check 报告过期状态
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import pathlib
+import contextlib
+import io
+
+import numpy as np
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+import build_index
+from embedding_store import open_embedding_index
+
+
+class CountingEncoder:
+    """确定性的假编码器：记录被编码的文本"""
+
+    def __init__(self):
+        self.seen = []
+
+    def __call__(self, texts):
+        self.seen.extend(texts)
+        out = np.zeros((len(texts), 8), dtype=np.float32)
+        for i, t in enumerate(texts):
+            rng = np.random.default_rng(abs(hash(t)) % (2 ** 32))
+            out[i] = rng.standard_normal(8)
+        return out
+
+
+def _workspace():
+    tmp = pathlib.Path(tempfile.mkdtemp(prefix="idx_"))
+    (tmp / "data").mkdir()
+    (tmp / "models").mkdir()
+    for _, filename in build_index.DATA_FILES:
+        shutil.copy(os.path.join(build_index.DATA_DIR, filename), tmp / "data" / filename)
+    return tmp
+
+
+def _build(tmp, encoder, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return build_index.build_dual_channel_index(tmp / "data", tmp / "models", encoder=encoder, **kwargs)
+
+
+def test_rebuild_reuses_cached_embeddings():
+    """第二次构建不编码任何文本；改动一条记录只重新编码该文本"""
+    tmp = _workspace()
+    try:
+        first = CountingEncoder()
+        records, encoded = _build(tmp, first, batch_size=2)
+        unique = {r["nl_text"] for r in records} | {r["struct_text"] for r in records}
+        assert encoded == len(unique) == len(first.seen)
+        before = open_embedding_index(str(tmp / "models" / "index_dual"))
+        nl_before = np.array(before["nl_vecs"])
+
+        second = CountingEncoder()
+        _, encoded = _build(tmp, second)
+        assert encoded == 0 and second.seen == []
+        assert build_index.check_index(tmp / "data", tmp / "models")["stale"] is False
+
+        # 修改 Scene B 4o 记录的输出文本
+        path = tmp / "data" / "Sense_B_4o.fixed.jsonl"
+        lines = path.read_text(encoding="utf-8").splitlines()
+        doc = json.loads(lines[0])
+        doc["output"] = doc["output"] + " A green sofa sits by the window."
+        lines[0] = json.dumps(doc, ensure_ascii=False)
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+        status = build_index.check_index(tmp / "data", tmp / "models")
+        assert status["stale"] and status["changed"] == ["Sense_B_4o_0"] and status["texts_to_encode"] == 1
+
+        third = CountingEncoder()
+        records, encoded = _build(tmp, third)
+        assert encoded == 1 and third.seen == [doc["output"].strip()]
+        after = open_embedding_index(str(tmp / "models" / "index_dual"))
+        changed = [i for i, r in enumerate(records) if r["id"] == "Sense_B_4o_0"][0]
+        for i in range(len(records)):
+            same = np.array_equal(after["nl_vecs"][i], nl_before[i])
+            assert same == (i != changed), i
+        assert not any(name.startswith(".tmp_") for name in os.listdir(tmp / "models"))
+    finally:
+        shutil.rmtree(tmp)
+    print("✅ 增量构建只编码改动的文本")
+
+
+def test_force_reencodes_everything():
+    """--force 忽略缓存"""
+    tmp = _workspace()
+    try:
+        _build(tmp, CountingEncoder())
+        again = CountingEncoder()
+        _, encoded = _build(tmp, again, force=True)
+        assert encoded == len(set(again.seen)) > 0
+    finally:
+        shutil.rmtree(tmp)
+    print("✅ --force 全量重新编码")
+
+
+if __name__ == "__main__":
+    test_rebuild_reuses_cached_embeddings()
+    test_force_reencodes_everything()
+    print("🎉 增量索引构建测试全部通过")
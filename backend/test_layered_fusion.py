@@ -55,7 +55,7 @@ def test_layered_fusion():
     # 3. 测试数据对齐
     print("3️⃣ 测试数据对齐...")
     test_node_id = "dp_ms_entrance"
-    node_details = find_node_details_by_hint(test_node_id, detailed_data)
+    node_details = find_node_details_by_hint(test_node_id, site_id)
     if node_details:
         print(f"   ✅ 节点 {test_node_id} 的Detail数据对齐成功: {len(node_details)} 项")
         for detail in node_details:
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+测试按节点对齐的双通道融合：细节记录按节点聚合，经别名表与结构候选对齐
+"""
+
+import os
+import sys
+import io
+import math
+import contextlib
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+import fusion_kernel
+from enhanced_retriever import EnhancedDualChannelRetriever
+from scene_registry import RetrievalState, detail_key
+
+CAPTIONS = [
+    ("SCENE_A_MS", "a glass door with a yellow line on the floor and a green trash bin"),
+    ("SCENE_A_MS", "cardboard boxes on the floor near a shelf"),
+    ("SCENE_B_STUDIO", "a tv screen and a purple chair"),
+    ("SCENE_B_STUDIO", "a table with laptops near the windows"),
+]
+
+
+def _retriever(**kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return EnhancedDualChannelRetriever(**kwargs)
+
+
+def test_aggregate_by_group():
+    """max / log-sum-exp 聚合，-1 表示无组，空组为 -inf"""
+    scores = [1.0, 3.0, 2.0, 5.0, 0.5]
+    groups = [0, 0, 1, -1, 1]
+    mx = fusion_kernel.aggregate_by_group(scores, groups, 3, "max")
+    assert list(mx[:2]) == [3.0, 2.0] and mx[2] == float("-inf")
+    lse = fusion_kernel.aggregate_by_group(scores, groups, 3, "lse")
+    assert abs(lse[0] - math.log(math.exp(1.0) + math.exp(3.0))) < 1e-12
+    print("✅ 按组聚合正确")
+
+
+def test_detail_scores_join_on_node_id():
+    """每个融合候选的 detail_score = 其别名细节键下所有记录分数的最大值"""
+    retriever = _retriever(alignment="node", detail_aggregation="max")
+    for site_id, caption in CAPTIONS:
+        scene = retriever.registry.get(site_id)
+        expected_by_key = {}
+        for item in scene.detail_records:
+            key = detail_key(item)
+            score = retriever._calculate_detail_score(item, caption.lower())
+            expected_by_key[key] = max(expected_by_key.get(key, float("-inf")), score)
+
+        fused = retriever.retrieve(caption, 10, site_id, RetrievalState())
+        assert fused
+        for cand in fused:
+            expected = expected_by_key.get(scene.alias_for(cand["id"]), 0.0)
+            assert abs(cand["detail_score"] - expected) < 1e-12, (site_id, cand["id"])
+    print("✅ 细节分数按节点ID对齐")
+
+
+def test_scene_b_detail_channel_contributes():
+    """Scene B 细节记录只有 textmap_node_id，节点对齐后细节通道也参与融合"""
+    retriever = _retriever(alignment="node")
+    fused = retriever.retrieve("a tv screen and a purple chair", 10, "SCENE_B_STUDIO", RetrievalState())
+    assert any(c["detail_score"] > 0 for c in fused)
+    assert all(c["has_detail"] for c in fused)
+    print(f"✅ Scene B 细节通道参与融合: top1={fused[0]['id']}")
+
+
+if __name__ == "__main__":
+    test_aggregate_by_group()
+    test_detail_scores_join_on_node_id()
+    test_scene_b_detail_channel_contributes()
+    print("🎉 节点对齐融合测试全部通过")
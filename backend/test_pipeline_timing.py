@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+测试定位流水线线程池执行与分阶段计时
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from pipeline_timing import (
+    stage, start_request_timer, current_timer, run_in_pool, StageHistograms,
+)
+
+
+def test_stage_without_timer_is_noop():
+    """没有请求计时器时 stage() 不报错也不记录"""
+    with stage("fusion"):
+        pass
+    print("✅ 无计时器时为空操作")
+
+
+def test_run_in_pool_keeps_request_timer():
+    """线程池中的阶段耗时记录到发起请求的计时器上，并发请求互不串扰"""
+    main_thread = threading.get_ident()
+
+    def pipeline(sleep_s):
+        assert threading.get_ident() != main_thread
+        with stage("structure"):
+            time.sleep(sleep_s)
+        with stage("structure"):
+            time.sleep(sleep_s)
+        return current_timer()
+
+    async def one_request(sleep_s):
+        timer = start_request_timer()
+        worker_timer = await run_in_pool(pipeline, sleep_s)
+        assert worker_timer is timer
+        return timer.finish()
+
+    async def main():
+        return await asyncio.gather(one_request(0.01), one_request(0.03))
+
+    fast, slow = asyncio.run(main())
+    assert fast["structure"] >= 15, fast
+    assert slow["structure"] >= 55 and slow["structure"] > fast["structure"], slow
+    assert fast["total"] >= fast["structure"]
+    assert list(fast.keys()) == ["structure", "total"]
+    print(f"✅ 线程池阶段计时: fast={fast}, slow={slow}")
+
+
+def test_histogram_cumulative_buckets():
+    """直方图桶为累积计数"""
+    h = StageHistograms(buckets_ms=(1, 10, 100))
+    h.observe_all({"fusion": 0.5, "total": 50})
+    h.observe("fusion", 5)
+    h.observe("fusion", 500)
+    snap = h.snapshot()
+    assert snap["fusion"]["buckets_ms"] == {"1": 1, "10": 2, "100": 2, "+Inf": 3}
+    assert snap["fusion"]["count"] == 3
+    assert abs(snap["fusion"]["sum_ms"] - 505.5) < 1e-9
+    assert snap["total"]["buckets_ms"]["100"] == 1
+    h.reset()
+    assert h.snapshot() == {}
+    print("✅ 直方图累积桶正确")
+
+
+if __name__ == "__main__":
+    test_stage_without_timer_is_noop()
+    test_run_in_pool_keeps_request_timer()
+    test_histogram_cumulative_buckets()
+    print("🎉 流水线计时测试全部通过")
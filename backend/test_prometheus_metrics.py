@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+测试 /metrics 文本输出：阶段与组件直方图（秒）、gauge 回调、线程池在途计数
+"""
+
+import os
+import re
+import sys
+import time
+import asyncio
+import threading
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from pipeline_timing import (
+    COMPONENT_HISTOGRAMS, STAGE_HISTOGRAMS, pool_inflight, run_in_pool, start_request_timer, timed,
+)
+from prometheus_metrics import GAUGES, render_metrics
+
+SAMPLE_RE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_]+="[^"]*"(,[a-zA-Z_]+="[^"]*")*\})? \S+$')
+
+
+def _samples(text, name):
+    out = {}
+    for line in text.splitlines():
+        if line.startswith(name):
+            key, value = line.rsplit(" ", 1)
+            out[key] = float(value)
+    return out
+
+
+def test_histograms_in_seconds():
+    """阶段直方图换算为秒；桶计数单调，+Inf 等于 count"""
+    STAGE_HISTOGRAMS.reset()
+    COMPONENT_HISTOGRAMS.reset()
+    STAGE_HISTOGRAMS.observe_all({"fusion": 3.0, "total": 40.0})
+    STAGE_HISTOGRAMS.observe_all({"fusion": 120.0, "total": 300.0})
+    timer = start_request_timer()
+    with timed("llm_call"):
+        time.sleep(0.002)
+    assert timer.stages_ms["llm_call"] >= 2.0
+
+    text = render_metrics()
+    for line in text.splitlines():
+        assert line.startswith("# ") or SAMPLE_RE.match(line), line
+    fusion = _samples(text, 'textnavi_locate_stage_seconds_bucket{stage="fusion"')
+    counts = list(fusion.values())
+    assert counts == sorted(counts) and counts[-1] == 2
+    assert fusion['textnavi_locate_stage_seconds_bucket{stage="fusion",le="0.005"}'] == 1
+    assert _samples(text, "textnavi_locate_stage_seconds_sum")['textnavi_locate_stage_seconds_sum{stage="fusion"}'] == 0.123
+    llm = _samples(text, "textnavi_component_seconds_count")
+    assert llm['textnavi_component_seconds_count{component="llm_call"}'] == 1
+    assert "# TYPE textnavi_locate_stage_seconds histogram" in text
+    STAGE_HISTOGRAMS.reset()
+    COMPONENT_HISTOGRAMS.reset()
+    print("✅ 直方图输出")
+
+
+def test_gauges():
+    """带标签的 gauge、counter 类型；回调出错或返回 None 时跳过"""
+    GAUGES.register("test_model_memory_bytes", "test", lambda: {"blip": 10, "missing": None}, label="model")
+    GAUGES.register("test_loads_total", "test", lambda: 3, kind="counter")
+    GAUGES.register("test_broken", "test", lambda: 1 / 0)
+    GAUGES.register("test_absent", "test", lambda: None)
+    try:
+        text = render_metrics()
+        assert 'test_model_memory_bytes{model="blip"} 10' in text and "missing" not in text
+        assert "# TYPE test_loads_total counter" in text and "test_loads_total 3" in text
+        assert "test_broken" not in text and "test_absent" not in text
+        assert "textnavi_locate_pool_queue_depth 0" in text
+        assert re.search(r"^process_resident_memory_bytes \d+$", text, re.M)
+    finally:
+        for name in ("test_model_memory_bytes", "test_loads_total", "test_broken", "test_absent"):
+            GAUGES.unregister(name)
+    print("✅ gauge 输出")
+
+
+def test_pool_inflight():
+    """run_in_pool 执行期间计入在途任务，完成后归零"""
+    release = threading.Event()
+    seen = []
+
+    def work():
+        seen.append(pool_inflight())
+        release.wait(5)
+
+    async def main():
+        task = asyncio.ensure_future(run_in_pool(work))
+        while not seen:
+            await asyncio.sleep(0.001)
+        release.set()
+        await task
+
+    asyncio.run(main())
+    assert seen == [1] and pool_inflight() == 0
+    print("✅ 线程池在途计数")
+
+
+if __name__ == "__main__":
+    test_histograms_in_seconds()
+    test_gauges()
+    test_pool_inflight()
+    print("🎉 /metrics 输出测试全部通过")
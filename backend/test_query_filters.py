@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+测试预编译的稳态过滤与反证提示：稳态过滤与原逐词替换实现逐字一致，
+惩罚只使用候选自身携带的提示，并在融合前作用于结构分数
+"""
+
+import os
+import sys
+import io
+import random
+import dataclasses
+import contextlib
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from query_filters import MOVABLE, NEGATIVE_PENALTY, negative_hits, stable_query
+from enhanced_retriever import EnhancedDualChannelRetriever
+from scene_registry import RetrievalState
+
+
+def _original_stable_query(text):
+    """原实现：每个可移动物体依次做 6 次 str.replace"""
+    t = text.lower()
+    for w in MOVABLE:
+        for old in (f" {w} ", f"{w} ", f" {w}", f" {w}s ", f"{w}s ", f" {w}s"):
+            t = t.replace(old, " ")
+    return " ".join(t.split()).rstrip(" .")
+
+
+def test_stable_query():
+    """与原实现逐字一致，包括子串语义（bookshelf → shelf）"""
+    assert stable_query("A laptop and two bags on the desk.") == "a and two s on the desk"
+    assert stable_query("Suitcases near the window") == "near the window"
+    assert stable_query("a bookshelf with books") == "a shelf with s"
+    assert stable_query("a cupboard by the door") == "a board by the door"
+    assert stable_query("") == ""
+
+    rng = random.Random(11)
+    vocab = list(MOVABLE) + [w + "s" for w in MOVABLE] + [
+        "bookshelf", "cupboard", "phonebook", "laptopbag", "cuperson", "the", "a", "desk", "window", "s", "."]
+    captions = []
+    for _ in range(3000):
+        words = [rng.choice(vocab) for _ in range(rng.randint(1, 8))]
+        captions.append("".join(w + rng.choice([" ", " ", "  ", ", ", ". ", ""]) for w in words))
+    for caption in captions:
+        assert stable_query(caption) == _original_stable_query(caption), caption
+    print(f"✅ {len(captions)} 个 caption 的稳态过滤与原实现一致")
+
+
+def test_negative_hits():
+    """每个不同的提示作为子串出现计 1 次；没有提示的候选不计"""
+    assert negative_hits({"id": "n1"}, "a green trash bin") == 0
+    assert negative_hits({"retrieval": {"negative": []}}, "a green trash bin") == 0
+    cand = {"retrieval": {"negative": ["trash", "green", "green", "sofa", "tr"]}}
+    assert negative_hits(cand, "a green trash bin") == 3
+    print("✅ 反证提示计数")
+
+
+def test_penalty_applied_in_fusion():
+    """结构候选携带 negative 提示时按命中数扣减 0.15；只写在节点元数据里的提示不生效（同原实现）"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        retriever = EnhancedDualChannelRetriever(alignment="node")
+    scene = retriever.registry.get("SCENE_A_MS")
+    target = "poi02_green_trash_bin"
+    caption = "a green trash bin near a laptop"
+    plain = retriever._retrieve_from_structure_map(caption, scene, 10)
+    before = {c["id"]: c["score"] for c in plain}
+    assert target in before
+
+    nodes = tuple(dict(n, retrieval={"negative": ["trash", "green"]}) if n["id"] == target else n
+                  for n in scene.nodes)
+    patched = dataclasses.replace(scene, nodes=nodes)
+    struct = retriever._retrieve_from_structure_map(caption, patched, 10)
+    detail = retriever._retrieve_detail_by_node(caption, patched)
+    retriever._enhanced_fusion(struct, detail, caption, patched, RetrievalState())
+    assert all(abs(c["score"] - before[c["id"]]) < 1e-12 for c in struct)
+
+    struct = retriever._retrieve_from_structure_map(caption, scene, 10)
+    for c in struct:
+        if c["id"] == target:
+            c["retrieval"] = {"negative": ["trash", "green"]}
+    retriever._enhanced_fusion(struct, retriever._retrieve_detail_by_node(caption, scene), caption, scene,
+                               RetrievalState())
+    for c in struct:
+        expected = before[c["id"]] - (2 * NEGATIVE_PENALTY if c["id"] == target else 0.0)
+        assert abs(c["score"] - expected) < 1e-12, c["id"]
+    print("✅ 反证惩罚作用于结构分数")
+
+
+if __name__ == "__main__":
+    test_stable_query()
+    test_negative_hits()
+    test_penalty_applied_in_fusion()
+    print("🎉 稳态过滤与反证提示测试全部通过")
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+测试按请求的性能剖析：采样模式（线程池任务）、cProfile 模式（当前线程上的同步代码段）、
+会话开关计数、剖析列表与保留上限
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from pipeline_timing import run_in_pool
+from request_profiler import (
+    begin_request_profile, bind_profile, claim_session_profile, close_slot, list_profiles, open_slot,
+    parse_mode, profile_file_path, prune_profiles, safe_name,
+)
+from session_store import InProcessSessionBackend, PROFILE_NS
+
+
+def _busy_fusion_stage(ms):
+    t_end = time.perf_counter() + ms / 1000.0
+    x = 0
+    while time.perf_counter() < t_end:
+        x += 1
+    return x
+
+
+def _other_loop_work(ms):
+    """同一事件循环线程上、剖析代码段之外运行的代码（如其他请求）"""
+    return _busy_fusion_stage(ms)
+
+
+async def _profiled_request(header, session_id, req_id, store=None, current_thread=False):
+    token = open_slot(header, allow_cprofile=True)
+    try:
+        profile = begin_request_profile(session_id, req_id, "locate", store, PROFILE_NS)
+        if current_thread:
+            with profile.thread():
+                _busy_fusion_stage(60)
+            await asyncio.sleep(0)
+            _other_loop_work(30)
+        else:
+            await run_in_pool(_busy_fusion_stage, 60)
+    finally:
+        closed = close_slot(token)
+    assert closed is profile
+    return profile
+
+
+def test_parse_mode_and_names():
+    assert parse_mode("1") == "sample" and parse_mode("Sample") == "sample"
+    assert parse_mode("cprofile") == "cprofile"
+    assert parse_mode(None) is None and parse_mode("0") is None and parse_mode("bogus") is None
+    assert safe_name("../../etc") == "_.._etc" and "/" not in safe_name("a/b") and safe_name("") == "_"
+    print("✅ 模式解析与安全目录名")
+
+
+def test_sampling_profile():
+    """采样模式：线程池中的任务被采样，写出折叠栈、speedscope 与 meta"""
+    with tempfile.TemporaryDirectory() as root:
+        profile = asyncio.run(_profiled_request("sample", "S1", "req-1"))
+        assert profile is not None and profile.mode == "sample"
+        meta = profile.write(root)
+        assert meta["samples"] > 0 and meta["endpoint"] == "locate" and meta["path"] == os.path.join("S1", "req-1")
+        folded = open(os.path.join(root, "S1", "req-1", "profile.folded"), encoding="utf-8").read()
+        assert "_busy_fusion_stage" in folded
+        for line in folded.splitlines():
+            stack, count = line.rsplit(" ", 1)
+            assert int(count) > 0 and stack
+
+        doc = json.load(open(os.path.join(root, "S1", "req-1", "profile.speedscope.json"), encoding="utf-8"))
+        prof = doc["profiles"][0]
+        assert prof["type"] == "sampled" and len(prof["samples"]) == len(prof["weights"])
+        n_frames = len(doc["shared"]["frames"])
+        assert all(0 <= i < n_frames for sample in prof["samples"] for i in sample)
+
+        listed = list_profiles(root)
+        assert [m["req_id"] for m in listed] == ["req-1"]
+        assert list_profiles(root, session_id="other") == []
+        assert profile_file_path(root, "S1", "req-1", "profile.folded")
+        assert profile_file_path(root, "S1", "req-1", "../meta.json") is None
+    print("✅ 采样模式输出")
+
+
+def test_cprofile_current_thread():
+    """cProfile 模式只剖析调用线程上 profile.thread() 包住的代码段，输出 pstats 与文本摘要"""
+    with tempfile.TemporaryDirectory() as root:
+        profile = asyncio.run(_profiled_request("cprofile", "S2", "req-2", current_thread=True))
+        assert profile.mode == "cprofile"
+        meta = profile.write(root)
+        assert meta["files"] == ["profile.pstats", "profile.txt"]
+        summary = open(os.path.join(root, "S2", "req-2", "profile.txt"), encoding="utf-8").read()
+        assert "_busy_fusion_stage" in summary
+        assert "_other_loop_work" not in summary, "profiler left running after the synchronous span"
+    print("✅ cProfile 模式输出")
+
+
+def test_disabled_by_default():
+    """无请求头、会话开关关闭时不剖析，bind_profile 原样返回函数"""
+    store = InProcessSessionBackend()
+    assert asyncio.run(_profiled_request(None, "S3", "req-3", store)) is None
+    assert bind_profile(_busy_fusion_stage) is _busy_fusion_stage
+    assert begin_request_profile("S3", "req-3", "locate") is None   # 中间件未开槽
+    print("✅ 默认不剖析")
+
+
+def test_cprofile_needs_admin():
+    """未允许 cprofile 的请求（无管理令牌）退回 sample"""
+    async def _request():
+        token = open_slot("cprofile")
+        try:
+            return begin_request_profile("S5", "req-5", "locate")
+        finally:
+            close_slot(token)
+
+    profile = asyncio.run(_request())
+    assert profile.mode == "sample" and profile.requested_mode == "sample"
+    profile.stop()
+    print("✅ cprofile 需要管理令牌")
+
+
+def test_retention():
+    """写出后只保留最新的 keep 个剖析，空的会话目录一并删除"""
+    with tempfile.TemporaryDirectory() as root:
+        for i in range(5):
+            profile = asyncio.run(_profiled_request("sample", f"S{i % 3}", f"req-{i}"))
+            profile.write(root, keep=0)
+            meta_path = os.path.join(root, f"S{i % 3}", f"req-{i}", "meta.json")
+            os.utime(meta_path, (1000 + i, 1000 + i))
+        assert len(list_profiles(root)) == 5
+        assert prune_profiles(root, keep=3) == 2
+        assert sorted(m["req_id"] for m in list_profiles(root)) == ["req-2", "req-3", "req-4"]
+        assert sorted(os.listdir(root)) == ["S0", "S1", "S2"]
+        assert prune_profiles(root, keep=1) == 2
+        assert [m["req_id"] for m in list_profiles(root)] == ["req-4"] and os.listdir(root) == ["S1"]
+
+        profile = asyncio.run(_profiled_request("sample", "S9", "req-9"))
+        profile.write(root, keep=1)
+        assert [m["req_id"] for m in list_profiles(root)] == ["req-9"]
+    print("✅ 剖析保留数量上限")
+
+
+def test_session_switch_burst():
+    """会话开关剖析接下来 N 个请求后自动关闭"""
+    store = InProcessSessionBackend()
+    store.set(PROFILE_NS, "S4", {"enabled": True, "mode": "sample", "remaining": 2})
+    assert claim_session_profile(store, PROFILE_NS, "S4") == "sample"
+    profile = asyncio.run(_profiled_request(None, "S4", "req-4", store))
+    assert profile is not None and profile.mode == "sample"
+    profile.stop()
+    assert store.get(PROFILE_NS, "S4") == {"enabled": False, "mode": "sample", "remaining": 0}
+    assert claim_session_profile(store, PROFILE_NS, "S4") is None
+    assert claim_session_profile(store, PROFILE_NS, "unknown") is None
+    print("✅ 会话开关突发计数")
+
+
+if __name__ == "__main__":
+    test_parse_mode_and_names()
+    test_sampling_profile()
+    test_cprofile_current_thread()
+    test_disabled_by_default()
+    test_cprofile_needs_admin()
+    test_retention()
+    test_session_switch_burst()
+    print("🎉 请求剖析测试全部通过")
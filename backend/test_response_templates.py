@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+测试预计算响应模板：预设输出与匹配数据只读一次文件、节点说明按语言查表、
+清单声明的模板文件覆盖内置表、源文件变化后重建
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+import response_templates
+from response_templates import DEFAULT_PRESET_OUTPUT, NODE_INSTRUCTIONS, ResponseTemplates
+from scene_registry import DATA_DIR, SITE_FILES, SceneRegistry
+
+
+def _first_record(filename):
+    with open(os.path.join(DATA_DIR, filename), "r", encoding="utf-8") as f:
+        return json.loads(f.readline())
+
+
+def test_builtin_sites():
+    """仓库清单：预设输出取预设文件首行，节点说明按语言，未知节点 / 语言回退"""
+    templates = ResponseTemplates(SceneRegistry())
+    assert templates.warm() == 4
+    record = _first_record("Sense_A_Finetuned.fixed.jsonl")
+    assert templates.preset_output("ft", "SCENE_A_MS") == record["output"]
+    assert templates.preset_output("FT", "SCENE_A_MS") == record["output"]
+    assert templates.matching_data("ft", "SCENE_A_MS") == record
+    assert templates.preset_output("base", "SCENE_B_STUDIO") == _first_record("Sense_B_4o.fixed.jsonl")["output"]
+    assert templates.preset_output("invalid", "INVALID") == DEFAULT_PRESET_OUTPUT
+    assert templates.matching_data("invalid", "INVALID") == {}
+
+    zh = templates.location_info("SCENE_A_MS", "tv_zone", "zh")
+    assert zh == NODE_INSTRUCTIONS["SCENE_A_MS"]["zh"]["tv_zone"]
+    assert templates.location_info("SCENE_A_MS", "tv_zone", "fr") == NODE_INSTRUCTIONS["SCENE_A_MS"]["en"]["tv_zone"]
+    assert templates.location_info("SCENE_B_STUDIO", "n9", "zh") == "当前位置：n9。请告诉我您要去哪里。"
+    assert templates.location_info("OTHER", "n9") == "Current location: n9. Please tell me where you want to go."
+    print("✅ 内置站点模板")
+
+
+def test_built_once_and_rebuilt_on_change():
+    """请求路径不再读文件；预设文件变化后重建，清单声明的模板文件覆盖内置节点说明"""
+    tmp = tempfile.mkdtemp(prefix="templates_")
+    structure, detail = SITE_FILES["SCENE_A_MS"]
+    try:
+        for name in (structure, detail):
+            shutil.copy(os.path.join(DATA_DIR, name), tmp)
+        with open(os.path.join(tmp, "preset.jsonl"), "w", encoding="utf-8") as f:
+            f.write(json.dumps({"output": "Welcome to floor 3."}) + "\n")
+        with open(os.path.join(tmp, "floor3_templates.json"), "w", encoding="utf-8") as f:
+            json.dump({"en": {"lift": "You are at the lift."}, "zh": {"lift": "您在电梯旁。"}}, f)
+        with open(os.path.join(tmp, "sites.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "sites": {"FLOOR_3": {
+                "structure": structure, "detail": detail, "presets": {"ft": "preset.jsonl"},
+                "index": {"templates": "floor3_templates.json"}}}}, f)
+
+        templates = ResponseTemplates(SceneRegistry(tmp), check_interval_s=0.0)
+        builds = []
+        original = response_templates.read_preset_record
+        response_templates.read_preset_record = lambda path: builds.append(path) or original(path)
+        try:
+            templates.warm()
+            for _ in range(20):
+                assert templates.preset_output("ft", "FLOOR_3") == "Welcome to floor 3."
+            assert len(builds) == 1
+            assert templates.location_info("FLOOR_3", "lift", "zh", provider="ft") == "您在电梯旁。"
+            assert templates.location_info("FLOOR_3", "dp_ms_entrance", provider="ft").startswith("Current location")
+
+            with open(os.path.join(tmp, "preset.jsonl"), "w", encoding="utf-8") as f:
+                f.write(json.dumps({"output": "Welcome back to floor 3."}) + "\n")
+            os.utime(os.path.join(tmp, "preset.jsonl"), (1, 1))
+            assert templates.preset_output("ft", "FLOOR_3") == "Welcome back to floor 3."
+            assert len(builds) == 2
+
+            with open(os.path.join(tmp, "preset.jsonl"), "w", encoding="utf-8") as f:
+                f.write("")
+            os.utime(os.path.join(tmp, "preset.jsonl"), (2, 2))
+            assert templates.preset_output("ft", "FLOOR_3") == DEFAULT_PRESET_OUTPUT
+        finally:
+            response_templates.read_preset_record = original
+    finally:
+        shutil.rmtree(tmp)
+    print("✅ 模板只构建一次并随源文件重建")
+
+
+if __name__ == "__main__":
+    test_builtin_sites()
+    test_built_once_and_rebuilt_on_change()
+    print("🎉 响应模板测试全部通过")
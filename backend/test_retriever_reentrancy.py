@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+测试检索器可重入：SCENE_A / SCENE_B 在线程池中并发检索，结果与串行一致且互不串场景
+"""
+
+import os
+import sys
+import io
+import json
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from enhanced_retriever import EnhancedDualChannelRetriever
+from scene_registry import SceneRegistry, RetrievalState
+from session_store import RETRIEVER_NS, InProcessSessionBackend
+
+CAPTIONS = {
+    "SCENE_A_MS": [
+        "a glass door with a yellow line on the floor and a green trash bin",
+        "cardboard boxes on the floor near a shelf",
+        "a bookshelf with a qr code",
+    ],
+    "SCENE_B_STUDIO": [
+        "a large open space with a sofa and a tv screen",
+        "a tv screen and a purple chair",
+        "a table with laptops near the windows",
+    ],
+}
+
+SCENE_PREFIX = {
+    "SCENE_A_MS": {f"poi{i:02d}" for i in range(1, 11)},
+    "SCENE_B_STUDIO": {f"poi{i:02d}" for i in range(11, 21)},
+}
+
+
+def _quiet(fn, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def _run(retriever, site_id, caption):
+    # 不在工作线程里重定向 stdout（sys.stdout 是进程级的，并发重定向会互相覆盖）
+    return retriever.retrieve(caption, 10, site_id, RetrievalState())
+
+
+def test_registry_caches_per_site():
+    """同一站点只加载一次，不同站点互不影响"""
+    registry = SceneRegistry()
+    a1 = _quiet(registry.get, "SCENE_A_MS")
+    b1 = _quiet(registry.get, "SCENE_B_STUDIO")
+    assert a1 is registry.get("SCENE_A_MS")
+    assert b1 is registry.get("SCENE_B_STUDIO")
+    assert a1.nodes and b1.nodes
+    assert _quiet(registry.get, "UNKNOWN_SITE") is None
+    print("✅ SceneRegistry 按站点缓存")
+
+
+def test_concurrent_matches_sequential():
+    """并发检索与串行检索结果一致，且候选只来自请求的场景"""
+    retriever = _quiet(EnhancedDualChannelRetriever)
+    jobs = [(site, cap) for site, caps in CAPTIONS.items() for cap in caps] * 4
+
+    expected = {job: json.dumps(_run(retriever, *job), sort_keys=True) for job in set(jobs)}
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda job: (job, _run(retriever, *job)), jobs))
+
+    for (site, cap), candidates in results:
+        assert json.dumps(candidates, sort_keys=True) == expected[(site, cap)], (site, cap)
+        for cand in candidates:
+            assert cand["id"][:5] in SCENE_PREFIX[site], (site, cand["id"])
+    print(f"✅ {len(jobs)} 个并发请求与串行结果一致，无跨场景污染")
+
+
+def test_state_is_per_session():
+    """连续识别计数只影响传入的会话状态"""
+    retriever = _quiet(EnhancedDualChannelRetriever)
+    caption = CAPTIONS["SCENE_A_MS"][0]
+    s1, s2 = RetrievalState(), RetrievalState()
+    for _ in range(3):
+        _quiet(retriever.retrieve, caption, 10, "SCENE_A_MS", s1)
+    _quiet(retriever.retrieve, caption, 10, "SCENE_A_MS", s2)
+    assert s1.repeat_count >= 1 and s1.last_top1_id
+    assert s2.repeat_count == 1
+    assert RetrievalState.from_dict(s1.to_dict()) == s1
+    print(f"✅ 会话状态独立: s1={s1}, s2={s2}")
+
+
+def test_concurrent_state_updates_merge():
+    """同一会话的两个请求都基于同一快照检索：按 rebase 原子写回时两次 advance 都保留"""
+    store = InProcessSessionBackend()
+    key = "T1_ft_SCENE_A_MS"
+    store.set(RETRIEVER_NS, key, {"last_top1_id": "poi01", "repeat_count": 2})
+    base = RetrievalState.from_dict(store.get(RETRIEVER_NS, key))
+    requests = [RetrievalState.from_dict(base.to_dict()) for _ in range(2)]
+    for state in requests:
+        state.advance("poi01")
+    for state in requests:
+        store.update(RETRIEVER_NS, key, lambda cur, state=state: state.rebase(base, cur), None)
+    assert store.get(RETRIEVER_NS, key) == {"last_top1_id": "poi01", "repeat_count": 4}
+
+    other = RetrievalState.from_dict(base.to_dict())
+    other.advance("poi05")
+    store.update(RETRIEVER_NS, key, lambda cur: other.rebase(base, cur), None)
+    assert store.get(RETRIEVER_NS, key) == {"last_top1_id": "poi05", "repeat_count": 1}
+    untouched = RetrievalState.from_dict(base.to_dict())
+    assert untouched.rebase(base, store.get(RETRIEVER_NS, key)) == {"last_top1_id": "poi05", "repeat_count": 1}
+    print("✅ 并发请求的检索状态原子合并")
+
+
+if __name__ == "__main__":
+    test_registry_caches_per_site()
+    test_concurrent_matches_sequential()
+    test_state_is_per_session()
+    test_concurrent_state_updates_merge()
+    print("🎉 检索器可重入测试全部通过")
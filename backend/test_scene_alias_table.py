@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+测试场景模型中由数据文件生成的别名表与节点细节表
+"""
+
+import os
+import sys
+import io
+import contextlib
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from scene_registry import SceneRegistry, build_alias_table, detail_key
+
+
+def _load(site_id):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return SceneRegistry().get(site_id)
+
+
+def test_alias_table_from_poi_codes():
+    """单POI记录优先，其次取codes列表中第一条包含该POI的记录"""
+    records = [
+        {"node_hint": "shared_spot", "poi": {"codes": ["POI01", "POI02"]}},
+        {"node_hint": "door_spot", "poi": {"code": "POI01"}},
+        {"fusion": {"links": {"textmap_node_id": "poi03_box"}}, "poi": {"code": "POI03"}},
+        {"node_hint": "no_poi"},
+    ]
+    table = build_alias_table(["poi01_door", "poi02_bin", "poi03_box_pile", "poi04_none"], records)
+    assert table == {"poi01_door": "door_spot", "poi02_bin": "shared_spot", "poi03_box_pile": "poi03_box"}
+    assert detail_key(records[2]) == "poi03_box"
+    print("✅ 别名表由 poi.code/poi.codes 生成")
+
+
+def test_scene_a_details_match_linear_scan():
+    """预计算的节点细节与按别名线性扫描的结果一致"""
+    scene = _load("SCENE_A_MS")
+    assert len(scene.alias_table) == len(scene.nodes)
+    for node in scene.nodes:
+        alias = scene.alias_for(node["id"])
+        expected = [item for item in scene.detail_records if item.get("node_hint") == alias]
+        assert expected and scene.details_for_node(node["id"]) == expected, node["id"]
+    # 非结构节点ID：直接按细节键查找，0命中时走关键词兜底
+    assert scene.details_for_node("dp_ms_entrance") == scene.details_for_hint("dp_ms_entrance")
+    assert len(scene.details_for_node("some_printer_area")) == (
+        len(scene.details_for_hint("tv_zone")) + len(scene.details_for_hint("desks_cluster")))
+    assert scene.details_for_node("unknown_spot") == []
+    print("✅ Scene A 节点细节与线性扫描一致")
+
+
+def test_scene_b_uses_textmap_links():
+    """Scene B 细节记录没有 node_hint，通过 fusion.links.textmap_node_id 关联"""
+    scene = _load("SCENE_B_STUDIO")
+    details = scene.details_for_node("poi14_main_work_table")
+    assert details and all(detail_key(item) == "poi14_main_table" for item in details)
+    assert scene.details_for_node("poi13_built_in_metal_shelving") == []
+    print(f"✅ Scene B 别名表: {len(scene.alias_table)}/{len(scene.nodes)} 个节点有细节记录")
+
+
+if __name__ == "__main__":
+    test_alias_table_from_poi_codes()
+    test_scene_a_details_match_linear_scan()
+    test_scene_b_uses_textmap_links()
+    print("🎉 场景别名表测试全部通过")
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+测试场景热更新：后台重载原子替换并递增版本、请求内固定版本、坏数据不替换、文件监视触发重载
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import contextvars
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from scene_registry import DATA_DIR, SITE_FILES, SceneRegistry, SceneWatcher
+
+STRUCTURE, DETAIL = SITE_FILES["SCENE_A_MS"]
+
+
+def _site_dir():
+    tmp = tempfile.mkdtemp(prefix="reload_")
+    shutil.copy(os.path.join(DATA_DIR, STRUCTURE), tmp)
+    shutil.copy(os.path.join(DATA_DIR, DETAIL), tmp)
+    with open(os.path.join(tmp, "sites.json"), "w", encoding="utf-8") as f:
+        json.dump({"sites": {"SITE": {"structure": STRUCTURE, "detail": DETAIL}}}, f)
+    return tmp
+
+
+def _rename_first_node(tmp, name):
+    """模拟 fix_textmap 脚本：改写结构文件中第一个节点的名称"""
+    path = os.path.join(tmp, STRUCTURE)
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    doc = json.loads(lines[0])
+    doc["input"]["topology"]["nodes"][0]["name"] = name
+    lines[0] = json.dumps(doc, ensure_ascii=False)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    # 保证 mtime 变化（部分文件系统时间精度较粗）
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10_000_000))
+
+
+def test_reload_swaps_and_bumps_version():
+    """reload 后新请求看到新数据和新版本；已固定的请求仍使用旧版本"""
+    tmp = _site_dir()
+    try:
+        registry = SceneRegistry(tmp)
+        seen = []
+        registry.add_reload_listener(lambda sid, model: seen.append((sid, model.version)))
+        v1 = registry.get("SITE")
+        assert v1.version == 1 and registry.version("SITE") == 1
+
+        # 模拟一个进行中的请求：固定 v1
+        ctx = contextvars.copy_context()
+        ctx.run(registry.pin, "SITE")
+
+        _rename_first_node(tmp, "Renamed Entrance")
+        v2 = registry.reload_async("SITE").result(timeout=30)
+        assert v2 is not None and v2.version == 2 and registry.version("SITE") == 2
+        assert registry.get("SITE").nodes[0]["name"] == "Renamed Entrance"
+        assert ctx.run(registry.get, "SITE") is v1
+        assert v1.nodes[0]["name"] != "Renamed Entrance"
+        assert seen == [("SITE", 2)]
+
+        # 淘汰后重新加载不改变版本
+        registry._models.clear()
+        assert registry.get("SITE").version == 2
+    finally:
+        shutil.rmtree(tmp)
+    print("✅ 重载原子替换，版本递增，进行中的请求保持旧版本")
+
+
+def test_broken_file_keeps_previous_model():
+    """结构文件写坏（解析失败）时保留旧模型"""
+    tmp = _site_dir()
+    try:
+        registry = SceneRegistry(tmp)
+        v1 = registry.get("SITE")
+        with open(os.path.join(tmp, STRUCTURE), "w", encoding="utf-8") as f:
+            f.write('{"input": {"topology": ')
+        assert registry.reload("SITE") is None
+        assert registry.get("SITE") is v1 and registry.version("SITE") == 1
+    finally:
+        shutil.rmtree(tmp)
+    print("✅ 坏数据不替换")
+
+
+def test_watcher_reloads_after_file_settles():
+    """监视器在指纹连续两次轮询相同后才重载"""
+    tmp = _site_dir()
+    try:
+        registry = SceneRegistry(tmp)
+        registry.get("SITE")
+        watcher = SceneWatcher(registry, interval=0.1)
+        assert watcher.poll() == []
+
+        _rename_first_node(tmp, "Watched Entrance")
+        assert registry.stale_sites() == ["SITE"]
+        assert watcher.poll() == []               # 第一次看到变化：等待写入稳定
+        assert watcher.poll() == ["SITE"]         # 指纹未再变化：重载
+        assert registry.version("SITE") == 2
+        assert registry.get("SITE").nodes[0]["name"] == "Watched Entrance"
+        assert registry.stale_sites() == [] and watcher.poll() == []
+
+        # 线程方式运行
+        watcher.start()
+        _rename_first_node(tmp, "Threaded Entrance")
+        deadline = time.time() + 5
+        while registry.version("SITE") != 3 and time.time() < deadline:
+            time.sleep(0.05)
+        watcher.stop()
+        assert registry.get("SITE").nodes[0]["name"] == "Threaded Entrance"
+    finally:
+        shutil.rmtree(tmp)
+    print("✅ 文件监视触发后台重载")
+
+
+def test_slow_listener_does_not_block_reloads():
+    """重载回调在释放重载锁后调用：回调未返回时其他重载照常完成"""
+    tmp = _site_dir()
+    try:
+        registry = SceneRegistry(tmp)
+        registry.get("SITE")
+        entered, release = threading.Event(), threading.Event()
+
+        def slow_listener(sid, model):
+            if model.version == 2:
+                entered.set()
+                release.wait(10)
+
+        registry.add_reload_listener(slow_listener)
+        first = threading.Thread(target=registry.reload, args=("SITE",))
+        first.start()
+        try:
+            assert entered.wait(10)
+            _rename_first_node(tmp, "Second Entrance")
+            done = []
+            second = threading.Thread(target=lambda: done.append(registry.reload("SITE")))
+            second.start()
+            second.join(5)
+            assert done and done[0].version == 3, "reload blocked by a running listener"
+        finally:
+            release.set()
+            first.join()
+        assert registry.get("SITE").nodes[0]["name"] == "Second Entrance"
+    finally:
+        shutil.rmtree(tmp)
+    print("✅ 慢回调不阻塞重载")
+
+
+if __name__ == "__main__":
+    test_reload_swaps_and_bumps_version()
+    test_broken_file_keeps_previous_model()
+    test_slow_listener_does_not_block_reloads()
+    test_watcher_reloads_after_file_settles()
+    print("🎉 场景热更新测试全部通过")
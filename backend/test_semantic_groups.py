@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+测试预计算的语义去重分组：加载时的分组表与逐候选关键词打分一致，去重输出不变
+"""
+
+import os
+import sys
+import io
+import random
+import contextlib
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from semantic_groups import build_group_table, semantic_group
+from enhanced_retriever import EnhancedDualChannelRetriever
+
+
+def test_classifier_rules():
+    """实体别名优先；关键词打分取最高组；低于阈值不分组"""
+    assert semantic_group("poi07_cardboard_boxes", "Cardboard Boxes") == "orange_sofa_corner"
+    assert semantic_group("POI09_QR_Bookshelf") == "chair_on_yline"
+    assert semantic_group("large_tv", "Large TV screen near entry") == "tv_screen_group"
+    assert semantic_group("n1", "", "orange couch") == "sofa_group"
+    assert semantic_group("n2", "plant") is None
+    print("✅ 分组规则")
+
+
+def test_group_table_matches_scene_nodes():
+    """每个站点的分组表覆盖全部节点，且与现场计算一致"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        retriever = EnhancedDualChannelRetriever(alignment="node")
+    for site_id in ("SCENE_A_MS", "SCENE_B_STUDIO"):
+        scene = retriever.registry.get(site_id)
+        assert scene.dedup_groups == build_group_table(scene.nodes)
+        for node in scene.nodes:
+            key = (node["id"], node.get("name", ""))
+            assert scene.dedup_groups[key] == semantic_group(node["id"], node.get("name", "")), key
+    print("✅ 分组表与现场计算一致")
+
+
+def test_dedup_output_unchanged_with_table():
+    """有无分组表时去重结果相同（顺序、合并数、分组标签）"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        retriever = EnhancedDualChannelRetriever(alignment="node")
+    rng = random.Random(11)
+    for site_id in ("SCENE_A_MS", "SCENE_B_STUDIO"):
+        scene = retriever.registry.get(site_id)
+        for _ in range(50):
+            def fresh():
+                r = random.Random(seed)
+                return [{"id": n["id"], "text": n.get("name", ""), "score": r.random()} for n in scene.nodes]
+            seed = rng.random()
+            with_table = retriever._semantic_deduplication(fresh(), "", scene.dedup_groups)
+            without = retriever._semantic_deduplication(fresh(), "")
+            assert with_table == without
+            assert len(with_table) <= len(scene.nodes)
+    print("✅ 去重输出与逐候选计算一致")
+
+
+if __name__ == "__main__":
+    test_classifier_rules()
+    test_group_table_matches_scene_nodes()
+    test_dedup_output_unchanged_with_table()
+    print("🎉 语义去重分组测试全部通过")
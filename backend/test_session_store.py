@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+测试会话状态后端（内存 / SQLite）的一致性与原子更新
+"""
+
+import os
+import sys
+import tempfile
+import multiprocessing
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from session_store import (
+    InProcessSessionBackend, SessionBackend, SQLiteSessionBackend, create_session_backend,
+    PHOTO_COUNT_NS, LOG_SWITCH_NS, SESSION_NS,
+)
+
+
+def _backends():
+    tmp = tempfile.mkdtemp()
+    return [InProcessSessionBackend(), SQLiteSessionBackend(os.path.join(tmp, "state.db"))]
+
+
+def _incr_worker(db_path, n):
+    store = SQLiteSessionBackend(db_path)
+    for _ in range(n):
+        store.update(PHOTO_COUNT_NS, "S1_ft_SCENE_A_MS", lambda c: (c or 0) + 1, 0)
+
+
+def test_basic_get_set_update():
+    """两种后端的 get/set/update 语义一致"""
+    print("🔍 测试基本读写...")
+    for store in _backends():
+        assert store.get(SESSION_NS, "missing") is None
+        assert store.get(SESSION_NS, "missing", {}) == {}
+
+        store.set(SESSION_NS, "S1", {"site_id": "SCENE_A_MS", "location_history": []})
+        session = store.get(SESSION_NS, "S1")
+        session["location_history"].append({"location": "poi01"})
+        # 返回的是副本，未写回前不影响存储
+        assert store.get(SESSION_NS, "S1")["location_history"] == [], store.name
+
+        def _apply(s):
+            s["location_history"].append({"location": "poi02"})
+            return s
+        store.update(SESSION_NS, "S1", _apply)
+        assert store.get(SESSION_NS, "S1")["location_history"] == [{"location": "poi02"}]
+
+        assert store.contains(SESSION_NS, "S1")
+        store.delete(SESSION_NS, "S1")
+        assert not store.contains(SESSION_NS, "S1")
+        print(f"  ✅ {store.name}")
+
+
+def test_compare_and_set_first_photo():
+    """首张照片检测：只有第一次 0 → 1 成功"""
+    print("🔍 测试首张照片 compare_and_set...")
+    for store in _backends():
+        key = "S1_ft_SCENE_A_MS"
+        assert store.compare_and_set(PHOTO_COUNT_NS, key, 0, 1, default=0) is True
+        assert store.compare_and_set(PHOTO_COUNT_NS, key, 0, 1, default=0) is False
+        assert store.get(PHOTO_COUNT_NS, key) == 1
+        print(f"  ✅ {store.name}")
+
+
+def test_log_switch_defaults():
+    """日志开关未设置时返回默认值"""
+    print("🔍 测试日志开关...")
+    for store in _backends():
+        default = {"enabled": False, "run_id": ""}
+        assert store.get(LOG_SWITCH_NS, "S1|ft", default) == default
+
+        def _on(cur):
+            cur["enabled"] = True
+            cur["run_id"] = "R1"
+            return cur
+        store.update(LOG_SWITCH_NS, "S1|ft", _on, default)
+        assert store.get(LOG_SWITCH_NS, "S1|ft") == {"enabled": True, "run_id": "R1"}
+        assert store.get(LOG_SWITCH_NS, "S1|base", default) == default
+        print(f"  ✅ {store.name}")
+
+
+def test_sqlite_multiprocess_atomic():
+    """多进程并发自增不丢失更新（模拟 --workers N）"""
+    print("🔍 测试 SQLite 多进程原子更新...")
+    db_path = os.path.join(tempfile.mkdtemp(), "state.db")
+    SQLiteSessionBackend(db_path)
+    procs = [multiprocessing.Process(target=_incr_worker, args=(db_path, 50)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert SQLiteSessionBackend(db_path).get(PHOTO_COUNT_NS, "S1_ft_SCENE_A_MS") == 200
+    print("  ✅ 4 workers × 50 increments = 200")
+
+
+def test_factory():
+    """SESSION_BACKEND 选择后端"""
+    assert create_session_backend("memory").name == "memory"
+    db_path = os.path.join(tempfile.mkdtemp(), "state.db")
+    assert create_session_backend("sqlite", db_path).name == "sqlite"
+    try:
+        SessionBackend()
+        assert False, "abstract backend instantiated"
+    except TypeError:
+        pass
+
+
+if __name__ == "__main__":
+    test_basic_get_set_update()
+    test_compare_and_set_first_photo()
+    test_log_switch_defaults()
+    test_sqlite_multiprocess_atomic()
+    test_factory()
+    print("🎉 会话状态后端测试全部通过")
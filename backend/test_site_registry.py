@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+测试清单驱动的站点注册表：清单解析、sites.d 片段新增站点、LRU 按站点数/内存淘汰
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+import scene_registry
+from scene_registry import DATA_DIR, SITE_FILES, SceneRegistry, load_site_manifest
+
+
+def _site_dir(n_sites):
+    """临时数据目录：把 Scene A 的文件复制成 n 个站点，全部通过 sites.d 片段声明"""
+    tmp = tempfile.mkdtemp(prefix="sites_")
+    structure, detail = SITE_FILES["SCENE_A_MS"]
+    shutil.copy(os.path.join(DATA_DIR, structure), tmp)
+    shutil.copy(os.path.join(DATA_DIR, detail), tmp)
+    with open(os.path.join(tmp, "sites.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "sites": {}}, f)
+    os.makedirs(os.path.join(tmp, "sites.d"))
+    for i in range(n_sites):
+        with open(os.path.join(tmp, "sites.d", f"floor{i:02d}.json"), "w", encoding="utf-8") as f:
+            json.dump({"sites": {f"FLOOR_{i:02d}": {
+                "structure": structure, "detail": detail,
+                "presets": {"FT": structure}}}}, f)
+    return tmp
+
+
+def test_default_manifest():
+    """仓库自带清单声明两个站点及其预设输出/索引产物"""
+    specs = load_site_manifest()
+    assert set(specs) == set(SITE_FILES)
+    registry = SceneRegistry()
+    assert registry.preset_file("ft", "SCENE_A_MS").endswith("Sense_A_Finetuned.fixed.jsonl")
+    assert registry.preset_file("base", "SCENE_B_STUDIO").endswith("Sense_B_4o.fixed.jsonl")
+    assert registry.preset_file("ft", "NO_SUCH_SITE") is None
+    assert registry.index_file("SCENE_A_MS", "embeddings").endswith(os.path.join("models", "SCENE_A_MS.meta.json"))
+    scene = registry.get("SCENE_B_STUDIO")
+    assert scene.nodes and scene.detail_records and scene.approx_bytes > 0
+    assert registry.get("NO_SUCH_SITE") is None
+    print(f"✅ 默认清单: {registry.sites()}")
+
+
+def test_drop_in_site_fragments():
+    """放入 sites.d 片段即可新增站点（无需修改代码）"""
+    tmp = _site_dir(3)
+    try:
+        registry = SceneRegistry(tmp)
+        assert registry.sites() == ["FLOOR_00", "FLOOR_01", "FLOOR_02"]
+        assert registry.preset_file("ft", "FLOOR_01") == os.path.join(tmp, SITE_FILES["SCENE_A_MS"][0])
+        assert len(registry.get("FLOOR_02").nodes) == len(SceneRegistry().get("SCENE_A_MS").nodes)
+    finally:
+        shutil.rmtree(tmp)
+    print("✅ sites.d 片段新增站点")
+
+
+def test_lru_bounds():
+    """常驻站点数与估算内存超限时淘汰最久未使用的站点"""
+    tmp = _site_dir(5)
+    try:
+        registry = SceneRegistry(tmp, max_resident=2)
+        for site_id in ("FLOOR_00", "FLOOR_01", "FLOOR_00", "FLOOR_02"):
+            assert registry.get(site_id) is not None
+        assert registry.resident() == ["FLOOR_00", "FLOOR_02"]
+        assert registry.evictions == 1 and registry.loads == 3
+        # peek 只看常驻站点：不加载、不改变 LRU 顺序
+        assert registry.peek("FLOOR_01") is None and registry.peek("FLOOR_00") is not None
+        assert registry.resident() == ["FLOOR_00", "FLOOR_02"] and registry.loads == 3
+
+        one = registry.get("FLOOR_00").approx_bytes
+        by_mem = SceneRegistry(tmp, max_mb=(one * 3.5) / (1024 * 1024))
+        for i in range(5):
+            by_mem.get(f"FLOOR_{i:02d}")
+        assert by_mem.resident() == ["FLOOR_02", "FLOOR_03", "FLOOR_04"]
+        assert by_mem.resident_bytes() <= by_mem.max_bytes
+
+        # 上限小于单个站点时仍保留最近使用的一个
+        tiny = SceneRegistry(tmp, max_mb=0.0001)
+        tiny.get("FLOOR_00")
+        tiny.get("FLOOR_01")
+        assert tiny.resident() == ["FLOOR_01"]
+    finally:
+        shutil.rmtree(tmp)
+    print("✅ LRU 按站点数与内存淘汰")
+
+
+def test_cold_load_outside_lock():
+    """一个站点冷加载期间，已常驻站点的 get 不被阻塞；同一站点的并发请求只加载一次"""
+    tmp = _site_dir(2)
+    original = scene_registry.load_scene_model
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_load(site_id, *args):
+        calls.append(site_id)
+        if site_id == "FLOOR_01":
+            started.set()
+            release.wait(5)
+        return original(site_id, *args)
+
+    scene_registry.load_scene_model = slow_load
+    try:
+        registry = SceneRegistry(tmp)
+        resident = registry.get("FLOOR_00")
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            cold = [pool.submit(registry.get, "FLOOR_01") for _ in range(2)]
+            assert started.wait(5)
+            # 冷加载进行中：常驻站点立即返回
+            assert pool.submit(registry.get, "FLOOR_00").result(timeout=1) is resident
+            release.set()
+            models = [f.result(timeout=5) for f in cold]
+        assert models[0] is models[1] is not None
+        assert calls == ["FLOOR_00", "FLOOR_01"] and registry.loads == 2
+        assert registry.resident() == ["FLOOR_00", "FLOOR_01"]
+    finally:
+        scene_registry.load_scene_model = original
+        release.set()
+        shutil.rmtree(tmp)
+    print("✅ 冷加载不阻塞其他站点")
+
+
+if __name__ == "__main__":
+    test_default_manifest()
+    test_drop_in_site_fragments()
+    test_lru_bounds()
+    test_cold_load_outside_lock()
+    print("🎉 站点注册表测试全部通过")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+测试结构化日志：级别门控、采样、请求调试轨迹（一条 JSON 记录）
+"""
+
+import os
+import sys
+import io
+import json
+import logging
+import contextlib
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+import structured_log
+from structured_log import (
+    JsonFormatter, SamplingFilter, get_logger, start_trace, trace_event, trace_enabled, finish_trace,
+)
+from enhanced_retriever import EnhancedDualChannelRetriever
+from scene_registry import RetrievalState
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _capture(logger_name):
+    handler = _ListHandler()
+    logging.getLogger(logger_name).addHandler(handler)
+    return handler
+
+
+def test_sampling_and_json_format():
+    """WARNING 以下按比例采样，轨迹与告警不采样；输出为单行 JSON"""
+    f = SamplingFilter(rate=0.0)
+    make = lambda name, level: logging.LogRecord(name, level, __file__, 1, "m %s", ("x",), None)
+    assert not f.filter(make("textnavi.retriever", logging.DEBUG))
+    assert f.filter(make("textnavi.retriever", logging.WARNING))
+    assert f.filter(make(structured_log.TRACE_LOGGER, logging.INFO))
+
+    record = make("textnavi.retriever", logging.INFO)
+    record.fields = {"site_id": "SCENE_A_MS"}
+    line = JsonFormatter().format(record)
+    payload = json.loads(line)
+    assert "\n" not in line and payload["msg"] == "m x" and payload["site_id"] == "SCENE_A_MS"
+    print("✅ 采样与 JSON 格式正确")
+
+
+def test_retrieve_is_silent_by_default():
+    """默认级别下检索不写 stdout，也不产生轨迹"""
+    get_logger("retriever")
+    logging.getLogger(structured_log.ROOT_LOGGER).setLevel(logging.WARNING)
+    retriever = EnhancedDualChannelRetriever()
+    out = io.StringIO()
+    start_trace(False)
+    with contextlib.redirect_stdout(out):
+        retriever.retrieve("a glass door with a green trash bin", 10, "SCENE_A_MS", RetrievalState())
+    assert out.getvalue() == "", out.getvalue()[:200]
+    assert not trace_enabled() and finish_trace() is None
+    print("✅ 默认情况下检索热路径无控制台输出")
+
+
+def test_request_trace_single_record():
+    """开启轨迹后，检索事件汇总为一条 JSON 记录输出"""
+    handler = _capture(structured_log.TRACE_LOGGER)
+    retriever = EnhancedDualChannelRetriever()
+    start_trace(True, req_id="r1", site_id="SCENE_A_MS")
+    retriever.retrieve("a glass door with a green trash bin", 10, "SCENE_A_MS", RetrievalState())
+    trace_event("custom", value=1)
+    record = finish_trace(node_id="poi01_entrance_glass_door")
+
+    events = [e["event"] for e in record["events"]]
+    assert events == ["fusion", "retrieve", "custom"], events
+    assert record["req_id"] == "r1" and record["node_id"] == "poi01_entrance_glass_door"
+    assert len(handler.records) == 1 and handler.records[0].fields == record
+    json.dumps(record)
+    assert not trace_enabled()
+    logging.getLogger(structured_log.TRACE_LOGGER).removeHandler(handler)
+    print(f"✅ 请求轨迹输出为一条记录: {events}")
+
+
+if __name__ == "__main__":
+    test_sampling_and_json_format()
+    test_retrieve_is_silent_by_default()
+    test_request_trace_single_record()
+    print("🎉 结构化日志测试全部通过")
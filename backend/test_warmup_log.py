@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+测试首张照片 warmup 日志：sync / off 立即写行，async 在后台生成 caption 后补写，
+行的时间戳取响应时刻，caption 失败时记录 BLIP_FAILED
+"""
+
+import os
+import sys
+import csv
+import time
+import tempfile
+import threading
+
+# 添加当前目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from bench.corpus import usable_log_caption
+from warmup_log import WARMUP_PLACEHOLDER, WarmupLog, warmup_row
+
+HEADER = ["site_id", "run_id", "ts_iso", "req_id", "session_id", "provider", "phase", "caption",
+          "top1_id", "top1_score", "top2_id", "top2_score", "margin", "gt_node_id",
+          "hit_top1", "hit_top2", "hit_hop1", "low_conf", "low_conf_rule",
+          "client_start_ms", "server_recv_ms", "server_resp_ms"]
+
+
+def _rows(path):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def _log_file(d):
+    path = os.path.join(d, "locate_log.csv")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow(HEADER)
+    return path
+
+
+def test_row_layout():
+    """warmup 行与 locate 表头对齐，回放语料不会收录"""
+    row = dict(zip(HEADER, warmup_row("SCENE_A_MS", "r1", "T1", "ft", None, 11, 12, 13, "2026-01-01T00:00:00")))
+    assert len(warmup_row("S", "r", "T", "ft", "c", None, 1, 2, "t")) == len(HEADER)
+    assert row["phase"] == "warmup" and row["caption"] == WARMUP_PLACEHOLDER and row["run_id"] == "WARMUP"
+    assert (row["client_start_ms"], row["server_recv_ms"], row["server_resp_ms"]) == (11, 12, 13)
+    assert usable_log_caption({k: str(v) for k, v in row.items()}) is None
+    print("✅ warmup 行格式")
+
+
+def test_sync_and_off():
+    """sync：调用方给出 caption，立即写行；off：不需要图片，写占位文本"""
+    calls = []
+    with tempfile.TemporaryDirectory() as d:
+        path = _log_file(d)
+        sync = WarmupLog(lambda img: calls.append(img) or "unused", mode="sync")
+        assert sync.needs_image
+        assert sync.record(path, "SCENE_A_MS", "r1", "T1", "ft", None, 1, 2, caption="a glass door") is None
+        off = WarmupLog(lambda img: calls.append(img) or "unused", mode="off")
+        assert not off.needs_image
+        off.record(path, "SCENE_A_MS", "r2", "T2", "ft", 5, 6, 7, image=b"ignored")
+        rows = _rows(path)
+        assert [r["caption"] for r in rows] == ["a glass door", WARMUP_PLACEHOLDER]
+        assert rows[1]["client_start_ms"] == "5" and calls == []
+    try:
+        WarmupLog(str, mode="later")
+        assert False, "unknown mode accepted"
+    except ValueError:
+        pass
+    print("✅ sync / off 模式")
+
+
+def test_async_writes_after_response():
+    """async：record 立即返回，caption 在后台生成后写行；时间戳为响应时刻"""
+    release = threading.Event()
+
+    def slow_caption(image):
+        release.wait(5)
+        if image == b"broken":
+            raise RuntimeError("decoder error")
+        return "a black cabinet with drawers"
+
+    with tempfile.TemporaryDirectory() as d:
+        path = _log_file(d)
+        warmup = WarmupLog(slow_caption, mode="async")
+        t = time.perf_counter()
+        future = warmup.record(path, "SCENE_A_MS", "r1", "T1", "ft", 100, 200, 300, image=b"jpeg")
+        warmup.record(path, "SCENE_A_MS", "r2", "T2", "ft", None, 400, 500, image=b"broken")
+        assert time.perf_counter() - t < 0.5 and future is not None
+        assert warmup.pending() == 2 and _rows(path) == []
+
+        release.set()
+        assert warmup.drain(timeout=5)
+        rows = sorted(_rows(path), key=lambda r: r["req_id"])
+        assert rows[0]["caption"] == "a black cabinet with drawers" and rows[0]["phase"] == "warmup"
+        assert (rows[0]["client_start_ms"], rows[0]["server_recv_ms"], rows[0]["server_resp_ms"]) == ("100", "200", "300")
+        assert rows[1]["caption"].startswith("BLIP_FAILED:") and rows[1]["client_start_ms"] == ""
+        assert warmup.pending() == 0 and warmup.completed == 2 and warmup.failed == 0
+    print("✅ async 模式后台补写 warmup 行")
+
+
+if __name__ == "__main__":
+    test_row_layout()
+    test_sync_and_off()
+    test_async_writes_after_response()
+    print("🎉 warmup 日志测试全部通过")
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Shared evaluation core for the VLN4VI log tools
+metrics_eval / metrics_top1 / rq3_evaluation / experiment_manager 共用的评估内核：
+
+- load_table(path): CSV 只读一次，转成列式数组（LogTable），按 (mtime, size) 缓存；文件变化后自动重读
+- LogTable.index(column): 按会话 / run_id 等列建立分组索引（GroupIndex），分组计数用 np.bincount
+- *_metrics(table): Top-k / ±1-hop / 低置信 / 误信 / 澄清 / 错误恢复指标，全部是向量化的掩码与分组计数，
+  结果按表缓存（同一文件未变化时重复调用不重新计算）
+
+只计算、不打印；各脚本负责输出格式。
+"""
+
+import csv
+import os
+import statistics as stats
+from itertools import zip_longest
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TRUE_VALUES = ("true", "1", "yes")
+
+# 延迟 / 恢复时间分布区间（毫秒上界, 标签）
+LATENCY_RANGES = ((500, "0-500ms"), (1000, "500ms-1s"), (2000, "1s-2s"), (5000, "2s-5s"), (None, "5s+"))
+RECOVERY_RANGES = ((1000, "0-1s"), (5000, "1-5s"), (10000, "5-10s"), (30000, "10-30s"), (None, "30s+"))
+
+# metrics_top1 的置信度 / margin 分档（下界为开区间，最后一档兜底）
+CONFIDENCE_LEVELS = (("high", 0.7), ("medium", 0.4), ("low", None))
+MARGIN_LEVELS = (("large", 0.15), ("medium", 0.07), ("small", None))
+
+
+class GroupIndex:
+    """一列取值的分组索引：keys 按首次出现顺序排列，codes[i] 为第 i 行所属分组"""
+
+    def __init__(self, values: np.ndarray):
+        if len(values) == 0:
+            self.keys: List[str] = []
+            self.codes = np.zeros(0, dtype=np.int64)
+        else:
+            uniq, first, inverse = np.unique(values.astype(str), return_index=True, return_inverse=True)
+            order = np.argsort(first, kind="stable")
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            self.keys = [str(k) for k in uniq[order]]
+            self.codes = rank[inverse.reshape(-1)]
+        self.position = {k: i for i, k in enumerate(self.keys)}
+        self._rows: Optional[List[np.ndarray]] = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def count(self, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """每个分组的行数（给出 mask 时只数 mask 为真的行）"""
+        if mask is None:
+            return np.bincount(self.codes, minlength=len(self.keys))
+        return np.bincount(self.codes[mask], minlength=len(self.keys))
+
+    def count_of(self, key: str, mask: Optional[np.ndarray] = None) -> int:
+        i = self.position.get(key)
+        return 0 if i is None else int(self.count(mask)[i])
+
+    def rows(self, key: str) -> np.ndarray:
+        """某分组的行号（升序）"""
+        if self._rows is None:
+            order = np.argsort(self.codes, kind="stable")
+            bounds = np.cumsum(np.bincount(self.codes, minlength=len(self.keys)))[:-1]
+            self._rows = np.split(order, bounds) if len(self.keys) else []
+        i = self.position.get(key)
+        return self._rows[i] if i is not None else np.zeros(0, dtype=np.int64)
+
+
+class LogTable:
+    """列式日志表：原始列为 str 的 object 数组，布尔 / 数值列与分组索引按需解析并缓存"""
+
+    def __init__(self, header: Sequence[str], columns: Dict[str, np.ndarray], n_rows: int, path: str = ""):
+        self.path = path
+        self.header = list(header)
+        self.n_rows = n_rows
+        self._columns = columns
+        self._cache: Dict[Tuple, object] = {}
+
+    def __len__(self):
+        return self.n_rows
+
+    def has(self, name: str) -> bool:
+        return name in self._columns
+
+    def cached(self, key, fn: Callable[[], object]):
+        """按表缓存计算结果（文件变化时 load_table 返回新表，缓存随之失效）"""
+        if key not in self._cache:
+            self._cache[key] = fn()
+        return self._cache[key]
+
+    def str(self, name: str, default: str = "") -> np.ndarray:
+        """原始字符串列；列不存在时整列为 default"""
+        col = self._columns.get(name)
+        if col is not None:
+            return col
+        return self.cached(("default", name, default), lambda: np.full(self.n_rows, default, dtype=object))
+
+    def present(self, name: str) -> np.ndarray:
+        """非空（去掉空白后）"""
+        return self.cached(("present", name),
+                           lambda: np.array([bool(v.strip()) for v in self.str(name)], dtype=bool))
+
+    def flag(self, *names: str) -> np.ndarray:
+        """布尔列（true/1/yes，不区分大小写）；给出多个列名时使用第一个存在的列"""
+        name = next((n for n in names if self.has(n)), names[0])
+
+        def _parse():
+            col = self.str(name)
+            if len(col) == 0:
+                return np.zeros(0, dtype=bool)
+            uniq, inverse = np.unique(col.astype(str), return_inverse=True)
+            truth = np.array([u.lower() in TRUE_VALUES for u in uniq], dtype=bool)
+            return truth[inverse.reshape(-1)]
+        return self.cached(("flag", name), _parse)
+
+    def num(self, name: str) -> np.ndarray:
+        """浮点列，无法解析时为 NaN"""
+        return self.cached(("num", name), lambda: np.array([_to_float(v) for v in self.str(name)], dtype=float))
+
+    def ints(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """整数列：(值, 是否可解析)，与 int(str) 的规则一致"""
+        def _parse():
+            vals = [_to_int(v) for v in self.str(name)]
+            valid = np.array([v is not None for v in vals], dtype=bool)
+            return np.array([v if v is not None else 0 for v in vals], dtype=np.int64), valid
+        return self.cached(("ints", name), _parse)
+
+    def index(self, name: str, default: str = "unknown") -> GroupIndex:
+        """按列分组（session_id / run_id / provider / site_id ...）"""
+        return self.cached(("index", name, default), lambda: GroupIndex(self.str(name, default)))
+
+    def select(self, rows: np.ndarray) -> List[Dict[str, str]]:
+        """按行号取出行（字典形式，用于导出）"""
+        return [{h: self._columns[h][i] for h in self._columns} for i in rows]
+
+
+def _to_float(value: str) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _to_int(value: str) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_table(path: str) -> LogTable:
+    """读取 CSV 为列式表（空行跳过；短行补空串，超出表头的多余字段忽略）"""
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None) or []
+        rows = [r for r in reader if r]
+    n = len(rows)
+    columns = {}
+    transposed = list(zip_longest(*rows, fillvalue="")) if rows else []
+    for i, name in enumerate(header):   # 重复列名时与 DictReader 一样保留最后一列
+        col = np.empty(n, dtype=object)
+        if i < len(transposed):
+            col[:] = transposed[i]
+        else:
+            col[:] = ""
+        columns[name] = col
+    return LogTable(header, columns, n, path)
+
+
+_TABLE_CACHE: Dict[str, Tuple[Tuple[int, int], LogTable]] = {}
+
+
+def load_table(path: str) -> LogTable:
+    """带缓存的 read_table：文件的 (mtime, size) 不变时直接返回已解析的表"""
+    key = os.path.abspath(path)
+    st = os.stat(key)
+    stamp = (st.st_mtime_ns, st.st_size)
+    hit = _TABLE_CACHE.get(key)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+    table = read_table(key)
+    _TABLE_CACHE[key] = (stamp, table)
+    return table
+
+
+def clear_cache():
+    _TABLE_CACHE.clear()
+
+
+# ---------- 通用统计 ----------
+
+def distribution(values: np.ndarray, ranges) -> Dict[str, int]:
+    """按 (上界, 标签) 区间计数（左闭右开，最后一档上界为 None）"""
+    edges = np.array([ub for ub, _ in ranges if ub is not None], dtype=float)
+    counts = np.bincount(np.searchsorted(edges, np.asarray(values, dtype=float), side="right"),
+                         minlength=len(ranges))
+    return {label: int(c) for (_, label), c in zip(ranges, counts)}
+
+
+def stats_mean(values: np.ndarray):
+    """与 statistics.mean 的值和类型相同：整数样本的均值为整数时返回 int（JSON 输出保持不变）"""
+    values = np.asarray(values)
+    if values.dtype.kind not in "iu":
+        return stats.mean(values.tolist())
+    total, n = int(values.sum()), len(values)
+    return total // n if total % n == 0 else total / n
+
+
+def stats_median(values: np.ndarray):
+    """与 statistics.median 的值和类型相同：奇数个样本取中间值，偶数个取中间两值的平均（float）"""
+    ordered = np.sort(np.asarray(values))
+    i = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[i].item()
+    return (ordered[i - 1].item() + ordered[i].item()) / 2
+
+
+def summary_stats(values: np.ndarray) -> Dict[str, object]:
+    """均值 / 中位数 / P90 / P95 / 最值，键顺序与取值类型同原脚本的 statistics 实现
+
+    P90、P95 与 statistics.quantiles 相同（样本不足 2 个时为 'N/A'）。
+    """
+    values = np.asarray(values)
+    out = {"count": int(len(values)), "mean": stats_mean(values), "median": stats_median(values)}
+    try:
+        out["p90"] = stats.quantiles(values.tolist(), n=10)[8]
+        out["p95"] = stats.quantiles(values.tolist(), n=20)[18]
+    except stats.StatisticsError:
+        out["p90"] = out["p95"] = "N/A"
+    out["min"], out["max"] = values.min().item(), values.max().item()
+    return out
+
+
+def _rate(count: int, total: int) -> float:
+    return (count / total) * 100 if total > 0 else 0
+
+
+# ---------- locate_log 指标 ----------
+
+def localization_metrics(t: LogTable) -> Optional[Dict[str, object]]:
+    """有标签样本上的 Top-1 / Top-2 / ±1-Hop 命中；没有标签样本时返回 None"""
+    def _compute():
+        labeled = t.present("gt_node_id")
+        total = int(labeled.sum())
+        if total == 0:
+            return None
+        hit_top1 = int((t.flag("hit_top1") & labeled).sum())
+        hit_top2 = int((t.flag("hit_top2") & labeled).sum())
+        hit_hop1 = int((t.flag("hit_hop1") & labeled).sum())
+        return {
+            "total_labeled": total,
+            "hit_top1": hit_top1,
+            "hit_top2": hit_top2,
+            "hit_hop1": hit_hop1,
+            "top1_acc": hit_top1 / total * 100,
+            "top2_acc": hit_top2 / total * 100,
+            "hop1_acc": hit_hop1 / total * 100,
+        }
+    return t.cached(("metrics", "localization"), _compute)
+
+
+def low_confidence_metrics(t: LogTable) -> Dict[str, object]:
+    """低置信触发率与按规则的分布（按规则首次出现顺序，同 dict(Counter)）"""
+    def _compute():
+        low = t.flag("low_conf")
+        count = int(low.sum())
+        reasons = {}
+        if count:
+            idx = GroupIndex(t.str("low_conf_rule", "unknown")[low])
+            reasons = {k: int(c) for k, c in zip(idx.keys, idx.count())}
+        return {
+            "total_requests": len(t),
+            "low_conf_count": count,
+            "low_conf_rate": _rate(count, len(t)),
+            "low_conf_reasons": reasons,
+        }
+    return t.cached(("metrics", "low_conf"), _compute)
+
+
+def misbelief_metrics(t: LogTable) -> Optional[Dict[str, object]]:
+    """有标签样本上的误信率与澄清触发率；没有标签样本时返回 None"""
+    def _compute():
+        labeled = t.present("gt_node_id")
+        total = int(labeled.sum())
+        if total == 0:
+            return None
+        misbelief = int((t.flag("misbelief") & labeled).sum())
+        clar = int((t.flag("clarification_triggered") & labeled).sum())
+        return {
+            "total_labeled": total,
+            "misbelief_count": misbelief,
+            "clarification_triggered_count": clar,
+            "misbelief_rate": _rate(misbelief, total),
+            "clarification_rate": _rate(clar, total),
+        }
+    return t.cached(("metrics", "misbelief"), _compute)
+
+
+def _banded(values: np.ndarray, correct: np.ndarray, levels) -> Dict[str, Dict[str, int]]:
+    """按阈值分档计数（NaN 不计入任何一档）"""
+    valid = ~np.isnan(values)
+    out = {}
+    taken = np.zeros(len(values), dtype=bool)
+    for name, lower in levels:
+        band = valid & ~taken if lower is None else valid & ~taken & (values > lower)
+        taken |= band
+        out[name] = {"count": int(band.sum()), "correct": int((band & correct).sum())}
+    return out
+
+
+def top1_breakdown(t: LogTable) -> Dict[str, object]:
+    """有标签样本的 Top-1 正确率，按 provider / site / 置信度档 / margin 档拆分
+
+    正确与否优先读 correct 列（旧日志），没有该列时读 hit_top1。
+    """
+    def _compute():
+        labeled = t.present("gt_node_id")
+        correct = t.flag("correct", "hit_top1") & labeled
+        out = {
+            "total_labeled": int(labeled.sum()),
+            "correct_predictions": int(correct.sum()),
+            "incorrect_predictions": int(labeled.sum() - correct.sum()),
+        }
+        for key, column in (("by_provider", "provider"), ("by_site", "site_id")):
+            idx = t.index(column)
+            totals, hits = idx.count(labeled), idx.count(correct)
+            out[key] = {k: {"total": int(totals[i]), "correct": int(hits[i])}
+                        for i, k in enumerate(idx.keys) if totals[i] > 0}
+        out["confidence_ranges"] = _banded(t.num("top1_score")[labeled], correct[labeled], CONFIDENCE_LEVELS)
+        out["margin_ranges"] = _banded(t.num("margin")[labeled], correct[labeled], MARGIN_LEVELS)
+        return out
+    return t.cached(("metrics", "top1_breakdown"), _compute)
+
+
+def session_metrics(t: LogTable, correct_columns: Sequence[str] = ("hit_top1",)) -> Dict[str, Dict[str, int]]:
+    """每个会话一次分组计数：总请求、有标签、Top-1 命中、低置信、误信（按会话首次出现顺序）"""
+    def _compute():
+        idx = t.index("session_id")
+        labeled = t.present("gt_node_id")
+        cols = {
+            "total_samples": idx.count(),
+            "labeled_samples": idx.count(labeled),
+            "hit_top1": idx.count(t.flag(*correct_columns)),
+            "correct_predictions": idx.count(t.flag(*correct_columns) & labeled),
+            "low_conf": idx.count(t.flag("low_conf")),
+            "misbelief": idx.count(t.flag("misbelief")),
+        }
+        return {k: {name: int(v[i]) for name, v in cols.items()} for i, k in enumerate(idx.keys)}
+    return t.cached(("metrics", "sessions", tuple(correct_columns)), _compute)
+
+
+# ---------- latency / clarification / recovery ----------
+
+def latency_metrics(t: LogTable) -> Optional[Dict[str, object]]:
+    """e2e_latency_ms 的统计与分布；没有可用数据时返回 None"""
+    def _compute():
+        values, valid = t.ints("e2e_latency_ms")
+        lat = values[valid]
+        if len(lat) == 0:
+            return None
+        out = summary_stats(lat)
+        out["distribution"] = distribution(lat, LATENCY_RANGES)
+        return out
+    return t.cached(("metrics", "latency"), _compute)
+
+
+def clarification_metrics(t: LogTable) -> Optional[Dict[str, object]]:
+    """按 clarification_id 分组，取每组最后一条带 total_rounds 的结束记录
+
+    没有任何 clarification_id 时返回 None；id_groups 为出现过的澄清 ID 数，
+    sessions 为已结束的 [(clarification_id, 轮数, 是否成功)]（按首次出现顺序）。
+    """
+    def _compute():
+        has_id = t.present("clarification_id")
+        if not has_id.any():
+            return None
+        idx = t.index("clarification_id")
+        rounds, rounds_valid = t.ints("total_rounds")
+        end = has_id & t.present("total_rounds") & rounds_valid
+        success = t.flag("clarification_success")
+        # 每组最后一条结束记录：按行号顺序写入，后面的覆盖前面的
+        last = np.full(len(idx), -1, dtype=np.int64)
+        rows = np.flatnonzero(end)
+        last[idx.codes[rows]] = rows
+        sessions = [(k, int(rounds[last[i]]), bool(success[last[i]]))
+                    for i, k in enumerate(idx.keys) if last[i] >= 0]
+        id_groups = len(np.unique(idx.codes[has_id]))
+        if not sessions:
+            return {"id_groups": id_groups, "sessions": [], "total_sessions": 0}
+        total_rounds = [r for _, r, _ in sessions]
+        successful = sum(1 for _, _, s in sessions if s)
+        dist = {}   # 按轮数首次出现顺序，同 dict(Counter)
+        for r in total_rounds:
+            dist[r] = dist.get(r, 0) + 1
+        return {
+            "id_groups": id_groups,
+            "sessions": sessions,
+            "total_sessions": len(sessions),
+            "successful_sessions": successful,
+            "success_rate": successful / len(sessions) * 100,
+            "avg_rounds": stats_mean(np.array(total_rounds)),
+            "total_rounds": int(sum(total_rounds)),
+            "round_distribution": dist,
+        }
+    return t.cached(("metrics", "clarification"), _compute)
+
+
+def recovery_metrics(t: LogTable) -> Optional[Dict[str, object]]:
+    """已完成的错误恢复耗时统计；completed 为带 recovery_duration_ms 的记录数"""
+    def _compute():
+        completed = t.present("recovery_duration_ms")
+        values, valid = t.ints("recovery_duration_ms")
+        times = values[completed & valid]
+        out = {"completed": int(completed.sum())}
+        if len(times) == 0:
+            return out
+        s = summary_stats(times)
+        out.update({
+            "total_recoveries": s["count"], "mean_time": s["mean"], "median_time": s["median"],
+            "p90": s["p90"], "p95": s["p95"], "min_time": s["min"], "max_time": s["max"],
+            "time_distribution": distribution(times, RECOVERY_RANGES),
+        })
+        return out
+    return t.cached(("metrics", "recovery"), _compute)
+
+
+def rq3_session_metrics(loc: LogTable, clar: Optional[LogTable] = None,
+                        rec: Optional[LogTable] = None) -> Dict[str, Dict[str, int]]:
+    """RQ3 按会话：有标签样本、误信次数、澄清会话数、错误恢复次数（会话顺序：定位日志 → 澄清 → 恢复）"""
+    out: Dict[str, Dict[str, int]] = {}
+
+    def _row(sid):
+        return out.setdefault(sid, {"labeled": 0, "misbelief": 0, "clarification_sessions": 0, "recoveries": 0})
+
+    per_session = session_metrics(loc)
+    for sid, m in per_session.items():
+        r = _row(sid)
+        r["labeled"], r["misbelief"] = m["labeled_samples"], m["misbelief"]
+    if clar is not None and len(clar):
+        idx = clar.index("session_id")
+        has_id = clar.present("clarification_id")
+        pairs = np.unique(np.stack([idx.codes[has_id],
+                                    clar.index("clarification_id").codes[has_id]], axis=1), axis=0) \
+            if has_id.any() else np.zeros((0, 2), dtype=np.int64)
+        distinct = np.bincount(pairs[:, 0], minlength=len(idx)) if len(pairs) else np.zeros(len(idx), dtype=int)
+        for i, sid in enumerate(idx.keys):
+            _row(sid)["clarification_sessions"] = int(distinct[i])
+    if rec is not None and len(rec):
+        idx = rec.index("session_id")
+        counts = idx.count()
+        for i, sid in enumerate(idx.keys):
+            _row(sid)["recoveries"] = int(counts[i])
+    return out
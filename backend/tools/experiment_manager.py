@@ -13,6 +13,8 @@ from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional
 
+from eval_core import load_table, session_metrics
+
 class ExperimentManager:
     def __init__(self, log_dir: str = "logs"):
         self.log_dir = Path(log_dir)
@@ -140,19 +142,18 @@ class ExperimentManager:
             
             print("-" * 40)
     
+    def _session_table(self):
+        """日志的列式表（按文件 mtime 缓存，列出多个会话时只读一次）"""
+        if not self.log_file.exists():
+            return None
+        return load_table(str(self.log_file))
+    
     def _count_session_samples(self, session_id: str) -> int:
         """Count the number of samples for a specific session"""
-        if not self.log_file.exists():
+        table = self._session_table()
+        if table is None:
             return 0
-        
-        count = 0
-        with open(self.log_file, "r", newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("session_id") == session_id:
-                    count += 1
-        
-        return count
+        return table.index("session_id").count_of(session_id)
     
     def get_experiment_summary(self, session_id: str):
         """Get detailed summary for a specific experiment session"""
@@ -199,27 +200,17 @@ class ExperimentManager:
     
     def _get_session_metrics(self, session_id: str) -> Optional[Dict]:
         """Get performance metrics for a specific session"""
-        if not self.log_file.exists():
+        table = self._session_table()
+        if table is None:
             return None
         
-        metrics = {
-            "total_samples": 0,
-            "labeled_samples": 0,
-            "correct_predictions": 0
+        # 所有会话一次分组计数；正确与否优先读 correct 列，旧格式之外的日志读 hit_top1
+        m = session_metrics(table, correct_columns=("correct", "hit_top1")).get(session_id, {})
+        return {
+            "total_samples": m.get("total_samples", 0),
+            "labeled_samples": m.get("labeled_samples", 0),
+            "correct_predictions": m.get("correct_predictions", 0)
         }
-        
-        with open(self.log_file, "r", newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("session_id") == session_id:
-                    metrics["total_samples"] += 1
-                    
-                    if row.get("gt_node_id") and row["gt_node_id"].strip():
-                        metrics["labeled_samples"] += 1
-                        if row.get("correct", "").lower() in ("true", "1", "yes"):
-                            metrics["correct_predictions"] += 1
-        
-        return metrics
     
     def export_experiment_data(self, session_id: str, output_file: str = None):
         """Export experiment data for a specific session"""
@@ -231,12 +222,8 @@ class ExperimentManager:
             return
         
         # Filter data for the specific session
-        exported_rows = []
-        with open(self.log_file, "r", newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("session_id") == session_id:
-                    exported_rows.append(row)
+        table = self._session_table()
+        exported_rows = table.select(table.index("session_id").rows(session_id))
         
         if not exported_rows:
             print(f"❌ 会话 {session_id} 没有数据")
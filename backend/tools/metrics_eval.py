@@ -4,90 +4,62 @@ Comprehensive VLN4VI Metrics Evaluation
 Calculates localization success rate, end-to-end latency, and low-confidence trigger rate
 """
 
-import csv
 import json
 import sys
-import statistics as stats
-from collections import Counter, defaultdict
 from pathlib import Path
 
+from eval_core import (
+    load_table, latency_metrics, localization_metrics, low_confidence_metrics, session_metrics,
+)
+
 def load_locate_log(loc_file: str):
-    """Load and parse locate log CSV"""
-    rows = []
+    """Load locate log CSV into a columnar table (None on failure)"""
     try:
-        with open(loc_file, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                rows.append(row)
-        print(f"✅ Loaded {len(rows)} rows from {loc_file}")
+        table = load_table(loc_file)
+        print(f"✅ Loaded {len(table)} rows from {loc_file}")
     except FileNotFoundError:
         print(f"❌ Locate log file not found: {loc_file}")
-        return []
+        return None
     except Exception as e:
         print(f"❌ Error reading locate log: {e}")
-        return []
+        return None
     
-    return rows
+    return table
 
 def load_latency_log(e2e_file: str):
-    """Load and parse latency log CSV"""
-    lat = []
+    """Load latency log CSV into a columnar table (None on failure)"""
     try:
-        with open(e2e_file, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                try:
-                    lat.append(int(row["e2e_latency_ms"]))
-                except (ValueError, KeyError):
-                    pass
-        print(f"✅ Loaded {len(lat)} latency records from {e2e_file}")
+        table = load_table(e2e_file)
+        _, valid = table.ints("e2e_latency_ms")
+        print(f"✅ Loaded {int(valid.sum())} latency records from {e2e_file}")
     except FileNotFoundError:
         print(f"⚠️  Latency log file not found: {e2e_file}")
-        return []
+        return None
     except Exception as e:
         print(f"❌ Error reading latency log: {e}")
-        return []
+        return None
     
-    return lat
+    return table
 
-def calculate_localization_metrics(rows):
+def calculate_localization_metrics(table):
     """Calculate Top-1, Top-2, and ±1-Hop accuracy"""
     print("\n" + "="*60)
     print("🎯 LOCALIZATION SUCCESS RATE")
     print("="*60)
     
-    # Filter labeled samples
-    labeled_rows = [row for row in rows if row.get("gt_node_id") and row["gt_node_id"].strip()]
-    
-    if not labeled_rows:
+    metrics = localization_metrics(table)
+    if not metrics:
         print("❌ No labeled samples found (gt_node_id empty)")
         print("💡 To get accuracy metrics, include gt_node_id when calling /api/locate")
         return
     
-    total_labeled = len(labeled_rows)
+    total_labeled = metrics["total_labeled"]
+    hit_top1, hit_top2, hit_hop1 = metrics["hit_top1"], metrics["hit_top2"], metrics["hit_hop1"]
     print(f"📊 Total labeled samples: {total_labeled}")
     
-    # Calculate hit counts
-    hit_top1 = 0
-    hit_top2 = 0
-    hit_hop1 = 0
-    
-    for row in labeled_rows:
-        if row.get("hit_top1", "").lower() in ("true", "1", "yes"):
-            hit_top1 += 1
-        if row.get("hit_top2", "").lower() in ("true", "1", "yes"):
-            hit_top2 += 1
-        if row.get("hit_hop1", "").lower() in ("true", "1", "yes"):
-            hit_hop1 += 1
-    
-    # Calculate accuracies
-    top1_acc = (hit_top1 / total_labeled) * 100
-    top2_acc = (hit_top2 / total_labeled) * 100
-    hop1_acc = (hit_hop1 / total_labeled) * 100
-    
-    print(f"\n🎯 Top-1 Accuracy: {hit_top1}/{total_labeled} = {top1_acc:.2f}%")
-    print(f"🎯 Top-2 Accuracy: {hit_top2}/{total_labeled} = {top2_acc:.2f}%")
-    print(f"🎯 ±1-Hop Accuracy: {hit_hop1}/{total_labeled} = {hop1_acc:.2f}%")
+    print(f"\n🎯 Top-1 Accuracy: {hit_top1}/{total_labeled} = {metrics['top1_acc']:.2f}%")
+    print(f"🎯 Top-2 Accuracy: {hit_top2}/{total_labeled} = {metrics['top2_acc']:.2f}%")
+    print(f"🎯 ±1-Hop Accuracy: {hit_hop1}/{total_labeled} = {metrics['hop1_acc']:.2f}%")
     
     # Detailed breakdown
     print(f"\n📋 Detailed Breakdown:")
@@ -96,158 +68,84 @@ def calculate_localization_metrics(rows):
     print(f"  • Within ±1-Hop: {hit_hop1}")
     print(f"  • Total errors: {total_labeled - hit_top1}")
     
-    return {
-        "total_labeled": total_labeled,
-        "hit_top1": hit_top1,
-        "hit_top2": hit_top2,
-        "hit_hop1": hit_hop1,
-        "top1_acc": top1_acc,
-        "top2_acc": top2_acc,
-        "hop1_acc": hop1_acc
-    }
+    return metrics
 
-def calculate_low_confidence_rate(rows):
+def calculate_low_confidence_rate(table):
     """Calculate low-confidence trigger rate"""
     print("\n" + "="*60)
     print("⚠️  LOW-CONFIDENCE TRIGGER RATE")
     print("="*60)
     
-    total_requests = len(rows)
-    low_conf_count = 0
-    
-    # Count low-confidence requests
-    for row in rows:
-        if row.get("low_conf", "").lower() in ("true", "1", "yes"):
-            low_conf_count += 1
-    
-    low_conf_rate = (low_conf_count / total_requests) * 100 if total_requests > 0 else 0
+    metrics = low_confidence_metrics(table)
+    total_requests = metrics["total_requests"]
+    low_conf_count = metrics["low_conf_count"]
     
     print(f"📊 Total requests: {total_requests}")
     print(f"⚠️  Low-confidence requests: {low_conf_count}")
-    print(f"📈 Low-confidence trigger rate: {low_conf_count}/{total_requests} = {low_conf_rate:.2f}%")
+    print(f"📈 Low-confidence trigger rate: {low_conf_count}/{total_requests} = {metrics['low_conf_rate']:.2f}%")
     
     # Analyze low-confidence reasons
-    low_conf_reasons = Counter()
-    for row in rows:
-        if row.get("low_conf", "").lower() in ("true", "1", "yes"):
-            reason = row.get("low_conf_rule", "unknown")
-            low_conf_reasons[reason] += 1
-    
-    if low_conf_reasons:
+    if metrics["low_conf_reasons"]:
         print(f"\n🔍 Low-confidence breakdown:")
-        for reason, count in low_conf_reasons.most_common():
+        for reason, count in sorted(metrics["low_conf_reasons"].items(), key=lambda kv: -kv[1]):
             percentage = (count / low_conf_count) * 100
             print(f"  • {reason}: {count} ({percentage:.1f}%)")
     
-    return {
-        "total_requests": total_requests,
-        "low_conf_count": low_conf_count,
-        "low_conf_rate": low_conf_rate,
-        "low_conf_reasons": dict(low_conf_reasons)
-    }
+    return metrics
 
-def calculate_e2e_latency(lat):
+def calculate_e2e_latency(table):
     """Calculate end-to-end latency statistics"""
     print("\n" + "="*60)
     print("⏱️  END-TO-END LATENCY")
     print("="*60)
     
-    if not lat:
+    metrics = latency_metrics(table) if table is not None else None
+    if not metrics:
         print("❌ No latency data available")
         return
     
-    # Calculate statistics
-    mean_lat = stats.mean(lat)
-    median_lat = stats.median(lat)
-    min_lat = min(lat)
-    max_lat = max(lat)
-    
-    # Calculate percentiles
-    try:
-        p90 = stats.quantiles(lat, n=10)[8]
-        p95 = stats.quantiles(lat, n=20)[18]
-    except:
-        p90 = p95 = "N/A"
-    
-    print(f"📊 Sample count: {len(lat)}")
-    print(f"⏱️  Mean latency: {mean_lat:.1f} ms")
-    print(f"⏱️  Median (P50): {median_lat:.1f} ms")
+    p90, p95 = metrics["p90"], metrics["p95"]
+    print(f"📊 Sample count: {metrics['count']}")
+    print(f"⏱️  Mean latency: {metrics['mean']:.1f} ms")
+    print(f"⏱️  Median (P50): {metrics['median']:.1f} ms")
     print(f"⏱️  P90 latency: {p90:.1f} ms" if p90 != "N/A" else "⏱️  P90 latency: N/A")
     print(f"⏱️  P95 latency: {p95:.1f} ms" if p95 != "N/A" else "⏱️  P95 latency: N/A")
-    print(f"⏱️  Min latency: {min_lat} ms")
-    print(f"⏱️  Max latency: {max_lat} ms")
-    
-    # Latency distribution
-    latency_ranges = {
-        "0-500ms": 0,
-        "500ms-1s": 0,
-        "1s-2s": 0,
-        "2s-5s": 0,
-        "5s+": 0
-    }
-    
-    for l in lat:
-        if l < 500:
-            latency_ranges["0-500ms"] += 1
-        elif l < 1000:
-            latency_ranges["500ms-1s"] += 1
-        elif l < 2000:
-            latency_ranges["1s-2s"] += 1
-        elif l < 5000:
-            latency_ranges["2s-5s"] += 1
-        else:
-            latency_ranges["5s+"] += 1
+    print(f"⏱️  Min latency: {metrics['min']} ms")
+    print(f"⏱️  Max latency: {metrics['max']} ms")
     
     print(f"\n📈 Latency distribution:")
-    for range_name, count in latency_ranges.items():
+    for range_name, count in metrics["distribution"].items():
         if count > 0:
-            percentage = (count / len(lat)) * 100
+            percentage = (count / metrics["count"]) * 100
             print(f"  • {range_name}: {count} ({percentage:.1f}%)")
     
-    return {
-        "count": len(lat),
-        "mean": mean_lat,
-        "median": median_lat,
-        "p90": p90,
-        "p95": p95,
-        "min": min_lat,
-        "max": max_lat,
-        "distribution": latency_ranges
-    }
+    return metrics
 
-def analyze_by_session(rows):
+def analyze_by_session(table):
     """Analyze metrics by session ID"""
     print("\n" + "="*60)
     print("📊 ANALYSIS BY SESSION")
     print("="*60)
     
-    sessions = defaultdict(list)
-    for row in rows:
-        session_id = row.get("session_id", "unknown")
-        sessions[session_id].append(row)
-    
+    sessions = session_metrics(table)
     if len(sessions) <= 1:
         print("📝 Only one session found, skipping session analysis")
         return
     
     print(f"📊 Found {len(sessions)} sessions:")
     
-    for session_id, session_rows in sessions.items():
+    for session_id, m in sessions.items():
         print(f"\n🔬 Session: {session_id}")
-        print(f"   Total requests: {len(session_rows)}")
+        print(f"   Total requests: {m['total_samples']}")
         
-        # Count labeled samples for this session
-        labeled_count = sum(1 for row in session_rows if row.get("gt_node_id") and row["gt_node_id"].strip())
+        labeled_count = m["labeled_samples"]
         if labeled_count > 0:
-            hit_top1 = sum(1 for row in session_rows if row.get("hit_top1", "").lower() in ("true", "1", "yes"))
-            top1_acc = (hit_top1 / labeled_count) * 100
+            top1_acc = (m["hit_top1"] / labeled_count) * 100
             print(f"   Labeled samples: {labeled_count}")
-            print(f"   Top-1 accuracy: {hit_top1}/{labeled_count} = {top1_acc:.2f}%")
+            print(f"   Top-1 accuracy: {m['hit_top1']}/{labeled_count} = {top1_acc:.2f}%")
         
-        # Count low-confidence requests
-        low_conf_count = sum(1 for row in session_rows if row.get("low_conf", "").lower() in ("true", "1", "yes"))
-        low_conf_rate = (low_conf_count / len(session_rows)) * 100
-        print(f"   Low-confidence rate: {low_conf_count}/{len(session_rows)} = {low_conf_rate:.2f}%")
+        low_conf_rate = (m["low_conf"] / m["total_samples"]) * 100
+        print(f"   Low-confidence rate: {m['low_conf']}/{m['total_samples']} = {low_conf_rate:.2f}%")
 
 def generate_summary_report(loc_metrics, low_conf_metrics, latency_metrics):
     """Generate a summary report"""
@@ -317,7 +215,7 @@ def main():
         print("💡 Usage: python tools/metrics_eval.py [locate_log.csv] [latency_log.csv]")
         return
     
-    # Load data
+    # Load data (each file is parsed once into columnar arrays)
     rows = load_locate_log(loc_file)
     lat = load_latency_log(e2e_file)
     
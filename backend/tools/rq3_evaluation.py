@@ -7,104 +7,59 @@ Analyzes trust and error handling metrics:
 - Error Recovery Time
 """
 
-import csv
 import json
 import sys
-import statistics as stats
-from collections import Counter, defaultdict
 from pathlib import Path
-from datetime import datetime
 
-def load_locate_log(loc_file: str):
-    """Load and parse locate log CSV"""
-    rows = []
+from eval_core import (
+    load_table, clarification_metrics as clarification_summary, misbelief_metrics,
+    recovery_metrics as recovery_summary, rq3_session_metrics,
+)
+
+def _load(path: str, label: str, missing_icon: str):
     try:
-        with open(loc_file, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                rows.append(row)
-        print(f"✅ Loaded {len(rows)} rows from {loc_file}")
+        table = load_table(path)
+        print(f"✅ Loaded {len(table)} rows from {path}")
     except FileNotFoundError:
-        print(f"❌ Locate log file not found: {loc_file}")
-        return []
+        print(f"{missing_icon} {label} log file not found: {path}")
+        return None
     except Exception as e:
-        print(f"❌ Error reading locate log: {e}")
-        return []
-    
-    return rows
+        print(f"❌ Error reading {label.lower()} log: {e}")
+        return None
+    return table
+
+def load_locate_log(loc_file: str):
+    """Load locate log CSV into a columnar table (None on failure)"""
+    return _load(loc_file, "Locate", "❌")
 
 def load_clarification_log(clar_file: str):
-    """Load and parse clarification log CSV"""
-    rows = []
-    try:
-        with open(clar_file, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                rows.append(row)
-        print(f"✅ Loaded {len(rows)} rows from {clar_file}")
-    except FileNotFoundError:
-        print(f"⚠️  Clarification log file not found: {clar_file}")
-        return []
-    except Exception as e:
-        print(f"❌ Error reading clarification log: {e}")
-        return []
-    
-    return rows
+    """Load clarification log CSV into a columnar table (None on failure)"""
+    return _load(clar_file, "Clarification", "⚠️ ")
 
 def load_recovery_log(recovery_file: str):
-    """Load and parse recovery log CSV"""
-    rows = []
-    try:
-        with open(recovery_file, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                rows.append(row)
-        print(f"✅ Loaded {len(rows)} rows from {recovery_file}")
-    except FileNotFoundError:
-        print(f"⚠️  Recovery log file not found: {recovery_file}")
-        return []
-    except Exception as e:
-        print(f"❌ Error reading recovery log: {e}")
-        return []
-    
-    return rows
+    """Load recovery log CSV into a columnar table (None on failure)"""
+    return _load(recovery_file, "Recovery", "⚠️ ")
 
-def calculate_misbelief_rate(rows):
+def calculate_misbelief_rate(table):
     """Calculate misbelief rate - users following wrong instructions without clarification"""
     print("\n" + "="*60)
     print("⚠️  MISBELIEF RATE ANALYSIS")
     print("="*60)
     
-    # Filter rows with ground truth and misbelief data
-    labeled_rows = [row for row in rows if row.get("gt_node_id") and row["gt_node_id"].strip()]
-    
-    if not labeled_rows:
+    metrics = misbelief_metrics(table)
+    if not metrics:
         print("❌ No labeled samples found (gt_node_id empty)")
         return None
     
-    total_labeled = len(labeled_rows)
-    misbelief_count = 0
-    clarification_triggered_count = 0
-    
-    for row in labeled_rows:
-        # Check if clarification was triggered
-        clarification_triggered = row.get("clarification_triggered", "").lower() in ("true", "1", "yes")
-        if clarification_triggered:
-            clarification_triggered_count += 1
-        
-        # Check if misbelief occurred
-        misbelief = row.get("misbelief", "").lower() in ("true", "1", "yes")
-        if misbelief:
-            misbelief_count += 1
-    
-    misbelief_rate = (misbelief_count / total_labeled) * 100 if total_labeled > 0 else 0
-    clarification_rate = (clarification_triggered_count / total_labeled) * 100 if total_labeled > 0 else 0
+    total_labeled = metrics["total_labeled"]
+    misbelief_count = metrics["misbelief_count"]
+    clarification_triggered_count = metrics["clarification_triggered_count"]
     
     print(f"📊 Total labeled samples: {total_labeled}")
     print(f"⚠️  Misbelief occurrences: {misbelief_count}")
     print(f"🔍 Clarification triggered: {clarification_triggered_count}")
-    print(f"📈 Misbelief rate: {misbelief_count}/{total_labeled} = {misbelief_rate:.2f}%")
-    print(f"📈 Clarification trigger rate: {clarification_triggered_count}/{total_labeled} = {clarification_rate:.2f}%")
+    print(f"📈 Misbelief rate: {misbelief_count}/{total_labeled} = {metrics['misbelief_rate']:.2f}%")
+    print(f"📈 Clarification trigger rate: {clarification_triggered_count}/{total_labeled} = {metrics['clarification_rate']:.2f}%")
     
     # Analyze misbelief patterns
     if misbelief_count > 0:
@@ -113,129 +68,72 @@ def calculate_misbelief_rate(rows):
         print(f"  • Users who triggered clarification: {clarification_triggered_count}")
         print(f"  • Users who followed correct instructions: {total_labeled - misbelief_count - clarification_triggered_count}")
     
-    return {
-        "total_labeled": total_labeled,
-        "misbelief_count": misbelief_count,
-        "clarification_triggered_count": clarification_triggered_count,
-        "misbelief_rate": misbelief_rate,
-        "clarification_rate": clarification_rate
-    }
+    return metrics
 
-def calculate_clarification_metrics(clar_rows):
+def calculate_clarification_metrics(clar_table):
     """Calculate clarification rounds and success rate"""
     print("\n" + "="*60)
     print("🔍 CLARIFICATION DIALOGUE ANALYSIS")
     print("="*60)
     
-    if not clar_rows:
+    if not clar_table:
         print("❌ No clarification data available")
         return None
     
-    # Group by clarification_id
-    clarification_sessions = defaultdict(list)
-    for row in clar_rows:
-        clarification_id = row.get("clarification_id", "")
-        if clarification_id:
-            clarification_sessions[clarification_id].append(row)
-    
-    if not clarification_sessions:
+    summary = clarification_summary(clar_table)
+    if summary is None:
         print("❌ No clarification sessions found")
         return None
     
-    print(f"📊 Total clarification sessions: {len(clarification_sessions)}")
+    print(f"📊 Total clarification sessions: {summary['id_groups']}")
     
-    # Analyze each session
-    total_rounds_list = []
-    successful_sessions = 0
-    total_sessions = 0
+    for session_id, total_rounds, clarification_success in summary["sessions"]:
+        print(f"  Session {session_id}: {total_rounds} rounds, Success: {clarification_success}")
     
-    for session_id, session_rows in clarification_sessions.items():
-        # Find session end row
-        end_rows = [row for row in session_rows if row.get("total_rounds") and row["total_rounds"].strip()]
-        
-        if end_rows:
-            end_row = end_rows[-1]
-            total_rounds = int(end_row.get("total_rounds", 0))
-            clarification_success = end_row.get("clarification_success", "").lower() in ("true", "1", "yes")
-            
-            total_rounds_list.append(total_rounds)
-            total_sessions += 1
-            
-            if clarification_success:
-                successful_sessions += 1
-            
-            print(f"  Session {session_id}: {total_rounds} rounds, Success: {clarification_success}")
-    
-    if total_sessions > 0:
-        avg_rounds = stats.mean(total_rounds_list) if total_rounds_list else 0
-        success_rate = (successful_sessions / total_sessions) * 100
+    if summary["total_sessions"] > 0:
+        total_sessions = summary["total_sessions"]
+        successful_sessions = summary["successful_sessions"]
         
         print(f"\n📈 Clarification Performance:")
-        print(f"  • Average rounds per session: {avg_rounds:.1f}")
-        print(f"  • Successful clarifications: {successful_sessions}/{total_sessions} = {success_rate:.2f}%")
-        print(f"  • Total rounds across all sessions: {sum(total_rounds_list)}")
+        print(f"  • Average rounds per session: {summary['avg_rounds']:.1f}")
+        print(f"  • Successful clarifications: {successful_sessions}/{total_sessions} = {summary['success_rate']:.2f}%")
+        print(f"  • Total rounds across all sessions: {summary['total_rounds']}")
         
         # Round distribution
-        round_distribution = Counter(total_rounds_list)
         print(f"\n📊 Round distribution:")
-        for rounds, count in sorted(round_distribution.items()):
+        for rounds, count in sorted(summary["round_distribution"].items()):
             percentage = (count / total_sessions) * 100
             print(f"  • {rounds} rounds: {count} sessions ({percentage:.1f}%)")
         
-        return {
-            "total_sessions": total_sessions,
-            "successful_sessions": successful_sessions,
-            "success_rate": success_rate,
-            "avg_rounds": avg_rounds,
-            "total_rounds": sum(total_rounds_list),
-            "round_distribution": dict(round_distribution)
-        }
+        return {k: summary[k] for k in ("total_sessions", "successful_sessions", "success_rate",
+                                        "avg_rounds", "total_rounds", "round_distribution")}
     
     return None
 
-def calculate_error_recovery_metrics(recovery_rows):
+def calculate_error_recovery_metrics(recovery_table):
     """Calculate error recovery time metrics"""
     print("\n" + "="*60)
     print("⚠️  ERROR RECOVERY TIME ANALYSIS")
     print("="*60)
     
-    if not recovery_rows:
+    if not recovery_table:
         print("❌ No error recovery data available")
         return None
     
-    # Filter completed recoveries
-    completed_recoveries = [row for row in recovery_rows if row.get("recovery_duration_ms") and row["recovery_duration_ms"].strip()]
-    
-    if not completed_recoveries:
+    summary = recovery_summary(recovery_table)
+    if not summary["completed"]:
         print("❌ No completed error recoveries found")
         return None
     
-    print(f"📊 Total completed recoveries: {len(completed_recoveries)}")
-    
-    # Extract recovery durations
-    recovery_times = []
-    for row in completed_recoveries:
-        try:
-            duration = int(row["recovery_duration_ms"])
-            recovery_times.append(duration)
-        except (ValueError, TypeError):
-            continue
+    print(f"📊 Total completed recoveries: {summary['completed']}")
     
-    if not recovery_times:
+    if "total_recoveries" not in summary:
         print("❌ No valid recovery time data")
         return None
     
-    # Calculate statistics
-    mean_time = stats.mean(recovery_times)
-    median_time = stats.median(recovery_times)
-    min_time = min(recovery_times)
-    max_time = max(recovery_times)
-    
-    try:
-        p90 = stats.quantiles(recovery_times, n=10)[8]
-        p95 = stats.quantiles(recovery_times, n=20)[18]
-    except:
-        p90 = p95 = "N/A"
+    mean_time, median_time = summary["mean_time"], summary["median_time"]
+    min_time, max_time = summary["min_time"], summary["max_time"]
+    p90, p95 = summary["p90"], summary["p95"]
     
     print(f"\n⏱️  Recovery Time Statistics:")
     print(f"  • Mean recovery time: {mean_time:.1f} ms ({mean_time/1000:.2f} s)")
@@ -245,93 +143,44 @@ def calculate_error_recovery_metrics(recovery_rows):
     print(f"  • Min recovery time: {min_time} ms ({min_time/1000:.2f} s)")
     print(f"  • Max recovery time: {max_time} ms ({max_time/1000:.2f} s)")
     
-    # Time distribution
-    time_ranges = {
-        "0-1s": 0,
-        "1-5s": 0,
-        "5-10s": 0,
-        "10-30s": 0,
-        "30s+": 0
-    }
-    
-    for time_ms in recovery_times:
-        time_s = time_ms / 1000
-        if time_s < 1:
-            time_ranges["0-1s"] += 1
-        elif time_s < 5:
-            time_ranges["1-5s"] += 1
-        elif time_s < 10:
-            time_ranges["5-10s"] += 1
-        elif time_s < 30:
-            time_ranges["10-30s"] += 1
-        else:
-            time_ranges["30s+"] += 1
-    
     print(f"\n📈 Recovery time distribution:")
-    for range_name, count in time_ranges.items():
+    for range_name, count in summary["time_distribution"].items():
         if count > 0:
-            percentage = (count / len(recovery_times)) * 100
+            percentage = (count / summary["total_recoveries"]) * 100
             print(f"  • {range_name}: {count} recoveries ({percentage:.1f}%)")
     
-    return {
-        "total_recoveries": len(recovery_times),
-        "mean_time": mean_time,
-        "median_time": median_time,
-        "p90": p90,
-        "p95": p95,
-        "min_time": min_time,
-        "max_time": max_time,
-        "time_distribution": time_ranges
-    }
+    return {k: v for k, v in summary.items() if k != "completed"}
 
-def analyze_by_session(rows, clar_rows, recovery_rows):
+def analyze_by_session(table, clar_table, recovery_table):
     """Analyze RQ3 metrics by session"""
     print("\n" + "="*60)
     print("📊 RQ3 ANALYSIS BY SESSION")
     print("="*60)
     
-    # Group by session
-    sessions = defaultdict(lambda: {"locate": [], "clarification": [], "recovery": []})
-    
-    for row in rows:
-        session_id = row.get("session_id", "unknown")
-        sessions[session_id]["locate"].append(row)
-    
-    for row in clar_rows:
-        session_id = row.get("session_id", "unknown")
-        sessions[session_id]["clarification"].append(row)
-    
-    for row in recovery_rows:
-        session_id = row.get("session_id", "unknown")
-        sessions[session_id]["recovery"].append(row)
-    
+    sessions = rq3_session_metrics(table, clar_table, recovery_table)
     if len(sessions) <= 1:
         print("📝 Only one session found, skipping session analysis")
         return
     
     print(f"📊 Found {len(sessions)} sessions:")
     
-    for session_id, session_data in sessions.items():
+    for session_id, m in sessions.items():
         print(f"\n🔬 Session: {session_id}")
         
         # Locate metrics
-        locate_rows = session_data["locate"]
-        labeled_count = sum(1 for row in locate_rows if row.get("gt_node_id") and row["gt_node_id"].strip())
+        labeled_count = m["labeled"]
         if labeled_count > 0:
-            misbelief_count = sum(1 for row in locate_rows if row.get("misbelief", "").lower() in ("true", "1", "yes"))
-            misbelief_rate = (misbelief_count / labeled_count) * 100
+            misbelief_rate = (m["misbelief"] / labeled_count) * 100
             print(f"   Labeled samples: {labeled_count}")
-            print(f"   Misbelief rate: {misbelief_count}/{labeled_count} = {misbelief_rate:.2f}%")
+            print(f"   Misbelief rate: {m['misbelief']}/{labeled_count} = {misbelief_rate:.2f}%")
         
         # Clarification metrics
-        clar_sessions = len(set(row.get("clarification_id", "") for row in session_data["clarification"] if row.get("clarification_id")))
-        if clar_sessions > 0:
-            print(f"   Clarification sessions: {clar_sessions}")
+        if m["clarification_sessions"] > 0:
+            print(f"   Clarification sessions: {m['clarification_sessions']}")
         
         # Recovery metrics
-        recovery_count = len(session_data["recovery"])
-        if recovery_count > 0:
-            print(f"   Error recoveries: {recovery_count}")
+        if m["recoveries"] > 0:
+            print(f"   Error recoveries: {m['recoveries']}")
 
 def generate_rq3_summary(misbelief_metrics, clarification_metrics, recovery_metrics):
     """Generate RQ3 summary report"""
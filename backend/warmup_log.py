@@ -0,0 +1,112 @@
+"""
+First-photo warm-up logging without blocking the response
+首张照片（warmup）：响应只需要预设输出，BLIP caption 仅用于日志。
+
+WARMUP_CAPTION 选择 caption 的生成方式：
+- sync（默认）：请求内生成 caption 并随响应返回（前端 onPick 把首张照片响应的 caption 显示为第一条消息）
+- async：立即返回预设输出（响应 caption 为占位文本）；caption 在定位线程池中后台生成，完成后连同 caption 写入 warmup 行
+- off：不生成 caption，warmup 行记录占位文本
+
+warmup 行的 ts_iso / server_resp_ms 取响应时刻，后台写入的行与同步写入的行字段含义相同；
+warmup 行不参与命中率统计和回放语料（bench.corpus.usable_log_caption 按 phase 跳过）。
+"""
+
+import os
+import csv
+import threading
+from concurrent import futures
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from pipeline_timing import submit_detached
+from structured_log import get_logger
+
+log = get_logger("warmup")
+
+WARMUP_CAPTION_MODES = ("async", "sync", "off")
+WARMUP_CAPTION = os.getenv("WARMUP_CAPTION", "sync").lower()
+WARMUP_PLACEHOLDER = "First photo - preset output"
+
+
+def warmup_row(site_id: str, req_id: str, session_id: str, provider: str, caption: Optional[str],
+               client_start_ms, server_recv_ms, server_resp_ms, ts_iso: str) -> List:
+    """locate_log.csv 的 warmup 行（列顺序同 HEADERS["locate"]）"""
+    return [
+        site_id, "WARMUP", ts_iso, req_id, session_id, provider,
+        "warmup",  # phase
+        caption or WARMUP_PLACEHOLDER,  # caption
+        "", "", "", "", "",  # top1, top2, margin
+        "", "", "", "",  # gt_node_id, hit_top1, hit_top2, hit_hop1
+        "", "",  # low_conf, low_conf_rule
+        client_start_ms or "", server_recv_ms, server_resp_ms  # timing
+    ]
+
+
+def append_row(path: str, row: List):
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow(row)
+
+
+class WarmupLog:
+    """写 warmup 行；async 模式下 caption 与写行在后台完成"""
+
+    def __init__(self, caption_fn: Callable[[bytes], str], mode: str = WARMUP_CAPTION,
+                 submit: Callable[..., futures.Future] = submit_detached):
+        if mode not in WARMUP_CAPTION_MODES:
+            raise ValueError(f"WARMUP_CAPTION must be one of {', '.join(WARMUP_CAPTION_MODES)}, got {mode!r}")
+        self.caption_fn = caption_fn
+        self.mode = mode
+        self._submit = submit
+        self._lock = threading.Lock()
+        self._pending = set()
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def needs_image(self) -> bool:
+        return self.mode != "off"
+
+    def record(self, path: str, site_id: str, req_id: str, session_id: str, provider: str,
+               client_start_ms, server_recv_ms, server_resp_ms, image: Optional[bytes] = None,
+               caption: Optional[str] = None) -> Optional[futures.Future]:
+        """写 warmup 行。给出 image（async 模式）时在后台生成 caption 后再写，返回其 Future"""
+        args = (site_id, req_id, session_id, provider)
+        timing = (client_start_ms, server_recv_ms, server_resp_ms, datetime.utcnow().isoformat())
+        if self.mode != "async" or image is None:
+            append_row(path, warmup_row(*args, caption, *timing))
+            return None
+        future = self._submit(self._caption_and_write, path, image, args, timing)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _caption_and_write(self, path: str, image: bytes, args: tuple, timing: tuple):
+        client_start_ms, server_recv_ms, server_resp_ms, ts_iso = timing
+        try:
+            caption = self.caption_fn(image)
+        except Exception as e:
+            log.warning("warm-up caption failed for %s: %s", args[1], e)
+            caption = f"BLIP_FAILED:{e}"
+        append_row(path, warmup_row(*args, caption, client_start_ms, server_recv_ms, server_resp_ms, ts_iso))
+
+    def _done(self, future: futures.Future):
+        with self._lock:
+            self._pending.discard(future)
+            if future.exception() is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+        if future.exception() is not None:
+            log.warning("warm-up log row not written: %s", future.exception())
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """等待后台 warmup 行写完（测试 / 关闭服务时）；全部完成返回 True"""
+        with self._lock:
+            pending = list(self._pending)
+        _, not_done = futures.wait(pending, timeout=timeout)
+        return not not_done